@@ -1,5 +1,6 @@
 # Module for creating FastAPI app and adding middleware and routers.
 import functools
+import logging
 
 from fastapi import Depends
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
@@ -17,8 +18,25 @@ from app.dependancies.database import get_db_session
 from app.internal.app import App
 from app.internal.config import AppSettings
 from app.internal.context import AppContext
+from app.internal.departure_views import departure_views
+from app.internal.invalidation import create_change_listener, \
+    install_notify_triggers, invalidation_bus
+from app.internal.logs import AccessLogMiddleware, configure_logging, \
+    shutdown_logging
+from app.internal.loop_monitor import LoopLagMonitor
+from app.internal.metrics import metrics_endpoint, metrics_registry
+from app.internal.migrations import upgrade
+from app.internal.offload import configure_offload, response_offloader
+from app.internal.profiling import ProfilingMiddleware
+from app.internal.scheduler import create_election, scheduler
+from app.internal.snapshot import SnapshotError, timetable_snapshot
+from app.internal.statements import lazy_load_detector
+from app.internal.tracing import TracedJSONResponse, TracingMiddleware, \
+    configure_tracing, shutdown_tracing
 from app.controller.campus import campus_router
 
+logger = logging.getLogger(__name__)
+
 
 async def get_context(db_session: AsyncSession = Depends(get_db_session)) \
         -> dict[str, AsyncSession]:
@@ -38,7 +56,7 @@ def create_app(settings: AppSettings) -> App:
     Returns:
         FastAPIWithContext: FastAPI application.
     """
-    app = App()
+    app = App(default_response_class=TracedJSONResponse)
     app.add_middleware(
         CORSMiddleware,
         allow_origins=['*'],
@@ -47,6 +65,17 @@ def create_app(settings: AppSettings) -> App:
         allow_headers=['*'],
     )
     app.add_middleware(GZipMiddleware, minimum_size=1000)
+    if settings.PROFILE_TOKEN:
+        app.add_middleware(
+            ProfilingMiddleware,
+            token=settings.PROFILE_TOKEN,
+            directory=settings.PROFILE_DIRECTORY,
+            interval=settings.PROFILE_INTERVAL,
+        )
+    if settings.TRACING_EXPORTER != 'off':
+        app.add_middleware(TracingMiddleware)
+    if settings.ACCESS_LOG:
+        app.add_middleware(AccessLogMiddleware)
     app.add_event_handler(
         'startup',
         functools.partial(_web_app_startup, app=app, settings=settings),
@@ -68,6 +97,8 @@ def create_app(settings: AppSettings) -> App:
     )
     app.include_router(shuttle_router, prefix='/shuttle', tags=['shuttle'])
     app.include_router(graphql_router, prefix='/query', tags=['graphql'])
+    if settings.METRICS_ENABLED:
+        app.add_route('/metrics', metrics_endpoint, include_in_schema=False)
     return app
 
 
@@ -77,13 +108,60 @@ async def _web_app_startup(app: App, settings: AppSettings) -> None:
         app (App): FastAPI application.
         settings (AppSettings): Application settings.
     """
+    configure_logging(settings)
+    configure_tracing(settings)
+    lazy_load_detector.configure(settings.LAZY_LOAD_MODE)
+    configure_offload(settings)
+    loop_monitor = None
+    if settings.LOOP_MONITOR_INTERVAL > 0:
+        loop_monitor = LoopLagMonitor(
+            interval=settings.LOOP_MONITOR_INTERVAL,
+            window=settings.LOOP_MONITOR_WINDOW,
+            blocking_threshold=settings.LOOP_BLOCKING_THRESHOLD,
+        )
+        await loop_monitor.start()
+        metrics_registry.register(loop_monitor.collect)
     database_engine = create_async_engine(
         settings.DATABASE_URI,
-        echo=True,
         pool_pre_ping=True,
     )
-    context = AppContext(app_settings=settings, db_engine=database_engine)
+    if settings.MIGRATE_ON_STARTUP:
+        applied = await upgrade(database_engine)
+        if applied:
+            logger.info('Applied schema migrations %s', applied)
+    await departure_views.start(database_engine)
+    if settings.INVALIDATION_INSTALL_TRIGGERS:
+        await install_notify_triggers(
+            database_engine,
+            invalidation_bus.tables,
+            settings.INVALIDATION_CHANNEL,
+        )
+    change_listener = await create_change_listener(
+        database_engine,
+        mode=settings.INVALIDATION_MODE,
+        channel=settings.INVALIDATION_CHANNEL,
+        interval=settings.INVALIDATION_POLL_INTERVAL,
+    )
+    if change_listener is not None:
+        await change_listener.start()
+    if settings.TIMETABLE_SNAPSHOT_PATH is not None:
+        try:
+            timetable_snapshot.load(
+                settings.TIMETABLE_SNAPSHOT_PATH,
+                max_age=settings.TIMETABLE_SNAPSHOT_MAX_AGE,
+            )
+        except SnapshotError as error:
+            logger.warning('Timetable snapshot is not loaded: %s', error)
+    context = AppContext(
+        app_settings=settings,
+        db_engine=database_engine,
+        change_listener=change_listener,
+        loop_monitor=loop_monitor,
+    )
     app.extra.context = context
+    if settings.SCHEDULER_ENABLED:
+        await scheduler.start(create_election(settings, database_engine))
+        metrics_registry.register(scheduler.collect)
 
 
 async def _web_app_shutdown(app: App) -> None:
@@ -92,4 +170,17 @@ async def _web_app_shutdown(app: App) -> None:
         app (App): FastAPI application.
     """
     context = AppContext.from_app(app)
+    metrics_registry.unregister(scheduler.collect)
+    await scheduler.stop()
+    departure_views.stop()
+    timetable_snapshot.unload()
+    if context.change_listener is not None:
+        await context.change_listener.stop()
     await context.db_engine.dispose()
+    if context.loop_monitor is not None:
+        metrics_registry.unregister(context.loop_monitor.collect)
+        await context.loop_monitor.stop()
+    response_offloader.shutdown()
+    lazy_load_detector.configure('off')
+    shutdown_tracing()
+    shutdown_logging()
@@ -1,25 +1,48 @@
 import datetime
 from datetime import timedelta
+from typing import Any, Hashable
 
 from fastapi import APIRouter, Depends
-from sqlalchemy import select, and_
+from sqlalchemy import bindparam, select, and_
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import joinedload, selectinload
 from starlette import status
 from starlette.responses import JSONResponse
 
 from app.dependancies.database import get_db_session
-from app.internal.date_utils import is_weekends
+from app.internal.boards import arrival_boards, served_from_boards
+from app.internal.cache import MINUTE, BytesSerializer, RenderedResponse, \
+    cached_response, render_body
+from app.internal.date_utils import current_datetime, is_weekends
+from app.internal.realtime_aging import age_arrival
+from app.internal.statements import statement_budget
+from app.internal.tracing import TracedRoute
 from app.model.bus import BusRoute, BusStop, BusRouteStop
 from app.response.bus import RouteListResponse, RouteListItemResponse, \
     RouteResponse, Company, Type, Terminal, StopListResponse, \
     StopListItemResponse, StopResponse, Location, \
     StopArrivalResponse, RouteArrivalResponse, Realtime, RouteTimetableResponse
+from app.rows.bus import BusStopRows, fetch_stop, fetch_stops
 
-bus_router = APIRouter()
+bus_router = APIRouter(route_class=TracedRoute)
+ARRIVAL_TABLES = (
+    'bus_stop', 'bus_route', 'bus_route_stop', 'bus_realtime',
+    'bus_timetable',
+)
+# Statements of the timetable endpoint are built once with bound parameters
+# instead of on every request.
+ROUTE_STOP_TIMETABLE_STATEMENT = select(BusRouteStop).where(
+    and_(
+        BusRouteStop.stop_id == bindparam('stop_id'),
+        BusRouteStop.route_id == bindparam('route_id'),
+    ),
+).options(
+    selectinload(BusRouteStop.timetable),
+)
 
 
 @bus_router.get('/route', response_model=RouteListResponse)
+@statement_budget(1, rows=10)
 async def get_bus_route(
     name: str | None = None,
     db_session: AsyncSession = Depends(get_db_session),
@@ -43,6 +66,7 @@ async def get_bus_route(
 
 
 @bus_router.get('/route/{route_id}', response_model=RouteResponse)
+@statement_budget(1, rows=10)
 async def get_bus_route_by_id(
     route_id: int,
     db_session: AsyncSession = Depends(get_db_session),
@@ -95,6 +119,7 @@ async def get_bus_route_by_id(
 
 
 @bus_router.get('/stop', response_model=StopListResponse)
+@statement_budget(1, rows=10)
 async def get_bus_stop(
     name: str | None = None,
     db_session: AsyncSession = Depends(get_db_session),
@@ -122,6 +147,7 @@ async def get_bus_stop(
 
 
 @bus_router.get('/stop/{stop_id}', response_model=StopResponse)
+@statement_budget(2, rows=20)
 async def get_bus_stop_by_id(
     stop_id: int,
     db_session: AsyncSession = Depends(get_db_session),
@@ -156,49 +182,41 @@ async def get_bus_stop_by_id(
     )
 
 
-@bus_router.get('/stop/{stop_id}/arrival', response_model=StopArrivalResponse)
-async def get_bus_stop_arrival(
-    stop_id: int,
-    db_session: AsyncSession = Depends(get_db_session),
-):
-    """Function to get a bus stop arrival by id.
+def build_stop_arrival(
+    stop: BusStopRows,
+    now: datetime.datetime,
+) -> StopArrivalResponse:
+    """Function to build the arrival of a bus stop.
     Args:
-        stop_id (int): ID of the bus stop.
-        db_session (AsyncSession): Database session.
+        stop (BusStopRows): Bus stop with its routes, their realtime
+            arrivals and their timetables.
+        now (datetime.datetime): Current time in Korea.
     Returns:
-        StopArrivalResponse: Bus stop arrival with the given id.
+        StopArrivalResponse: Bus stop arrival.
     """
-    statement = select(BusStop).where(BusStop.id == stop_id).options(
-        selectinload(BusStop.routes).options(
-            selectinload(BusRouteStop.route),
-            selectinload(BusRouteStop.realtime),
-            selectinload(BusRouteStop.timetable),
-        ),
-    )
-    query_result: BusStop | None = (await db_session.execute(statement))\
-        .scalars().one_or_none()
-    if query_result is None:
-        return JSONResponse(
-            status_code=status.HTTP_404_NOT_FOUND,
-            content={'message': 'Bus stop not found.'},
-        )
     routes: list[RouteArrivalResponse] = []
-    now = datetime.datetime.now()
     weekdays = 'weekdays'
     if now.weekday() == 5:
         weekdays = 'saturday'
-    elif now.weekday() == 6 or is_weekends(now.today()):
+    elif now.weekday() == 6 or is_weekends(now.date()):
         weekdays = 'sunday'
-    for route in query_result.routes:
+    for route in stop.routes:
         realtime_list: list[Realtime] = []
-        for index, realtime in enumerate(route.realtime):
+        for realtime in route.realtime:
+            aged = age_arrival(
+                realtime.minutes, realtime.stop,
+                realtime.last_updated_time, now,
+            )
+            if aged is None:
+                continue
             realtime_list.append(Realtime(
-                sequence=index + 1,
-                stop=realtime.stop,
+                sequence=len(realtime_list) + 1,
+                stop=aged.stops,
                 seat=realtime.seat,
-                time=timedelta(minutes=realtime.minutes),
+                time=timedelta(minutes=aged.minutes),
                 low_plate=realtime.low_floor,
                 updated_at=realtime.last_updated_time,
+                stale=aged.stale,
             ))
         timetable_list: list[datetime.time] = []
         for timetable in filter(
@@ -209,29 +227,88 @@ async def get_bus_stop_arrival(
             timetable_list.append(timetable.departure_time)
         routes.append(RouteArrivalResponse(
             id=route.route_id,
-            name=route.route.name,
+            name=route.route_name,
             sequence=route.order,
             arrival=realtime_list,
             timetable=timetable_list,
         ))
     return StopArrivalResponse(
-        id=query_result.id,
-        name=query_result.name,
-        mobile=query_result.mobile_number,
+        id=stop.id,
+        name=stop.name,
+        mobile=stop.mobile_number,
         location=Location(
-            latitude=query_result.latitude,
-            longitude=query_result.longitude,
-            district=query_result.district,
-            region=query_result.region,
+            latitude=stop.latitude,
+            longitude=stop.longitude,
+            district=stop.district,
+            region=stop.region,
         ),
         route=routes,
     )
 
 
+async def stop_arrival_board(
+    stop_id: int,
+    **_: Any,
+) -> RenderedResponse | None:
+    """Function to get the precomputed arrival of the bus stop.
+    Returns:
+        RenderedResponse: Board of the stop, or None when it can not be
+            served.
+    """
+    return await arrival_boards.response('bus_arrival', stop_id)
+
+
+@bus_router.get('/stop/{stop_id}/arrival', response_model=StopArrivalResponse)
+@served_from_boards(stop_arrival_board)
+@cached_response('bus_arrival', tables=ARRIVAL_TABLES, bucket=MINUTE)
+@statement_budget(4, rows=1200)
+async def get_bus_stop_arrival(
+    stop_id: int,
+    db_session: AsyncSession = Depends(get_db_session),
+):
+    """Function to get a bus stop arrival by id.
+    Args:
+        stop_id (int): ID of the bus stop.
+        db_session (AsyncSession): Database session.
+    Returns:
+        StopArrivalResponse: Bus stop arrival with the given id.
+    """
+    query_result = await fetch_stop(db_session, stop_id)
+    if query_result is None:
+        return JSONResponse(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content={'message': 'Bus stop not found.'},
+        )
+    return build_stop_arrival(query_result, current_datetime())
+
+
+@arrival_boards.board(
+    'bus_arrival', tables=ARRIVAL_TABLES, serializer=BytesSerializer())
+async def build_arrival_boards(
+    db_session: AsyncSession,
+) -> dict[Hashable, bytes]:
+    """Function to build the arrival of every bus stop.
+    Args:
+        db_session (AsyncSession): Database session.
+    Returns:
+        dict[Hashable, bytes]: Rendered StopArrivalResponse by stop ID.
+    """
+    now = current_datetime()
+    return {
+        stop.id: render_body(build_stop_arrival(stop, now))
+        for stop in await fetch_stops(db_session)
+    }
+
+
 @bus_router.get(
     '/stop/{stop_id}/route/{route_id}/timetable',
     response_model=RouteTimetableResponse,
 )
+@cached_response(
+    'bus_timetable',
+    tables=('bus_route_stop', 'bus_timetable'),
+)
+@statement_budget(2, rows=300)
 async def get_bus_stop_timetable(
     stop_id: int,
     route_id: int,
@@ -245,16 +322,10 @@ async def get_bus_stop_timetable(
     Returns:
         RouteTimetableResponse: Bus stop timetable with the given id.
     """
-    statement = select(BusRouteStop).where(
-        and_(
-            BusRouteStop.stop_id == stop_id,
-            BusRouteStop.route_id == route_id,
-        ),
-    ).options(
-        selectinload(BusRouteStop.timetable),
-    )
-    query_result: BusRouteStop | None = (await db_session.execute(statement))\
-        .scalars().one_or_none()
+    query_result: BusRouteStop | None = (await db_session.execute(
+        ROUTE_STOP_TIMETABLE_STATEMENT,
+        {'stop_id': stop_id, 'route_id': route_id},
+    )).scalars().one_or_none()
     if query_result is None:
         return JSONResponse(
             status_code=status.HTTP_404_NOT_FOUND,
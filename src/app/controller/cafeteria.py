@@ -13,12 +13,14 @@ from sqlalchemy.orm import selectinload
 from starlette import status
 
 from app.dependancies.database import get_db_session
+from app.internal.statements import statement_budget
+from app.internal.tracing import TracedRoute
 from app.model.cafeteria import Restaurant
 from app.model.campus import Campus
 from app.response.cafeteria import Restaurant as RestaurantResponse, Menu
 from app.response.cafeteria import RestaurantList, RestaurantLocation
 
-cafeteria_router = APIRouter()
+cafeteria_router = APIRouter(route_class=TracedRoute)
 
 
 def get_time_slot(current_time: datetime.time) -> str:
@@ -34,6 +36,7 @@ def get_time_slot(current_time: datetime.time) -> str:
     '/{campus_id}/restaurant',
     response_model=RestaurantList,
 )
+@statement_budget(3, rows=50)
 async def get_restaurant_list(
     campus_id: int,
     feed_date: datetime.date = datetime.date.today(),
@@ -11,13 +11,16 @@ from sqlalchemy.orm import load_only
 from starlette import status
 
 from app.dependancies.database import get_db_session
+from app.internal.statements import statement_budget
+from app.internal.tracing import TracedRoute
 from app.model.campus import Campus
 from app.response.campus import CampusListResponse, CampusListItemResponse
 
-campus_router = APIRouter()
+campus_router = APIRouter(route_class=TracedRoute)
 
 
 @campus_router.get('', response_model=CampusListResponse)
+@statement_budget(1, rows=10)
 async def get_campus_list(
     name: str | None = None,
     db_session: AsyncSession = Depends(get_db_session),
@@ -43,6 +46,7 @@ async def get_campus_list(
 
 
 @campus_router.get('/{campus_id}', response_model=CampusListItemResponse)
+@statement_budget(1, rows=10)
 async def get_campus(
     campus_id: int,
     db_session: AsyncSession = Depends(get_db_session),
@@ -3,22 +3,46 @@ import datetime
 from fastapi import APIRouter, Depends
 from sqlalchemy import select, or_
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import selectinload
 from starlette import status
 from starlette.responses import JSONResponse
 
 from app.dependancies.database import get_db_session
-from app.internal.date_utils import is_weekends, current_period, is_holiday
+from app.internal.commute_tracker import RouteTimeline, \
+    commute_shuttle_tracker
+from app.internal.date_utils import current_datetime
+from app.internal.statements import statement_budget
+from app.internal.tracing import TracedRoute
 from app.model.commute_shuttle import CommuteShuttleRoute
 from app.response.commute_shuttle import CommuteShuttleList, \
     CommuteShuttleListItem, CommuteShuttleRouteResponse, \
     CommuteShuttleCurrentLocation, CommuteShuttleTimetableResponse, \
     CommuteShuttleArrivalList, CommuteShuttleArrivalListItem
 
-commute_shuttle_router = APIRouter()
+commute_shuttle_router = APIRouter(route_class=TracedRoute)
+
+
+def current_location(
+    route: RouteTimeline,
+    now: datetime.datetime,
+) -> CommuteShuttleCurrentLocation:
+    """Function to get the stops a commute shuttle is between.
+    Args:
+        route (RouteTimeline): Timeline of the route.
+        now (datetime.datetime): Current time.
+    Returns:
+        CommuteShuttleCurrentLocation: Last and next stop of the shuttle.
+    """
+    (start_name, start_time), (end_name, end_time) = \
+        route.current(now.time())
+    return CommuteShuttleCurrentLocation(
+        start=CommuteShuttleTimetableResponse(
+            name=start_name, time=start_time),
+        end=CommuteShuttleTimetableResponse(name=end_name, time=end_time),
+    )
 
 
 @commute_shuttle_router.get('/route', response_model=CommuteShuttleList)
+@statement_budget(1, rows=10)
 async def get_commute_shuttle_route(
     name: str | None = None,
     db_session: AsyncSession = Depends(get_db_session),
@@ -54,6 +78,7 @@ async def get_commute_shuttle_route(
     '/route/{route_id}',
     response_model=CommuteShuttleRouteResponse,
 )
+@statement_budget(4, rows=20)
 async def get_commute_shuttle_route_by_id(
     route_id: str,
     db_session: AsyncSession = Depends(get_db_session),
@@ -65,85 +90,22 @@ async def get_commute_shuttle_route_by_id(
     Returns:
         CommuteShuttleRoute: Commute shuttle route with the given id.
     """
-    statement = select(CommuteShuttleRoute).where(
-        CommuteShuttleRoute.name == route_id,
-    ).options(
-        selectinload(CommuteShuttleRoute.timetable),
-    )
-    query_result = (await db_session.execute(statement)).\
-        scalars().one_or_none()
-    if query_result is None:
+    routes = await commute_shuttle_tracker.routes(db_session)
+    route = routes.get(route_id)
+    if route is None:
         return JSONResponse(
             status_code=status.HTTP_404_NOT_FOUND,
             content={'message': 'Commute shuttle route not found.'},
         )
-
-    timetable_list: list[CommuteShuttleTimetableResponse] = []
-    for timetable in query_result.timetable:
-        timetable_list.append(
-            CommuteShuttleTimetableResponse(
-                name=timetable.stop_name,
-                time=timetable.departure_time,
-            ),
-        )
-    now = datetime.datetime.now()
-    passed_stops = list(
-        filter(
-            lambda x: x.time < now.time(),
-            timetable_list,
-        ),
-    )
-    if len(passed_stops) == 0:
-        recently_stop = CommuteShuttleTimetableResponse(
-            name='',
-            time=datetime.time(hour=0, minute=0, second=0),
-        )
-    else:
-        recently_stop = max(
-            passed_stops,
-            key=lambda x: x.time,
-        )
-
-    next_stops = list(
-        filter(
-            lambda x: x.time > now.time(),
-            timetable_list,
-        ),
-    )
-    if len(next_stops) == 0:
-        next_stop = CommuteShuttleTimetableResponse(
-            name='',
-            time=datetime.time(hour=0, minute=0, second=0),
-        )
-    else:
-        next_stop = min(
-            next_stops,
-            key=lambda x: x.time,
-        )
-
-    now = datetime.datetime.now()
-    if is_weekends(now):
-        status_message = 'ERROR.WEEKENDS'
-    elif await current_period(db_session, now) != 'semester':
-        status_message = 'ERROR.NOT_SEMESTER'
-    elif await is_holiday(db_session, now) != 'normal':
-        status_message = 'ERROR.HOLIDAY'
-    else:
-        status_message = 'SUCCESS'
+    now = current_datetime()
     return CommuteShuttleRouteResponse(
-        name=query_result.name,
-        timetable=timetable_list,
-        current=CommuteShuttleCurrentLocation(
-            start=CommuteShuttleTimetableResponse(
-                name=recently_stop.name,
-                time=recently_stop.time,
-            ),
-            end=CommuteShuttleTimetableResponse(
-                name=next_stop.name,
-                time=next_stop.time,
-            ),
-        ),
-        status=status_message,
+        name=route.name,
+        timetable=[
+            CommuteShuttleTimetableResponse(name=stop_name, time=stop_time)
+            for stop_name, stop_time in route.timetable
+        ],
+        current=current_location(route, now),
+        status=await commute_shuttle_tracker.status(db_session, now),
     )
 
 
@@ -151,6 +113,7 @@ async def get_commute_shuttle_route_by_id(
     '/arrival',
     response_model=CommuteShuttleArrivalList,
 )
+@statement_budget(4, rows=20)
 async def get_commute_shuttle_arrival(
     db_session: AsyncSession = Depends(get_db_session),
 ):
@@ -160,81 +123,20 @@ async def get_commute_shuttle_arrival(
     Returns:
         CommuteShuttleArrivalList: List of all commute shuttle routes.
     """
-    now = datetime.datetime.now()
-    if is_weekends(now):
-        status_message = 'ERROR.WEEKENDS'
-    elif await current_period(db_session, now) != 'semester':
-        status_message = 'ERROR.NOT_SEMESTER'
-    elif await is_holiday(db_session, now) != 'normal':
-        status_message = 'ERROR.HOLIDAY'
-    else:
-        status_message = 'SUCCESS'
-
-    statement = select(CommuteShuttleRoute).options(
-        selectinload(CommuteShuttleRoute.timetable),
-    )
-    query_result = (await db_session.execute(statement)).scalars().all()
-    routes = []
-    for route in query_result:
-        timetable_list: list[CommuteShuttleTimetableResponse] = []
-        for timetable in route.timetable:
-            timetable_list.append(
-                CommuteShuttleTimetableResponse(
-                    name=timetable.stop_name,
-                    time=timetable.departure_time,
-                ),
-            )
-        passed_stops = list(
-            filter(
-                lambda x: x.time < now.time(),
-                timetable_list,
-            ),
-        )
-        if len(passed_stops) == 0:
-            recently_stop = CommuteShuttleTimetableResponse(
-                name='',
-                time=datetime.time(hour=0, minute=0, second=0),
-            )
-        else:
-            recently_stop = max(
-                passed_stops,
-                key=lambda x: x.time,
-            )
-
-        next_stops = list(
-            filter(
-                lambda x: x.time > now.time(),
-                timetable_list,
-            ),
-        )
-        if len(next_stops) == 0:
-            next_stop = CommuteShuttleTimetableResponse(
-                name='',
-                time=datetime.time(hour=0, minute=0, second=0),
-            )
-        else:
-            next_stop = min(
-                next_stops,
-                key=lambda x: x.time,
-            )
-        routes.append(
+    # The tracker keeps the routes and the status, so only the current
+    # locations are computed on each request.
+    now = current_datetime()
+    status_message = await commute_shuttle_tracker.status(db_session, now)
+    routes = await commute_shuttle_tracker.routes(db_session)
+    return CommuteShuttleArrivalList(
+        route=[
             CommuteShuttleArrivalListItem(
                 name=route.name,
                 korean=route.korean,
                 english=route.english,
-                current=CommuteShuttleCurrentLocation(
-                    start=CommuteShuttleTimetableResponse(
-                        name=recently_stop.name,
-                        time=recently_stop.time,
-                    ),
-                    end=CommuteShuttleTimetableResponse(
-                        name=next_stop.name,
-                        time=next_stop.time,
-                    ),
-                ),
-            ),
-        )
-    return CommuteShuttleArrivalList(
-        route=routes,
+                current=current_location(route, now),
+            )
+            for route in routes.values()
+        ],
         status=status_message,
     )
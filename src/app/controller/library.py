@@ -12,19 +12,22 @@ from sqlalchemy.orm import selectinload
 from starlette import status
 
 from app.dependancies.database import get_db_session
+from app.internal.statements import statement_budget
+from app.internal.tracing import TracedRoute
 from app.model.library import ReadingRoom
 from app.response.library import ReadingRoom as ReadingRoomResponse
 from app.response.library import CampusReadingRoomResponse
 from app.response.library import ReadingRoomSeat, ReadingRoomInformation
 
 
-library_router = APIRouter()
+library_router = APIRouter(route_class=TracedRoute)
 
 
 @library_router.get(
     '/{campus_id}/room',
     response_model=CampusReadingRoomResponse,
 )
+@statement_budget(2, rows=20)
 async def get_reading_room_list(
     campus_id: int,
     db_session: AsyncSession = Depends(get_db_session),
@@ -73,6 +76,7 @@ async def get_reading_room_list(
     '/{campus_id}/room/{room_id}',
     response_model=ReadingRoomResponse,
 )
+@statement_budget(1, rows=10)
 async def get_reading_room(
     campus_id: int,
     room_id: int,
@@ -1,10 +1,9 @@
 import datetime
-from typing import Optional
+from typing import Any, Optional
 
 import strawberry
 from fastapi import Depends
-from sqlalchemy.ext.asyncio import AsyncSession
-from strawberry.fastapi import GraphQLRouter
+from strawberry.extensions import ParserCache, ValidationCache
 from strawberry.types import Info
 
 from app.controller.query.bus import query_bus, BusRouteStopItem, \
@@ -13,9 +12,12 @@ from app.controller.query.cafeteria import CafeteriaItem, query_cafeteria
 from app.controller.query.commute_shuttle import query_commute_shuttle, \
     CommuteShuttleRoute
 from app.controller.query.library import ReadingRoomItem, query_reading_room
+from app.controller.query.persisted_query import PersistedQueryRouter
 from app.controller.query.shuttle import query_shuttle, ShuttleItem
 from app.controller.query.subway import StationItem, query_subway
-from app.dependancies.database import get_db_session
+from app.dependancies.database import SessionFactory, get_session_factory
+from app.internal.config import AppSettings
+from app.internal.tracing import TracedSchema
 
 
 @strawberry.type
@@ -35,18 +37,20 @@ class Query:
     ) -> ShuttleItem:
         if tag is not None and route is not None:
             raise ValueError("tag and route cannot be used together")
-        db_session: AsyncSession = info.context['db_session']
-        result = await query_shuttle(
-            db_session,
-            stop_query=stop,
-            route_query=route,
-            tag_query=tag,
-            period_query=period,
-            weekday_query=weekday,
-            date_query=date,
-            timetable_start=start,
-            timetable_end=end,
-        )
+        sessions: SessionFactory = info.context['sessions']
+        async with sessions.sessions(2 if period is None else 1) as opened:
+            result = await query_shuttle(
+                opened[0],
+                stop_query=stop,
+                route_query=route,
+                tag_query=tag,
+                period_query=period,
+                weekday_query=weekday,
+                date_query=date,
+                timetable_start=start,
+                timetable_end=end,
+                period_session=opened[-1],
+            )
         return result
 
     @strawberry.field
@@ -55,11 +59,12 @@ class Query:
         info: Info,
         name: Optional[str] = None,
     ) -> list[CommuteShuttleRoute]:
-        db_session: AsyncSession = info.context['db_session']
-        result = await query_commute_shuttle(
-            db_session,
-            name=name,
-        )
+        sessions: SessionFactory = info.context['sessions']
+        async with sessions.session() as db_session:
+            result = await query_commute_shuttle(
+                db_session,
+                name=name,
+            )
         return result
 
     @strawberry.field
@@ -72,15 +77,16 @@ class Query:
         start: Optional[datetime.time] = None,
         end: Optional[datetime.time] = None,
     ) -> list[BusRouteStopItem]:
-        db_session: AsyncSession = info.context['db_session']
-        result = await query_bus(
-            db_session,
-            route_stop=route_stop,
-            weekdays=weekdays,
-            date=date,
-            timetable_start=start,
-            timetable_end=end,
-        )
+        sessions: SessionFactory = info.context['sessions']
+        async with sessions.session() as db_session:
+            result = await query_bus(
+                db_session,
+                route_stop=route_stop,
+                weekdays=weekdays,
+                date=date,
+                timetable_start=start,
+                timetable_end=end,
+            )
         return result
 
     @strawberry.field
@@ -93,15 +99,16 @@ class Query:
             start: Optional[datetime.time] = None,
             end: Optional[datetime.time] = None,
     ) -> list[StationItem]:
-        db_session: AsyncSession = info.context['db_session']
-        result = await query_subway(
-            db_session,
-            station=station,
-            heading=heading,
-            weekday=weekday,
-            timetable_start=start,
-            timetable_end=end,
-        )
+        sessions: SessionFactory = info.context['sessions']
+        async with sessions.session() as db_session:
+            result = await query_subway(
+                db_session,
+                station=station,
+                heading=heading,
+                weekday=weekday,
+                timetable_start=start,
+                timetable_end=end,
+            )
         return result
 
     @strawberry.field
@@ -112,13 +119,14 @@ class Query:
             room: Optional[list[int]] = None,
             active: Optional[bool] = None,
     ) -> list[ReadingRoomItem]:
-        db_session: AsyncSession = info.context['db_session']
-        result = await query_reading_room(
-            db_session,
-            campus=campus,
-            room=room,
-            active=active,
-        )
+        sessions: SessionFactory = info.context['sessions']
+        async with sessions.session() as db_session:
+            result = await query_reading_room(
+                db_session,
+                campus=campus,
+                room=room,
+                active=active,
+            )
         return result
 
     @strawberry.field
@@ -130,28 +138,43 @@ class Query:
             date: Optional[datetime.date] = None,
             slot: Optional[str] = None,
     ) -> list[CafeteriaItem]:
-        result: list[CafeteriaItem] = await query_cafeteria(
-            info.context['db_session'],
-            campus=campus,
-            restaurant=restaurant,
-            date=date,
-            slot=slot,
-        )
+        sessions: SessionFactory = info.context['sessions']
+        async with sessions.session() as db_session:
+            result: list[CafeteriaItem] = await query_cafeteria(
+                db_session,
+                campus=campus,
+                restaurant=restaurant,
+                date=date,
+                slot=slot,
+            )
         return result
 
 
 async def graphql_context(
-        db_session: AsyncSession = Depends(get_db_session),
-) -> dict[str, AsyncSession]:
+        sessions: SessionFactory = Depends(get_session_factory),
+) -> dict[str, Any]:
     """Function to get the GraphQL context.
+
+    Resolvers open their own sessions from the factory instead of sharing
+    one, so independent root fields of an operation run concurrently.
     Args:
-        db_session (AsyncSession): Database session.
+        sessions (SessionFactory): Per-request session factory.
     Returns:
-        dict[str, AsyncSession]: GraphQL context.
+        dict[str, Any]: GraphQL context.
     """
-    return {'db_session': db_session}
+    return {'sessions': sessions}
 
 
-schema = strawberry.Schema(query=Query)
-graphql_router: GraphQLRouter = GraphQLRouter(
-    schema, context_getter=graphql_context)
+app_settings = AppSettings()
+schema = TracedSchema(
+    query=Query,
+    extensions=[
+        ParserCache(maxsize=app_settings.GRAPHQL_DOCUMENT_CACHE_SIZE),
+        ValidationCache(maxsize=app_settings.GRAPHQL_DOCUMENT_CACHE_SIZE),
+    ],
+)
+graphql_router: PersistedQueryRouter = PersistedQueryRouter(
+    schema,
+    context_getter=graphql_context,
+    persisted_query_size=app_settings.GRAPHQL_PERSISTED_QUERY_SIZE,
+)
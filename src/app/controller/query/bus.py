@@ -1,13 +1,20 @@
+import dataclasses
 import datetime
-from typing import Optional
+from typing import Any, Hashable, Optional
 
-import holidays
 import strawberry
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import selectinload
 
+from app.controller.query.cache import FIELD_TABLES, cached_query
+from app.internal.boards import arrival_boards, served_from_boards
+from app.internal.date_utils import current_datetime, korean_holidays
+from app.internal.realtime_aging import age_arrival
+from app.internal.statements import statement_budget
+from app.internal.tracing import traced
 from app.model.bus import BusRouteStop
+from app.rows.bus import BusRouteStopRows, fetch_realtime, \
+    fetch_route_stops
 
 
 @strawberry.input
@@ -23,6 +30,7 @@ class BusRealtime:
     seat: int = strawberry.field(name='remainingSeat')
     low_floor: bool = strawberry.field(name='lowFloor')
     updated_at: datetime.datetime = strawberry.field(name='updatedAt')
+    stale: bool = strawberry.field(name='stale')
 
 
 @strawberry.type
@@ -44,48 +52,72 @@ class BusRouteStopItem:
     timetable: list[BusTimetable] = strawberry.field(name='timetable')
 
 
-async def query_bus(
+async def bus_board(
+    route_stop: list[BusRouteStopQuery],
+    weekdays: Optional[list[str]],
+    date: datetime.date,
+    timetable_start: Optional[datetime.time],
+    timetable_end: Optional[datetime.time],
+    **_: Any,
+) -> Optional[list[BusRouteStopItem]]:
+    """Function to assemble the bus route stops from the boards.
+    Returns:
+        list[BusRouteStopItem]: Route stops asked for, or None when
+            arguments other than the route stops and today are given or a
+            board can not be served.
+    """
+    if any(argument is not None for argument in (
+            weekdays, timetable_start, timetable_end)) or \
+            date != datetime.date.today():
+        return None
+    route_stops = await arrival_boards.get('bus', None)
+    if route_stops is None:
+        return None
+    return await arrival_boards.get_many('bus', [
+        (query.stop, query.route) for query in route_stop
+        if (query.stop, query.route) in route_stops
+    ])
+
+
+@cached_query('bus')
+async def query_bus_timetables(
     db_session: AsyncSession,
     route_stop: list[BusRouteStopQuery],
-    weekdays: Optional[list[str]] = None,
-    date: datetime.date = datetime.date.today(),
-    timetable_start: Optional[datetime.time] = None,
-    timetable_end: Optional[datetime.time] = None,
+    weekdays: Optional[list[str]],
+    date: datetime.date,
+    timetable_start: Optional[datetime.time],
+    timetable_end: Optional[datetime.time],
 ) -> list[BusRouteStopItem]:
+    """Function to query the bus route stops with their timetables.
+
+    The realtime arrivals change every few seconds and are left out, so
+    that the route stops can be cached until their timetables change.
+    Returns:
+        list[BusRouteStopItem]: Route stops without realtime arrivals.
+    """
     result: list[BusRouteStopItem] = []
-    korean_holidays = holidays.KR()
+    if not route_stop:
+        return result
+    # The holiday lookup runs on the event loop, so it is done once with the
+    # calendar shared by the module instead of one built for every call.
+    sunday_timetable = date in korean_holidays or date.weekday() == 6
+    # Every pair is loaded by the same statements instead of one per pair.
+    route_stops: dict[tuple[int, int], BusRouteStopRows] = {
+        (item.stop_id, item.route_id): item
+        for item in await fetch_route_stops(db_session, [
+            (query.stop, query.route) for query in route_stop
+        ], realtime=False)
+    }
     for query in route_stop:
-        statement = select(BusRouteStop).where(
-            BusRouteStop.stop_id == query.stop,
-            BusRouteStop.route_id == query.route,
-        ).options(
-            selectinload(BusRouteStop.stop),
-            selectinload(BusRouteStop.route),
-            selectinload(BusRouteStop.realtime),
-            selectinload(BusRouteStop.timetable),
-            selectinload(BusRouteStop.start_stop),
-        )
-        query_result: Optional[BusRouteStop] = (
-            await db_session.execute(statement)
-        ).scalars().first()
+        query_result = route_stops.get((query.stop, query.route))
         if query_result is None:
             continue
 
-        realtime_list: list[BusRealtime] = []
-        for realtime in query_result.realtime:
-            realtime_list.append(BusRealtime(
-                stop=realtime.stop,
-                time=realtime.minutes,
-                seat=realtime.seat,
-                low_floor=realtime.low_floor,
-                updated_at=realtime.last_updated_time,
-            ))
-
         timetable_list: list[BusTimetable] = []
 
         for timetable in query_result.timetable:
             if weekdays is None:
-                if date in korean_holidays or date.weekday() == 6:
+                if sunday_timetable:
                     if timetable.weekday != 'sunday':
                         continue
                 elif date.weekday() == 5:
@@ -109,13 +141,82 @@ async def query_bus(
             ))
         result.append(BusRouteStopItem(
             stop_id=query_result.stop_id,
-            stop_name=query_result.stop.name,
+            stop_name=query_result.stop_name,
             route_id=query_result.route_id,
-            route_name=query_result.route.name,
+            route_name=query_result.route_name,
             sequence=query_result.order,
-            start_stop_id=query_result.start_stop.id,
-            start_stop_name=query_result.start_stop.name,
-            realtime=realtime_list,
+            start_stop_id=query_result.start_stop_id,
+            start_stop_name=query_result.start_stop_name,
+            realtime=[],
             timetable=timetable_list,
         ))
     return result
+
+
+@traced()
+@served_from_boards(bus_board)
+@statement_budget(3, rows=600)
+async def query_bus(
+    db_session: AsyncSession,
+    route_stop: list[BusRouteStopQuery],
+    weekdays: Optional[list[str]] = None,
+    date: datetime.date = datetime.date.today(),
+    timetable_start: Optional[datetime.time] = None,
+    timetable_end: Optional[datetime.time] = None,
+) -> list[BusRouteStopItem]:
+    route_stops = await query_bus_timetables(
+        db_session, route_stop, weekdays, date, timetable_start,
+        timetable_end,
+    )
+    if not route_stops:
+        return route_stops
+    now = current_datetime()
+    arrivals = await fetch_realtime(db_session, [
+        (item.stop_id, item.route_id) for item in route_stops
+    ])
+    result: list[BusRouteStopItem] = []
+    for item in route_stops:
+        realtime_list: list[BusRealtime] = []
+        for realtime in arrivals.get((item.stop_id, item.route_id), []):
+            aged = age_arrival(
+                realtime.minutes, realtime.stop,
+                realtime.last_updated_time, now,
+            )
+            if aged is None:
+                continue
+            realtime_list.append(BusRealtime(
+                stop=aged.stops,
+                time=aged.minutes,
+                seat=realtime.seat,
+                low_floor=realtime.low_floor,
+                updated_at=realtime.last_updated_time,
+                stale=aged.stale,
+            ))
+        # The cached route stops are shared, so the arrivals are set on
+        # copies.
+        result.append(dataclasses.replace(item, realtime=realtime_list))
+    return result
+
+
+@arrival_boards.board(
+    'bus', tables=(*FIELD_TABLES['bus'], 'bus_realtime'))
+async def build_bus_boards(
+    db_session: AsyncSession,
+) -> dict[Hashable, Any]:
+    """Function to build the arrivals and timetable of every route stop.
+    Args:
+        db_session (AsyncSession): Database session.
+    Returns:
+        dict[Hashable, Any]: BusRouteStopItem by stop and route ID, and the
+            set of every pair under None.
+    """
+    statement = select(BusRouteStop.stop_id, BusRouteStop.route_id)
+    result = await query_bus(db_session, route_stop=[
+        BusRouteStopQuery(stop=stop_id, route=route_id)
+        for stop_id, route_id in await db_session.execute(statement)
+    ], date=datetime.date.today())
+    boards: dict[Hashable, Any] = {
+        (item.stop_id, item.route_id): item for item in result
+    }
+    boards[None] = frozenset(boards)
+    return boards
@@ -0,0 +1,116 @@
+"""Module that caches the results of the GraphQL query functions.
+
+Each ``query_*`` function is cached under its own field name with its own
+time-to-live, so a document mixing rarely changing fields with realtime
+fields reuses the cached parts and only recomputes the expired ones. The
+bus and subway fields only cache their timetables, and fetch and age their
+realtime arrivals on every request.
+Attributes:
+    FIELD_TABLES (dict[str, tuple[str, ...]]): Tables each field reads,
+        whose changes clear the field's cached results.
+    query_caches (dict[str, TieredCache]): Cache of each field.
+"""
+import dataclasses
+import functools
+import inspect
+from typing import Any, Awaitable, Callable, Hashable, Optional, TypeVar
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.internal.cache import TieredCache, cache_bypass, create_cache, \
+    time_bucket
+from app.internal.config import AppSettings
+
+T = TypeVar('T')
+
+
+def normalize_argument(value: Any) -> Hashable:
+    """Function to turn a query argument into a hashable value.
+    Args:
+        value (Any): Argument of a query function.
+    Returns:
+        Hashable: Normalized argument.
+    """
+    if isinstance(value, (list, tuple)):
+        return tuple(normalize_argument(item) for item in value)
+    if isinstance(value, (set, frozenset)):
+        return tuple(sorted(normalize_argument(item) for item in value))
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return (type(value).__name__,) + tuple(
+            normalize_argument(getattr(value, field.name))
+            for field in dataclasses.fields(value)
+        )
+    return value
+
+
+app_settings = AppSettings()
+FIELD_TABLES: dict[str, tuple[str, ...]] = {
+    'shuttle': (
+        'shuttle_stop', 'shuttle_route', 'shuttle_route_stop',
+        'shuttle_timetable', 'shuttle_period', 'shuttle_holiday',
+    ),
+    'bus': ('bus_timetable', 'bus_route_stop', 'bus_route', 'bus_stop'),
+    'subway': (
+        'subway_timetable', 'subway_route_station', 'subway_route',
+        'subway_station',
+    ),
+    'cafeteria': ('menu', 'restaurant'),
+    'reading_room': ('reading_room',),
+    'commute_shuttle': (
+        'commute_shuttle_route', 'commute_shuttle_timetable',
+        'commute_shuttle_stop',
+    ),
+}
+query_caches: dict[str, TieredCache] = {
+    field: create_cache(f'query:{field}', tables)
+    for field, tables in FIELD_TABLES.items()
+}
+
+
+def cached_query(
+    field: str,
+    bucket: Optional[str] = None,
+) -> Callable[[Callable[..., Awaitable[T]]], Callable[..., Awaitable[T]]]:
+    """Function to cache the result of a query function.
+
+    The key consists of every argument except database sessions, with
+    defaults applied so that omitted and explicitly passed default values
+    share an entry.
+    Args:
+        field (str): Name of the field, used to look up the cache and the
+            time-to-live. Fields without a positive time-to-live are not
+            cached.
+        bucket (str): Format of the time bucket to add to the key when the
+            result depends on the current time, such as MINUTE or DAY.
+    Returns:
+        Callable: Decorator for the query function.
+    """
+    def decorator(
+        function: Callable[..., Awaitable[T]],
+    ) -> Callable[..., Awaitable[T]]:
+        signature = inspect.signature(function)
+        if field not in query_caches:
+            query_caches[field] = create_cache(f'query:{field}')
+
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs) -> T:
+            ttl = app_settings.QUERY_CACHE_TTL.get(field, 0)
+            if ttl <= 0 or cache_bypass.get():
+                return await function(*args, **kwargs)
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            parts: list[Hashable] = [
+                (name, normalize_argument(value))
+                for name, value in sorted(bound.arguments.items())
+                if not isinstance(value, AsyncSession)
+            ]
+            if bucket is not None:
+                parts.append(time_bucket(bucket))
+            cache = query_caches[field]
+            return await cache.get_or_set(
+                cache.make_key(parts),
+                ttl,
+                lambda: function(*args, **kwargs),
+            )
+        return wrapper
+    return decorator
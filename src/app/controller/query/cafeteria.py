@@ -6,6 +6,10 @@ from sqlalchemy import select, and_, true
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import selectinload
 
+from app.controller.query.cache import cached_query
+from app.internal.cache import DAY
+from app.internal.statements import statement_budget
+from app.internal.tracing import traced
 from app.model.cafeteria import Restaurant, Menu
 
 
@@ -25,6 +29,9 @@ class CafeteriaItem:
     menus: list[MenuItem] = strawberry.field(name="menu")
 
 
+@traced()
+@cached_query('cafeteria', bucket=DAY)
+@statement_budget(3, rows=20)
 async def query_cafeteria(
     db_session: AsyncSession,
     campus: Optional[int] = None,
@@ -5,6 +5,9 @@ from sqlalchemy import or_, select
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import selectinload
 
+from app.controller.query.cache import cached_query
+from app.internal.statements import statement_budget
+from app.internal.tracing import traced
 from app.model.commute_shuttle import CommuteShuttleRoute as RouteModel
 from app.model.commute_shuttle import CommuteShuttleTimetableItem
 
@@ -24,6 +27,9 @@ class CommuteShuttleRoute:
         name='timetable')
 
 
+@traced()
+@cached_query('commute_shuttle')
+@statement_budget(3, rows=20)
 async def query_commute_shuttle(
     db_session: AsyncSession,
     name: Optional[str] = None,
@@ -5,6 +5,9 @@ import strawberry
 from sqlalchemy import select, and_
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.controller.query.cache import cached_query
+from app.internal.statements import statement_budget
+from app.internal.tracing import traced
 from app.model.library import ReadingRoom
 
 
@@ -32,6 +35,9 @@ class ReadingRoomItem:
     updated_at: datetime.datetime
 
 
+@traced()
+@cached_query('reading_room')
+@statement_budget(1, rows=10)
 async def query_reading_room(
     db_session: AsyncSession,
     campus: Optional[int] = None,
@@ -0,0 +1,176 @@
+"""Module that adds automatic persisted queries to the GraphQL router.
+
+Clients send the sha256 hash of a document in
+``extensions.persistedQuery.sha256Hash``. The first request for a hash that
+is not registered yet is answered with ``PersistedQueryNotFound``; the
+client then retries with the full document, which is stored so that later
+requests only need to carry the hash and the variables.
+
+The router also encodes the result of an operation in the response builder
+pool when its query functions built enough rows to offload.
+"""
+import hashlib
+import json
+from collections import OrderedDict
+from typing import Any, Optional
+
+from graphql import GraphQLError
+from strawberry.fastapi import GraphQLRouter
+from strawberry.http import GraphQLHTTPResponse, GraphQLRequestData
+from strawberry.http.async_base_view import AsyncHTTPRequestAdapter
+from strawberry.http.exceptions import HTTPException
+from strawberry.types import ExecutionResult
+
+from app.internal.offload import response_offloader
+from app.internal.tracing import tracer
+
+
+class PersistedQueryNotFound(Exception):
+    """Exception raised when a hash is sent without a registered document."""
+
+
+class EncodedResponseData(dict):
+    """Class that holds the response data and its encoded JSON.
+    Attributes:
+        encoded (str): JSON of the response data.
+    """
+
+    def __init__(self, data: GraphQLHTTPResponse, encoded: str) -> None:
+        super().__init__(data)
+        self.encoded = encoded
+
+
+class PersistedQueryStore:
+    """Class that keeps the most recently used persisted documents.
+    Attributes:
+        maxsize (int): Maximum number of documents to keep.
+    """
+
+    def __init__(self, maxsize: int) -> None:
+        self.maxsize = maxsize
+        self._documents: OrderedDict[str, str] = OrderedDict()
+
+    def get(self, sha256_hash: str) -> Optional[str]:
+        document = self._documents.get(sha256_hash)
+        if document is not None:
+            self._documents.move_to_end(sha256_hash)
+        return document
+
+    def put(self, sha256_hash: str, document: str) -> None:
+        self._documents[sha256_hash] = document
+        self._documents.move_to_end(sha256_hash)
+        while len(self._documents) > self.maxsize:
+            self._documents.popitem(last=False)
+
+    def resolve(
+        self,
+        query: Optional[str],
+        extensions: Optional[dict[str, Any]],
+    ) -> Optional[str]:
+        """Function to resolve the document of a request.
+        Args:
+            query (str): Document sent with the request.
+            extensions (dict): Extensions sent with the request.
+        Returns:
+            str: Document to execute.
+        Raises:
+            PersistedQueryNotFound: If only an unknown hash is sent.
+            HTTPException: If the hash does not match the document.
+        """
+        if not isinstance(extensions, dict):
+            return query
+        persisted_query = extensions.get('persistedQuery')
+        if not isinstance(persisted_query, dict):
+            return query
+        if persisted_query.get('version') != 1:
+            raise HTTPException(400, 'Unsupported persisted query version')
+        sha256_hash = persisted_query.get('sha256Hash')
+        if not isinstance(sha256_hash, str):
+            raise HTTPException(400, 'Persisted query hash is missing')
+        if query is None:
+            document = self.get(sha256_hash)
+            if document is None:
+                raise PersistedQueryNotFound()
+            return document
+        if hashlib.sha256(query.encode('utf-8')).hexdigest() != sha256_hash:
+            raise HTTPException(400, 'Provided sha does not match query')
+        self.put(sha256_hash, query)
+        return query
+
+
+class PersistedQueryRouter(GraphQLRouter):
+    """GraphQL router that accepts automatic persisted queries.
+    Attributes:
+        persisted_queries (PersistedQueryStore): Registered documents.
+    """
+
+    def __init__(self, *args, persisted_query_size: int = 1000, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.persisted_queries = PersistedQueryStore(persisted_query_size)
+
+    def should_render_graphiql(self, request: Any) -> bool:
+        # Hash-only GET requests carry no query but must not get GraphiQL.
+        if request.query_params.get('extensions') is not None:
+            return False
+        return super().should_render_graphiql(request)
+
+    async def parse_http_body(
+        self,
+        request: AsyncHTTPRequestAdapter,
+    ) -> GraphQLRequestData:
+        content_type = request.content_type or ''
+        if 'application/json' in content_type:
+            data = self.parse_json(await request.get_body())
+        elif request.method == 'GET':
+            data = self.parse_query_params(request.query_params)
+            if isinstance(data.get('extensions'), str):
+                data['extensions'] = self.parse_json(data['extensions'])
+        else:
+            return await super().parse_http_body(request)
+        if not isinstance(data, dict):
+            raise HTTPException(400, 'Request body must be a JSON object')
+        return GraphQLRequestData(
+            query=self.persisted_queries.resolve(
+                data.get('query'), data.get('extensions'),
+            ),
+            variables=data.get('variables'),
+            operation_name=data.get('operationName'),
+        )
+
+    def encode_json(self, response_data: Any) -> str:
+        if isinstance(response_data, EncodedResponseData):
+            return response_data.encoded
+        with tracer.span('serialize'):
+            return super().encode_json(response_data)
+
+    async def process_result(
+        self,
+        request: Any,
+        result: ExecutionResult,
+    ) -> GraphQLHTTPResponse:
+        response_data = await super().process_result(request, result)
+        rows = getattr(request.state, 'built_rows', 0)
+        if not response_offloader.should_offload(rows):
+            return response_data
+        with tracer.span('serialize'):
+            encoded = await response_offloader.run(
+                json.dumps, response_data, rows=rows)
+        return EncodedResponseData(response_data, encoded)
+
+    async def execute_operation(
+        self,
+        request: Any,
+        context: Any,
+        root_value: Any,
+    ) -> ExecutionResult:
+        with response_offloader.tally() as rows:
+            try:
+                result = await super().execute_operation(
+                    request, context, root_value)
+            except PersistedQueryNotFound:
+                return ExecutionResult(data=None, errors=[GraphQLError(
+                    'PersistedQueryNotFound',
+                    extensions={'code': 'PERSISTED_QUERY_NOT_FOUND'},
+                )])
+        request.state.built_rows = rows[0]
+        return result
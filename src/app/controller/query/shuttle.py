@@ -1,13 +1,22 @@
+import asyncio
 import datetime
-from typing import Optional
+from typing import Any, Hashable, Optional
 
 import strawberry
-from sqlalchemy import select
+from sqlalchemy import bindparam, select
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import selectinload
 
+from app.controller.query.cache import FIELD_TABLES, cached_query
+from app.internal.boards import arrival_boards, served_from_boards
+from app.internal.cache import MINUTE
 from app.internal.date_utils import current_period, is_weekends
-from app.model.shuttle import ShuttleRouteStop, ShuttleStop, ShuttleRoute
+from app.internal.offload import response_offloader
+from app.internal.snapshot import timetable_snapshot
+from app.internal.statements import statement_budget
+from app.internal.timeline import TimelineBuilder
+from app.internal.tracing import traced
+from app.model.shuttle import ShuttleRouteStop, ShuttleStop, \
+    ShuttleRoute, ShuttleTimetableItem
 
 
 @strawberry.type
@@ -21,6 +30,7 @@ class ShuttleArrivalOtherStopItem:
 class ShuttleArrivalTimeItem:
     weekdays: bool = strawberry.field(name="weekdays")
     time: datetime.time = strawberry.field(name="time")
+    # Seconds from the start of the current minute when no date is given.
     remaining_time: float = strawberry.field(name="remainingTime")
     other_stops: list[ShuttleArrivalOtherStopItem] = \
         strawberry.field(name="otherStops")
@@ -68,110 +78,272 @@ class ShuttleItem:
     params: ShuttleQueryItem = strawberry.field(name="params")
 
 
-async def query_shuttle(
-    db_session: AsyncSession,
-    stop_query: Optional[list[str]] = None,
+# Statements are built once with bound parameters instead of on every call.
+STOP_ROWS_STATEMENT = select(
+    ShuttleStop.name, ShuttleStop.latitude, ShuttleStop.longitude,
+)
+# The other stops of every route are listed, so every route stop is loaded
+# even when the stops are filtered.
+ROUTE_STOP_ROWS_STATEMENT = select(
+    ShuttleRouteStop.route_name, ShuttleRouteStop.stop_name,
+    ShuttleRouteStop.stop_order, ShuttleRouteStop.cumulative_time,
+    ShuttleRoute.korean, ShuttleRoute.english, ShuttleRoute.tags,
+).join(ShuttleRouteStop.route)
+TIMETABLE_ROWS_STATEMENT = select(
+    ShuttleTimetableItem.route_name, ShuttleTimetableItem.stop_name,
+    ShuttleTimetableItem.period_type_name, ShuttleTimetableItem.weekday,
+    ShuttleTimetableItem.departure_time,
+).order_by(ShuttleTimetableItem.departure_time)
+STOP_ROWS_BY_NAME_STATEMENT = STOP_ROWS_STATEMENT.where(
+    ShuttleStop.name.in_(bindparam('stops', expanding=True)))
+TIMETABLE_ROWS_BY_STOP_STATEMENT = TIMETABLE_ROWS_STATEMENT.where(
+    ShuttleTimetableItem.stop_name.in_(bindparam('stops', expanding=True)))
+SNAPSHOT_TIMETABLE_ROWS = (
+    'shuttle_timetable',
+    ('route_name', 'stop_name', 'period_type_name', 'weekday',
+     'departure_time'),
+    ('stop_name',),
+    ('departure_time',),
+)
+
+
+def build_shuttle_stops(
+    stops: list[tuple[str, float, float]],
+    route_stops: list[tuple[str, str, int, int, str, str, str]],
+    timetables: list[tuple[str, str, str, bool, datetime.time]],
+    date_query: datetime.datetime,
+    period_query: list[str],
+    weekday_query: list[bool],
     route_query: Optional[list[str]] = None,
     tag_query: Optional[list[str]] = None,
-    period_query: Optional[list[str]] = None,
-    weekday_query: Optional[list[bool]] = None,
-    date_query: Optional[datetime.datetime] = None,
     timetable_start: Optional[datetime.time] = None,
     timetable_end: Optional[datetime.time] = None,
-) -> ShuttleItem:
-    filters = []
-    if date_query is None:
-        date_query = datetime.datetime.now()
-    if stop_query:
-        filters.append(ShuttleStop.name.in_(stop_query))
-    if period_query is None:
-        period_query = [(await current_period(db_session, date_query))]
-    if weekday_query is None:
-        weekday_query = [not is_weekends(date_query.date())]
-    statement = select(ShuttleStop).where(*filters).options(
-        selectinload(ShuttleStop.routes).options(
-            selectinload(ShuttleRouteStop.route).options(
-                selectinload(ShuttleRoute.stops),
-            ),
-            selectinload(ShuttleRouteStop.timetable),
-        ),
-    )
-    query_result = (await db_session.execute(statement)).scalars().all()
+) -> list[ShuttleStopItem]:
+    """Function to build the shuttle stops from the rows of the query.
+    Args:
+        stops (list[tuple]): Name, latitude and longitude of each stop.
+        route_stops (list[tuple]): Route name, stop name, stop order,
+            cumulative time, Korean and English descriptions and tag of the
+            route of each stop on every route.
+        timetables (list[tuple]): Route name, stop name, period, weekday
+            flag and departure time of each departure, sorted by time.
+        date_query (datetime.datetime): Time the remaining times are
+            computed from.
+        period_query (list[str]): Periods of the departures to keep.
+        weekday_query (list[bool]): Weekday flags of the departures to keep.
+        route_query (list[str]): Routes to keep, or None for every route.
+        tag_query (list[str]): Tags to keep, or None for every tag.
+        timetable_start (datetime.time): Earliest departure time.
+        timetable_end (datetime.time): Latest departure time.
+    Returns:
+        list[ShuttleStopItem]: Stops in the order of the rows.
+    """
+    route_stop_dict: dict[str, list[tuple[int, str, int]]] = {}
+    stop_route_dict: dict[str, list[tuple[str, int, str, str, str]]] = {}
+    for route_name, stop_name, stop_order, cumulative_time, korean, \
+            english, tag in route_stops:
+        route_stop_dict.setdefault(route_name, []).append(
+            (stop_order, stop_name, cumulative_time))
+        stop_route_dict.setdefault(stop_name, []).append(
+            (route_name, cumulative_time, korean, english, tag))
+    for other_stops in route_stop_dict.values():
+        other_stops.sort()
+    departure_dict: dict[tuple[str, str], list[tuple[str, bool,
+                                                     datetime.time]]] = {}
+    for route_name, stop_name, period, weekday, departure_time \
+            in timetables:
+        departure_dict.setdefault((route_name, stop_name), []).append(
+            (period, weekday, departure_time))
+
     result: list[ShuttleStopItem] = []
-    for stop in query_result:  # type: ShuttleStop
+    for stop_name, latitude, longitude in stops:
         route_dict = {}
-        tag_dict = {}
-        for route in stop.routes:  # type: ShuttleRouteStop
-            route_stop_list: list[dict] = []
-            for other in route.route.stops:  # type: ShuttleRouteStop
-                route_stop_list.append({
-                    "stop_name": other.stop_name,
-                    "timedelta": other.cumulative_time - route.cumulative_time,
-                })
-            if route_query is not None and route.route.name not in route_query:
+        timeline_builder: TimelineBuilder[str, ShuttleArrivalTimeItem] = \
+            TimelineBuilder(key=lambda item: item.remaining_time)
+        for route_name, cumulative_time, korean, english, tag \
+                in stop_route_dict.get(stop_name, []):
+            route_stop_list = [
+                (other_name, other_time - cumulative_time)
+                for _, other_name, other_time in route_stop_dict[route_name]
+            ]
+            if route_query is not None and route_name not in route_query:
                 continue
-            if tag_query is not None and route.route.tags not in tag_query:
+            if tag_query is not None and tag not in tag_query:
                 continue
             timetable: list[ShuttleArrivalTimeItem] = []
-            for timetable_item in route.timetable:
-                if timetable_item.period_type_name not in period_query:
+            for period, weekday, departure_time in departure_dict.get(
+                    (route_name, stop_name), []):
+                if period not in period_query:
                     continue
-                elif timetable_item.weekday not in weekday_query:
+                elif weekday not in weekday_query:
                     continue
                 elif timetable_start is not None and \
-                        timetable_item.departure_time < timetable_start:
+                        departure_time < timetable_start:
                     continue
                 elif timetable_end is not None and \
-                        timetable_item.departure_time > timetable_end:
+                        departure_time > timetable_end:
                     continue
-                remaining_time = (datetime.datetime.combine(
-                    date_query.date(),
-                    timetable_item.departure_time,
-                ) - date_query).total_seconds()
-                other_stops: list[ShuttleArrivalOtherStopItem] = []
-                for other_stop in route_stop_list:
-                    other_stops.append(ShuttleArrivalOtherStopItem(
-                        stop_name=other_stop["stop_name"],
-                        timedelta=other_stop["timedelta"],
-                        time=(datetime.datetime.combine(
-                            date_query.date(),
-                            timetable_item.departure_time,
-                        ) + datetime.timedelta(
-                            minutes=other_stop["timedelta"],
-                        )).time(),
-                    ))
+                departure = datetime.datetime.combine(
+                    date_query.date(), departure_time)
                 timetable.append(ShuttleArrivalTimeItem(
-                    weekdays=timetable_item.weekday,
-                    time=timetable_item.departure_time,
-                    remaining_time=remaining_time,
-                    other_stops=other_stops,
+                    weekdays=weekday,
+                    time=departure_time,
+                    remaining_time=(departure - date_query).total_seconds(),
+                    other_stops=[
+                        ShuttleArrivalOtherStopItem(
+                            stop_name=other_name,
+                            timedelta=other_timedelta,
+                            time=(departure + datetime.timedelta(
+                                minutes=other_timedelta,
+                            )).time(),
+                        )
+                        for other_name, other_timedelta in route_stop_list
+                    ],
                 ))
-            if route.route.name not in route_dict:
-                route_dict[route.route.name] = ShuttleRouteStopItem(
-                    route_id=route.route.name,
-                    description_korean=route.route.korean,
-                    description_english=route.route.english,
+            if route_name not in route_dict:
+                route_dict[route_name] = ShuttleRouteStopItem(
+                    route_id=route_name,
+                    description_korean=korean,
+                    description_english=english,
                     timetable=timetable,
                 )
-            if route.route.tags not in tag_dict:
-                tag_dict[route.route.tags] = ShuttleTagStopItem(
-                    tag_id=route.route.tags,
-                    timetable=[],
-                )
-            tag_dict[route.route.tags].timetable.extend(timetable)
-        for route_item in route_dict.values():
-            route_item.timetable.sort(key=lambda x: x.remaining_time)
-        for tag_item in tag_dict.values():
-            tag_item.timetable.sort(key=lambda x: x.remaining_time)
+            # Departures of a route are loaded sorted by time.
+            timeline_builder.add(tag, timetable)
         result.append(ShuttleStopItem(
-            name=stop.name,
+            name=stop_name,
             location=ShuttleStopLocationItem(
-                latitude=stop.latitude,
-                longitude=stop.longitude,
+                latitude=latitude,
+                longitude=longitude,
             ),
             routes=list(route_dict.values()),
-            tags=list(tag_dict.values()),
+            tags=[
+                ShuttleTagStopItem(tag_id=tag, timetable=timetable)
+                for tag, timetable in timeline_builder.timelines().items()
+            ],
         ))
+    return result
+
+
+async def fetch_shuttle_rows(
+    db_session: AsyncSession,
+    stop_query: Optional[list[str]] = None,
+) -> tuple[list[tuple], list[tuple], list[tuple]]:
+    """Function to fetch the rows the shuttle stops are built from.
+    Args:
+        db_session (AsyncSession): Database session.
+        stop_query (list[str]): Names of the stops, or None for every stop.
+    Returns:
+        tuple[list[tuple], list[tuple], list[tuple]]: Rows of the stops,
+            the route stops and the departures.
+    """
+    parameters = {}
+    stop_statement, timetable_statement = \
+        STOP_ROWS_STATEMENT, TIMETABLE_ROWS_STATEMENT
+    if stop_query:
+        parameters = {'stops': stop_query}
+        stop_statement, timetable_statement = \
+            STOP_ROWS_BY_NAME_STATEMENT, TIMETABLE_ROWS_BY_STOP_STATEMENT
+    stops = [tuple(row) for row in
+             await db_session.execute(stop_statement, parameters)]
+    route_stops = [tuple(row) for row in
+                   await db_session.execute(ROUTE_STOP_ROWS_STATEMENT)]
+    snapshot = timetable_snapshot.groups(*SNAPSHOT_TIMETABLE_ROWS)
+    if snapshot is not None:
+        keys = [(name,) for name in dict.fromkeys(stop_query)] \
+            if stop_query else list(snapshot)
+        timetables = sorted((
+            row for key in keys for row in snapshot.get(key, [])
+        ), key=lambda row: row[4])
+    else:
+        timetables = [tuple(row) for row in await db_session.execute(
+            timetable_statement, parameters)]
+    return stops, route_stops, timetables
+
+
+async def shuttle_board(
+    stop_query: Optional[list[str]],
+    route_query: Optional[list[str]],
+    tag_query: Optional[list[str]],
+    period_query: Optional[list[str]],
+    weekday_query: Optional[list[bool]],
+    date_query: Optional[datetime.datetime],
+    timetable_start: Optional[datetime.time],
+    timetable_end: Optional[datetime.time],
+    **_: Any,
+) -> Optional[ShuttleItem]:
+    """Function to assemble the shuttle stops from the boards.
+    Returns:
+        ShuttleItem: Stops asked for, or None when arguments other than
+            the stops are given or a board can not be served.
+    """
+    if any(argument is not None for argument in (
+            route_query, tag_query, period_query, weekday_query,
+            date_query, timetable_start, timetable_end)):
+        return None
+    index = await arrival_boards.get('shuttle', None)
+    if index is None:
+        return None
+    names, params = index
+    stops = await arrival_boards.get_many('shuttle', [
+        name for name in names if not stop_query or name in stop_query
+    ])
+    if stops is None:
+        return None
+    return ShuttleItem(stops=stops, params=params)
+
+
+@traced()
+@served_from_boards(shuttle_board)
+@cached_query('shuttle', bucket=MINUTE)
+@statement_budget(4, rows=5500)
+async def query_shuttle(
+    db_session: AsyncSession,
+    stop_query: Optional[list[str]] = None,
+    route_query: Optional[list[str]] = None,
+    tag_query: Optional[list[str]] = None,
+    period_query: Optional[list[str]] = None,
+    weekday_query: Optional[list[bool]] = None,
+    date_query: Optional[datetime.datetime] = None,
+    timetable_start: Optional[datetime.time] = None,
+    timetable_end: Optional[datetime.time] = None,
+    period_session: Optional[AsyncSession] = None,
+) -> ShuttleItem:
+    if date_query is None:
+        # Results are cached and served from the boards for a minute, so
+        # the remaining times count from its start for every caller.
+        date_query = datetime.datetime.now().replace(second=0, microsecond=0)
+    if weekday_query is None:
+        weekday_query = [not is_weekends(date_query.date())]
+    if period_query is not None:
+        rows = await fetch_shuttle_rows(db_session, stop_query)
+    elif period_session is None or period_session is db_session:
+        period_query = [(await current_period(db_session, date_query))]
+        rows = await fetch_shuttle_rows(db_session, stop_query)
+    else:
+        # The period lookup does not depend on the stops, so both queries
+        # run at the same time on separate connections.
+        period, rows = await asyncio.gather(
+            current_period(period_session, date_query),
+            fetch_shuttle_rows(db_session, stop_query),
+        )
+        period_query = [period]
+    # Plain rows are fetched so that a large result can be built off the
+    # event loop.
+    stops, route_stops, timetables = rows
+    result = await response_offloader.run(
+        build_shuttle_stops,
+        stops,
+        route_stops,
+        timetables,
+        date_query,
+        period_query,
+        weekday_query,
+        route_query,
+        tag_query,
+        timetable_start,
+        timetable_end,
+        rows=len(timetables),
+    )
     return ShuttleItem(
         stops=result,
         params=ShuttleQueryItem(
@@ -179,3 +351,23 @@ async def query_shuttle(
             weekday=weekday_query,
         ),
     )
+
+
+@arrival_boards.board('shuttle', tables=FIELD_TABLES['shuttle'])
+async def build_shuttle_boards(
+    db_session: AsyncSession,
+) -> dict[Hashable, Any]:
+    """Function to build the shuttle departures of every stop.
+    Args:
+        db_session (AsyncSession): Database session.
+    Returns:
+        dict[Hashable, Any]: ShuttleStopItem by stop name, and the stop
+            names in the order of the rows with the query parameters under
+            None.
+    """
+    result = await query_shuttle(db_session)
+    boards: dict[Hashable, Any] = {
+        stop.name: stop for stop in result.stops
+    }
+    boards[None] = ([stop.name for stop in result.stops], result.params)
+    return boards
@@ -1,12 +1,22 @@
+import dataclasses
 import datetime
-from typing import Optional
+from typing import Any, Hashable, Optional
 
 import strawberry
-from sqlalchemy import select, true, and_, ColumnElement
+from sqlalchemy import StatementLambdaElement, lambda_stmt, select
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import selectinload
+from sqlalchemy.orm import aliased
 
-from app.model.subway import RouteStation
+from app.controller.query.cache import FIELD_TABLES, cached_query
+from app.internal.boards import arrival_boards, served_from_boards
+from app.internal.date_utils import current_datetime
+from app.internal.offload import response_offloader
+from app.internal.realtime_aging import age_arrival
+from app.internal.snapshot import timetable_snapshot
+from app.internal.statements import statement_budget
+from app.internal.tracing import traced
+from app.model.subway import Line, RealtimeItem, RouteStation, TimetableItem
+from app.rows.subway import NAME_STATEMENT
 
 
 @strawberry.type
@@ -34,6 +44,7 @@ class RealtimeItemResponse:
     train_no: str = strawberry.field(name="trainNo")
     is_express: bool = strawberry.field(name="isExpress")
     is_last: bool = strawberry.field(name="isLast")
+    stale: bool = strawberry.field(name="stale")
 
 
 @strawberry.type
@@ -53,6 +64,273 @@ class StationItem:
     realtime: RealtimeListResponse = strawberry.field(name="realtime")
 
 
+def build_station_items(
+    stations: list[tuple[str, str, int, str, int]],
+    timetables: list[tuple[str, str, str, datetime.time, str, str]],
+    timetable_start: Optional[datetime.time] = None,
+    timetable_end: Optional[datetime.time] = None,
+) -> list[StationItem]:
+    """Function to build the subway stations from the rows of the query,
+    without their realtime arrivals.
+    Args:
+        stations (list[tuple]): ID, name, line ID, line name and sequence
+            of each station.
+        timetables (list[tuple]): Station ID, heading, weekday, departure
+            time, destination ID and destination name of each departure.
+        timetable_start (datetime.time): Earliest departure time.
+        timetable_end (datetime.time): Latest departure time.
+    Returns:
+        list[StationItem]: Stations in the order of the rows.
+    """
+    station_timetables: dict[str, dict[str, list[TimetableItemResponse]]] = {
+        station_id: {'up': [], 'down': []} for station_id, *_ in stations
+    }
+    for station_id, heading, weekday, departure_time, terminal_id, \
+            terminal_name in timetables:
+        if timetable_start is not None and \
+                (timetable_start > departure_time > datetime.time(4, 0)):
+            continue
+        if timetable_end is not None and timetable_end < departure_time:
+            continue
+        station_timetables[station_id][heading].append(
+            TimetableItemResponse(
+                terminal_id=terminal_id,
+                terminal_name=terminal_name,
+                weekday=weekday,
+                time=departure_time,
+            ),
+        )
+    return [
+        StationItem(
+            station_id=station_id,
+            station_name=station_name,
+            line_id=line_id,
+            line_name=line_name,
+            sequence=sequence,
+            timetable=TimetableListResponse(
+                up=station_timetables[station_id]['up'],
+                down=station_timetables[station_id]['down'],
+            ),
+            realtime=RealtimeListResponse(up=[], down=[]),
+        )
+        for station_id, station_name, line_id, line_name, sequence
+        in stations
+    ]
+
+
+def build_realtime_lists(
+    realtimes: list[tuple[str, str, int, str, int, int, str, bool, bool,
+                          str, str, datetime.datetime]],
+    now: Optional[datetime.datetime] = None,
+) -> dict[str, RealtimeListResponse]:
+    """Function to build the realtime arrivals of the subway stations.
+    Args:
+        realtimes (list[tuple]): Station ID, heading, sequence, location,
+            remaining stations, remaining minutes, train number, express
+            and last flags, destination ID, destination name and update
+            time of each arriving train.
+        now (datetime.datetime): Time the arrivals are aged to, or None
+            for the current time in Korea.
+    Returns:
+        dict[str, RealtimeListResponse]: Arrivals by station ID.
+    """
+    if now is None:
+        now = current_datetime()
+    station_realtimes: dict[str, RealtimeListResponse] = {}
+    for station_id, heading, sequence, location, remaining_station, \
+            remaining_time, train_no, is_express, is_last, terminal_id, \
+            terminal_name, updated_at in realtimes:
+        aged = age_arrival(remaining_time, remaining_station, updated_at, now)
+        if aged is None:
+            continue
+        arrivals = station_realtimes.setdefault(
+            station_id, RealtimeListResponse(up=[], down=[]))
+        (arrivals.up if heading == 'true' else arrivals.down).append(
+            RealtimeItemResponse(
+                terminal_id=terminal_id,
+                terminal_name=terminal_name,
+                sequence=sequence,
+                location=location,
+                remaining_station=aged.stops,
+                remaining_time=aged.minutes,
+                train_no=train_no,
+                is_express=is_express,
+                is_last=is_last,
+                stale=aged.stale,
+            ),
+        )
+    return station_realtimes
+
+
+async def subway_board(
+    station: Optional[list[str]],
+    heading: Optional[str],
+    weekday: Optional[str],
+    timetable_start: Optional[datetime.time],
+    timetable_end: Optional[datetime.time],
+    **_: Any,
+) -> Optional[list[StationItem]]:
+    """Function to assemble the subway stations from the boards.
+    Returns:
+        list[StationItem]: Stations asked for, or None when arguments other
+            than the stations are given or a board can not be served.
+    """
+    if any(argument is not None for argument in (
+            heading, weekday, timetable_start, timetable_end)):
+        return None
+    station_ids = await arrival_boards.get('subway', None)
+    if station_ids is None:
+        return None
+    return await arrival_boards.get_many('subway', [
+        station_id for station_id in station_ids
+        if station is None or station_id in station
+    ])
+
+
+# Plain rows are fetched so that a large result can be built off the event
+# loop.
+DESTINATION_STATION = aliased(RouteStation)
+STATION_ROWS_STATEMENT = select(
+    RouteStation.id, RouteStation.station_name, Line.id, Line.name,
+    RouteStation.sequence,
+).join(RouteStation.line)
+TIMETABLE_ROWS_STATEMENT = select(
+    TimetableItem.station_id, TimetableItem.heading,
+    TimetableItem.weekday, TimetableItem.departure_time,
+    DESTINATION_STATION.id, DESTINATION_STATION.station_name,
+).join(
+    DESTINATION_STATION,
+    TimetableItem.destination_id == DESTINATION_STATION.id,
+)
+REALTIME_ROWS_STATEMENT = select(
+    RealtimeItem.station_id, RealtimeItem.heading, RealtimeItem.sequence,
+    RealtimeItem.location, RealtimeItem.stop, RealtimeItem.minute,
+    RealtimeItem.train, RealtimeItem.express, RealtimeItem.last,
+    DESTINATION_STATION.id, DESTINATION_STATION.station_name,
+    RealtimeItem.last_updated_at,
+).join(
+    DESTINATION_STATION,
+    RealtimeItem.destination_id == DESTINATION_STATION.id,
+)
+
+SNAPSHOT_TIMETABLE_ROWS = (
+    'subway_timetable',
+    ('station_id', 'heading', 'weekday', 'departure_time', 'destination_id'),
+    ('station_id',),
+    ('departure_time',),
+)
+
+
+def build_row_statements(
+    station: Optional[list[str]],
+    heading: Optional[str],
+    weekday: Optional[str],
+) -> tuple[StatementLambdaElement, StatementLambdaElement,
+           StatementLambdaElement]:
+    """Function to build the statements of the stations, the timetables and
+    the realtime arrivals filtered by the arguments.
+    Args:
+        station (list[str]): IDs of the stations, or None for every station.
+        heading (str): Heading of the timetables, or None for both.
+        weekday (str): Weekday of the timetables, or None for every day.
+    Returns:
+        tuple: Statements of the stations, the timetables and the realtime
+            arrivals.
+    """
+    # Lambda statements cache their construction and cache key by the code
+    # of the lambdas, so a call only extracts the values they close over.
+    station_statement = lambda_stmt(lambda: STATION_ROWS_STATEMENT)
+    timetable_statement = lambda_stmt(lambda: TIMETABLE_ROWS_STATEMENT)
+    realtime_statement = lambda_stmt(lambda: REALTIME_ROWS_STATEMENT)
+    if station is not None:
+        station_statement += \
+            lambda s: s.where(RouteStation.id.in_(station))
+        timetable_statement += \
+            lambda s: s.where(TimetableItem.station_id.in_(station))
+        realtime_statement += \
+            lambda s: s.where(RealtimeItem.station_id.in_(station))
+    if heading is not None:
+        timetable_statement += \
+            lambda s: s.where(TimetableItem.heading == heading)
+    if weekday is not None:
+        timetable_statement += \
+            lambda s: s.where(TimetableItem.weekday == weekday)
+    realtime_statement += lambda s: s.order_by(RealtimeItem.minute)
+    return station_statement, timetable_statement, realtime_statement
+
+
+def filter_snapshot_rows(
+    snapshot: dict[tuple, list[tuple]],
+    names: dict[str, str],
+    station: Optional[list[str]],
+    heading: Optional[str],
+    weekday: Optional[str],
+) -> list[tuple]:
+    """Function to get the timetable rows of the snapshot filtered by the
+    arguments.
+    Args:
+        snapshot (dict[tuple, list[tuple]]): Departures by station.
+        names (dict[str, str]): Names of the stations by ID.
+        station (list[str]): IDs of the stations, or None for every station.
+        heading (str): Heading of the timetables, or None for both.
+        weekday (str): Weekday of the timetables, or None for every day.
+    Returns:
+        list[tuple]: Rows of the timetable statement.
+    """
+    keys = list(snapshot) if station is None \
+        else [(station_id,) for station_id in dict.fromkeys(station)]
+    return [
+        (*row, names[row[4]])
+        for key in keys for row in snapshot.get(key, [])
+        if (heading is None or row[1] == heading)
+        and (weekday is None or row[2] == weekday)
+        # Departures to unknown stations are left out, as the join of the
+        # statement leaves them out.
+        and row[4] in names
+    ]
+
+
+@cached_query('subway')
+async def query_subway_timetables(
+    db_session: AsyncSession,
+    station: Optional[list[str]],
+    heading: Optional[str],
+    weekday: Optional[str],
+    timetable_start: Optional[datetime.time],
+    timetable_end: Optional[datetime.time],
+) -> list[StationItem]:
+    """Function to query the subway stations with their timetables.
+
+    The realtime arrivals change every few seconds and are left out, so
+    that the stations can be cached until their timetables change.
+    Returns:
+        list[StationItem]: Stations without realtime arrivals.
+    """
+    station_statement, timetable_statement, _ = \
+        build_row_statements(station, heading, weekday)
+    stations = (await db_session.execute(station_statement)).all()
+    snapshot = timetable_snapshot.groups(*SNAPSHOT_TIMETABLE_ROWS)
+    if snapshot is not None:
+        timetables = filter_snapshot_rows(
+            snapshot,
+            dict((await db_session.execute(NAME_STATEMENT)).all()),
+            station, heading, weekday,
+        )
+    else:
+        timetables = (await db_session.execute(timetable_statement)).all()
+    return await response_offloader.run(
+        build_station_items,
+        [tuple(row) for row in stations],
+        [tuple(row) for row in timetables],
+        timetable_start,
+        timetable_end,
+        rows=len(timetables),
+    )
+
+
+@traced()
+@served_from_boards(subway_board)
+@statement_budget(3, rows=1500)
 async def query_subway(
     db_session: AsyncSession,
     station: Optional[list[str]] = None,
@@ -61,74 +339,34 @@ async def query_subway(
     timetable_start: Optional[datetime.time] = None,
     timetable_end: Optional[datetime.time] = None,
 ):
-    filters: list[ColumnElement] = []
-
-    if station is not None:
-        filters.append(RouteStation.id.in_(station))
-
-    station_statement = select(RouteStation).where(and_(
-        true(), *filters,
-    )).options(
-        selectinload(RouteStation.line),
-        selectinload(RouteStation.timetable),
-        selectinload(RouteStation.realtime),
+    stations = await query_subway_timetables(
+        db_session, station, heading, weekday, timetable_start,
+        timetable_end,
     )
-    stations = (await db_session.execute(station_statement)).scalars().all()
-
-    result: list[StationItem] = []
-    for station_item in stations:  # type: RouteStation
-        station_timetable_dict: dict[str, list[TimetableItemResponse]] = \
-            {'up': [], 'down': []}
-        station_realtime_dict: dict[str, list[RealtimeItemResponse]] = \
-            {'up': [], 'down': []}
-        for timetable_item in station_item.timetable:
-            if heading is not None and timetable_item.heading != heading:
-                continue
-            if weekday is not None and timetable_item.weekday != weekday:
-                continue
-            if timetable_start is not None and \
-                    (timetable_start >
-                     timetable_item.departure_time > datetime.time(4, 0)):
-                continue
-            if timetable_end is not None and \
-                    timetable_end < timetable_item.departure_time:
-                continue
-            station_timetable_dict[timetable_item.heading].append(
-                TimetableItemResponse(
-                    terminal_id=timetable_item.destination.id,
-                    terminal_name=timetable_item.destination.station_name,
-                    weekday=timetable_item.weekday,
-                    time=timetable_item.departure_time,
-                ),
-            )
-        for realtime_item in station_item.realtime:
-            heading = 'up' if realtime_item.heading == 'true' else 'down'
-            station_realtime_dict[heading].append(
-                RealtimeItemResponse(
-                    terminal_id=realtime_item.destination.id,
-                    terminal_name=realtime_item.destination.station_name,
-                    sequence=realtime_item.sequence,
-                    location=realtime_item.location,
-                    remaining_station=realtime_item.stop,
-                    remaining_time=realtime_item.minute,
-                    train_no=realtime_item.train,
-                    is_express=realtime_item.express,
-                    is_last=realtime_item.last,
-                ),
-            )
-        result.append(StationItem(
-            station_id=station_item.id,
-            station_name=station_item.station_name,
-            line_id=station_item.line.id,
-            line_name=station_item.line.name,
-            sequence=station_item.sequence,
-            timetable=TimetableListResponse(
-                up=station_timetable_dict['up'],
-                down=station_timetable_dict['down'],
-            ),
-            realtime=RealtimeListResponse(
-                up=station_realtime_dict['up'],
-                down=station_realtime_dict['down'],
-            ),
-        ))
-    return result
+    _, _, realtime_statement = build_row_statements(station, None, None)
+    realtimes = build_realtime_lists(
+        [tuple(row) for row in await db_session.execute(realtime_statement)])
+    # The cached stations are shared, so the arrivals are set on copies.
+    return [
+        dataclasses.replace(item, realtime=realtimes.get(
+            item.station_id, RealtimeListResponse(up=[], down=[])))
+        for item in stations
+    ]
+
+
+@arrival_boards.board(
+    'subway', tables=(*FIELD_TABLES['subway'], 'subway_realtime'))
+async def build_subway_boards(
+    db_session: AsyncSession,
+) -> dict[Hashable, Any]:
+    """Function to build the timetable and arrivals of every station.
+    Args:
+        db_session (AsyncSession): Database session.
+    Returns:
+        dict[Hashable, Any]: StationItem by station ID, and the station IDs
+            in the order of the rows under None.
+    """
+    result = await query_subway(db_session)
+    boards: dict[Hashable, Any] = {item.station_id: item for item in result}
+    boards[None] = [item.station_id for item in result]
+    return boards
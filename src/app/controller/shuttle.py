@@ -1,4 +1,5 @@
 import datetime
+from typing import Any, Hashable
 
 from fastapi import APIRouter, Depends
 from sqlalchemy import select, and_, ColumnElement
@@ -8,19 +9,46 @@ from starlette import status
 from starlette.responses import JSONResponse
 
 from app.dependancies.database import get_db_session
+from app.internal.boards import arrival_boards, served_from_boards
+from app.internal.cache import DAY, MINUTE, BytesSerializer, \
+    RenderedResponse, cached_response, render_body
 from app.internal.date_utils import current_period, is_weekends, is_holiday
-from app.model.shuttle import ShuttleRoute, ShuttleStop, ShuttleRouteStop, \
-    ShuttleTimetableItem
+from app.internal.statements import statement_budget
+from app.internal.timeline import TimelineBuilder
+from app.internal.tracing import TracedRoute
+from app.model.shuttle import ShuttleRoute, ShuttleStop
 from app.response.shuttle import RouteListResponse, RouteListItemResponse, \
     RouteItemResponse, RouteStopItemResponse, StopListItemResponse, \
     StopListResponse, StopItemResponse, ArrivalResponse, ArrivalQuery, \
     ArrivalResponseItem, TimetableResponse, TimetableResponseItem
+from app.rows.shuttle import ShuttleDepartureRow, ShuttleStopRows, \
+    fetch_stop, fetch_stops
 
-shuttle_router = APIRouter()
+shuttle_router = APIRouter(route_class=TracedRoute)
+# Tags that keep their position in the responses; other tags follow them.
+TAG_ORDER = ('DH', 'DY', 'DJ', 'C')
+ARRIVAL_TABLES = (
+    'shuttle_stop', 'shuttle_route', 'shuttle_route_stop',
+    'shuttle_timetable', 'shuttle_period', 'shuttle_holiday',
+)
+TAGS_STATEMENT = select(ShuttleRoute.tags).where(
+    ShuttleRoute.tags.isnot(None)).distinct()
+
+
+async def route_tags(db_session: AsyncSession) -> list[str]:
+    """Function to get the tags of every shuttle route.
+    Args:
+        db_session (AsyncSession): Database session.
+    Returns:
+        list[str]: Tags, with the tags of TAG_ORDER first.
+    """
+    tags = (await db_session.execute(TAGS_STATEMENT)).scalars().all()
+    return sorted(tags, key=lambda tag: (
+        TAG_ORDER.index(tag) if tag in TAG_ORDER else len(TAG_ORDER), tag))
 
 
 def filter_timetable_item(
-    item: ShuttleTimetableItem,
+    item: ShuttleDepartureRow,
     period: str,
     weekdays: bool,
     now: datetime.datetime,
@@ -32,6 +60,7 @@ def filter_timetable_item(
 
 
 @shuttle_router.get('/route', response_model=RouteListResponse)
+@statement_budget(1, rows=10)
 async def get_shuttle_route_list(
         name: str | None = None,
         tag: str | None = None,
@@ -66,6 +95,7 @@ async def get_shuttle_route_list(
 
 
 @shuttle_router.get('/route/{route_id}', response_model=RouteItemResponse)
+@statement_budget(2, rows=20)
 async def get_shuttle_route_by_id(
         route_id: str,
         db_session: AsyncSession = Depends(get_db_session),
@@ -106,6 +136,7 @@ async def get_shuttle_route_by_id(
 
 
 @shuttle_router.get('/stop', response_model=StopListResponse)
+@statement_budget(1, rows=20)
 async def get_shuttle_stop_list(
         name: str | None = None,
         db_session: AsyncSession = Depends(get_db_session),
@@ -134,6 +165,7 @@ async def get_shuttle_stop_list(
 
 
 @shuttle_router.get('/stop/{stop_id}', response_model=StopItemResponse)
+@statement_budget(2, rows=20)
 async def get_shuttle_stop_by_id(
         stop_id: str,
         db_session: AsyncSession = Depends(get_db_session),
@@ -165,64 +197,40 @@ async def get_shuttle_stop_by_id(
     )
 
 
-@shuttle_router.get('/stop/{stop_id}/arrival', response_model=ArrivalResponse)
-async def get_shuttle_stop_arrival(
-        stop_id: str,
-        period: str | None = None,
-        weekdays: bool | None = None,
-        holiday: str | None = None,
-        output: str | None = 'tag',
-        db_session: AsyncSession = Depends(get_db_session),
-):
-    """Function to get the arrival time of the shuttle stop.
+def build_stop_arrival(
+    stop: ShuttleStopRows,
+    tags: list[str],
+    period: str,
+    weekdays: bool,
+    holiday: str,
+    output: str,
+    now: datetime.datetime,
+    limit: int | None = None,
+) -> ArrivalResponse:
+    """Function to build the arrival time of a shuttle stop.
     Args:
-        stop_id (str): ID of the shuttle stop.
+        stop (ShuttleStopRows): Stop with its routes and their
+            departures.
+        tags (list[str]): Tags of every route, used by the tag output.
         period (str): Period of the semester.
-        weekdays (str): Weekdays of the week.
+        weekdays (bool): Weekdays of the week.
         holiday (str): Holiday of the week.
-        output (str): Output format.
-        db_session (AsyncSession): Database session.
+        output (str): Output format, tag or route.
+        now (datetime.datetime): Current time.
+        limit (int): Maximum number of departures of each tag.
     Returns:
         ArrivalResponse: Arrival time of the shuttle stop.
     """
-    now = datetime.datetime.now()
-    # Complete the query parameters
-    if period is None:
-        period = await current_period(db_session, now)
-    if weekdays is None:
-        weekdays = not is_weekends(now)
-    if holiday is None:
-        holiday = await is_holiday(db_session, now)
-    statement = select(ShuttleStop).where(
-        ShuttleStop.name == stop_id,
-    ).options(
-        selectinload(ShuttleStop.routes).options(
-            selectinload(ShuttleRouteStop.timetable),
-            selectinload(ShuttleRouteStop.route),
-        ),
-    )
-    query_result = (await db_session.execute(statement)) \
-        .scalars().first()
-    if query_result is None:
-        return JSONResponse(
-            status_code=status.HTTP_404_NOT_FOUND,
-            content={'message': 'Shuttle stop not found.'},
-        )
     timetable_list = []
-    if output not in ['tag', 'route']:
-        return JSONResponse(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            content={'message': 'Invalid output format.'},
-        )
-    elif output == 'route':
-        for route in query_result.routes:  # type: ShuttleRouteStop
+    if output == 'route':
+        for route in stop.routes:
             departure_timetable = []
             remaining_timetable = []
             if holiday != 'halt':
                 for timetable_by_route in [
                     timetable for timetable in route.timetable
                     if filter_timetable_item(timetable, period, weekdays, now)
-                ]:  # type: ShuttleTimetableItem
+                ]:
                     if timetable_by_route.departure_time >= now.time():
                         departure_timetable.append(
                             timetable_by_route.departure_time)
@@ -237,20 +245,17 @@ async def get_shuttle_stop_arrival(
                 remaining_time=remaining_timetable,
             ))
     elif output == 'tag':
-        timetable_dict: dict[str, list[datetime.time]] = {
-            'DH': [], 'DY': [], 'DJ': [], 'C': [],
-        }
-        for route in query_result.routes:
+        timeline_builder: TimelineBuilder[str, datetime.time] = \
+            TimelineBuilder(key=lambda departure_time: departure_time,
+                            groups=tags)
+        for route in stop.routes:
             if holiday != 'halt':
-                for timetable_by_tag in [
-                    timetable for timetable in route.timetable
+                timeline_builder.add(route.tags, [
+                    timetable.departure_time for timetable in route.timetable
                     if filter_timetable_item(timetable, period, weekdays, now)
-                ]:  # type: ShuttleTimetableItem
-                    timetable_dict[route.route.tags].append(
-                        timetable_by_tag.departure_time,
-                    )
-        for tag, timetable_items in timetable_dict.items():
-            merged_timetable = sorted(timetable_items)
+                ])
+        for tag, merged_timetable in \
+                timeline_builder.timelines(limit).items():
             departure_timetable = []
             remaining_timetable = []
             for timetable_item in merged_timetable:
@@ -266,7 +271,7 @@ async def get_shuttle_stop_arrival(
             ))
 
     return ArrivalResponse(
-        name=query_result.name,
+        name=stop.name,
         query=ArrivalQuery(
             period=period,
             weekdays=weekdays,
@@ -276,8 +281,111 @@ async def get_shuttle_stop_arrival(
     )
 
 
+async def stop_arrival_board(
+    stop_id: str,
+    period: str | None,
+    weekdays: bool | None,
+    holiday: str | None,
+    output: str | None,
+    limit: int | None,
+    **_: Any,
+) -> RenderedResponse | None:
+    """Function to get the precomputed arrival time of the shuttle stop.
+    Returns:
+        RenderedResponse: Board of the stop, or None when the parameters
+            are not the defaults or the board can not be served.
+    """
+    if period is not None or weekdays is not None or holiday is not None \
+            or limit is not None:
+        return None
+    return await arrival_boards.response('shuttle_arrival', (stop_id, output))
+
+
+@shuttle_router.get('/stop/{stop_id}/arrival', response_model=ArrivalResponse)
+@served_from_boards(stop_arrival_board)
+@cached_response('shuttle_arrival', tables=ARRIVAL_TABLES, bucket=MINUTE)
+@statement_budget(5, rows=1000)
+async def get_shuttle_stop_arrival(
+        stop_id: str,
+        period: str | None = None,
+        weekdays: bool | None = None,
+        holiday: str | None = None,
+        output: str | None = 'tag',
+        limit: int | None = None,
+        db_session: AsyncSession = Depends(get_db_session),
+):
+    """Function to get the arrival time of the shuttle stop.
+    Args:
+        stop_id (str): ID of the shuttle stop.
+        period (str): Period of the semester.
+        weekdays (str): Weekdays of the week.
+        holiday (str): Holiday of the week.
+        output (str): Output format.
+        limit (int): Maximum number of departures of each tag.
+        db_session (AsyncSession): Database session.
+    Returns:
+        ArrivalResponse: Arrival time of the shuttle stop.
+    """
+    now = datetime.datetime.now()
+    # Complete the query parameters
+    if period is None:
+        period = await current_period(db_session, now)
+    if weekdays is None:
+        weekdays = not is_weekends(now)
+    if holiday is None:
+        holiday = await is_holiday(db_session, now)
+    query_result = await fetch_stop(db_session, stop_id)
+    if query_result is None:
+        return JSONResponse(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content={'message': 'Shuttle stop not found.'},
+        )
+    if output not in ['tag', 'route']:
+        return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content={'message': 'Invalid output format.'},
+        )
+    tags = await route_tags(db_session) if output == 'tag' else []
+    return build_stop_arrival(
+        query_result, tags, period, weekdays, holiday, output, now, limit)
+
+
+@arrival_boards.board(
+    'shuttle_arrival', tables=ARRIVAL_TABLES, serializer=BytesSerializer())
+async def build_arrival_boards(
+    db_session: AsyncSession,
+) -> dict[Hashable, bytes]:
+    """Function to build the arrival time of every shuttle stop.
+    Args:
+        db_session (AsyncSession): Database session.
+    Returns:
+        dict[Hashable, bytes]: Rendered ArrivalResponse by stop ID and
+            output format.
+    """
+    now = datetime.datetime.now()
+    period = await current_period(db_session, now)
+    weekdays = not is_weekends(now)
+    holiday = await is_holiday(db_session, now)
+    tags = await route_tags(db_session)
+    boards: dict[Hashable, bytes] = {}
+    for stop in await fetch_stops(db_session):
+        for output in ('tag', 'route'):
+            boards[(stop.name, output)] = render_body(build_stop_arrival(
+                stop, tags, period, weekdays, holiday, output, now))
+    return boards
+
+
 @shuttle_router.get(
     '/stop/{stop_id}/timetable', response_model=TimetableResponse)
+@cached_response(
+    'shuttle_timetable',
+    tables=(
+        'shuttle_stop', 'shuttle_route', 'shuttle_route_stop',
+        'shuttle_timetable', 'shuttle_period',
+    ),
+    bucket=DAY,
+)
+@statement_budget(4, rows=1000)
 async def get_shuttle_stop_timetable(
         stop_id: str,
         period: str | None = None,
@@ -297,16 +405,7 @@ async def get_shuttle_stop_timetable(
     # Complete the query parameters
     if period is None:
         period = await current_period(db_session, now)
-    statement = select(ShuttleStop).where(
-        ShuttleStop.name == stop_id,
-    ).options(
-        selectinload(ShuttleStop.routes).options(
-            selectinload(ShuttleRouteStop.timetable),
-            selectinload(ShuttleRouteStop.route),
-        ),
-    )
-    query_result = (await db_session.execute(statement)) \
-        .scalars().first()
+    query_result = await fetch_stop(db_session, stop_id)
     if query_result is None:
         return JSONResponse(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -319,13 +418,13 @@ async def get_shuttle_stop_timetable(
             content={'message': 'Invalid output format.'},
         )
     elif output == 'route':
-        for route in query_result.routes:  # type: ShuttleRouteStop
+        for route in query_result.routes:
             weekdays_timetable = []
             weekends_timetable = []
             for timetable_by_route in list(filter(
                     lambda x: x.period_type_name == period,
                     route.timetable,
-            )):  # type: ShuttleTimetableItem
+            )):
                 if timetable_by_route.weekday is True:
                     weekdays_timetable.append(
                         timetable_by_route.departure_time)
@@ -338,42 +437,28 @@ async def get_shuttle_stop_timetable(
                 weekends=weekends_timetable,
             ))
     elif output == 'tag':
-        timetable_dict: dict[str, dict[str, list[datetime.time]]] = {
-            'DH': {
-                'weekdays': [],
-                'weekends': [],
-            },
-            'DY': {
-                'weekdays': [],
-                'weekends': [],
-            },
-            'DJ': {
-                'weekdays': [],
-                'weekends': [],
-            },
-            'C': {
-                'weekdays': [],
-                'weekends': [],
-            },
-        }
+        tags = await route_tags(db_session)
+        weekday_builder: TimelineBuilder[tuple[str, bool], datetime.time] = \
+            TimelineBuilder(
+                key=lambda departure_time: departure_time,
+                groups=[
+                    (tag, weekday) for tag in tags
+                    for weekday in (True, False)
+                ],
+            )
         for route in query_result.routes:
-            for timetable_by_tag in filter(
-                    lambda x: x.period_type_name == period,
-                    route.timetable,
-            ):  # type: ShuttleTimetableItem
-                if timetable_by_tag.weekday is True:
-                    timetable_dict[route.route.tags]['weekdays'].append(
-                        timetable_by_tag.departure_time,
-                    )
-                else:
-                    timetable_dict[route.route.tags]['weekends'].append(
-                        timetable_by_tag.departure_time,
-                    )
-        for tag, timetable_for_tag in timetable_dict.items():
+            for weekday in (True, False):
+                weekday_builder.add((route.tags, weekday), [
+                    timetable.departure_time for timetable in route.timetable
+                    if timetable.period_type_name == period
+                    and timetable.weekday == weekday
+                ])
+        timelines = weekday_builder.timelines()
+        for tag in tags:
             timetable_list.append(TimetableResponseItem(
                 name=tag,
-                weekdays=sorted(timetable_for_tag['weekdays']),
-                weekends=sorted(timetable_for_tag['weekends']),
+                weekdays=timelines[(tag, True)],
+                weekends=timelines[(tag, False)],
             ))
 
     return TimetableResponse(
@@ -1,24 +1,45 @@
-from datetime import timedelta
+from datetime import datetime, time, timedelta
+from typing import Any, Hashable
 
 from fastapi import APIRouter, Depends
-from sqlalchemy import select
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import bindparam, select
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import load_only, selectinload
+from sqlalchemy.orm import load_only
 from starlette import status
 from starlette.responses import JSONResponse
 
 from app.dependancies.database import get_db_session
-from app.internal.date_utils import is_weekends, current_time
-from app.model.subway import RouteStation, RealtimeItem, TimetableItem
+from app.internal.boards import arrival_boards, served_from_boards
+from app.internal.cache import MINUTE, BytesSerializer, RenderedResponse, \
+    cached_response, render_body
+from app.internal.date_utils import current_datetime, current_time, \
+    is_weekends
+from app.internal.offload import response_offloader
+from app.internal.realtime_aging import AgedArrival, age_arrival
+from app.internal.statements import statement_budget
+from app.internal.subway_matching import MatchedArrival, match_arrivals
+from app.internal.tracing import TracedRoute, tracer
+from app.model.subway import RouteStation
 from app.response.subway import StationListItemResponse, StationListResponse, \
     StationItemResponse, StationCurrentStatusResponse, RealtimeResponse, \
     Realtime, Destination, CurrentStatus, TimetableResponse, Timetable, \
-    Origin, StationTimetableResponse
+    Origin, StationTimetableResponse, Arrival, ArrivalResponse
+from app.rows.subway import SubwayRealtimeRow, SubwayStationRows, \
+    fetch_departures, fetch_station, fetch_stations
 
-subway_router = APIRouter()
+subway_router = APIRouter(route_class=TracedRoute)
+ARRIVAL_TABLES = (
+    'subway_route_station', 'subway_realtime', 'subway_timetable',
+)
+# Statements of the timetable endpoint are built once with bound parameters
+# instead of on every request.
+STATION_STATEMENT = select(RouteStation.id, RouteStation.station_name). \
+    where(RouteStation.id == bindparam('station_id'))
 
 
 @subway_router.get('/station', response_model=StationListResponse)
+@statement_budget(1, rows=10)
 async def get_station_list(
         name: str | None = None,
         db_session: AsyncSession = Depends(get_db_session),
@@ -57,6 +78,7 @@ async def get_station_list(
 
 @subway_router.get(
     '/station/{station_id}', response_model=StationItemResponse)
+@statement_budget(1, rows=10)
 async def get_station(
         station_id: str,
         db_session: AsyncSession = Depends(get_db_session),
@@ -87,43 +109,112 @@ async def get_station(
     )
 
 
-@subway_router.get(
-    '/station/{station_id}/arrival',
-    response_model=StationCurrentStatusResponse,
-)
-async def get_station_arrival(
-        station_id: str,
-        db_session: AsyncSession = Depends(get_db_session),
-):
-    """ Function to get a subway station.
+def build_arrival(
+    heading: str,
+    sequence: int,
+    item: MatchedArrival,
+    now: datetime,
+) -> Arrival:
+    """Function to build a train aligned to its scheduled slot.
     Args:
-        station_id (str): ID of the subway station.
-        db_session (AsyncSession): Database session.
+        heading (str): Heading, up or down.
+        sequence (int): Sequence of the train in the heading.
+        item (MatchedArrival): Train with its realtime arrival, scheduled
+            departure or both.
+        now (datetime): Current time.
     Returns:
-        SubwayStationResponse: Response contains of subway station.
+        Arrival: Train of the station.
     """
-    statement = select(RouteStation). \
-        where(RouteStation.id == station_id). \
-        options(
-        selectinload(RouteStation.realtime).selectinload(
-            RealtimeItem.destination,
-        ),
-        selectinload(RouteStation.timetable).selectinload(
-            TimetableItem.start_station,
+    if item.realtime is not None:
+        destination = Destination(
+            id=item.realtime.destination_id,
+            name=item.realtime.destination_name,
+        )
+    else:
+        destination = Destination(
+            id=item.departure.destination_id,
+            name=item.departure.destination_name,
+        )
+    return Arrival(
+        heading=heading,
+        sequence=sequence,
+        no=item.realtime.train if item.realtime is not None else None,
+        destination=destination,
+        scheduled=item.scheduled.time() if item.scheduled else None,
+        time=max(item.expected - now, timedelta()),
+        delay=item.delay,
+        realtime=item.realtime is not None,
+    )
+
+
+def build_realtime(
+    heading: str,
+    item: SubwayRealtimeRow,
+    aged: AgedArrival,
+) -> Realtime:
+    """Function to build a realtime arrival aged to the current time.
+    Args:
+        heading (str): Heading, up or down.
+        item (SubwayRealtimeRow): Realtime arrival as stored.
+        aged (AgedArrival): Arrival aged to the current time.
+    Returns:
+        Realtime: Realtime arrival of the station.
+    """
+    return Realtime(
+        heading=heading,
+        sequence=item.sequence,
+        no=item.train,
+        destination=Destination(
+            id=item.destination_id,
+            name=item.destination_name,
         ),
-        selectinload(RouteStation.timetable).selectinload(
-            TimetableItem.destination,
+        current=CurrentStatus(
+            location=item.location,
+            time=timedelta(minutes=aged.minutes),
+            status=item.status,
         ),
+        express=item.express,
+        last=item.last,
+        updated_at=item.last_updated_at,
+        stale=aged.stale,
     )
 
-    query_result: RouteStation | None = (
-        await db_session.execute(statement)
-    ).scalars().one_or_none()
-    if query_result is None:
-        return JSONResponse(
-            status_code=status.HTTP_404_NOT_FOUND,
-            content={'message': 'Station not found'},
-        )
+
+def build_station_arrival(
+    query_result: SubwayStationRows,
+) -> StationCurrentStatusResponse:
+    """Function to build the arrival of a subway station.
+    Args:
+        query_result (SubwayStationRows): Station with its realtime arrivals
+            and timetable.
+    Returns:
+        StationCurrentStatusResponse: Arrival of the subway station.
+    """
+    # Remaining times count from the start of the minute, as a board serves
+    # the whole minute it was built in.
+    now = current_datetime().replace(second=0, microsecond=0)
+    realtime: dict[str, list[tuple[SubwayRealtimeRow, AgedArrival]]] = {
+        'true': [], 'false': [],
+    }
+    for item in query_result.realtime:
+        aged = age_arrival(item.minute, None, item.last_updated_at, now)
+        if aged is not None and item.heading in realtime:
+            realtime[item.heading].append((item, aged))
+    arrival = {
+        heading: [
+            build_arrival(heading, index, item, now)
+            for index, item in enumerate(items)
+        ] for heading, items in match_arrivals(
+            # Trains are expected when their aged minutes run out, as the
+            # realtime list shows them.
+            [
+                (now + timedelta(minutes=aged.minutes), item)
+                for item, aged in realtime['true'] + realtime['false']
+            ],
+            query_result.timetable,
+            now,
+        ).items()
+    }
     up_timetable_filter = list(filter(
         lambda x: (x.heading == 'up'
                    and (x.weekday == 'weekends') == is_weekends()
@@ -144,12 +235,12 @@ async def get_station_arrival(
             heading='up',
             sequence=index,
             origin=Origin(
-                id=item.start_station.id,
-                name=item.start_station.station_name,
+                id=item.start_station_id,
+                name=item.start_station_name,
             ),
             destination=Destination(
                 id=item.destination_id,
-                name=item.destination.station_name,
+                name=item.destination_name,
             ),
             time=item.departure_time,
         ))
@@ -161,12 +252,12 @@ async def get_station_arrival(
             heading='down',
             sequence=index,
             origin=Origin(
-                id=item.start_station.id,
-                name=item.start_station.station_name,
+                id=item.start_station_id,
+                name=item.start_station_name,
             ),
             destination=Destination(
                 id=item.destination_id,
-                name=item.destination.station_name,
+                name=item.destination_name,
             ),
             time=item.departure_time,
         ))
@@ -175,65 +266,43 @@ async def get_station_arrival(
         name=query_result.station_name,
         line=query_result.line_id,
         realtime=RealtimeResponse(
-            up=list(map(
-                lambda x: Realtime(
-                    heading='up',
-                    sequence=x.sequence,
-                    no=x.train,
-                    destination=Destination(
-                        id=x.destination_id,
-                        name=x.destination.station_name,
-                    ),
-                    current=CurrentStatus(
-                        location=x.location,
-                        time=timedelta(minutes=x.minute),
-                        status=x.status,
-                    ),
-                    express=x.express,
-                    last=x.last,
-                    updated_at=x.last_updated_at,
-                ),
-                filter(
-                    lambda x: x.heading == 'true',
-                    query_result.realtime,
-                ),
-            )),
-            down=list(map(
-                lambda x: Realtime(
-                    heading='down',
-                    sequence=x.sequence,
-                    no=x.train,
-                    destination=Destination(
-                        id=x.destination_id,
-                        name=x.destination.station_name,
-                    ),
-                    current=CurrentStatus(
-                        location=x.location,
-                        time=timedelta(minutes=x.minute),
-                        status=x.status,
-                    ),
-                    express=x.express,
-                    last=x.last,
-                    updated_at=x.last_updated_at,
-                ),
-                filter(
-                    lambda x: x.heading == 'false',
-                    query_result.realtime,
-                ),
-            )),
+            up=[
+                build_realtime('up', item, aged)
+                for item, aged in realtime['true']
+            ],
+            down=[
+                build_realtime('down', item, aged)
+                for item, aged in realtime['false']
+            ],
         ),
         timetable=TimetableResponse(
             up=up_timetable,
             down=down_timetable,
         ),
+        arrival=ArrivalResponse(up=arrival['up'], down=arrival['down']),
     )
 
 
+async def station_arrival_board(
+    station_id: str,
+    **_: Any,
+) -> RenderedResponse | None:
+    """Function to get the precomputed arrival of the subway station.
+    Returns:
+        RenderedResponse: Board of the station, or None when it can not be
+            served.
+    """
+    return await arrival_boards.response('subway_arrival', station_id)
+
+
 @subway_router.get(
-    '/station/{station_id}/timetable',
-    response_model=StationTimetableResponse,
+    '/station/{station_id}/arrival',
+    response_model=StationCurrentStatusResponse,
 )
-async def get_station_timetable(
+@served_from_boards(station_arrival_board)
+@cached_response('subway_arrival', tables=ARRIVAL_TABLES, bucket=MINUTE)
+@statement_budget(3, rows=750)
+async def get_station_arrival(
         station_id: str,
         db_session: AsyncSession = Depends(get_db_session),
 ):
@@ -244,117 +313,118 @@ async def get_station_timetable(
     Returns:
         SubwayStationResponse: Response contains of subway station.
     """
-    statement = select(RouteStation). \
-        where(RouteStation.id == station_id). \
-        options(
-        selectinload(RouteStation.timetable).selectinload(
-            TimetableItem.start_station,
-        ),
-        selectinload(RouteStation.timetable).selectinload(
-            TimetableItem.destination,
-        ),
-    )
-    query_result: RouteStation | None = (
-        await db_session.execute(statement)
-    ).scalars().one_or_none()
+    query_result = await fetch_station(db_session, station_id)
     if query_result is None:
         return JSONResponse(
             status_code=status.HTTP_404_NOT_FOUND,
             content={'message': 'Station not found'},
         )
-    up_weekends_timetable_filter = list(filter(
-        lambda x: (x.heading == 'up'
-                   and x.weekday == 'weekends'),
-        query_result.timetable,
-    ))
-    down_weekends_timetable_filter = list(filter(
-        lambda x: (x.heading == 'down'
-                   and x.weekday == 'weekends'),
-        query_result.timetable,
-    ))
-    up_weekdays_timetable_filter = list(filter(
-        lambda x: (x.heading == 'up'
-                   and x.weekday == 'weekdays'),
-        query_result.timetable,
-    ))
-    down_weekdays_timetable_filter = list(filter(
-        lambda x: (x.heading == 'down'
-                   and x.weekday == 'weekdays'),
-        query_result.timetable,
-    ))
-    up_weekdays_timetable = []
-    for index, item in enumerate(up_weekdays_timetable_filter):
-        up_weekdays_timetable.append(Timetable(
-            weekday=item.weekday,
-            heading='up',
-            sequence=index,
-            origin=Origin(
-                id=item.start_station.id,
-                name=item.start_station.station_name,
-            ),
-            destination=Destination(
-                id=item.destination_id,
-                name=item.destination.station_name,
-            ),
-            time=item.departure_time,
-        ))
-    down_weekdays_timetable = []
-    for index, item in enumerate(down_weekdays_timetable_filter):
-        down_weekdays_timetable.append(Timetable(
-            weekday=item.weekday,
-            heading='down',
-            sequence=index,
-            origin=Origin(
-                id=item.start_station.id,
-                name=item.start_station.station_name,
-            ),
-            destination=Destination(
-                id=item.destination_id,
-                name=item.destination.station_name,
-            ),
-            time=item.departure_time,
-        ))
-    up_weekends_timetable = []
-    for index, item in enumerate(up_weekends_timetable_filter):
-        up_weekends_timetable.append(Timetable(
-            weekday=item.weekday,
-            heading='up',
-            sequence=index,
-            origin=Origin(
-                id=item.start_station.id,
-                name=item.start_station.station_name,
-            ),
-            destination=Destination(
-                id=item.destination_id,
-                name=item.destination.station_name,
-            ),
-            time=item.departure_time,
-        ))
-    down_weekends_timetable = []
-    for index, item in enumerate(down_weekends_timetable_filter):
-        down_weekends_timetable.append(Timetable(
-            weekday=item.weekday,
-            heading='down',
-            sequence=index,
-            origin=Origin(
-                id=item.start_station.id,
-                name=item.start_station.station_name,
-            ),
+    return build_station_arrival(query_result)
+
+
+@arrival_boards.board(
+    'subway_arrival', tables=ARRIVAL_TABLES, serializer=BytesSerializer())
+async def build_arrival_boards(
+    db_session: AsyncSession,
+) -> dict[Hashable, bytes]:
+    """Function to build the arrival of every subway station.
+    Args:
+        db_session (AsyncSession): Database session.
+    Returns:
+        dict[Hashable, bytes]: Rendered StationCurrentStatusResponse by
+            station ID.
+    """
+    return {
+        station.id: render_body(build_station_arrival(station))
+        for station in await fetch_stations(db_session)
+    }
+
+
+def build_station_timetable(
+    station: tuple[str, str],
+    timetables: list[tuple[str, str, str, str, str, str, time]],
+) -> bytes:
+    """Function to render the timetable of a station from rows.
+    Args:
+        station (tuple[str, str]): ID and name of the station.
+        timetables (list[tuple]): Weekday, heading, origin ID and name,
+            destination ID and name and departure time of each departure.
+    Returns:
+        bytes: Rendered StationTimetableResponse.
+    """
+    timetable_dict: dict[tuple[str, str], list[Timetable]] = {
+        (weekday, heading): []
+        for weekday in ('weekdays', 'weekends') for heading in ('up', 'down')
+    }
+    for weekday, heading, origin_id, origin_name, destination_id, \
+            destination_name, departure_time in timetables:
+        timetable = timetable_dict.get((weekday, heading))
+        if timetable is None:
+            continue
+        timetable.append(Timetable(
+            weekday=weekday,
+            heading=heading,
+            sequence=len(timetable),
+            origin=Origin(id=origin_id, name=origin_name),
             destination=Destination(
-                id=item.destination_id,
-                name=item.destination.station_name,
+                id=destination_id,
+                name=destination_name,
             ),
-            time=item.departure_time,
+            time=departure_time,
         ))
-    return StationTimetableResponse(
-        id=query_result.id,
-        name=query_result.station_name,
+    response = StationTimetableResponse(
+        id=station[0],
+        name=station[1],
         weekdays=TimetableResponse(
-            up=up_weekdays_timetable,
-            down=down_weekdays_timetable,
+            up=timetable_dict[('weekdays', 'up')],
+            down=timetable_dict[('weekdays', 'down')],
         ),
         weekends=TimetableResponse(
-            up=up_weekends_timetable,
-            down=down_weekends_timetable,
+            up=timetable_dict[('weekends', 'up')],
+            down=timetable_dict[('weekends', 'down')],
         ),
     )
+    with tracer.span('serialize'):
+        return JSONResponse(content=jsonable_encoder(response)).body
+
+
+@subway_router.get(
+    '/station/{station_id}/timetable',
+    response_model=StationTimetableResponse,
+)
+@cached_response(
+    'subway_timetable',
+    tables=('subway_route_station', 'subway_timetable'),
+)
+@statement_budget(2, rows=750)
+async def get_station_timetable(
+        station_id: str,
+        db_session: AsyncSession = Depends(get_db_session),
+):
+    """ Function to get a subway station.
+    Args:
+        station_id (str): ID of the subway station.
+        db_session (AsyncSession): Database session.
+    Returns:
+        SubwayStationResponse: Response contains of subway station.
+    """
+    station = (await db_session.execute(
+        STATION_STATEMENT, {'station_id': station_id},
+    )).one_or_none()
+    if station is None:
+        return JSONResponse(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content={'message': 'Station not found'},
+        )
+    # Plain rows are fetched so that the response can be built off the event
+    # loop.
+    timetables = [
+        tuple(row[1:]) for row in await fetch_departures(
+            db_session, station_id)
+    ]
+    return RenderedResponse(await response_offloader.run(
+        build_station_timetable,
+        tuple(station),
+        timetables,
+        rows=len(timetables),
+    ))
@@ -1,31 +1,269 @@
 # -*- coding: utf-8 -*-
 """Module that contains database dependancies to use in the app.
 
+Static tables such as timetables, routes, stops and menus are read from the
+replicas, while realtime tables and every write go to the primary. Each
+session keeps reading from the replica it was given in round-robin order,
+so its reads see one state of the data, and reads again from the primary
+when it can not connect to that replica. A replica that fails is skipped
+until its cooldown passes.
+
 Attributes:
-    database_host (str): Address of the database.
-    database_port (int): Port of the database.
-    database_name (str): Name of the database.
-    database_user (str): User of the database.
-    database_password (str): Password of the database.
-    engine (sqlalchemy.ext.asyncio.AsyncEngine): Database engine.
+    app_settings (AppSettings): Application settings.
+    engine (sqlalchemy.ext.asyncio.AsyncEngine): Primary database engine.
+    replica_engines (list[AsyncEngine]): Read replica database engines.
+    database_router (DatabaseRouter): Router between primary and replicas.
 """
-import os
-from typing import AsyncGenerator
+import asyncio
+import contextlib
+import itertools
+import time
+from typing import Any, AsyncGenerator, AsyncIterator, Optional
+
+from fastapi import Request
+from sqlalchemy import Delete, Engine, Insert, Update, event, text
+from sqlalchemy.engine import ExceptionContext
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, \
+    AsyncEngine
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.util import find_tables
+
+from app.internal.config import AppSettings
+from app.internal.scheduler import scheduler
+
+REALTIME_TABLES = frozenset({
+    'bus_realtime',
+    'subway_realtime',
+    'reading_room',
+})
+
+
+class DatabaseRouter:
+    """Class that picks the engine each statement is executed on.
+    Attributes:
+        primary (AsyncEngine): Engine of the primary database.
+        replicas (list[AsyncEngine]): Engines of the read replicas.
+        cooldown (float): Seconds a failed replica is skipped.
+    """
+
+    def __init__(
+        self,
+        primary: AsyncEngine,
+        replicas: list[AsyncEngine],
+        cooldown: float,
+    ) -> None:
+        self.primary = primary
+        self.replicas = replicas
+        self.cooldown = cooldown
+        self._unhealthy_until: dict[Engine, float] = {}
+        self._counter = itertools.count()
+        for replica in replicas:
+            event.listen(
+                replica.sync_engine, 'handle_error', self._on_replica_error)
+
+    def _on_replica_error(self, context: ExceptionContext) -> None:
+        # Errors without a connection were raised while connecting.
+        if context.is_disconnect or context.connection is None or \
+                isinstance(context.original_exception, OSError):
+            self.mark_unhealthy(context.engine)
+
+    def mark_unhealthy(self, replica: Engine) -> None:
+        self._unhealthy_until[replica] = time.monotonic() + self.cooldown
+
+    def mark_healthy(self, replica: Engine) -> None:
+        self._unhealthy_until.pop(replica, None)
+
+    def is_healthy(self, replica: Engine) -> bool:
+        return self._unhealthy_until.get(replica, 0) <= time.monotonic()
+
+    def healthy_replicas(self) -> list[Engine]:
+        return [
+            replica.sync_engine for replica in self.replicas
+            if self.is_healthy(replica.sync_engine)
+        ]
+
+    def get_engine(
+        self,
+        tables: set[str],
+        write: bool = False,
+        replica: Optional[Engine] = None,
+    ) -> Engine:
+        """Function to get the engine for a statement.
+        Args:
+            tables (set[str]): Names of the tables the statement touches.
+            write (bool): Whether the statement writes.
+            replica (Engine): Replica the caller reads from, kept as long as
+                it is healthy, or None to pick one.
+        Returns:
+            Engine: Engine to execute the statement on.
+        """
+        if write or not tables or tables & REALTIME_TABLES:
+            return self.primary.sync_engine
+        if replica is not None and self.is_healthy(replica):
+            return replica
+        replicas = self.healthy_replicas()
+        if not replicas:
+            return self.primary.sync_engine
+        return replicas[next(self._counter) % len(replicas)]
+
+    async def check_replicas(self) -> None:
+        """Function to probe every replica and update its health."""
+        async def check(replica: AsyncEngine) -> None:
+            try:
+                async with replica.connect() as connection:
+                    await connection.execute(text('SELECT 1'))
+            except Exception:
+                self.mark_unhealthy(replica.sync_engine)
+            else:
+                self.mark_healthy(replica.sync_engine)
+        await asyncio.gather(*(check(replica) for replica in self.replicas))
+
+
+class RoutingSession(Session):
+    """Session that asks the database router for the engine to use.
+
+    The replica picked for the first read is kept for the whole session.
+    A read that fails because the session can not connect to its replica is
+    run again on the primary, which serves the reads of the session from
+    then on.
+    Attributes:
+        router (DatabaseRouter): Router between primary and replicas.
+    """
+
+    def __init__(self, router: DatabaseRouter, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self.router = router
+        self._replica: Optional[Engine] = None
+        self._replica_connected = False
+
+    def execute(self, statement: Any, *args: Any, **kwargs: Any) -> Any:
+        try:
+            result = super().execute(statement, *args, **kwargs)
+        except DBAPIError:
+            # Only errors of its connection mark a replica unhealthy, and a
+            # replica that already served the session is not left, as its
+            # connection may have failed in the middle of a transaction.
+            if self._replica is None or self._replica_connected or \
+                    self.router.is_healthy(self._replica):
+                raise
+            self._replica = self.router.primary.sync_engine
+            return super().execute(statement, *args, **kwargs)
+        if self._replica is not None:
+            self._replica_connected = True
+        return result
 
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+    def get_bind(
+        self,
+        mapper: Optional[Any] = None,
+        clause: Optional[Any] = None,
+        **kwargs: Any,
+    ) -> Engine:
+        tables: set[str] = set()
+        if mapper is not None:
+            tables.update(table.name for table in mapper.tables)
+        if clause is not None:
+            tables.update(
+                table.name for table in find_tables(clause, include_crud=True))
+        write = self._flushing or isinstance(clause, (Insert, Update, Delete))
+        bind = self.router.get_engine(
+            tables, write=write, replica=self._replica)
+        if bind is not self._replica and \
+                bind is not self.router.primary.sync_engine:
+            self._replica = bind
+            self._replica_connected = False
+        return bind
 
-# Get database engine.
-database_host = os.getenv('DB_HOST')
-database_port = os.getenv('DB_PORT')
-database_name = os.getenv('DB_NAME')
-database_user = os.getenv('DB_USER')
-database_password = os.getenv('DB_PASSWORD')
+
+app_settings = AppSettings()
 engine = create_async_engine(
-    f'postgresql+asyncpg://{database_user}:{database_password}@'
-    f'{database_host}:{database_port}/{database_name}',
-    echo=True,
+    app_settings.DATABASE_URI,
     pool_pre_ping=True,
 )
+replica_engines = [
+    create_async_engine(uri, pool_pre_ping=True)
+    for uri in app_settings.DATABASE_REPLICA_URIS
+]
+database_router = DatabaseRouter(
+    primary=engine,
+    replicas=replica_engines,
+    cooldown=app_settings.DATABASE_REPLICA_COOLDOWN,
+)
+
+
+# Replicas marked unhealthy after an error are probed again instead of
+# waiting for the cooldown to expire and failing a request.
+@scheduler.job(
+    'replica_health',
+    interval=app_settings.DATABASE_REPLICA_COOLDOWN,
+    jitter=1,
+)
+async def check_replica_health() -> None:
+    await database_router.check_replicas()
+
+
+def create_session() -> AsyncSession:
+    """Function to create a session that routes between the databases.
+    Returns:
+        AsyncSession: Database session.
+    """
+    return AsyncSession(
+        sync_session_class=RoutingSession,
+        router=database_router,
+    )
+
+
+class SessionFactory:
+    """Class that hands out independent database sessions for one request.
+
+    Every session draws its own connection from the engine pool, so
+    resolvers holding different sessions can run their queries
+    concurrently. The number of sessions open at the same time is capped
+    to keep a single request from draining the pool.
+    Attributes:
+        limit (int): Maximum number of sessions open at the same time.
+    """
+
+    def __init__(self, limit: int) -> None:
+        self.limit = max(limit, 1)
+        self._available = self.limit
+        self._condition = asyncio.Condition()
+
+    @contextlib.asynccontextmanager
+    async def sessions(self, count: int) -> AsyncIterator[list[AsyncSession]]:
+        """Function to open several sessions at once.
+
+        The permits for all sessions are taken in one step, so two callers
+        waiting for a second session can not deadlock each other. When the
+        cap is smaller than the requested count, the list repeats the
+        opened sessions and callers must not use them concurrently.
+        Args:
+            count (int): Number of sessions to open.
+        Yields:
+            list[AsyncSession]: Opened database sessions.
+        """
+        acquired = min(max(count, 1), self.limit)
+        async with self._condition:
+            await self._condition.wait_for(
+                lambda: self._available >= acquired)
+            self._available -= acquired
+        opened = [create_session() for _ in range(acquired)]
+        try:
+            yield [opened[index % acquired] for index in range(count)]
+        finally:
+            await asyncio.gather(*(session.close() for session in opened))
+            async with self._condition:
+                self._available += acquired
+                self._condition.notify_all()
+
+    @contextlib.asynccontextmanager
+    async def session(self) -> AsyncIterator[AsyncSession]:
+        """Function to open a single session.
+        Yields:
+            AsyncSession: Opened database session.
+        """
+        async with self.sessions(1) as (session,):
+            yield session
 
 
 async def get_db_session() -> AsyncGenerator[AsyncSession, None]:
@@ -33,8 +271,20 @@ async def get_db_session() -> AsyncGenerator[AsyncSession, None]:
         Yields:
             AsyncSession: Database session.
     """
-    session = AsyncSession(bind=engine)
+    session = create_session()
     try:
         yield session
     finally:
         await session.close()
+
+
+async def get_session_factory(request: Request) -> SessionFactory:
+    """Function to get a per-request session factory.
+    Args:
+        request (Request): Current request.
+    Returns:
+        SessionFactory: Session factory capped by the application settings.
+    """
+    return SessionFactory(
+        limit=request.app.extra.settings.GRAPHQL_SESSION_LIMIT,
+    )
@@ -0,0 +1,283 @@
+"""Module that precomputes the arrival boards of every stop.
+
+Arrival endpoints and GraphQL fields called with their default arguments
+list the upcoming departures of a stop from now on, which is the same for
+every request of a minute. Board builders compute that result for every
+stop at once and store it ready to serve in the shared cache backend, as the
+rendered body for the endpoints and as pickled objects for the GraphQL
+fields. A request with the default arguments then costs a lookup however
+long the timetables are, while requests with other arguments, and requests
+for boards that are not built yet, compute their result as before.
+
+Every board is rebuilt by its own job at the start of each minute and as
+soon as one of its tables changes. Boards hold remaining times as they were
+when they were built, so they are served for one minute at most, and boards
+built before a change that this worker was told about are not served
+either, so a board is never older than a computed result of the same
+minute. With a shared backend only the scheduler leader builds the boards.
+With the in-process backend every worker keeps its own boards, so a worker
+only rebuilds them while it serves them: the first request asking for a
+board after it expired is computed and schedules the rebuild.
+
+Attributes:
+    arrival_boards (BoardStore): Boards of the app.
+"""
+import asyncio
+import functools
+import inspect
+import struct
+import time
+from typing import Any, Awaitable, Callable, Hashable, Iterable, Optional, \
+    TypeVar
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.dependancies.database import create_session
+from app.internal.cache import CacheBackend, InvalidValue, MemoryBackend, \
+    PickleSerializer, RenderedResponse, Serializer, cache_bypass, \
+    shared_backend
+from app.internal.config import AppSettings
+from app.internal.invalidation import TableChanged, invalidation_bus
+from app.internal.scheduler import scheduler
+
+T = TypeVar('T')
+BoardBuilder = Callable[[AsyncSession], Awaitable[dict[Hashable, Any]]]
+
+
+class Board:
+    """Class that holds a registered board builder.
+    Attributes:
+        name (str): Name of the boards, part of their keys.
+        builder (BoardBuilder): Coroutine function returning every board
+            by key.
+        serializer (Serializer): Serializer of the boards.
+        job (str): Name of the job rebuilding the boards.
+        changed_at (float): Unix time of the last change of the tables.
+        built_at (float): Unix time the last rebuild started at.
+        requested_at (float): Unix time the boards were last asked for.
+        lock (asyncio.Lock): Lock held while the boards are rebuilt.
+        waiting (bool): Whether a rebuild waits for the lock.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        builder: BoardBuilder,
+        serializer: Serializer,
+    ) -> None:
+        self.name = name
+        self.builder = builder
+        self.serializer = serializer
+        self.job = f'{name}_board'
+        self.changed_at = 0.0
+        self.built_at = 0.0
+        self.requested_at = 0.0
+        self.lock = asyncio.Lock()
+        self.waiting = False
+
+
+class BoardStore:
+    """Class that builds the boards and serves them from a cache backend.
+    Attributes:
+        backend (CacheBackend): Backend the boards are stored in.
+        ttl (float): Seconds a board is served after it was built, one
+            minute at most.
+        enabled (bool): Whether boards are built and served.
+        shared (bool): Whether the backend is shared by the workers.
+        boards (dict[str, Board]): Registered boards by name.
+    """
+
+    def __init__(
+        self,
+        backend: CacheBackend,
+        ttl: float,
+        enabled: bool = True,
+    ) -> None:
+        if not 0 < ttl <= 60:
+            raise ValueError('Boards must be served for one minute at most')
+        self.backend = backend
+        self.ttl = ttl
+        self.enabled = enabled
+        self.shared = not isinstance(backend, MemoryBackend)
+        self.boards: dict[str, Board] = {}
+
+    def board(
+        self,
+        name: str,
+        tables: Iterable[str],
+        serializer: Optional[Serializer] = None,
+    ) -> Callable[[BoardBuilder], BoardBuilder]:
+        """Function to register the decorated coroutine function as a
+        board builder.
+
+        The builder gets a database session and returns every board by
+        key. It runs with the caches bypassed, so it can call the
+        decorated endpoints and query functions themselves.
+        Args:
+            name (str): Unique name of the boards.
+            tables (Iterable[str]): Tables the boards are built from.
+            serializer (Serializer): Serializer, pickle by default.
+        Returns:
+            Callable: Decorator that returns the builder unchanged.
+        """
+        def decorator(builder: BoardBuilder) -> BoardBuilder:
+            if not self.enabled:
+                return builder
+            if name in self.boards:
+                raise ValueError(f'Board {name} is already registered')
+            board = Board(name, builder, serializer or PickleSerializer())
+            self.boards[name] = board
+
+            async def refresh() -> None:
+                if self.shared or \
+                        time.time() - board.requested_at <= self.ttl:
+                    await self.refresh(name)
+            scheduler.add_job(
+                board.job, refresh,
+                cron='* * * * *',
+                singleton=self.shared,
+                run_at_start=True,
+            )
+
+            def on_change(event: TableChanged) -> None:
+                board.changed_at = time.time()
+                scheduler.trigger(board.job)
+            invalidation_bus.subscribe(tables, on_change)
+            return builder
+        return decorator
+
+    def make_key(self, name: str, key: Hashable) -> str:
+        return f'board:{name}:{key!r}'
+
+    async def refresh(self, name: str) -> None:
+        """Function to rebuild every board of a builder.
+        Args:
+            name (str): Name of the boards.
+        """
+        board = self.boards[name]
+        if board.waiting:
+            # The rebuild waiting for the current one reads newer data.
+            return
+        board.waiting = True
+        async with board.lock:
+            board.waiting = False
+            built_at = time.time()
+            board.built_at = built_at
+            token = cache_bypass.set(True)
+            db_session = create_session()
+            try:
+                boards = await board.builder(db_session)
+            finally:
+                await db_session.close()
+                cache_bypass.reset(token)
+            header = struct.pack('>d', built_at)
+            for key, value in boards.items():
+                await self.backend.set(
+                    self.make_key(name, key),
+                    header + board.serializer.dumps(value),
+                    self.ttl,
+                )
+
+    async def get(self, name: str, key: Hashable) -> Optional[Any]:
+        """Function to get a board.
+        Args:
+            name (str): Name of the boards.
+            key (Hashable): Key returned by the builder.
+        Returns:
+            Any: Board, or None when it is not built, outdated or the
+                caches are bypassed.
+        """
+        board = self.boards.get(name)
+        if board is None or cache_bypass.get():
+            return None
+        now = time.time()
+        if not self.shared:
+            board.requested_at = now
+            if now - board.built_at > self.ttl and not board.lock.locked():
+                scheduler.trigger(board.job)
+        serialized = await self.backend.get(self.make_key(name, key))
+        if serialized is None:
+            return None
+        (built_at,) = struct.unpack_from('>d', serialized)
+        if built_at < board.changed_at or now - built_at > self.ttl:
+            return None
+        try:
+            return board.serializer.loads(serialized[8:])
+        except InvalidValue:
+            return None
+
+    async def get_many(
+        self,
+        name: str,
+        keys: Iterable[Hashable],
+    ) -> Optional[list[Any]]:
+        """Function to get several boards of a builder.
+        Args:
+            name (str): Name of the boards.
+            keys (Iterable[Hashable]): Keys returned by the builder.
+        Returns:
+            list[Any]: Boards in the order of the keys, or None when one of
+                them can not be served.
+        """
+        boards = []
+        for key in keys:
+            board = await self.get(name, key)
+            if board is None:
+                return None
+            boards.append(board)
+        return boards
+
+    async def response(
+        self,
+        name: str,
+        key: Hashable,
+    ) -> Optional[RenderedResponse]:
+        """Function to get a board holding a rendered body as a response.
+        Args:
+            name (str): Name of the boards.
+            key (Hashable): Key returned by the builder.
+        Returns:
+            RenderedResponse: Response, or None when the board can not be
+                served.
+        """
+        body = await self.get(name, key)
+        if body is None:
+            return None
+        return RenderedResponse(body)
+
+
+app_settings = AppSettings()
+arrival_boards = BoardStore(
+    shared_backend,
+    ttl=app_settings.ARRIVAL_BOARD_TTL,
+    enabled=app_settings.ARRIVAL_BOARD_ENABLED,
+)
+
+
+def served_from_boards(
+    lookup: Callable[..., Awaitable[Optional[Any]]],
+) -> Callable[[Callable[..., Awaitable[T]]], Callable[..., Awaitable[T]]]:
+    """Function to answer calls from the boards when they hold the result.
+    Args:
+        lookup (Callable): Coroutine function called with every argument of
+            the decorated function by name, returning the result read from
+            the boards or None to call the decorated function.
+    Returns:
+        Callable: Decorator for an endpoint or a query function.
+    """
+    def decorator(
+        function: Callable[..., Awaitable[T]],
+    ) -> Callable[..., Awaitable[T]]:
+        signature = inspect.signature(function)
+
+        @functools.wraps(function)
+        async def wrapper(*args: Any, **kwargs: Any) -> T:
+            if arrival_boards.boards and not cache_bypass.get():
+                bound = signature.bind(*args, **kwargs)
+                bound.apply_defaults()
+                result = await lookup(**bound.arguments)
+                if result is not None:
+                    return result
+            return await function(*args, **kwargs)
+        return wrapper
+    return decorator
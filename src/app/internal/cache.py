@@ -0,0 +1,568 @@
+"""Module that provides the two-level cache shared by the app.
+
+Each cache keeps the most recently used values in a local LRU in front of a
+shared backend, which is a Redis server for multi-node deployments or an
+in-process dictionary for a single node and the tests. Values are stored in
+the shared backend as bytes, produced by the cache's serializer and
+prefixed with the expiry time so that local copies expire with them.
+Pickled values are signed, so a value that was not written by a worker of
+the app is dropped instead of being unpickled.
+
+Concurrent misses of the same key are collapsed into one computation inside
+a worker, and a short lock in the shared backend keeps the other workers
+waiting for that value instead of recomputing it.
+
+Attributes:
+    shared_backend (CacheBackend): Backend configured by the settings.
+    cache_bypass (ContextVar[bool]): Whether the current request skips the
+        caches, set while a request is profiled.
+"""
+import abc
+import asyncio
+import datetime
+import functools
+import hmac
+import logging
+import pickle
+import secrets
+import struct
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Hashable, Iterable, Optional
+
+from fastapi.datastructures import DefaultPlaceholder
+from fastapi.encoders import jsonable_encoder
+from fastapi.routing import APIRoute, serialize_response
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.responses import JSONResponse, Response
+
+from app.internal.config import AppSettings
+from app.internal.invalidation import TableChanged, invalidation_bus
+from app.internal.scheduler import scheduler
+from app.internal.tracing import tracer
+
+logger = logging.getLogger(__name__)
+MINUTE = '%Y%m%d%H%M'
+DAY = '%Y%m%d'
+cache_bypass: ContextVar[bool] = ContextVar('cache_bypass', default=False)
+
+
+def time_bucket(
+    bucket: str,
+    now: Optional[datetime.datetime] = None,
+) -> str:
+    """Function to get the time bucket that a result computed now belongs to.
+    Args:
+        bucket (str): Format of the bucket such as MINUTE or DAY.
+        now (datetime.datetime): Current time.
+    Returns:
+        str: Bucket of the current time.
+    """
+    if now is None:
+        now = datetime.datetime.now()
+    return now.strftime(bucket)
+
+
+class CacheBackend(abc.ABC):
+    """Class that stores serialized values shared between workers."""
+
+    @abc.abstractmethod
+    async def get(self, key: str) -> Optional[bytes]:
+        ...
+
+    @abc.abstractmethod
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        ...
+
+    @abc.abstractmethod
+    async def add(self, key: str, value: bytes, ttl: float) -> bool:
+        """Function to set a key only if it does not exist.
+        Returns:
+            bool: Whether the key was set.
+        """
+
+    @abc.abstractmethod
+    async def delete(self, key: str) -> None:
+        ...
+
+    @abc.abstractmethod
+    async def delete_prefix(self, prefix: str) -> None:
+        ...
+
+    async def purge_expired(self) -> None:
+        """Function to drop the expired values the backend still holds."""
+
+
+class MemoryBackend(CacheBackend):
+    """Class that keeps the shared values inside the process."""
+
+    def __init__(self) -> None:
+        self._values: dict[str, tuple[float, bytes]] = {}
+
+    async def get(self, key: str) -> Optional[bytes]:
+        entry = self._values.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self._values[key]
+            return None
+        return entry[1]
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        self._values[key] = (time.monotonic() + ttl, value)
+
+    async def add(self, key: str, value: bytes, ttl: float) -> bool:
+        if await self.get(key) is not None:
+            return False
+        await self.set(key, value, ttl)
+        return True
+
+    async def delete(self, key: str) -> None:
+        self._values.pop(key, None)
+
+    async def delete_prefix(self, prefix: str) -> None:
+        for key in [key for key in self._values if key.startswith(prefix)]:
+            del self._values[key]
+
+    async def purge_expired(self) -> None:
+        now = time.monotonic()
+        for key in [key for key, (expires_at, _) in self._values.items()
+                    if expires_at <= now]:
+            del self._values[key]
+
+
+class RedisBackend(CacheBackend):
+    """Class that keeps the shared values in a Redis server.
+    Attributes:
+        url (str): URL of the Redis server.
+    """
+
+    def __init__(self, url: str) -> None:
+        try:
+            from redis.asyncio import from_url
+        except ImportError:
+            raise RuntimeError(
+                'The redis package is required for the redis cache backend')
+        self.url = url
+        self._client = from_url(url)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self._client.get(key)
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        await self._client.set(key, value, px=max(int(ttl * 1000), 1))
+
+    async def add(self, key: str, value: bytes, ttl: float) -> bool:
+        return bool(await self._client.set(
+            key, value, px=max(int(ttl * 1000), 1), nx=True))
+
+    async def delete(self, key: str) -> None:
+        await self._client.delete(key)
+
+    async def delete_prefix(self, prefix: str) -> None:
+        keys = [key async for key in self._client.scan_iter(f'{prefix}*')]
+        if keys:
+            await self._client.unlink(*keys)
+
+
+class InvalidValue(Exception):
+    """Exception raised when a stored value can not be trusted."""
+
+
+class Serializer(abc.ABC):
+    @abc.abstractmethod
+    def dumps(self, value: Any) -> bytes:
+        ...
+
+    @abc.abstractmethod
+    def loads(self, value: bytes) -> Any:
+        """Function to deserialize a stored value.
+        Args:
+            value (bytes): Serialized value.
+        Returns:
+            Any: Value.
+        Raises:
+            InvalidValue: When the value was not written by the app.
+        """
+
+
+class PickleSerializer(Serializer):
+    """Class that serializes Python objects such as GraphQL results.
+
+    Pickles are prefixed with their HMAC, so that values written to the
+    shared backend without the key are never unpickled.
+    Attributes:
+        key (bytes): Signing key, the one of the settings by default.
+    """
+
+    def __init__(self, key: Optional[bytes] = None) -> None:
+        self.key = key or signing_key
+
+    def dumps(self, value: Any) -> bytes:
+        pickled = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        return hmac.digest(self.key, pickled, 'sha256') + pickled
+
+    def loads(self, value: bytes) -> Any:
+        signature, pickled = value[:32], value[32:]
+        if not hmac.compare_digest(
+                signature, hmac.digest(self.key, pickled, 'sha256')):
+            raise InvalidValue('Cached pickle has an invalid signature')
+        return pickle.loads(pickled)
+
+
+class BytesSerializer(Serializer):
+    """Class that keeps already serialized response bodies as they are."""
+
+    def dumps(self, value: Any) -> bytes:
+        return value
+
+    def loads(self, value: bytes) -> Any:
+        return value
+
+
+class ResponseSerializer(Serializer):
+    """Class that serializes the status, media type and body of responses."""
+
+    def dumps(self, value: tuple[int, str, bytes]) -> bytes:
+        status_code, media_type, body = value
+        media = media_type.encode()
+        return struct.pack('>HH', status_code, len(media)) + media + body
+
+    def loads(self, value: bytes) -> tuple[int, str, bytes]:
+        status_code, length = struct.unpack_from('>HH', value)
+        return status_code, value[4:4 + length].decode(), value[4 + length:]
+
+
+class TieredCache:
+    """Class that caches values in a local LRU and a shared backend.
+    Attributes:
+        namespace (str): Prefix of every key of this cache.
+        backend (CacheBackend): Shared backend.
+        serializer (Serializer): Serializer for the shared backend.
+        local_size (int): Maximum number of values in the local LRU.
+        lock_timeout (float): Seconds other workers wait for a value that
+            one worker is computing before computing it themselves.
+    """
+
+    def __init__(
+        self,
+        namespace: str,
+        backend: CacheBackend,
+        serializer: Serializer,
+        local_size: int,
+        lock_timeout: float = 5,
+    ) -> None:
+        self.namespace = namespace
+        self.backend = backend
+        self.serializer = serializer
+        self.local_size = local_size
+        self.lock_timeout = lock_timeout
+        self._local: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self._inflight: dict[str, asyncio.Future] = {}
+
+    def make_key(self, parts: Iterable[Hashable]) -> str:
+        return f'{self.namespace}:' + ':'.join(repr(part) for part in parts)
+
+    def _get_local(self, key: str) -> tuple[bool, Any]:
+        entry = self._local.get(key)
+        if entry is None:
+            return False, None
+        if entry[0] <= time.monotonic():
+            del self._local[key]
+            return False, None
+        self._local.move_to_end(key)
+        return True, entry[1]
+
+    def _set_local(self, key: str, value: Any, ttl: float) -> None:
+        self._local[key] = (time.monotonic() + ttl, value)
+        self._local.move_to_end(key)
+        while len(self._local) > self.local_size:
+            self._local.popitem(last=False)
+
+    async def get(self, key: str) -> tuple[bool, Any]:
+        found, value = self._get_local(key)
+        if found:
+            return True, value
+        serialized = await self.backend.get(key)
+        if serialized is None:
+            return False, None
+        (expires_at,) = struct.unpack_from('>d', serialized)
+        try:
+            value = self.serializer.loads(serialized[8:])
+        except InvalidValue:
+            logger.warning('Dropped the untrusted cached value %s', key)
+            return False, None
+        self._set_local(key, value, expires_at - time.time())
+        return True, value
+
+    async def set(self, key: str, value: Any, ttl: float) -> None:
+        self._set_local(key, value, ttl)
+        await self.backend.set(
+            key,
+            struct.pack('>d', time.time() + ttl) +
+            self.serializer.dumps(value),
+            ttl,
+        )
+
+    async def get_or_set(
+        self,
+        key: str,
+        ttl: float,
+        loader: Callable[[], Awaitable[Any]],
+    ) -> Any:
+        """Function to get a value, computing it once on a miss.
+        Args:
+            key (str): Key made by make_key.
+            ttl (float): Time-to-live in seconds.
+            loader (Callable): Coroutine function computing the value.
+        Returns:
+            Any: Cached or computed value.
+        """
+        found, value = await self.get(key)
+        if found:
+            return value
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            return await asyncio.shield(inflight)
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await self._load(key, ttl, loader)
+        except BaseException as exception:
+            future.set_exception(exception)
+            # Mark the exception as retrieved when no one else waits.
+            future.exception()
+            raise
+        else:
+            future.set_result(value)
+            return value
+        finally:
+            del self._inflight[key]
+
+    async def _load(
+        self,
+        key: str,
+        ttl: float,
+        loader: Callable[[], Awaitable[Any]],
+    ) -> Any:
+        lock_key = f'{key}:lock'
+        locked = await self.backend.add(lock_key, b'1', self.lock_timeout)
+        if not locked:
+            deadline = time.monotonic() + self.lock_timeout
+            while time.monotonic() < deadline:
+                await asyncio.sleep(0.05)
+                found, value = await self.get(key)
+                if found:
+                    return value
+        try:
+            value = await loader()
+            await self.set(key, value, ttl)
+            return value
+        finally:
+            if locked:
+                await self.backend.delete(lock_key)
+
+    async def invalidate(self) -> None:
+        self._local.clear()
+        await self.backend.delete_prefix(f'{self.namespace}:')
+
+
+def create_backend(settings: AppSettings) -> CacheBackend:
+    """Function to create the shared backend from the settings.
+    Args:
+        settings (AppSettings): Application settings.
+    Returns:
+        CacheBackend: Shared backend.
+    """
+    if settings.CACHE_BACKEND == 'redis':
+        if settings.CACHE_SIGNING_KEY is None:
+            raise ValueError('CACHE_SIGNING_KEY is required with redis')
+        return RedisBackend(settings.CACHE_REDIS_URL)
+    return MemoryBackend()
+
+
+app_settings = AppSettings()
+shared_backend = create_backend(app_settings)
+# Only the workers sharing the backend need the same key.
+signing_key = app_settings.CACHE_SIGNING_KEY.encode() \
+    if app_settings.CACHE_SIGNING_KEY is not None else secrets.token_bytes(32)
+
+
+# Keys with a time bucket are never read again once the bucket is over, so
+# the in-process backend drops expired values instead of waiting for reads.
+@scheduler.job('cache_purge', interval=60, jitter=5)
+async def purge_expired_values() -> None:
+    await shared_backend.purge_expired()
+
+
+def create_cache(
+    namespace: str,
+    tables: Iterable[str] = (),
+    serializer: Optional[Serializer] = None,
+) -> TieredCache:
+    """Function to create a cache that is cleared when its tables change.
+    Args:
+        namespace (str): Prefix of every key of the cache.
+        tables (Iterable[str]): Tables the cached values are built from.
+        serializer (Serializer): Serializer, pickle by default.
+    Returns:
+        TieredCache: Cache on the shared backend.
+    """
+    cache = TieredCache(
+        namespace=namespace,
+        backend=shared_backend,
+        serializer=serializer or PickleSerializer(),
+        local_size=app_settings.CACHE_LOCAL_SIZE,
+    )
+
+    async def invalidate(event: TableChanged) -> None:
+        await cache.invalidate()
+    invalidation_bus.subscribe(tables, invalidate)
+    return cache
+
+
+class RenderedResponse(Response):
+    """Response whose body is the rendered JSON of the response model.
+
+    Endpoints that render their body themselves, such as the ones building
+    large responses off the event loop, return it so that the body is
+    cached like a rendered result.
+    """
+    media_type = 'application/json'
+
+
+class UncacheableResponse(Exception):
+    """Exception carrying a response that must not be cached."""
+
+    def __init__(self, response: Response) -> None:
+        super().__init__()
+        self.response = response
+
+
+def render_body(result: Any) -> bytes:
+    """Function to render the JSON body of the result of an endpoint.
+    Args:
+        result (Any): Response model or response returned by the endpoint.
+    Returns:
+        bytes: Rendered body.
+    Raises:
+        UncacheableResponse: When the endpoint returned a response other
+            than a rendered one.
+    """
+    if isinstance(result, RenderedResponse):
+        return result.body
+    if isinstance(result, Response):
+        raise UncacheableResponse(result)
+    with tracer.span('serialize'):
+        return JSONResponse(content=jsonable_encoder(result)).body
+
+
+async def render_response(
+    result: Any,
+    route: Optional[APIRoute] = None,
+) -> Response:
+    """Function to render the result of an endpoint as its route does.
+    Args:
+        result (Any): Response model or response returned by the endpoint.
+        route (APIRoute): Route of the endpoint, whose response model,
+            class and status code render the result.
+    Returns:
+        Response: Rendered response.
+    Raises:
+        UncacheableResponse: When the endpoint returned a response other
+            than a rendered one.
+    """
+    if isinstance(result, RenderedResponse):
+        return result
+    if isinstance(result, Response):
+        raise UncacheableResponse(result)
+    if route is None:
+        return RenderedResponse(render_body(result))
+    content = await serialize_response(
+        field=route.secure_cloned_response_field,
+        response_content=result,
+        include=route.response_model_include,
+        exclude=route.response_model_exclude,
+        by_alias=route.response_model_by_alias,
+        exclude_unset=route.response_model_exclude_unset,
+        exclude_defaults=route.response_model_exclude_defaults,
+        exclude_none=route.response_model_exclude_none,
+    )
+    response_class = route.response_class
+    if isinstance(response_class, DefaultPlaceholder):
+        response_class = response_class.value
+    if route.status_code is None:
+        return response_class(content)
+    return response_class(content, status_code=route.status_code)
+
+
+def cached_response(
+    field: str,
+    tables: Iterable[str],
+    bucket: Optional[str] = None,
+) -> Callable[[Callable[..., Awaitable[Any]]], Callable[..., Awaitable[Any]]]:
+    """Function to cache the rendered response of an endpoint.
+
+    The result is rendered with the response model, class and status code
+    of the route, which binds itself to the endpoint through its
+    ``bind_route`` attribute, and the status code, media type and body are
+    replayed on a hit. Responses returned directly by the endpoint, such as
+    not found errors, are passed through without caching, except rendered
+    responses.
+    Args:
+        field (str): Name of the endpoint, used for the namespace and to look
+            up the time-to-live in RESPONSE_CACHE_TTL.
+        tables (Iterable[str]): Tables the response is built from.
+        bucket (str): Format of the time bucket to add to the key when the
+            response depends on the current time, such as MINUTE or DAY.
+    Returns:
+        Callable: Decorator for the endpoint.
+    """
+    cache = create_cache(f'response:{field}', tables, ResponseSerializer())
+
+    def decorator(
+        function: Callable[..., Awaitable[Any]],
+    ) -> Callable[..., Awaitable[Any]]:
+        routes: list[APIRoute] = []
+
+        def bind_route(route: APIRoute) -> None:
+            # Routers included in an app are copied, the last copy serves.
+            routes[:] = [route]
+
+        async def render(**kwargs: Any) -> tuple[int, str, bytes]:
+            response = await render_response(
+                await function(**kwargs), *routes)
+            return (
+                response.status_code,
+                response.media_type or 'application/json',
+                response.body,
+            )
+
+        @functools.wraps(function)
+        async def wrapper(**kwargs: Any) -> Any:
+            ttl = app_settings.RESPONSE_CACHE_TTL.get(field, 0)
+            if ttl <= 0 or cache_bypass.get():
+                return await function(**kwargs)
+            parts: list[Hashable] = [
+                (name, value) for name, value in sorted(kwargs.items())
+                if not isinstance(value, AsyncSession)
+            ]
+            if bucket is not None:
+                parts.append(time_bucket(bucket))
+            try:
+                status_code, media_type, body = await cache.get_or_set(
+                    cache.make_key(parts),
+                    ttl,
+                    functools.partial(render, **kwargs),
+                )
+            except UncacheableResponse as exception:
+                return exception.response
+            return Response(
+                content=body,
+                status_code=status_code,
+                media_type=media_type,
+            )
+        setattr(wrapper, 'bind_route', bind_route)
+        return wrapper
+    return decorator
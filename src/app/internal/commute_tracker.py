@@ -0,0 +1,163 @@
+"""Module that tracks where each commute shuttle is along its route.
+
+The routes and their timetables are loaded once and kept with the
+departures sorted by time, so the stops a shuttle is between are found
+with a bisect. The service status only changes with the day, so it is
+computed once a day. Both are dropped when the invalidation bus reports a
+change of the tables they were built from, and the routes are loaded again
+once they are older than COMMUTE_ROUTES_TTL, so that edits the bus does not
+report are picked up as well.
+
+Attributes:
+    commute_shuttle_tracker (CommuteShuttleTracker): Tracker of the app.
+"""
+import bisect
+import datetime
+import time
+from typing import NamedTuple, Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+
+from app.internal.config import AppSettings
+from app.internal.date_utils import current_period, is_holiday, is_weekends
+from app.internal.invalidation import TableChanged, invalidation_bus
+from app.model.commute_shuttle import CommuteShuttleRoute
+
+ROUTE_TABLES = ('commute_shuttle_route', 'commute_shuttle_timetable')
+STATUS_TABLES = ('shuttle_period', 'shuttle_holiday')
+NO_STOP = ('', datetime.time(hour=0, minute=0, second=0))
+
+
+class RouteTimeline(NamedTuple):
+    """Class that holds the timetable of a commute shuttle route.
+    Attributes:
+        name (str): Name of the route.
+        korean (str): Korean description of the route.
+        english (str): English description of the route.
+        timetable (list[tuple[str, datetime.time]]): Stops and departure
+            times in stop order.
+        times (list[datetime.time]): Departure times in time order.
+        stops (list[str]): Stops matching the departure times.
+    """
+    name: str
+    korean: str
+    english: str
+    timetable: list[tuple[str, datetime.time]]
+    times: list[datetime.time]
+    stops: list[str]
+
+    def current(self, now: datetime.time) -> tuple[
+        tuple[str, datetime.time],
+        tuple[str, datetime.time],
+    ]:
+        """Function to get the stops the shuttle is between.
+        Args:
+            now (datetime.time): Current time.
+        Returns:
+            tuple: Last stop departed before now and the next stop departing
+                after now, or an empty stop at midnight for either.
+        """
+        passed = bisect.bisect_left(self.times, now)
+        upcoming = bisect.bisect_right(self.times, now)
+        start = NO_STOP if passed == 0 else \
+            (self.stops[passed - 1], self.times[passed - 1])
+        end = NO_STOP if upcoming == len(self.times) else \
+            (self.stops[upcoming], self.times[upcoming])
+        return start, end
+
+
+class CommuteShuttleTracker:
+    """Class that keeps the commute shuttle routes and the day's status.
+    Attributes:
+        routes_ttl (float): Seconds the routes are kept.
+    """
+
+    def __init__(self, routes_ttl: float) -> None:
+        self.routes_ttl = routes_ttl
+        self._routes: Optional[dict[str, RouteTimeline]] = None
+        self._routes_expire_at = 0.0
+        self._routes_version = 0
+        self._status: Optional[tuple[datetime.date, str]] = None
+
+    def reset_routes(self, event: Optional[TableChanged] = None) -> None:
+        self._routes = None
+        self._routes_version += 1
+
+    def reset_status(self, event: Optional[TableChanged] = None) -> None:
+        self._status = None
+
+    async def routes(
+        self,
+        db_session: AsyncSession,
+    ) -> dict[str, RouteTimeline]:
+        """Function to get every route, loading them on the first call
+        and once they expire.
+        Args:
+            db_session (AsyncSession): Database session.
+        Returns:
+            dict[str, RouteTimeline]: Timeline of each route by name.
+        """
+        if self._routes is not None and \
+                time.monotonic() < self._routes_expire_at:
+            return self._routes
+        version = self._routes_version
+        expire_at = time.monotonic() + self.routes_ttl
+        statement = select(CommuteShuttleRoute).options(
+            selectinload(CommuteShuttleRoute.timetable),
+        )
+        query_result = (await db_session.execute(statement)).scalars().all()
+        routes: dict[str, RouteTimeline] = {}
+        for route in query_result:  # type: CommuteShuttleRoute
+            timetable = [
+                (item.stop_name, item.departure_time)
+                for item in route.timetable
+            ]
+            by_time = sorted(timetable, key=lambda stop: stop[1])
+            routes[route.name] = RouteTimeline(
+                name=route.name,
+                korean=route.korean,
+                english=route.english,
+                timetable=timetable,
+                times=[departure_time for _, departure_time in by_time],
+                stops=[stop_name for stop_name, _ in by_time],
+            )
+        # Keep the result only if the tables did not change meanwhile.
+        if version == self._routes_version:
+            self._routes = routes
+            self._routes_expire_at = expire_at
+        return routes
+
+    async def status(
+        self,
+        db_session: AsyncSession,
+        now: datetime.datetime,
+    ) -> str:
+        """Function to get whether the commute shuttles run today.
+        Args:
+            db_session (AsyncSession): Database session.
+            now (datetime.datetime): Current time in Korea Standard Time,
+                as returned by current_datetime.
+        Returns:
+            str: SUCCESS, or the reason the shuttles do not run.
+        """
+        if self._status is not None and self._status[0] == now.date():
+            return self._status[1]
+        if is_weekends(now):
+            status_message = 'ERROR.WEEKENDS'
+        elif await current_period(db_session, now) != 'semester':
+            status_message = 'ERROR.NOT_SEMESTER'
+        elif await is_holiday(db_session, now) != 'normal':
+            status_message = 'ERROR.HOLIDAY'
+        else:
+            status_message = 'SUCCESS'
+        self._status = (now.date(), status_message)
+        return status_message
+
+
+app_settings = AppSettings()
+commute_shuttle_tracker = CommuteShuttleTracker(
+    routes_ttl=app_settings.COMMUTE_ROUTES_TTL)
+invalidation_bus.subscribe(ROUTE_TABLES, commute_shuttle_tracker.reset_routes)
+invalidation_bus.subscribe(STATUS_TABLES, commute_shuttle_tracker.reset_status)
@@ -1,5 +1,6 @@
 # Module for application-wide settings.
 import os
+from typing import Optional
 
 from pydantic import BaseSettings, Field
 
@@ -7,7 +8,94 @@ from pydantic import BaseSettings, Field
 class AppSettings(BaseSettings):
     """Class that contains the application-wide settings.
     Attributes:
-        DATABASE_URI(str): The URI of the database.
+        DATABASE_URI(str): The URI of the primary database.
+        DATABASE_REPLICA_URIS(list[str]): The URIs of the read replicas.
+        DATABASE_REPLICA_COOLDOWN(float): Seconds a failed replica is
+            skipped before it is used again.
+        GRAPHQL_SESSION_LIMIT(int): Maximum number of database sessions a
+            single GraphQL request can hold at the same time.
+        GRAPHQL_DOCUMENT_CACHE_SIZE(int): Number of parsed and validated
+            GraphQL documents to keep.
+        GRAPHQL_PERSISTED_QUERY_SIZE(int): Number of persisted query
+            documents to keep.
+        QUERY_CACHE_TTL(dict[str, float]): Time-to-live in seconds of the
+            cached result of each GraphQL field. Zero disables the cache.
+        RESPONSE_CACHE_TTL(dict[str, float]): Time-to-live in seconds of
+            the cached body of each arrival and timetable endpoint.
+        COMMUTE_ROUTES_TTL(float): Seconds the commute shuttle routes are
+            kept before they are loaded again.
+        CACHE_BACKEND(str): Shared cache backend, memory or redis.
+        CACHE_REDIS_URL(str): URL of the Redis server of the shared cache.
+        CACHE_LOCAL_SIZE(int): Number of values each cache keeps in the
+            local LRU in front of the shared backend.
+        CACHE_SIGNING_KEY(str): Key signing the pickled values of the
+            shared cache, required with redis.
+        INVALIDATION_MODE(str): How table changes are detected: auto,
+            notify, poll or off. Auto notifies on PostgreSQL when every
+            watched table has its trigger, and polls otherwise.
+        INVALIDATION_CHANNEL(str): PostgreSQL notification channel.
+        INVALIDATION_POLL_INTERVAL(float): Seconds between two polls.
+        INVALIDATION_INSTALL_TRIGGERS(bool): Whether to install the
+            notification triggers on startup.
+        TIMETABLE_SNAPSHOT_PATH(str): Path of the timetable snapshot that
+            workers load on startup, or None not to load one.
+        TIMETABLE_SNAPSHOT_MAX_AGE(int): Maximum age in seconds of the
+            timetable snapshot.
+        PROFILE_TOKEN(str): Token that enables profiling of a request, or
+            None to disable profiling.
+        PROFILE_DIRECTORY(str): Directory the request profiles are written
+            to.
+        PROFILE_INTERVAL(float): Seconds between two stack samples.
+        LOG_LEVEL(str): Level of the root logger.
+        LOG_FORMAT(str): Format of the log records, json or text.
+        LOG_SAMPLING(dict[str, float]): Fraction of the records below
+            WARNING to keep for each logger name.
+        ACCESS_LOG(bool): Whether to log every request.
+        SQL_LOG_MODE(str): Which SQL statements to log: off, slow or
+            sample.
+        SQL_LOG_SLOW_THRESHOLD(float): Seconds above which a statement is
+            logged in slow mode.
+        SQL_LOG_SAMPLE_RATE(float): Fraction of the statements logged in
+            sample mode.
+        TRACING_EXPORTER(str): Where spans are exported: off, console,
+            file or otlp.
+        TRACING_FILE(str): File the spans are appended to by the file
+            exporter.
+        TRACING_OTLP_ENDPOINT(str): URL of the OTLP collector, or None for
+            the endpoint of the OpenTelemetry environment variables.
+        TRACING_SAMPLE_RATE(float): Fraction of the requests traced.
+        LAZY_LOAD_MODE(str): What to do when a relationship is loaded
+            lazily: off, warn or raise.
+        LOOP_MONITOR_INTERVAL(float): Seconds between two measurements of
+            the event loop lag, or zero to disable the monitor.
+        LOOP_MONITOR_WINDOW(int): Number of recent measurements the lag
+            percentiles are computed from.
+        LOOP_BLOCKING_THRESHOLD(float): Seconds a coroutine step may hold
+            the event loop before its stack is logged, or None to disable
+            the blocking detector.
+        METRICS_ENABLED(bool): Whether to serve the metrics on /metrics.
+        RESPONSE_OFFLOAD_MODE(str): Where large responses are built: off,
+            thread or process.
+        RESPONSE_OFFLOAD_WORKERS(int): Size of the response builder pool.
+        RESPONSE_OFFLOAD_THRESHOLD(int): Number of rows from which a
+            response is built in the pool instead of on the event loop.
+        SCHEDULER_ENABLED(bool): Whether to run the periodic jobs.
+        SCHEDULER_ELECTION(str): How the worker running the singleton jobs
+            is elected: auto, advisory or local. Auto uses an advisory lock
+            on PostgreSQL and a lock inside the process otherwise.
+        SCHEDULER_LOCK_NAME(str): Name of the leader lock.
+        ARRIVAL_BOARD_ENABLED(bool): Whether to precompute the arrival
+            boards of every stop.
+        ARRIVAL_BOARD_TTL(float): Seconds an arrival board is served after
+            it was built, at most 60 as it holds remaining times.
+        REALTIME_STALE_AFTER(float): Seconds after its last update from
+            which a realtime arrival is flagged as stale.
+        MIGRATE_ON_STARTUP(bool): Whether to apply the pending schema
+            migrations to the primary database on startup.
+        DEPARTURE_VIEWS_ENABLED(bool): Whether the arrival endpoints read
+            the departures from materialized views on PostgreSQL.
+        DEPARTURE_VIEWS_REFRESH_INTERVAL(float): Seconds between two
+            scheduled refreshes of the departure views.
     """
     DATABASE_URI: str = Field(
         default=f"postgresql+asyncpg://"
@@ -16,3 +104,213 @@ class AppSettings(BaseSettings):
                 f"{os.getenv('DB_NAME')}",
         env="DATABASE_URI",
     )
+    DATABASE_REPLICA_URIS: list[str] = Field(
+        default=[],
+        env="DATABASE_REPLICA_URIS",
+    )
+    DATABASE_REPLICA_COOLDOWN: float = Field(
+        default=30,
+        env="DATABASE_REPLICA_COOLDOWN",
+    )
+    GRAPHQL_SESSION_LIMIT: int = Field(
+        default=4,
+        env="GRAPHQL_SESSION_LIMIT",
+    )
+    GRAPHQL_DOCUMENT_CACHE_SIZE: int = Field(
+        default=256,
+        env="GRAPHQL_DOCUMENT_CACHE_SIZE",
+    )
+    GRAPHQL_PERSISTED_QUERY_SIZE: int = Field(
+        default=1000,
+        env="GRAPHQL_PERSISTED_QUERY_SIZE",
+    )
+    QUERY_CACHE_TTL: dict[str, float] = Field(
+        default={
+            "shuttle": 60,
+            "bus": 3600,
+            "subway": 3600,
+            "cafeteria": 600,
+            "reading_room": 30,
+            "commute_shuttle": 3600,
+        },
+        env="QUERY_CACHE_TTL",
+    )
+    RESPONSE_CACHE_TTL: dict[str, float] = Field(
+        default={
+            "shuttle_arrival": 30,
+            "shuttle_timetable": 3600,
+            "bus_arrival": 60,
+            "bus_timetable": 3600,
+            "subway_arrival": 60,
+            "subway_timetable": 3600,
+        },
+        env="RESPONSE_CACHE_TTL",
+    )
+    COMMUTE_ROUTES_TTL: float = Field(
+        default=3600,
+        env="COMMUTE_ROUTES_TTL",
+    )
+    CACHE_BACKEND: str = Field(
+        default="memory",
+        env="CACHE_BACKEND",
+    )
+    CACHE_REDIS_URL: str = Field(
+        default="redis://localhost:6379/0",
+        env="CACHE_REDIS_URL",
+    )
+    CACHE_LOCAL_SIZE: int = Field(
+        default=1024,
+        env="CACHE_LOCAL_SIZE",
+    )
+    CACHE_SIGNING_KEY: Optional[str] = Field(
+        default=None,
+        env="CACHE_SIGNING_KEY",
+    )
+    INVALIDATION_MODE: str = Field(
+        default="auto",
+        env="INVALIDATION_MODE",
+    )
+    INVALIDATION_CHANNEL: str = Field(
+        default="table_change",
+        env="INVALIDATION_CHANNEL",
+    )
+    INVALIDATION_POLL_INTERVAL: float = Field(
+        default=5,
+        env="INVALIDATION_POLL_INTERVAL",
+    )
+    INVALIDATION_INSTALL_TRIGGERS: bool = Field(
+        default=False,
+        env="INVALIDATION_INSTALL_TRIGGERS",
+    )
+    TIMETABLE_SNAPSHOT_PATH: Optional[str] = Field(
+        default=None,
+        env="TIMETABLE_SNAPSHOT_PATH",
+    )
+    TIMETABLE_SNAPSHOT_MAX_AGE: int = Field(
+        default=86400,
+        env="TIMETABLE_SNAPSHOT_MAX_AGE",
+    )
+    PROFILE_TOKEN: Optional[str] = Field(
+        default=None,
+        env="PROFILE_TOKEN",
+    )
+    PROFILE_DIRECTORY: str = Field(
+        default="/tmp/hyuabot-profiles",
+        env="PROFILE_DIRECTORY",
+    )
+    PROFILE_INTERVAL: float = Field(
+        default=0.001,
+        env="PROFILE_INTERVAL",
+    )
+    LOG_LEVEL: str = Field(
+        default="INFO",
+        env="LOG_LEVEL",
+    )
+    LOG_FORMAT: str = Field(
+        default="json",
+        env="LOG_FORMAT",
+    )
+    LOG_SAMPLING: dict[str, float] = Field(
+        default={},
+        env="LOG_SAMPLING",
+    )
+    ACCESS_LOG: bool = Field(
+        default=True,
+        env="ACCESS_LOG",
+    )
+    SQL_LOG_MODE: str = Field(
+        default="off",
+        env="SQL_LOG_MODE",
+    )
+    SQL_LOG_SLOW_THRESHOLD: float = Field(
+        default=0.2,
+        env="SQL_LOG_SLOW_THRESHOLD",
+    )
+    SQL_LOG_SAMPLE_RATE: float = Field(
+        default=0.01,
+        env="SQL_LOG_SAMPLE_RATE",
+    )
+    TRACING_EXPORTER: str = Field(
+        default="off",
+        env="TRACING_EXPORTER",
+    )
+    TRACING_FILE: str = Field(
+        default="/tmp/hyuabot-traces.jsonl",
+        env="TRACING_FILE",
+    )
+    TRACING_OTLP_ENDPOINT: Optional[str] = Field(
+        default=None,
+        env="TRACING_OTLP_ENDPOINT",
+    )
+    TRACING_SAMPLE_RATE: float = Field(
+        default=1.0,
+        env="TRACING_SAMPLE_RATE",
+    )
+    LAZY_LOAD_MODE: str = Field(
+        default="off",
+        env="LAZY_LOAD_MODE",
+    )
+    LOOP_MONITOR_INTERVAL: float = Field(
+        default=0.1,
+        env="LOOP_MONITOR_INTERVAL",
+    )
+    LOOP_MONITOR_WINDOW: int = Field(
+        default=600,
+        env="LOOP_MONITOR_WINDOW",
+    )
+    LOOP_BLOCKING_THRESHOLD: Optional[float] = Field(
+        default=None,
+        env="LOOP_BLOCKING_THRESHOLD",
+    )
+    METRICS_ENABLED: bool = Field(
+        default=False,
+        env="METRICS_ENABLED",
+    )
+    RESPONSE_OFFLOAD_MODE: str = Field(
+        default="thread",
+        env="RESPONSE_OFFLOAD_MODE",
+    )
+    RESPONSE_OFFLOAD_WORKERS: int = Field(
+        default=2,
+        env="RESPONSE_OFFLOAD_WORKERS",
+    )
+    RESPONSE_OFFLOAD_THRESHOLD: int = Field(
+        default=1000,
+        env="RESPONSE_OFFLOAD_THRESHOLD",
+    )
+    SCHEDULER_ENABLED: bool = Field(
+        default=True,
+        env="SCHEDULER_ENABLED",
+    )
+    SCHEDULER_ELECTION: str = Field(
+        default="auto",
+        env="SCHEDULER_ELECTION",
+    )
+    SCHEDULER_LOCK_NAME: str = Field(
+        default="hyuabot-scheduler",
+        env="SCHEDULER_LOCK_NAME",
+    )
+    ARRIVAL_BOARD_ENABLED: bool = Field(
+        default=True,
+        env="ARRIVAL_BOARD_ENABLED",
+    )
+    ARRIVAL_BOARD_TTL: float = Field(
+        default=60,
+        env="ARRIVAL_BOARD_TTL",
+    )
+    REALTIME_STALE_AFTER: float = Field(
+        default=180,
+        env="REALTIME_STALE_AFTER",
+    )
+    MIGRATE_ON_STARTUP: bool = Field(
+        default=False,
+        env="MIGRATE_ON_STARTUP",
+    )
+    DEPARTURE_VIEWS_ENABLED: bool = Field(
+        default=False,
+        env="DEPARTURE_VIEWS_ENABLED",
+    )
+    DEPARTURE_VIEWS_REFRESH_INTERVAL: float = Field(
+        default=3600,
+        env="DEPARTURE_VIEWS_REFRESH_INTERVAL",
+    )
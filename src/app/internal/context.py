@@ -1,10 +1,13 @@
 # This module contains the application context.
 from __future__ import annotations
 
-from typing import NamedTuple, TYPE_CHECKING
+from typing import NamedTuple, Optional, TYPE_CHECKING
 
 from sqlalchemy.ext.asyncio import AsyncEngine
 
+from app.internal.invalidation import ChangeListener
+from app.internal.loop_monitor import LoopLagMonitor
+
 
 if TYPE_CHECKING:
     from app.internal.config import AppSettings
@@ -16,9 +19,13 @@ class AppContext(NamedTuple):
     Attributes:
         app_settings (AppSettings): Application settings.
         db_engine (AsyncEngine): Database engine.
+        change_listener (ChangeListener): Listener for table changes.
+        loop_monitor (LoopLagMonitor): Monitor of the event loop lag.
     """
     app_settings: AppSettings
     db_engine: AsyncEngine
+    change_listener: Optional[ChangeListener] = None
+    loop_monitor: Optional[LoopLagMonitor] = None
 
     @staticmethod
     def from_app(app: App) -> AppContext:
@@ -1,17 +1,40 @@
 import datetime
+import functools
+
 import holidays
 from korean_lunar_calendar import KoreanLunarCalendar
-from sqlalchemy import select, and_, or_
+from sqlalchemy import bindparam, select, and_, or_
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.model.calendar import Holiday
 from app.model.shuttle import ShuttlePeriod
 
+KST = datetime.timezone(datetime.timedelta(hours=9))
 exclude_holidays = [
     datetime.date(2021, 5, 1),
 ]
 korean_holidays = holidays.KR()
 lunar_calendar = KoreanLunarCalendar()
+# Statements run by every arrival request are built once with bound
+# parameters, so their cache keys are computed once as well.
+PERIOD_STATEMENT = select(ShuttlePeriod).where(
+    and_(
+        ShuttlePeriod.start <= bindparam('value'),
+        ShuttlePeriod.end >= bindparam('value'),
+    ),
+)
+HOLIDAY_STATEMENT = select(Holiday).where(
+    or_(
+        and_(
+            Holiday.holiday_date == bindparam('solar'),
+            Holiday.calendar_type == 'solar',
+        ),
+        and_(
+            Holiday.holiday_date == bindparam('lunar'),
+            Holiday.calendar_type == 'lunar',
+        ),
+    ),
+)
 
 
 def is_weekends(value: datetime.date = datetime.date.today()) -> bool:
@@ -22,47 +45,55 @@ def is_weekends(value: datetime.date = datetime.date.today()) -> bool:
 
 
 def current_time() -> datetime.time:
-    tz = datetime.timezone(datetime.timedelta(hours=9))
-    return datetime.datetime.now(tz=tz).time()
+    return datetime.datetime.now(tz=KST).time()
+
+
+def current_datetime() -> datetime.datetime:
+    """Function to get the current time in Korea, whatever the timezone of
+    the host.
+    Returns:
+        datetime.datetime: Current time without the timezone, like the
+            update times of the realtime feeds and the timetables.
+    """
+    return datetime.datetime.now(tz=KST).replace(tzinfo=None)
 
 
 async def current_period(
         db_session: AsyncSession,
         value: datetime.datetime = datetime.datetime.now(),
 ) -> str:
-    statement = select(ShuttlePeriod).where(
-        and_(
-            ShuttlePeriod.start <= value,
-            ShuttlePeriod.end >= value,
-        ),
-    )
-    query_result = (await db_session.execute(statement)).scalars().first()
+    query_result = (await db_session.execute(
+        PERIOD_STATEMENT, {'value': value},
+    )).scalars().first()
     if query_result is None:
         return 'semester'
     return query_result.period_type_name
 
 
+@functools.lru_cache(maxsize=64)
+def lunar_date(value: datetime.date) -> datetime.date:
+    """Function to convert a solar date to the lunar calendar.
+
+    The conversion runs on the event loop and only a few dates are asked
+    for, so the results are cached; callers pass dates, not times.
+    Args:
+        value (datetime.date): Solar date.
+    Returns:
+        datetime.date: Lunar date.
+    """
+    lunar_calendar.setSolarDate(value.year, value.month, value.day)
+    return datetime.date.fromisoformat(lunar_calendar.LunarIsoFormat())
+
+
 async def is_holiday(
         db_session: AsyncSession,
         value: datetime.date = datetime.date.today(),
 ) -> str:
-    lunar_calendar.setSolarDate(value.year, value.month, value.day)
-    statement = select(Holiday).where(
-        or_(
-            and_(
-                Holiday.holiday_date == value,
-                Holiday.calendar_type == 'solar',
-            ),
-            and_(
-                Holiday.holiday_date == datetime.datetime.strptime(
-                    lunar_calendar.LunarIsoFormat(), '%Y-%m-%d',
-                ),
-                Holiday.calendar_type == 'lunar',
-            ),
-        ),
-    )
-    query_result = (await db_session.execute(statement)).scalars() \
-        .one_or_none()
+    if isinstance(value, datetime.datetime):
+        value = value.date()
+    query_result = (await db_session.execute(
+        HOLIDAY_STATEMENT, {'solar': value, 'lunar': lunar_date(value)},
+    )).scalars().one_or_none()
     if query_result is None:
         return 'normal'
     return query_result.holiday_type
@@ -0,0 +1,235 @@
+"""Module that keeps materialized views of the departures on PostgreSQL.
+
+The departures of the subway and bus arrivals are read with joins on every
+request: the subway timetable with the names of the start and destination
+stations, and the bus route stops with their stops, routes and the
+timetable of the stop they start from. Those tables only change when the
+updaters reload the timetables, so deployments that keep the work in the
+database can materialize the joins once and let the arrival endpoints read
+flat rows by the leading column of a unique index.
+
+Each view is defined by the statement its rows module reads without it,
+so both return the same rows. A hash of the definition is kept in the
+comment of the view, and a view whose comment does not match is dropped
+and created again, so a changed statement never leaves a stale view
+behind. The views are created on startup when
+DEPARTURE_VIEWS_ENABLED is set and the primary database is PostgreSQL, and
+the rows modules read them from then on. A singleton job refreshes them
+concurrently, so reads are never blocked, every
+DEPARTURE_VIEWS_REFRESH_INTERVAL seconds and whenever one of their source
+tables changes. The caches built from those tables are cleared again once
+the refresh finishes, as they may have been refilled from the views before.
+
+Attributes:
+    departure_views (DepartureViews): Departure views of the app.
+"""
+import asyncio
+import datetime
+import hashlib
+import logging
+from typing import Iterable, Optional
+
+from sqlalchemy import Column, Index, MetaData, Select, Table, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+from sqlalchemy.schema import CreateIndex
+
+from app.internal.config import AppSettings
+from app.internal.invalidation import TableChanged, invalidation_bus
+from app.internal.scheduler import lock_key, scheduler
+
+logger = logging.getLogger(__name__)
+# Changes published after a refresh carry this source, so that they do not
+# trigger another refresh.
+REFRESH_SOURCE = 'refresh'
+view_metadata = MetaData()
+
+
+class MaterializedView:
+    """Class that holds a materialized view of a statement.
+    Attributes:
+        name (str): Name of the view.
+        definition (Select): Statement the view materializes, with its
+            columns labeled by their names in the view.
+        table (Table): Columns of the view, to select from.
+        index (Index): Unique index the concurrent refresh needs.
+        sources (tuple[str, ...]): Tables the view is built from.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        statement: Select,
+        columns: Iterable[str],
+        key: Iterable[str],
+        sources: Iterable[str],
+    ) -> None:
+        columns = tuple(columns)
+        self.name = name
+        self.definition = statement.order_by(None).with_only_columns(
+            *(column.label(label) for label, column in zip(
+                columns, statement.selected_columns)),
+            maintain_column_froms=False,
+        )
+        self.table = Table(name, view_metadata, *(
+            Column(label, column.type) for label, column in zip(
+                columns, statement.selected_columns)
+        ))
+        self.index = Index(
+            f'ux_{name}', *(self.table.c[column] for column in key),
+            unique=True,
+        )
+        self.sources = tuple(sources)
+
+    async def create(self, connection: AsyncConnection) -> None:
+        """Function to create the view, or replace it when it was created
+        from another definition.
+        Args:
+            connection (AsyncConnection): Connection to the database.
+        """
+        definition = str(self.definition.compile(
+            dialect=connection.dialect,
+            compile_kwargs={'literal_binds': True},
+        ))
+        index = str(CreateIndex(self.index).compile(
+            dialect=connection.dialect))
+        digest = hashlib.sha256(
+            f'{definition}\n{index}'.encode()).hexdigest()
+        current = (await connection.execute(
+            text("SELECT obj_description(to_regclass(:name), 'pg_class')"),
+            {'name': self.name},
+        )).scalar_one()
+        if current == digest:
+            return
+        await self.drop(connection)
+        await connection.execute(text(
+            f'CREATE MATERIALIZED VIEW {self.name} AS {definition}'))
+        await connection.execute(CreateIndex(self.index))
+        await connection.execute(text(
+            f"COMMENT ON MATERIALIZED VIEW {self.name} IS '{digest}'"))
+
+    async def drop(self, connection: AsyncConnection) -> None:
+        await connection.execute(
+            text(f'DROP MATERIALIZED VIEW IF EXISTS {self.name}'))
+
+    async def refresh(self, connection: AsyncConnection) -> None:
+        await connection.execute(
+            text(f'REFRESH MATERIALIZED VIEW CONCURRENTLY {self.name}'))
+
+
+class DepartureViews:
+    """Class that creates and refreshes the departure views.
+    Attributes:
+        enabled (bool): Whether the views are used when the database
+            supports them.
+        views (dict[str, MaterializedView]): Views by name.
+        engine (AsyncEngine): Engine of the primary database, or None while
+            the views are not created.
+    """
+    job = 'departure_views'
+
+    def __init__(self, enabled: bool, interval: float) -> None:
+        self.enabled = enabled
+        self.views: dict[str, MaterializedView] = {}
+        self.engine: Optional[AsyncEngine] = None
+        self._lock = asyncio.Lock()
+        self._waiting = False
+        if enabled:
+            # Every worker reads the views of the same database.
+            scheduler.add_job(
+                self.job, self.refresh, interval=interval, singleton=True)
+
+    @property
+    def ready(self) -> bool:
+        """Whether the rows modules read the views."""
+        return self.engine is not None
+
+    def add(
+        self,
+        name: str,
+        statement: Select,
+        columns: Iterable[str],
+        key: Iterable[str],
+        sources: Iterable[str],
+    ) -> MaterializedView:
+        """Function to declare a view of a statement.
+        Args:
+            name (str): Unique name of the view.
+            statement (Select): Statement the view materializes.
+            columns (Iterable[str]): Names of the selected columns in the
+                view.
+            key (Iterable[str]): Columns identifying a row of the view.
+            sources (Iterable[str]): Tables the statement reads.
+        Returns:
+            MaterializedView: Declared view.
+        """
+        if name in self.views:
+            raise ValueError(f'View {name} is already declared')
+        view = MaterializedView(name, statement, columns, key, sources)
+        self.views[name] = view
+        if self.enabled:
+            invalidation_bus.subscribe(view.sources, self.on_change)
+        return view
+
+    def on_change(self, event: TableChanged) -> None:
+        if event.source != REFRESH_SOURCE:
+            scheduler.trigger(self.job)
+
+    async def start(self, engine: AsyncEngine) -> None:
+        """Function to create the views and read them from now on.
+        Args:
+            engine (AsyncEngine): Engine of the primary database.
+        """
+        if not self.enabled:
+            return
+        if engine.dialect.name != 'postgresql':
+            logger.warning('Departure views need PostgreSQL, not %s',
+                           engine.dialect.name)
+            return
+        async with engine.begin() as connection:
+            # Workers starting together create the views one after another.
+            await connection.execute(
+                text('SELECT pg_advisory_xact_lock(:key)'),
+                {'key': lock_key('departure_views_create')},
+            )
+            for view in self.views.values():
+                await view.create(connection)
+        self.engine = engine
+
+    def stop(self) -> None:
+        self.engine = None
+
+    async def drop(self, engine: AsyncEngine) -> None:
+        """Function to drop the views.
+        Args:
+            engine (AsyncEngine): Engine of the primary database.
+        """
+        self.engine = None
+        async with engine.begin() as connection:
+            for view in self.views.values():
+                await view.drop(connection)
+
+    async def refresh(self) -> None:
+        """Function to refresh every view without blocking their reads."""
+        if self.engine is None or self._waiting:
+            # The refresh waiting for the current one reads newer data.
+            return
+        self._waiting = True
+        async with self._lock:
+            self._waiting = False
+            async with self.engine.begin() as connection:
+                for view in self.views.values():
+                    await view.refresh(connection)
+        detected_at = datetime.datetime.now()
+        for table_name in sorted({
+            table_name for view in self.views.values()
+            for table_name in view.sources
+        }):
+            await invalidation_bus.publish(
+                TableChanged(table_name, REFRESH_SOURCE, detected_at))
+
+
+app_settings = AppSettings()
+departure_views = DepartureViews(
+    enabled=app_settings.DEPARTURE_VIEWS_ENABLED,
+    interval=app_settings.DEPARTURE_VIEWS_REFRESH_INTERVAL,
+)
@@ -0,0 +1,343 @@
+"""Module that tells the caches when the crawler rewrites a table.
+
+On PostgreSQL the listener subscribes to a notification channel that the
+triggers from ``notify_trigger_statements`` publish the table name to. On
+other databases, or when a watched table has no trigger, the listener
+polls a fingerprint of every watched table instead: the newest
+``last_updated_time`` for realtime tables, and the row count with a
+checksum of the rows otherwise, so that rewrites keeping the row count are
+seen as well. Every worker runs its own listener, so the caches of every
+worker are cleared.
+
+Attributes:
+    invalidation_bus (InvalidationBus): Bus the caches subscribe to.
+"""
+import abc
+import asyncio
+import datetime
+import inspect
+import logging
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Iterable, NamedTuple, Optional
+
+from sqlalchemy import column, func, literal_column, select, table, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+logger = logging.getLogger(__name__)
+
+TIMESTAMPED_TABLES = frozenset({
+    'bus_realtime',
+    'subway_realtime',
+    'reading_room',
+})
+# Row hashes are summed modulo this, so that the order of the rows does
+# not change the checksum.
+CHECKSUM_MODULUS = 2 ** 64
+
+
+class TableChanged(NamedTuple):
+    """Class that describes a change of a table.
+    Attributes:
+        table (str): Name of the changed table.
+        source (str): How the change was detected, notify or poll.
+        detected_at (datetime.datetime): When the change was detected.
+    """
+    table: str
+    source: str
+    detected_at: datetime.datetime
+
+
+InvalidationHandler = Callable[[TableChanged], Optional[Awaitable[None]]]
+
+
+class InvalidationBus:
+    """Class that dispatches table changes to the subscribed caches."""
+
+    def __init__(self) -> None:
+        self._handlers: dict[str, list[InvalidationHandler]] = \
+            defaultdict(list)
+
+    @property
+    def tables(self) -> set[str]:
+        return set(self._handlers)
+
+    def subscribe(
+        self,
+        tables: Iterable[str],
+        handler: InvalidationHandler,
+    ) -> None:
+        for table_name in tables:
+            self._handlers[table_name].append(handler)
+
+    async def publish(self, event: TableChanged) -> None:
+        """Function to call every handler subscribed to the changed table.
+        Args:
+            event (TableChanged): Change of a table.
+        """
+        for handler in self._handlers.get(event.table, []):
+            try:
+                result = handler(event)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception:
+                logger.exception('Invalidation handler failed for %s',
+                                 event.table)
+
+
+invalidation_bus = InvalidationBus()
+
+
+def notify_trigger_statements(
+    tables: Iterable[str],
+    channel: str,
+) -> list[str]:
+    """Function to get the statements creating the notification triggers.
+    Args:
+        tables (Iterable[str]): Names of the tables to watch.
+        channel (str): Notification channel.
+    Returns:
+        list[str]: DDL statements.
+    """
+    statements = [
+        "CREATE OR REPLACE FUNCTION notify_table_change() "
+        "RETURNS trigger AS $$ BEGIN "
+        f"PERFORM pg_notify('{channel}', TG_TABLE_NAME); "
+        "RETURN NULL; END; $$ LANGUAGE plpgsql",
+    ]
+    for table_name in sorted(tables):
+        trigger_name = f'{table_name}_notify_change'
+        statements.append(
+            f'DROP TRIGGER IF EXISTS {trigger_name} ON {table_name}')
+        statements.append(
+            f'CREATE TRIGGER {trigger_name} '
+            f'AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table_name} '
+            'FOR EACH STATEMENT EXECUTE FUNCTION notify_table_change()')
+    return statements
+
+
+async def install_notify_triggers(
+    engine: AsyncEngine,
+    tables: Iterable[str],
+    channel: str,
+) -> None:
+    async with engine.begin() as connection:
+        for statement in notify_trigger_statements(tables, channel):
+            await connection.execute(text(statement))
+
+
+async def missing_notify_triggers(
+    engine: AsyncEngine,
+    tables: Iterable[str],
+) -> set[str]:
+    """Function to find the tables without a notification trigger.
+    Args:
+        engine (AsyncEngine): Engine of a PostgreSQL database.
+        tables (Iterable[str]): Names of the tables to watch.
+    Returns:
+        set[str]: Names of the tables whose changes are not notified.
+    """
+    async with engine.connect() as connection:
+        notified = set((await connection.execute(text(
+            "SELECT c.relname FROM pg_trigger AS t "
+            "JOIN pg_class AS c ON c.oid = t.tgrelid "
+            "WHERE t.tgname = c.relname || '_notify_change' "
+            "AND NOT t.tgisinternal "
+            "AND pg_table_is_visible(c.oid)"))).scalars())
+    return set(tables) - notified
+
+
+class ChangeListener(abc.ABC):
+    """Class that detects table changes and publishes them to the bus.
+    Attributes:
+        engine (AsyncEngine): Engine of the primary database.
+        bus (InvalidationBus): Bus to publish the changes to.
+        retry_interval (float): Seconds to wait after a failure.
+    """
+
+    def __init__(
+        self,
+        engine: AsyncEngine,
+        bus: InvalidationBus,
+        retry_interval: float = 5,
+    ) -> None:
+        self.engine = engine
+        self.bus = bus
+        self.retry_interval = retry_interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def publish(self, table_name: str, source: str) -> None:
+        await self.bus.publish(TableChanged(
+            table=table_name,
+            source=source,
+            detected_at=datetime.datetime.now(),
+        ))
+
+    @abc.abstractmethod
+    async def _run(self) -> None:
+        ...
+
+
+class NotifyChangeListener(ChangeListener):
+    """Class that listens to PostgreSQL notifications.
+    Attributes:
+        channel (str): Notification channel.
+    """
+
+    def __init__(self, *args: Any, channel: str, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.channel = channel
+        self._pending: set[asyncio.Task] = set()
+
+    def _on_notify(
+        self,
+        connection: Any,
+        pid: int,
+        channel: str,
+        payload: str,
+    ) -> None:
+        if payload not in self.bus.tables:
+            return
+        task = asyncio.create_task(self.publish(payload, 'notify'))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                async with self.engine.connect() as connection:
+                    raw_connection = await connection.get_raw_connection()
+                    driver_connection: Any = \
+                        raw_connection.driver_connection
+                    terminated = asyncio.Event()
+                    driver_connection.add_termination_listener(
+                        lambda _: terminated.set())
+                    try:
+                        await driver_connection.add_listener(
+                            self.channel, self._on_notify)
+                        # Changes made while no one was listening are lost.
+                        for table_name in self.bus.tables:
+                            await self.publish(table_name, 'notify')
+                        await terminated.wait()
+                    finally:
+                        # Keep the listening connection out of the pool.
+                        await connection.invalidate()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('Change notification listener failed')
+            await asyncio.sleep(self.retry_interval)
+
+
+class PollingChangeListener(ChangeListener):
+    """Class that polls a fingerprint of every watched table.
+    Attributes:
+        interval (float): Seconds between two polls.
+    """
+
+    def __init__(self, *args: Any, interval: float, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.interval = interval
+        self._fingerprints: dict[str, Any] = {}
+
+    @staticmethod
+    async def fingerprint(
+        connection: AsyncConnection,
+        table_name: str,
+    ) -> tuple:
+        """Function to compute a value that changes with the table.
+        Args:
+            connection (AsyncConnection): Connection to the database.
+            table_name (str): Name of the table.
+        Returns:
+            tuple: Newest update time and row count of a realtime table, or
+                row count and checksum of the rows of any other table.
+        """
+        if table_name in TIMESTAMPED_TABLES:
+            return tuple((await connection.execute(select(
+                func.max(column('last_updated_time')),
+                func.count(),
+            ).select_from(table(table_name)))).one())
+        if connection.dialect.name == 'postgresql':
+            # The hashes of the rows are summed on the server, so that the
+            # checksum does not depend on the order of the rows.
+            name = connection.dialect.identifier_preparer.quote(table_name)
+            return tuple((await connection.execute(text(
+                f'SELECT count(*), '
+                f'coalesce(sum(hashtext(t::text)::bigint), 0) '
+                f'FROM {name} AS t'))).one())
+        count = checksum = 0
+        for row in await connection.execute(
+                select(literal_column('*')).select_from(table(table_name))):
+            count += 1
+            checksum = (checksum + hash(tuple(row))) % CHECKSUM_MODULUS
+        return count, checksum
+
+    async def poll(self) -> None:
+        """Function to publish the tables whose fingerprint changed."""
+        async with self.engine.connect() as connection:
+            for table_name in sorted(self.bus.tables):
+                fingerprint = await self.fingerprint(connection, table_name)
+                previous = self._fingerprints.get(table_name)
+                self._fingerprints[table_name] = fingerprint
+                if previous is not None and previous != fingerprint:
+                    await self.publish(table_name, 'poll')
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.poll()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('Change polling failed')
+            await asyncio.sleep(self.interval)
+
+
+async def create_change_listener(
+    engine: AsyncEngine,
+    mode: str,
+    channel: str,
+    interval: float,
+) -> Optional[ChangeListener]:
+    """Function to create the listener for the configured mode.
+    Args:
+        engine (AsyncEngine): Engine of the primary database.
+        mode (str): One of auto, notify, poll and off. Auto uses
+            notifications on PostgreSQL when every watched table has its
+            trigger, and polling otherwise.
+        channel (str): Notification channel.
+        interval (float): Seconds between two polls.
+    Returns:
+        ChangeListener: Listener, or None when disabled.
+    """
+    if mode == 'auto':
+        mode = 'poll'
+        if engine.dialect.name == 'postgresql':
+            missing = await missing_notify_triggers(
+                engine, invalidation_bus.tables)
+            if missing:
+                logger.warning(
+                    'Polling for table changes, as %s have no '
+                    'notification trigger', ', '.join(sorted(missing)))
+            else:
+                mode = 'notify'
+    if mode == 'notify':
+        return NotifyChangeListener(
+            engine, invalidation_bus, channel=channel)
+    if mode == 'poll':
+        return PollingChangeListener(
+            engine, invalidation_bus, interval=interval)
+    return None
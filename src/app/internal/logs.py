@@ -0,0 +1,278 @@
+"""Module that configures logging without blocking the event loop.
+
+Records are put on a queue by the handler of the root logger and written by
+a listener thread, so the event loop never waits for the output stream.
+Only the message is rendered before a record is queued; formatting, JSON
+encoding and writing happen on the listener thread.
+
+Loggers can be sampled by name, keeping a fraction of their records below
+WARNING, and SQL statements are logged by engine events in one of three
+modes: off, slow (statements slower than a threshold) or sample (a
+fraction of all statements). Every record logged while a request is served
+carries the request id that the access log middleware assigns.
+
+Attributes:
+    request_id (ContextVar[str]): Id of the request being served.
+"""
+import datetime
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import time
+import uuid
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Optional
+
+from sqlalchemy import Engine, event
+
+from app.internal.config import AppSettings
+
+request_id: ContextVar[str] = ContextVar('request_id', default='')
+sql_logger = logging.getLogger('app.sql')
+access_logger = logging.getLogger('app.access')
+RECORD_ATTRIBUTES = frozenset(
+    logging.LogRecord('', 0, '', 0, '', None, None).__dict__) | {'message'}
+
+Scope = dict[str, Any]
+Message = dict[str, Any]
+Receive = Callable[[], Awaitable[Message]]
+Send = Callable[[Message], Awaitable[None]]
+ASGIApp = Callable[[Scope, Receive, Send], Awaitable[None]]
+
+
+class JSONFormatter(logging.Formatter):
+    """Formatter that writes a record and its extra fields as JSON."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: dict[str, Any] = {
+            'time': datetime.datetime.fromtimestamp(
+                record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update(
+            (key, value) for key, value in record.__dict__.items()
+            if key not in RECORD_ATTRIBUTES and value != ''
+        )
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Filter that keeps a fraction of the records of some loggers.
+
+    Records at WARNING and above are always kept.
+    Attributes:
+        rates (dict[str, float]): Fraction of the records to keep for each
+            logger name, matched against the longest prefix.
+    """
+
+    def __init__(self, rates: dict[str, float]) -> None:
+        super().__init__()
+        self.rates = rates
+
+    def rate(self, name: str) -> float:
+        while True:
+            if name in self.rates:
+                return self.rates[name]
+            if '.' not in name:
+                return self.rates.get('', 1)
+            name = name.rsplit('.', 1)[0]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        return random.random() < self.rate(record.name)
+
+
+class RequestIdFilter(logging.Filter):
+    """Filter that adds the id of the current request to the records."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, 'request_id'):
+            record.request_id = request_id.get()
+        return True
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Handler that queues records with only their message rendered."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Render the message now, since the arguments may change once the
+        # caller continues, and leave the formatting to the listener.
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class SQLLogger:
+    """Class that logs SQL statements from engine events.
+    Attributes:
+        mode (str): off, slow or sample.
+        threshold (float): Seconds above which a statement is slow.
+        rate (float): Fraction of the statements logged in sample mode.
+    """
+
+    def __init__(self, mode: str, threshold: float, rate: float) -> None:
+        self.mode = mode
+        self.threshold = threshold
+        self.rate = rate
+
+    def install(self) -> None:
+        if self.mode in ('slow', 'sample'):
+            event.listen(Engine, 'before_cursor_execute', self.before)
+            event.listen(Engine, 'after_cursor_execute', self.after)
+            event.listen(Engine, 'handle_error', self.handle_error)
+
+    def remove(self) -> None:
+        if event.contains(Engine, 'before_cursor_execute', self.before):
+            event.remove(Engine, 'before_cursor_execute', self.before)
+            event.remove(Engine, 'after_cursor_execute', self.after)
+            event.remove(Engine, 'handle_error', self.handle_error)
+
+    def before(self, connection: Any, cursor: Any, statement: str,
+               parameters: Any, context: Any, executemany: bool) -> None:
+        connection.info.setdefault('query_started', []).append(
+            time.perf_counter())
+
+    def after(self, connection: Any, cursor: Any, statement: str,
+              parameters: Any, context: Any, executemany: bool) -> None:
+        duration = time.perf_counter() - \
+            connection.info['query_started'].pop()
+        if self.mode == 'slow' and duration < self.threshold:
+            return
+        if self.mode == 'sample' and random.random() >= self.rate:
+            return
+        sql_logger.info(
+            'SQL statement took %.1f ms', duration * 1000,
+            extra={
+                'statement': statement,
+                'duration_ms': round(duration * 1000, 3),
+                'rows': cursor.rowcount,
+                'host': connection.engine.url.host,
+            },
+        )
+
+    def handle_error(self, context: Any) -> None:
+        # A failed statement never reaches after_cursor_execute, so its start
+        # time is dropped here.
+        if context.connection is None:
+            return
+        started = context.connection.info.get('query_started')
+        if started:
+            started.pop()
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_handler: Optional[logging.Handler] = None
+_sql_logger: Optional[SQLLogger] = None
+
+
+def configure_logging(settings: AppSettings) -> None:
+    """Function to route the logs through the queue and the listener.
+
+    Calling it again replaces the previous configuration.
+    Args:
+        settings (AppSettings): Application settings.
+    """
+    global _listener, _handler, _sql_logger
+    shutdown_logging()
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    if settings.LOG_FORMAT == 'json':
+        stream_handler.setFormatter(JSONFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter(
+            '%(asctime)s %(levelname)s %(name)s [%(request_id)s] '
+            '%(message)s',
+        ))
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    _handler = NonBlockingQueueHandler(log_queue)
+    _handler.addFilter(RequestIdFilter())
+    _handler.addFilter(SamplingFilter(settings.LOG_SAMPLING))
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    _listener.start()
+
+    root_logger = logging.getLogger()
+    root_logger.addHandler(_handler)
+    root_logger.setLevel(settings.LOG_LEVEL)
+    # Statements are logged by SQLLogger instead of the engines.
+    logging.getLogger('sqlalchemy.engine').setLevel(logging.WARNING)
+    sql_logger.setLevel(logging.INFO)
+    access_logger.setLevel(logging.INFO)
+
+    _sql_logger = SQLLogger(
+        settings.SQL_LOG_MODE,
+        settings.SQL_LOG_SLOW_THRESHOLD,
+        settings.SQL_LOG_SAMPLE_RATE,
+    )
+    _sql_logger.install()
+
+
+def shutdown_logging() -> None:
+    """Function to write the queued records and remove the handler."""
+    global _listener, _handler, _sql_logger
+    if _sql_logger is not None:
+        _sql_logger.remove()
+        _sql_logger = None
+    if _handler is not None:
+        logging.getLogger().removeHandler(_handler)
+        _handler = None
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class AccessLogMiddleware:
+    """Middleware that assigns request ids and logs every request.
+
+    The id is taken from the X-Request-ID header when the client sends
+    one and is returned in the same header.
+    Attributes:
+        app (ASGIApp): Wrapped application.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) \
+            -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        current_id = dict(scope['headers']).get(
+            b'x-request-id', b'').decode('latin-1')[:64] or uuid.uuid4().hex
+        token = request_id.set(current_id)
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_with_id(message: Message) -> None:
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+                message['headers'] = [
+                    *message.get('headers', []),
+                    (b'x-request-id', current_id.encode('latin-1')),
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            access_logger.info(
+                '%s %s %d', scope['method'], scope['path'], status_code,
+                extra={
+                    'method': scope['method'],
+                    'path': scope['path'],
+                    'query': scope['query_string'].decode('latin-1'),
+                    'status': status_code,
+                    'duration_ms': round(
+                        (time.perf_counter() - started) * 1000, 3),
+                },
+            )
+            request_id.reset(token)
@@ -0,0 +1,162 @@
+"""Module that measures the lag of the event loop and reports blocking calls.
+
+The lag monitor is a task that sleeps for a fixed interval and records how
+much later than asked it wakes up. Synchronous work running on the loop,
+such as a holiday calendar lookup or the validation of a large model,
+delays the wake up by the time it runs, so the lag is how long a request
+arriving at that moment waits before the loop serves it. The percentiles of
+the recent lags are exposed on the metrics endpoint.
+
+In debug mode, enabled by a blocking threshold, a watchdog thread keeps
+scheduling a callback on the loop. When the callback has not run after the
+threshold, a coroutine step is still holding the loop, and the watchdog
+logs the stack of the loop thread, which shows the code of that step while
+it runs. Every blocking step is reported once.
+"""
+import asyncio
+import collections
+import contextlib
+import logging
+import math
+import sys
+import threading
+import time
+import traceback
+from typing import Optional
+
+from app.internal.metrics import Metric, Sample
+
+logger = logging.getLogger(__name__)
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class LoopLagMonitor:
+    """Class that measures the lag of the running event loop.
+    Attributes:
+        interval (float): Seconds between two measurements.
+        blocking_threshold (float): Seconds a coroutine step may hold the
+            loop before its stack is logged, or None to disable the
+            watchdog.
+        lags (deque[float]): Most recent lags in seconds.
+        count (int): Number of measurements since the start.
+        total (float): Sum of the lags since the start.
+        blocked (int): Number of blocking steps reported.
+    """
+
+    def __init__(
+        self,
+        interval: float = 0.1,
+        window: int = 600,
+        blocking_threshold: Optional[float] = None,
+    ) -> None:
+        self.interval = interval
+        self.blocking_threshold = blocking_threshold
+        self.lags: collections.deque[float] = collections.deque(
+            maxlen=window)
+        self.count = 0
+        self.total = 0.0
+        self.blocked = 0
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    async def start(self) -> None:
+        """Function to start measuring the loop this is awaited on."""
+        self._task = asyncio.create_task(
+            self._run(), name='loop-lag-monitor')
+        if self.blocking_threshold is not None:
+            self._stopped.clear()
+            self._watchdog = threading.Thread(
+                target=self._watch,
+                args=(asyncio.get_running_loop(), threading.get_ident()),
+                name='loop-watchdog',
+                daemon=True,
+            )
+            self._watchdog.start()
+
+    async def stop(self) -> None:
+        if self._watchdog is not None:
+            self._stopped.set()
+            self._watchdog.join()
+            self._watchdog = None
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - started - self.interval)
+            self.lags.append(lag)
+            self.count += 1
+            self.total += lag
+
+    def _watch(self, loop: asyncio.AbstractEventLoop, thread_id: int) -> None:
+        threshold = self.blocking_threshold or 0.0
+        poll = threshold / 4
+        while not self._stopped.wait(poll):
+            answered = threading.Event()
+            scheduled = time.perf_counter()
+            try:
+                loop.call_soon_threadsafe(answered.set)
+            except RuntimeError:
+                return
+            reported = False
+            while not answered.wait(poll):
+                if self._stopped.is_set():
+                    return
+                blocked = time.perf_counter() - scheduled
+                if blocked >= threshold and not reported:
+                    reported = True
+                    self.blocked += 1
+                    frame = sys._current_frames().get(thread_id)
+                    logger.warning(
+                        'Event loop blocked for more than %.0f ms at\n%s',
+                        blocked * 1000,
+                        ''.join(traceback.format_stack(frame)).rstrip(),
+                    )
+
+    def percentiles(self) -> dict[float, float]:
+        """Function to get the percentiles of the recent lags.
+        Returns:
+            dict[float, float]: Lag in seconds of each quantile, empty
+                before the first measurement.
+        """
+        lags = sorted(self.lags)
+        if not lags:
+            return {}
+        return {
+            quantile: lags[max(0, math.ceil(quantile * len(lags)) - 1)]
+            for quantile in QUANTILES
+        }
+
+    def collect(self) -> list[Metric]:
+        """Function to get the metrics of the monitor.
+        Returns:
+            list[Metric]: Lag summary, maximum recent lag and blocking
+                steps reported.
+        """
+        name = 'hyuabot_event_loop_lag_seconds'
+        samples = [
+            Sample(name, {'quantile': str(quantile)}, lag)
+            for quantile, lag in self.percentiles().items()
+        ]
+        samples.append(Sample(f'{name}_sum', {}, self.total))
+        samples.append(Sample(f'{name}_count', {}, self.count))
+        return [
+            Metric(name, 'summary',
+                   'Delay of the event loop in waking up a sleeping task.',
+                   samples),
+            Metric('hyuabot_event_loop_lag_max_seconds', 'gauge',
+                   'Largest recent delay of the event loop.',
+                   [Sample('hyuabot_event_loop_lag_max_seconds', {},
+                           max(self.lags, default=0.0))]),
+            Metric('hyuabot_event_loop_blocked_total', 'counter',
+                   'Coroutine steps that held the event loop longer than '
+                   'the blocking threshold.',
+                   [Sample('hyuabot_event_loop_blocked_total', {},
+                           self.blocked)]),
+        ]
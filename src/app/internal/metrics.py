@@ -0,0 +1,127 @@
+"""Module that exposes the metrics of a worker in the Prometheus format.
+
+Components register a collector, a function returning metric families, and
+the metrics endpoint renders the families of every collector when it is
+scraped, so nothing is computed between two scrapes. The endpoint is only
+added to the app when METRICS_ENABLED is set, and every worker answers
+with its own metrics.
+
+Attributes:
+    metrics_registry (MetricsRegistry): Registry of the app.
+"""
+from typing import Callable, NamedTuple
+
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Sample(NamedTuple):
+    """Class that holds one value of a metric.
+    Attributes:
+        name (str): Name of the sample, such as the metric name followed
+            by _sum or _count.
+        labels (dict[str, str]): Labels of the sample.
+        value (float): Value of the sample.
+    """
+    name: str
+    labels: dict[str, str]
+    value: float
+
+
+class Metric(NamedTuple):
+    """Class that holds a metric family.
+    Attributes:
+        name (str): Name of the metric.
+        kind (str): gauge, counter or summary.
+        description (str): Help text of the metric.
+        samples (list[Sample]): Values of the metric.
+    """
+    name: str
+    kind: str
+    description: str
+    samples: list[Sample]
+
+
+Collector = Callable[[], list[Metric]]
+
+
+def format_value(value: float) -> str:
+    if value != value:
+        return 'NaN'
+    if value in (float('inf'), float('-inf')):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+
+def format_labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ''
+    pairs = ','.join(
+        '{}="{}"'.format(key, value.replace('\\', r'\\')
+                         .replace('\n', r'\n').replace('"', r'\"'))
+        for key, value in labels.items()
+    )
+    return f'{{{pairs}}}'
+
+
+def render_metrics(metrics: list[Metric]) -> str:
+    """Function to render metric families in the text exposition format.
+    Args:
+        metrics (list[Metric]): Metric families to render.
+    Returns:
+        str: Rendered metrics.
+    """
+    lines = []
+    for metric in metrics:
+        lines.append(f'# HELP {metric.name} {metric.description}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        lines.extend(
+            f'{sample.name}{format_labels(sample.labels)} '
+            f'{format_value(sample.value)}'
+            for sample in metric.samples
+        )
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsRegistry:
+    """Class that holds the collectors of the metrics endpoint."""
+
+    def __init__(self) -> None:
+        self._collectors: list[Collector] = []
+
+    def register(self, collector: Collector) -> None:
+        if collector not in self._collectors:
+            self._collectors.append(collector)
+
+    def unregister(self, collector: Collector) -> None:
+        if collector in self._collectors:
+            self._collectors.remove(collector)
+
+    def collect(self) -> list[Metric]:
+        """Function to get the metric families of every collector.
+        Returns:
+            list[Metric]: Metric families in the order of registration.
+        """
+        return [
+            metric
+            for collector in self._collectors
+            for metric in collector()
+        ]
+
+
+metrics_registry = MetricsRegistry()
+
+
+async def metrics_endpoint(request: Request) -> PlainTextResponse:
+    """Function to render the metrics of the worker.
+    Args:
+        request (Request): Scrape request.
+    Returns:
+        PlainTextResponse: Metrics in the text exposition format.
+    """
+    return PlainTextResponse(
+        render_metrics(metrics_registry.collect()),
+        media_type=CONTENT_TYPE,
+    )
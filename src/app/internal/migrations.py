@@ -0,0 +1,207 @@
+"""Module that applies versioned schema migrations to the database.
+
+The tables are owned by the updaters that fill them, so this service only
+migrates what it needs for its own reads, such as the indexes of the hot
+lookup paths. Those indexes are declared in the ``__table_args__`` of the
+models next to the columns they cover, which also creates them in every
+database built from the models, and each migration refers to them instead
+of repeating their columns.
+
+Applied versions are recorded in the schema_migration table. Every run
+holds a transaction-scoped advisory lock on PostgreSQL, so workers starting
+together apply each migration once, and a migration is recorded in the
+transaction that applies it.
+"""
+import argparse
+import asyncio
+import datetime
+from typing import NamedTuple, Optional
+
+from sqlalchemy import Column, DateTime, Index, Integer, MetaData, String, \
+    Table, delete, insert, select, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+from sqlalchemy.schema import CreateIndex, DropIndex, ExecutableDDLElement
+
+from app.internal.scheduler import lock_key
+from app.model.bus import BusTimetableItem
+from app.model.cafeteria import Menu
+from app.model.shuttle import ShuttlePeriod, ShuttleTimetableItem
+from app.model.subway import TimetableItem
+
+
+class Migration(NamedTuple):
+    """Class that holds a version of the schema.
+    Attributes:
+        version (int): Version, applied in ascending order.
+        description (str): Description of the change.
+        upgrade (tuple[ExecutableDDLElement, ...]): Statements applying the
+            change.
+        downgrade (tuple[ExecutableDDLElement, ...]): Statements reverting
+            the change, in order.
+    """
+    version: int
+    description: str
+    upgrade: tuple[ExecutableDDLElement, ...]
+    downgrade: tuple[ExecutableDDLElement, ...]
+
+
+def index_migration(
+    version: int,
+    description: str,
+    *indexes: Index,
+) -> Migration:
+    """Function to create a migration that adds indexes of the models.
+    Args:
+        version (int): Version of the migration.
+        description (str): Description of the change.
+        *indexes (Index): Indexes declared on the models.
+    Returns:
+        Migration: Migration creating the indexes that do not exist yet and
+            dropping them when reverted.
+    """
+    return Migration(
+        version,
+        description,
+        tuple(CreateIndex(index, if_not_exists=True) for index in indexes),
+        tuple(
+            DropIndex(index, if_exists=True) for index in reversed(indexes)
+        ),
+    )
+
+
+def model_index(model: type, name: str) -> Index:
+    return next(
+        index for index in model.__table__.indexes if index.name == name)
+
+
+migration_metadata = MetaData()
+schema_migration = Table(
+    'schema_migration', migration_metadata,
+    Column('version', Integer, primary_key=True),
+    Column('description', String(200)),
+    Column('applied_at', DateTime),
+)
+MIGRATIONS: tuple[Migration, ...] = (
+    index_migration(
+        1, 'Index the hot lookup paths',
+        model_index(ShuttleTimetableItem, 'ix_shuttle_timetable_stop'),
+        model_index(BusTimetableItem, 'ix_bus_timetable_route_start_stop'),
+        model_index(TimetableItem, 'ix_subway_timetable_station'),
+        model_index(Menu, 'ix_menu_restaurant_date'),
+        model_index(ShuttlePeriod, 'ix_shuttle_period_range'),
+    ),
+)
+
+
+async def _prepare(connection: AsyncConnection) -> set[int]:
+    if connection.dialect.name == 'postgresql':
+        await connection.execute(
+            text('SELECT pg_advisory_xact_lock(:key)'),
+            {'key': lock_key('schema_migration')},
+        )
+    await connection.run_sync(migration_metadata.create_all)
+    return set((await connection.execute(
+        select(schema_migration.c.version))).scalars())
+
+
+async def applied_versions(engine: AsyncEngine) -> set[int]:
+    """Function to get the versions applied to the database.
+    Args:
+        engine (AsyncEngine): Engine of the primary database.
+    Returns:
+        set[int]: Applied versions.
+    """
+    async with engine.begin() as connection:
+        return await _prepare(connection)
+
+
+async def upgrade(
+    engine: AsyncEngine,
+    target: Optional[int] = None,
+    migrations: tuple[Migration, ...] = MIGRATIONS,
+) -> list[int]:
+    """Function to apply the pending migrations.
+    Args:
+        engine (AsyncEngine): Engine of the primary database.
+        target (int): Last version to apply, or None for every version.
+        migrations (tuple[Migration, ...]): Migrations to choose from.
+    Returns:
+        list[int]: Versions applied by this call, in order.
+    """
+    applied: list[int] = []
+    async with engine.begin() as connection:
+        versions = await _prepare(connection)
+        for migration in sorted(migrations, key=lambda item: item.version):
+            if migration.version in versions or \
+                    (target is not None and migration.version > target):
+                continue
+            for statement in migration.upgrade:
+                await connection.execute(statement)
+            await connection.execute(insert(schema_migration).values(
+                version=migration.version,
+                description=migration.description,
+                applied_at=datetime.datetime.now(),
+            ))
+            applied.append(migration.version)
+    return applied
+
+
+async def downgrade(
+    engine: AsyncEngine,
+    target: int,
+    migrations: tuple[Migration, ...] = MIGRATIONS,
+) -> list[int]:
+    """Function to revert the migrations after a version.
+    Args:
+        engine (AsyncEngine): Engine of the primary database.
+        target (int): Last version to keep, zero to revert every version.
+        migrations (tuple[Migration, ...]): Migrations to choose from.
+    Returns:
+        list[int]: Versions reverted by this call, in order.
+    """
+    reverted: list[int] = []
+    async with engine.begin() as connection:
+        versions = await _prepare(connection)
+        for migration in sorted(
+                migrations, key=lambda item: item.version, reverse=True):
+            if migration.version not in versions or \
+                    migration.version <= target:
+                continue
+            for statement in migration.downgrade:
+                await connection.execute(statement)
+            await connection.execute(delete(schema_migration).where(
+                schema_migration.c.version == migration.version))
+            reverted.append(migration.version)
+    return reverted
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Migrate the schema of the primary database.')
+    parser.add_argument(
+        'command', choices=('upgrade', 'downgrade', 'status'),
+        help='Apply, revert or list the migrations.')
+    parser.add_argument(
+        '--target', type=int, default=None,
+        help='Last version to apply or keep.')
+    arguments = parser.parse_args()
+
+    from app.dependancies.database import engine
+
+    async def run() -> None:
+        if arguments.command == 'upgrade':
+            print('Applied', await upgrade(engine, arguments.target))
+        elif arguments.command == 'downgrade':
+            print('Reverted', await downgrade(engine, arguments.target or 0))
+        else:
+            versions = await applied_versions(engine)
+            for migration in MIGRATIONS:
+                state = 'applied' if migration.version in versions \
+                    else 'pending'
+                print(migration.version, state, migration.description)
+        await engine.dispose()
+    asyncio.run(run())
+
+
+if __name__ == '__main__':
+    main()
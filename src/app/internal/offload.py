@@ -0,0 +1,142 @@
+"""Module that builds large responses off the event loop.
+
+Queries covering the whole network, such as every subway timetable or the
+shuttle departures of every stop, build thousands of response objects.
+Built on the event loop, they hold it for tens of milliseconds and stall
+the realtime requests served at the same time. Their read paths fetch
+plain tuples from the database and hand them to a builder function. The
+builder runs inline for small payloads and in a bounded pool once the
+number of rows reaches the threshold.
+
+Two pools are available:
+
+    thread   Builders share the interpreter with the event loop, which
+             still runs between their bytecodes, so the loop stalls for
+             the switch interval at most instead of the whole build.
+    process  Builders run in parallel in spawned processes. Arguments and
+             results are pickled, so it pays off for builders that turn
+             compact tuples into rendered bytes.
+
+Builders must be module-level functions taking picklable arguments so that
+both pools can run them. The GraphQL router also encodes the result of an
+operation in the pool when its query functions built that many rows.
+
+Attributes:
+    response_offloader (ResponseOffloader): Offloader of the app.
+"""
+import asyncio
+import concurrent.futures
+import functools
+import multiprocessing
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from typing import Any, Callable, Iterator, Optional, TypeVar
+
+from app.internal.config import AppSettings
+from app.internal.tracing import tracer
+
+T = TypeVar('T')
+_tally: ContextVar[Optional[list[int]]] = \
+    ContextVar('offload_tally', default=None)
+
+
+class ResponseOffloader:
+    """Class that runs response builders inline or in a bounded pool.
+    Attributes:
+        mode (str): off, thread or process.
+        threshold (int): Number of rows from which a builder is offloaded.
+    """
+
+    def __init__(self) -> None:
+        self.mode = 'off'
+        self.threshold = 0
+        self._executor: Optional[concurrent.futures.Executor] = None
+
+    def configure(self, mode: str, workers: int, threshold: int) -> None:
+        """Function to change the pool of the offloader.
+        Args:
+            mode (str): off, thread or process.
+            workers (int): Maximum number of threads or processes.
+            threshold (int): Number of rows from which a builder is
+                offloaded.
+        """
+        if mode not in ('off', 'thread', 'process'):
+            raise ValueError(f'Unknown offload mode: {mode}')
+        self.shutdown()
+        self.mode = mode
+        self.threshold = threshold
+        if mode == 'thread':
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix='response-builder')
+        elif mode == 'process':
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+        self.mode = 'off'
+
+    def should_offload(self, rows: int) -> bool:
+        return self._executor is not None and rows >= self.threshold
+
+    async def run(
+        self,
+        function: Callable[..., T],
+        *args: Any,
+        rows: int,
+    ) -> T:
+        """Function to run a builder inline or in the pool.
+        Args:
+            function (Callable): Module-level builder.
+            *args (Any): Picklable arguments of the builder.
+            rows (int): Number of rows the builder works on.
+        Returns:
+            T: Result of the builder.
+        """
+        tally = _tally.get()
+        if tally is not None:
+            tally[0] += rows
+        if not self.should_offload(rows):
+            return function(*args)
+        with tracer.span('offload', {'offload.rows': rows}):
+            call = functools.partial(function, *args)
+            if self.mode == 'thread':
+                # Spans started by the builder belong to the request.
+                call = functools.partial(
+                    copy_context().run, call)
+            return await asyncio.get_running_loop().run_in_executor(
+                self._executor, call)
+
+    @contextmanager
+    def tally(self) -> Iterator[list[int]]:
+        """Function to count the rows built by the code running inside.
+
+        Builders run by tasks started inside the block are counted too.
+        Returns:
+            Iterator[list[int]]: List holding the number of rows.
+        """
+        rows = [0]
+        token = _tally.set(rows)
+        try:
+            yield rows
+        finally:
+            _tally.reset(token)
+
+
+response_offloader = ResponseOffloader()
+
+
+def configure_offload(settings: AppSettings) -> None:
+    """Function to configure the offloader from the settings.
+    Args:
+        settings (AppSettings): Application settings.
+    """
+    response_offloader.configure(
+        settings.RESPONSE_OFFLOAD_MODE,
+        workers=settings.RESPONSE_OFFLOAD_WORKERS,
+        threshold=settings.RESPONSE_OFFLOAD_THRESHOLD,
+    )
@@ -0,0 +1,203 @@
+"""Module that profiles single requests on demand.
+
+A request carrying the profiling token in the ``X-Profile`` header or the
+``profile`` query parameter runs under a profiler, from the first
+middleware through dependency resolution, the query functions, SQLAlchemy
+and the serialization of the response. The middleware is only installed
+when a token is configured, so requests cost nothing extra otherwise.
+
+Two profilers are available through the ``X-Profile-Mode`` header:
+
+    sample  (default) A thread samples the stack of the event loop thread
+            and writes the stacks in the folded format read by
+            flamegraph.pl, speedscope and inferno. Time the loop spends
+            waiting for the database shows up as the loop's select call.
+    trace   cProfile records every call and writes a pstats file.
+
+Both profilers see everything running on the event loop thread, so other
+requests served at the same time show up in the profile as well. Only one
+request is profiled at a time per worker, and caches are bypassed while
+profiling so the profile shows the work behind the response. The profile
+id is returned in the ``X-Profile-Id`` response header and the profile is
+written to the configured directory.
+"""
+import cProfile
+import collections
+import hmac
+import os
+import sys
+import threading
+import uuid
+from types import FrameType
+from typing import Any, Awaitable, Callable, Optional
+from urllib.parse import parse_qs
+
+from app.internal.cache import cache_bypass
+
+Scope = dict[str, Any]
+Message = dict[str, Any]
+Receive = Callable[[], Awaitable[Message]]
+Send = Callable[[Message], Awaitable[None]]
+ASGIApp = Callable[[Scope, Receive, Send], Awaitable[None]]
+
+
+def frame_name(frame: FrameType) -> str:
+    code = frame.f_code
+    module = frame.f_globals.get('__name__', os.path.basename(
+        code.co_filename))
+    return f'{module}:{code.co_qualname}'
+
+
+class StackSampler:
+    """Class that samples the stack of a thread in a background thread.
+    Attributes:
+        thread_id (int): Identifier of the sampled thread.
+        interval (float): Seconds between two samples.
+        stacks (Counter[str]): Number of samples of each folded stack.
+    """
+
+    def __init__(self, thread_id: int, interval: float) -> None:
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: collections.Counter[str] = collections.Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name='stack-sampler', daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            frame: Optional[FrameType] = \
+                sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                names.append(frame_name(frame))
+                frame = frame.f_back
+            if names:
+                self.stacks[';'.join(reversed(names))] += 1
+
+    def folded(self) -> str:
+        return ''.join(
+            f'{stack} {count}\n' for stack, count in self.stacks.items())
+
+
+class ProfilingMiddleware:
+    """Middleware that profiles the requests carrying the token.
+    Attributes:
+        app (ASGIApp): Wrapped application.
+        token (str): Token that enables profiling for a request.
+        directory (str): Directory the profiles are written to.
+        interval (float): Seconds between two samples of the sampler.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        token: str,
+        directory: str,
+        interval: float = 0.001,
+    ) -> None:
+        self.app = app
+        self.token = token
+        self.directory = directory
+        self.interval = interval
+        self._lock = threading.Lock()
+
+    def requested_mode(self, scope: Scope) -> Optional[str]:
+        """Function to get the profiler a request asks for.
+        Args:
+            scope (Scope): ASGI scope of the request.
+        Returns:
+            str: sample or trace, or None if the request is not profiled.
+        """
+        headers = dict(scope['headers'])
+        token = headers.get(b'x-profile', b'').decode('latin-1')
+        if not token and b'profile' in scope['query_string']:
+            query = parse_qs(scope['query_string'].decode('latin-1'))
+            token = query.get('profile', [''])[0]
+        if not hmac.compare_digest(token, self.token):
+            return None
+        mode = headers.get(b'x-profile-mode', b'sample').decode('latin-1')
+        return mode if mode in ('sample', 'trace') else 'sample'
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) \
+            -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        mode = self.requested_mode(scope)
+        if mode is None:
+            await self.app(scope, receive, send)
+            return
+        if not self._lock.acquire(blocking=False):
+            await self.app(
+                scope, receive, self._with_headers(send, busy='true'))
+            return
+        profile_id = uuid.uuid4().hex
+        bypass = cache_bypass.set(True)
+        try:
+            if mode == 'trace':
+                await self._trace(profile_id, scope, receive, send)
+            else:
+                await self._sample(profile_id, scope, receive, send)
+        finally:
+            cache_bypass.reset(bypass)
+            self._lock.release()
+
+    def profile_path(self, profile_id: str, mode: str) -> str:
+        extension = 'prof' if mode == 'trace' else 'folded'
+        return os.path.join(self.directory, f'{profile_id}.{extension}')
+
+    def _with_headers(self, send: Send, **headers: str) -> Send:
+        async def wrapper(message: Message) -> None:
+            if message['type'] == 'http.response.start':
+                message['headers'] = [
+                    *message.get('headers', []),
+                    *(
+                        (f'x-profile-{name}'.encode(), value.encode())
+                        for name, value in headers.items()
+                    ),
+                ]
+            await send(message)
+        return wrapper
+
+    async def _sample(
+        self,
+        profile_id: str,
+        scope: Scope,
+        receive: Receive,
+        send: Send,
+    ) -> None:
+        sampler = StackSampler(threading.get_ident(), self.interval)
+        sampler.start()
+        try:
+            await self.app(
+                scope, receive, self._with_headers(send, id=profile_id))
+        finally:
+            sampler.stop()
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.profile_path(profile_id, 'sample'), 'w') as file:
+                file.write(sampler.folded())
+
+    async def _trace(
+        self,
+        profile_id: str,
+        scope: Scope,
+        receive: Receive,
+        send: Send,
+    ) -> None:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            await self.app(
+                scope, receive, self._with_headers(send, id=profile_id))
+        finally:
+            profiler.disable()
+            os.makedirs(self.directory, exist_ok=True)
+            profiler.dump_stats(self.profile_path(profile_id, 'trace'))
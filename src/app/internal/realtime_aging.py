@@ -0,0 +1,61 @@
+"""Module that ages realtime arrivals by the time since their update.
+
+The bus and subway feeds store the minutes and stops left at the moment of
+their last update. Serving them as stored makes every cached response wrong
+as soon as the feed is a minute old, so the arrivals are aged when a
+response is built: the whole minutes elapsed since the update are taken off
+the minutes left, the stops left shrink in proportion, and an arrival whose
+minutes ran out is dropped as it has already arrived. Arrivals of a feed
+older than REALTIME_STALE_AFTER seconds are flagged as stale.
+"""
+import datetime
+from typing import NamedTuple, Optional
+
+from app.internal.config import AppSettings
+
+app_settings = AppSettings()
+
+
+class AgedArrival(NamedTuple):
+    """Class that holds a realtime arrival aged to the current time.
+    Attributes:
+        minutes (int): Minutes left now.
+        stops (int): Stops left now, or None when the feed has no stops.
+        stale (bool): Whether the feed is older than the stale threshold.
+    """
+    minutes: int
+    stops: Optional[int]
+    stale: bool
+
+
+def age_arrival(
+    minutes: int,
+    stops: Optional[int],
+    updated_at: datetime.datetime,
+    now: datetime.datetime,
+    stale_after: Optional[float] = None,
+) -> Optional[AgedArrival]:
+    """Function to age a realtime arrival to the current time.
+    Args:
+        minutes (int): Minutes left at the update.
+        stops (int): Stops left at the update, or None.
+        updated_at (datetime.datetime): Time of the update.
+        now (datetime.datetime): Current time, in the timezone of the feed.
+        stale_after (float): Seconds after which the feed is stale, or None
+            for REALTIME_STALE_AFTER.
+    Returns:
+        AgedArrival: Arrival aged to now, or None when it has arrived.
+    """
+    if stale_after is None:
+        stale_after = app_settings.REALTIME_STALE_AFTER
+    # The age counts from the start of the minute, so that every response
+    # cached or built in the same minute bucket shows the same numbers, and
+    # a feed updated after that, from a clock ahead of ours, is not aged.
+    start = now.replace(second=0, microsecond=0)
+    age = max((start - updated_at).total_seconds(), 0)
+    left = minutes - int(age // 60)
+    if left < 0:
+        return None
+    if stops is not None and minutes > 0:
+        stops = -(-stops * left // minutes)
+    return AgedArrival(left, stops, age > stale_after)
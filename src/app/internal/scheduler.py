@@ -0,0 +1,494 @@
+"""Module that runs periodic jobs inside every worker.
+
+Modules register their jobs when they are imported, with an interval in
+seconds or a cron expression evaluated in Korea Standard Time, and the
+scheduler started on startup runs every job in its own task until
+shutdown. A job runs again only after its previous run finished, and an
+optional jitter delays each run by a random number of seconds so that the
+workers do not hit the database at the same moment.
+
+Jobs that keep the state of a worker, such as its local caches, run in
+every worker. Singleton jobs refresh state shared by every worker and only
+run on the leader. On PostgreSQL the leader is the worker holding a session
+advisory lock on a connection it keeps open, so another worker takes over
+when the leader's connection is lost; elsewhere, and in the tests, a lock
+inside the process stands in for it. Workers that are not the leader skip
+singleton runs, which is counted in the job metrics.
+
+Attributes:
+    scheduler (Scheduler): Scheduler of the app.
+"""
+import abc
+import asyncio
+import contextlib
+import datetime
+import hashlib
+import logging
+import random
+import time
+from typing import Any, Awaitable, Callable, Optional, TypeVar
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from app.internal.config import AppSettings
+from app.internal.metrics import Metric, Sample
+from app.internal.tracing import tracer
+
+logger = logging.getLogger(__name__)
+KST = datetime.timezone(datetime.timedelta(hours=9))
+JobFunction = Callable[[], Awaitable[Any]]
+F = TypeVar('F', bound=JobFunction)
+
+
+class Schedule(abc.ABC):
+    """Class that tells when a job runs next."""
+
+    @abc.abstractmethod
+    def next_after(self, moment: datetime.datetime) -> datetime.datetime:
+        """Function to get the first run after a moment.
+        Args:
+            moment (datetime.datetime): Aware moment to start from.
+        Returns:
+            datetime.datetime: Moment of the next run.
+        """
+
+
+class IntervalSchedule(Schedule):
+    """Class that runs a job at a fixed interval.
+    Attributes:
+        seconds (float): Seconds between the end of a run and the next.
+    """
+
+    def __init__(self, seconds: float) -> None:
+        if seconds <= 0:
+            raise ValueError('Interval must be positive')
+        self.seconds = seconds
+
+    def next_after(self, moment: datetime.datetime) -> datetime.datetime:
+        return moment + datetime.timedelta(seconds=self.seconds)
+
+
+class CronSchedule(Schedule):
+    """Class that runs a job at the minutes matching a cron expression.
+
+    The expression has the five fields minute, hour, day of month, month
+    and day of week (0 or 7 is Sunday), each a list of ``*``, values and
+    ranges with an optional ``/step``. As in cron, a day matches either
+    field when both the day of month and the day of week are restricted.
+    Attributes:
+        expression (str): Cron expression.
+        timezone (datetime.tzinfo): Time zone the expression is read in.
+    """
+    FIELDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+    def __init__(
+        self,
+        expression: str,
+        timezone: datetime.tzinfo = KST,
+    ) -> None:
+        self.expression = expression
+        self.timezone = timezone
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f'Cron expression needs 5 fields: {expression}')
+        minutes, hours, days, months, weekdays = (
+            self._parse(field, *limits)
+            for field, limits in zip(fields, self.FIELDS)
+        )
+        self.minutes = sorted(minutes)
+        self.hours = sorted(hours)
+        self.days = days
+        self.months = months
+        # Sunday is 0 in cron and 6 for datetime.weekday.
+        self.weekdays = {(weekday - 1) % 7 for weekday in weekdays}
+        self._any_day = fields[2].startswith('*')
+        self._any_weekday = fields[4].startswith('*')
+
+    @staticmethod
+    def _parse(field: str, low: int, high: int) -> set[int]:
+        values: set[int] = set()
+        for part in field.split(','):
+            value_range, _, step = part.partition('/')
+            try:
+                if value_range == '*':
+                    start, end = low, high
+                elif '-' in value_range:
+                    start, end = map(int, value_range.split('-', 1))
+                else:
+                    start = end = int(value_range)
+                    if step:
+                        end = high
+                increment = int(step) if step else 1
+            except ValueError:
+                raise ValueError(f'Invalid cron field: {field}') from None
+            if not low <= start <= end <= high or increment <= 0:
+                raise ValueError(f'Invalid cron field: {field}')
+            values.update(range(start, end + 1, increment))
+        return values
+
+    def matches_day(self, day: datetime.date) -> bool:
+        if day.month not in self.months:
+            return False
+        day_matches = day.day in self.days
+        weekday_matches = day.weekday() in self.weekdays
+        if self._any_day or self._any_weekday:
+            return day_matches and weekday_matches
+        return day_matches or weekday_matches
+
+    def next_after(self, moment: datetime.datetime) -> datetime.datetime:
+        moment = moment.astimezone(self.timezone).replace(
+            second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        day = moment.date()
+        # Every day and month combination appears within eight years.
+        for _ in range(366 * 8):
+            if self.matches_day(day):
+                earliest = (moment.hour, moment.minute) \
+                    if day == moment.date() else (0, 0)
+                for hour in self.hours:
+                    for minute in self.minutes:
+                        if (hour, minute) >= earliest:
+                            return datetime.datetime.combine(
+                                day, datetime.time(hour, minute),
+                                tzinfo=self.timezone,
+                            )
+            day += datetime.timedelta(days=1)
+        raise ValueError(f'Cron expression never matches: {self.expression}')
+
+
+class LeaderElection(abc.ABC):
+    """Class that elects the worker running the singleton jobs."""
+
+    @abc.abstractmethod
+    async def campaign(self) -> bool:
+        """Function to become or stay the leader.
+        Returns:
+            bool: Whether this worker is the leader.
+        """
+
+    @abc.abstractmethod
+    async def resign(self) -> None:
+        """Function to let another worker become the leader."""
+
+
+class LocalElection(LeaderElection):
+    """Class that elects the leader among the schedulers of the process.
+    Attributes:
+        name (str): Name of the lock.
+    """
+    _leaders: dict[str, 'LocalElection'] = {}
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    async def campaign(self) -> bool:
+        return self._leaders.setdefault(self.name, self) is self
+
+    async def resign(self) -> None:
+        if self._leaders.get(self.name) is self:
+            del self._leaders[self.name]
+
+
+def lock_key(name: str) -> int:
+    """Function to get the advisory lock key of a name.
+    Args:
+        name (str): Name of the lock.
+    Returns:
+        int: Signed 64-bit key.
+    """
+    return int.from_bytes(
+        hashlib.blake2b(name.encode('utf-8'), digest_size=8).digest(),
+        'big',
+        signed=True,
+    )
+
+
+class AdvisoryLockElection(LeaderElection):
+    """Class that elects the leader with a PostgreSQL advisory lock.
+
+    The lock belongs to the database session, so the leader keeps the
+    connection that took it out of the pool until it resigns, and the lock
+    is released by the server when that connection is lost.
+    Attributes:
+        engine (AsyncEngine): Engine of the primary database.
+        key (int): Key of the advisory lock.
+    """
+
+    def __init__(self, engine: AsyncEngine, name: str) -> None:
+        self.engine = engine
+        self.key = lock_key(name)
+        self._connection: Optional[AsyncConnection] = None
+
+    async def campaign(self) -> bool:
+        if self._connection is not None:
+            try:
+                await self._connection.execute(text('SELECT 1'))
+                return True
+            except Exception:
+                logger.warning('Scheduler leader connection was lost',
+                               exc_info=True)
+                await self.resign()
+        connection = await self.engine.connect()
+        try:
+            await connection.execution_options(isolation_level='AUTOCOMMIT')
+            acquired = (await connection.execute(
+                text('SELECT pg_try_advisory_lock(:key)'),
+                {'key': self.key},
+            )).scalar()
+        except BaseException:
+            await connection.invalidate()
+            await connection.close()
+            raise
+        if not acquired:
+            await connection.close()
+            return False
+        logger.info('This worker is now the scheduler leader')
+        self._connection = connection
+        return True
+
+    async def resign(self) -> None:
+        connection, self._connection = self._connection, None
+        if connection is not None:
+            # Closing the database session releases the lock, and keeps a
+            # connection holding it from going back to the pool.
+            with contextlib.suppress(Exception):
+                await connection.invalidate()
+            await connection.close()
+
+
+def create_election(
+    settings: AppSettings,
+    engine: AsyncEngine,
+) -> LeaderElection:
+    """Function to create the leader election of the settings.
+    Args:
+        settings (AppSettings): Application settings.
+        engine (AsyncEngine): Engine of the primary database.
+    Returns:
+        LeaderElection: Advisory lock election on PostgreSQL, or a lock
+            inside the process.
+    """
+    mode = settings.SCHEDULER_ELECTION
+    if mode == 'auto':
+        mode = 'advisory' if engine.dialect.name == 'postgresql' else 'local'
+    if mode == 'advisory':
+        return AdvisoryLockElection(engine, settings.SCHEDULER_LOCK_NAME)
+    if mode == 'local':
+        return LocalElection(settings.SCHEDULER_LOCK_NAME)
+    raise ValueError(f'Unknown scheduler election: {mode}')
+
+
+class Job:
+    """Class that holds a registered job and its statistics.
+    Attributes:
+        name (str): Name of the job.
+        function (JobFunction): Coroutine function run by the job.
+        schedule (Schedule): When the job runs.
+        jitter (float): Maximum random delay in seconds of each run.
+        singleton (bool): Whether only the leader runs the job.
+        run_at_start (bool): Whether the job runs when the scheduler starts.
+        runs (int): Number of finished runs, failed ones included.
+        failures (int): Number of runs that raised an exception.
+        skipped (int): Number of runs skipped by workers not leading.
+        duration (float): Total seconds spent in the runs.
+        last_success (float): Unix time of the last successful run.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        function: JobFunction,
+        schedule: Schedule,
+        jitter: float = 0.0,
+        singleton: bool = False,
+        run_at_start: bool = False,
+    ) -> None:
+        self.name = name
+        self.function = function
+        self.schedule = schedule
+        self.jitter = jitter
+        self.singleton = singleton
+        self.run_at_start = run_at_start
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0
+        self.duration = 0.0
+        self.last_success = 0.0
+
+
+class Scheduler:
+    """Class that runs the registered jobs.
+    Attributes:
+        jobs (dict[str, Job]): Registered jobs by name.
+        election (LeaderElection): Election of the running scheduler.
+    """
+
+    def __init__(self) -> None:
+        self.jobs: dict[str, Job] = {}
+        self.election: Optional[LeaderElection] = None
+        self._tasks: list[asyncio.Task] = []
+        self._triggered: set[asyncio.Task] = set()
+
+    def add_job(
+        self,
+        name: str,
+        function: JobFunction,
+        interval: Optional[float] = None,
+        cron: Optional[str] = None,
+        jitter: float = 0.0,
+        singleton: bool = False,
+        run_at_start: bool = False,
+    ) -> Job:
+        """Function to register a job.
+        Args:
+            name (str): Unique name of the job.
+            function (JobFunction): Coroutine function to run.
+            interval (float): Seconds between two runs.
+            cron (str): Cron expression of the runs, instead of interval.
+            jitter (float): Maximum random delay in seconds of each run.
+            singleton (bool): Whether only the leader runs the job.
+            run_at_start (bool): Whether the job runs when the scheduler
+                starts.
+        Returns:
+            Job: Registered job.
+        """
+        if name in self.jobs:
+            raise ValueError(f'Job {name} is already registered')
+        if (interval is None) == (cron is None):
+            raise ValueError('Either interval or cron must be given')
+        schedule = IntervalSchedule(interval) if interval is not None \
+            else CronSchedule(cron or '')
+        job = Job(name, function, schedule, jitter=jitter,
+                  singleton=singleton, run_at_start=run_at_start)
+        self.jobs[name] = job
+        return job
+
+    def job(self, name: str, **kwargs: Any) -> Callable[[F], F]:
+        """Function to register the decorated coroutine function as a job.
+        Args:
+            name (str): Unique name of the job.
+            **kwargs (Any): Schedule of the job, as for add_job.
+        Returns:
+            Callable: Decorator that returns the function unchanged.
+        """
+        def decorator(function: F) -> F:
+            self.add_job(name, function, **kwargs)
+            return function
+        return decorator
+
+    async def start(self, election: LeaderElection) -> None:
+        """Function to start running every registered job.
+        Args:
+            election (LeaderElection): Election of the singleton jobs.
+        """
+        self.election = election
+        self._tasks = [
+            asyncio.create_task(self._run(job), name=f'job-{job.name}')
+            for job in self.jobs.values()
+        ]
+
+    def trigger(self, name: str) -> None:
+        """Function to run a job now, besides its schedule.
+
+        Nothing runs while the scheduler is stopped, and singleton jobs
+        still only run on the leader.
+        Args:
+            name (str): Name of the job.
+        """
+        if self.election is None:
+            return
+        task = asyncio.create_task(
+            self.run_job(self.jobs[name]), name=f'job-{name}-triggered')
+        self._triggered.add(task)
+        task.add_done_callback(self._triggered.discard)
+
+    async def stop(self) -> None:
+        tasks = [*self._tasks, *self._triggered]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
+        if self.election is not None:
+            await self.election.resign()
+            self.election = None
+
+    async def _run(self, job: Job) -> None:
+        now = datetime.datetime.now(KST)
+        next_run = now if job.run_at_start else job.schedule.next_after(now)
+        while True:
+            delay = (next_run - datetime.datetime.now(KST)).total_seconds()
+            await asyncio.sleep(
+                max(0.0, delay) + random.uniform(0, job.jitter))
+            await self.run_job(job)
+            next_run = job.schedule.next_after(datetime.datetime.now(KST))
+
+    async def run_job(self, job: Job) -> None:
+        """Function to run a job once, if this worker may run it.
+        Args:
+            job (Job): Job to run.
+        """
+        if job.singleton:
+            try:
+                leader = self.election is not None and \
+                    await self.election.campaign()
+            except Exception:
+                logger.exception('Scheduler leader election failed')
+                leader = False
+            if not leader:
+                job.skipped += 1
+                return
+        started = time.perf_counter()
+        try:
+            with tracer.span(f'job {job.name}', root=True):
+                await job.function()
+        except Exception:
+            job.failures += 1
+            logger.exception('Job %s failed', job.name)
+        else:
+            job.last_success = time.time()
+        finally:
+            job.runs += 1
+            job.duration += time.perf_counter() - started
+
+    def collect(self) -> list[Metric]:
+        """Function to get the metrics of the jobs.
+        Returns:
+            list[Metric]: Runs, failures, skipped runs, durations and last
+                success of every job.
+        """
+        families = (
+            ('hyuabot_job_runs_total', 'counter', 'Finished runs of a job.',
+             'runs'),
+            ('hyuabot_job_failures_total', 'counter',
+             'Runs of a job that raised an exception.', 'failures'),
+            ('hyuabot_job_skipped_total', 'counter',
+             'Runs of a singleton job skipped by a worker not leading.',
+             'skipped'),
+            ('hyuabot_job_last_success_timestamp_seconds', 'gauge',
+             'Unix time of the last successful run of a job.',
+             'last_success'),
+        )
+        metrics = [
+            Metric(name, kind, description, [
+                Sample(name, {'job': job.name}, getattr(job, attribute))
+                for job in self.jobs.values()
+            ])
+            for name, kind, description, attribute in families
+        ]
+        duration = 'hyuabot_job_duration_seconds'
+        metrics.append(Metric(
+            duration, 'summary', 'Seconds spent running a job.',
+            [
+                sample
+                for job in self.jobs.values()
+                for sample in (
+                    Sample(f'{duration}_sum', {'job': job.name},
+                           job.duration),
+                    Sample(f'{duration}_count', {'job': job.name}, job.runs),
+                )
+            ],
+        ))
+        return metrics
+
+
+scheduler = Scheduler()
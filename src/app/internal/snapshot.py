@@ -0,0 +1,428 @@
+"""Module that writes and loads binary snapshots of the timetables.
+
+A snapshot stores every timetable as columnar arrays, with the departures
+of each route, stop and weekday sorted by time. Strings such as route names
+and station ids are interned into one table shared by all timetables and
+stored as indexes into it, and times are stored as seconds since midnight,
+so workers can memory-map the file and use the columns without decoding
+them row by row.
+
+Layout (native byte order, sections aligned to four bytes)::
+
+    header   magic, schema version, byte order, table count,
+             creation time, crc32 of everything after the header
+    strings  count, offsets[count + 1], utf-8 data
+    tables   name, row count, column count, then for each column its
+             name, kind and values
+
+Snapshots with another schema version, byte order or checksum are rejected
+with SnapshotError, so stale files never get loaded after an upgrade.
+
+Workers load the snapshot into ``timetable_snapshot`` on startup, and the
+timetable readers take their departures from it instead of the database.
+A table that changes in the database after that is no longer served, so
+its readers, like the readers of a rejected snapshot, query the database.
+
+Attributes:
+    timetable_snapshot (TimetableSnapshot): Snapshot of the app.
+"""
+import argparse
+import array
+import asyncio
+import datetime
+import mmap
+import struct
+import sys
+import time
+import zlib
+from typing import Any, Iterable, Iterator, NamedTuple, Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from app.internal.invalidation import TableChanged, invalidation_bus
+from app.model.bus import BusTimetableItem
+from app.model.shuttle import ShuttleTimetableItem
+from app.model.subway import TimetableItem
+
+MAGIC = b'HYUS'
+SCHEMA_VERSION = 1
+HEADER = struct.Struct('<4sHBxHxxqI')
+BYTE_ORDER = 0 if sys.byteorder == 'little' else 1
+# Kind of a column and the array typecode its values are stored with.
+TYPECODES = {'str': 'I', 'int': 'q', 'bool': 'B', 'time': 'I'}
+# Columns of every timetable, grouping columns before the departure time.
+SNAPSHOT_TABLES: dict[str, tuple[Any, ...]] = {
+    'shuttle_timetable': (
+        ShuttleTimetableItem.period_type_name,
+        ShuttleTimetableItem.weekday,
+        ShuttleTimetableItem.route_name,
+        ShuttleTimetableItem.stop_name,
+        ShuttleTimetableItem.departure_time,
+    ),
+    'bus_timetable': (
+        BusTimetableItem.route_id,
+        BusTimetableItem.start_stop_id,
+        BusTimetableItem.weekday,
+        BusTimetableItem.departure_time,
+    ),
+    'subway_timetable': (
+        TimetableItem.station_id,
+        TimetableItem.heading,
+        TimetableItem.weekday,
+        TimetableItem.departure_time,
+        TimetableItem.destination_id,
+        TimetableItem.start_station_id,
+    ),
+}
+
+
+class SnapshotError(Exception):
+    """Exception raised when a snapshot can not be used."""
+
+
+class ColumnSpec(NamedTuple):
+    """Class that describes a column of a snapshot table.
+    Attributes:
+        name (str): Name of the column.
+        kind (str): One of str, int, bool and time.
+    """
+    name: str
+    kind: str
+
+
+def column_kind(python_type: type) -> str:
+    if python_type is bool:
+        return 'bool'
+    if python_type is int:
+        return 'int'
+    if python_type is datetime.time:
+        return 'time'
+    return 'str'
+
+
+def _padding(length: int) -> bytes:
+    return b'\0' * (-length % 4)
+
+
+def _encode_name(name: str) -> bytes:
+    encoded = name.encode('utf-8')
+    return struct.pack('<H', len(encoded)) + encoded
+
+
+def write_snapshot(
+    path: str,
+    tables: dict[str, tuple[list[ColumnSpec], Iterable[tuple]]],
+    created_at: Optional[float] = None,
+) -> None:
+    """Function to write a snapshot file.
+    Args:
+        path (str): Path of the snapshot file.
+        tables (dict): Columns and rows of each table. Rows are written in
+            the order they are given.
+        created_at (float): Creation time as a UNIX timestamp.
+    """
+    strings: list[str] = []
+    string_ids: dict[str, int] = {}
+    encoded_tables: list[bytes] = []
+    for table_name, (columns, rows) in tables.items():
+        values = [array.array(TYPECODES[column.kind]) for column in columns]
+        row_count = 0
+        for row in rows:
+            row_count += 1
+            for column, column_values, value in zip(columns, values, row):
+                if column.kind == 'str':
+                    if value not in string_ids:
+                        string_ids[value] = len(strings)
+                        strings.append(value)
+                    column_values.append(string_ids[value])
+                elif column.kind == 'time':
+                    column_values.append(
+                        value.hour * 3600 + value.minute * 60 + value.second)
+                else:
+                    column_values.append(int(value))
+        section = _encode_name(table_name)
+        section += struct.pack('<IH', row_count, len(columns))
+        for column, column_values in zip(columns, values):
+            section += _encode_name(column.name) + column.kind[0].encode()
+            section += _padding(len(section))
+            section += column_values.tobytes()
+            section += _padding(len(section))
+        encoded_tables.append(section)
+
+    encoded_strings = [string.encode('utf-8') for string in strings]
+    offsets = array.array('I', [0])
+    for encoded in encoded_strings:
+        offsets.append(offsets[-1] + len(encoded))
+    blob = b''.join(encoded_strings)
+    body = struct.pack('<I', len(strings)) + offsets.tobytes() + blob
+    body += _padding(len(body))
+    body += b''.join(encoded_tables)
+
+    header = HEADER.pack(
+        MAGIC,
+        SCHEMA_VERSION,
+        BYTE_ORDER,
+        len(encoded_tables),
+        int(created_at if created_at is not None else time.time()),
+        zlib.crc32(body),
+    )
+    with open(path, 'wb') as file:
+        file.write(header + body)
+
+
+class SnapshotTable:
+    """Class that gives access to the columns of a snapshot table.
+    Attributes:
+        name (str): Name of the table.
+        row_count (int): Number of rows.
+        columns (dict[str, ColumnSpec]): Columns of the table.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        row_count: int,
+        columns: dict[str, tuple[ColumnSpec, memoryview]],
+        strings: list[str],
+    ) -> None:
+        self.name = name
+        self.row_count = row_count
+        self.columns = {key: spec for key, (spec, _) in columns.items()}
+        self._values = {key: values for key, (_, values) in columns.items()}
+        self._strings = strings
+
+    def raw(self, name: str) -> memoryview:
+        """Function to get the stored values of a column without copying.
+        Args:
+            name (str): Name of the column.
+        Returns:
+            memoryview: String ids, integers, booleans or seconds.
+        """
+        return self._values[name]
+
+    def decode(self, name: str) -> list[Any]:
+        """Function to get the values of a column as Python objects.
+        Args:
+            name (str): Name of the column.
+        Returns:
+            list: Values of the column.
+        """
+        kind = self.columns[name].kind
+        values = self._values[name]
+        if kind == 'str':
+            return [self._strings[value] for value in values]
+        if kind == 'time':
+            return [
+                datetime.time(value // 3600 % 24, value // 60 % 60, value % 60)
+                for value in values
+            ]
+        if kind == 'bool':
+            return [bool(value) for value in values]
+        return list(values)
+
+    def rows(self) -> Iterator[tuple]:
+        return zip(*(self.decode(name) for name in self.columns))
+
+
+class Snapshot:
+    """Class that holds a memory-mapped snapshot file.
+    Attributes:
+        created_at (datetime.datetime): When the snapshot was written.
+        strings (list[str]): Interned strings.
+        tables (dict[str, SnapshotTable]): Tables of the snapshot.
+    """
+
+    def __init__(self, path: str, max_age: Optional[float] = None) -> None:
+        with open(path, 'rb') as file:
+            try:
+                self._mmap = mmap.mmap(
+                    file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise SnapshotError('Snapshot file is empty')
+        view = memoryview(self._mmap)
+        if len(view) < HEADER.size:
+            raise SnapshotError('Snapshot file is truncated')
+        magic, version, byte_order, table_count, created_at, checksum = \
+            HEADER.unpack_from(view)
+        if magic != MAGIC:
+            raise SnapshotError('File is not a snapshot')
+        if version != SCHEMA_VERSION:
+            raise SnapshotError(
+                f'Snapshot schema version {version} is not {SCHEMA_VERSION}')
+        if byte_order != BYTE_ORDER:
+            raise SnapshotError('Snapshot was written on another byte order')
+        if zlib.crc32(view[HEADER.size:]) != checksum:
+            raise SnapshotError('Snapshot checksum does not match')
+        if max_age is not None and time.time() - created_at > max_age:
+            raise SnapshotError('Snapshot is older than the maximum age')
+        self.created_at = datetime.datetime.fromtimestamp(created_at)
+
+        offset = HEADER.size
+        (string_count,) = struct.unpack_from('<I', view, offset)
+        offset += 4
+        offsets = view[offset:offset + (string_count + 1) * 4].cast('I')
+        offset += (string_count + 1) * 4
+        self.strings = [
+            str(view[offset + start:offset + end], 'utf-8')
+            for start, end in zip(offsets[:-1], offsets[1:])
+        ]
+        offset += offsets[-1]
+        offset += -offset % 4
+
+        self.tables: dict[str, SnapshotTable] = {}
+        for _ in range(table_count):
+            table_name, offset = self._read_name(view, offset)
+            row_count, column_count = struct.unpack_from('<IH', view, offset)
+            offset += 6
+            columns: dict[str, tuple[ColumnSpec, memoryview]] = {}
+            for _ in range(column_count):
+                column_name, offset = self._read_name(view, offset)
+                kind = {'s': 'str', 'i': 'int', 'b': 'bool', 't': 'time'}[
+                    chr(view[offset])]
+                offset += 1
+                offset += -offset % 4
+                typecode = TYPECODES[kind]
+                size = row_count * struct.calcsize(typecode)
+                columns[column_name] = (
+                    ColumnSpec(column_name, kind),
+                    view[offset:offset + size].cast(typecode),
+                )
+                offset += size
+                offset += -offset % 4
+            self.tables[table_name] = SnapshotTable(
+                table_name, row_count, columns, self.strings)
+
+    @staticmethod
+    def _read_name(view: memoryview, offset: int) -> tuple[str, int]:
+        (length,) = struct.unpack_from('<H', view, offset)
+        offset += 2
+        return str(view[offset:offset + length], 'utf-8'), offset + length
+
+
+def load_snapshot(path: str, max_age: Optional[float] = None) -> Snapshot:
+    """Function to memory-map a snapshot file.
+    Args:
+        path (str): Path of the snapshot file.
+        max_age (float): Maximum age in seconds of the snapshot.
+    Returns:
+        Snapshot: Loaded snapshot.
+    Raises:
+        SnapshotError: If the snapshot is invalid, outdated or too old.
+    """
+    try:
+        return Snapshot(path, max_age=max_age)
+    except (OSError, struct.error, KeyError, TypeError) as error:
+        raise SnapshotError(f'Snapshot can not be read: {error}')
+
+
+class TimetableSnapshot:
+    """Class that serves the timetables of the loaded snapshot.
+    Attributes:
+        snapshot (Snapshot): Loaded snapshot, or None.
+        discarded (set[str]): Tables that changed since the snapshot was
+            loaded.
+    """
+
+    def __init__(self) -> None:
+        self.snapshot: Optional[Snapshot] = None
+        self.discarded: set[str] = set()
+        self._groups: dict[tuple, dict[tuple, list[tuple]]] = {}
+        invalidation_bus.subscribe(SNAPSHOT_TABLES, self.discard)
+
+    def load(self, path: str, max_age: Optional[float] = None) -> None:
+        """Function to load a snapshot file and serve its tables.
+        Args:
+            path (str): Path of the snapshot file.
+            max_age (float): Maximum age in seconds of the snapshot.
+        Raises:
+            SnapshotError: If the snapshot is invalid, outdated or too old.
+        """
+        snapshot = load_snapshot(path, max_age=max_age)
+        self.unload()
+        self.snapshot = snapshot
+
+    def unload(self) -> None:
+        self.snapshot = None
+        self.discarded = set()
+        self._groups = {}
+
+    def discard(self, event: TableChanged) -> None:
+        self.discarded.add(event.table)
+
+    def groups(
+        self,
+        table_name: str,
+        columns: tuple[str, ...],
+        key: tuple[str, ...],
+        order: tuple[str, ...],
+    ) -> Optional[dict[tuple, list[tuple]]]:
+        """Function to get the rows of a table grouped by key columns.
+
+        The rows are decoded and grouped once for each set of arguments.
+        Args:
+            table_name (str): Name of the table.
+            columns (tuple[str, ...]): Columns of the returned rows.
+            key (tuple[str, ...]): Columns the rows are grouped by, or none
+                for a single group under the empty tuple.
+            order (tuple[str, ...]): Columns each group is sorted by.
+        Returns:
+            dict[tuple, list[tuple]]: Rows by the values of the key
+                columns, or None when the table is not served.
+        """
+        if self.snapshot is None or table_name in self.discarded or \
+                table_name not in self.snapshot.tables:
+            return None
+        arguments = (table_name, columns, key, order)
+        groups = self._groups.get(arguments)
+        if groups is None:
+            table = self.snapshot.tables[table_name]
+            values = {
+                name: table.decode(name) for name in {*columns, *key, *order}
+            }
+            rows = sorted(range(table.row_count), key=lambda index: tuple(
+                values[name][index] for name in order))
+            groups = {}
+            for index in rows:
+                groups.setdefault(
+                    tuple(values[name][index] for name in key), [],
+                ).append(tuple(values[name][index] for name in columns))
+            self._groups[arguments] = groups
+        return groups
+
+
+timetable_snapshot = TimetableSnapshot()
+
+
+async def export_snapshot(engine: AsyncEngine, path: str) -> None:
+    """Function to export the timetables of the database to a snapshot.
+    Args:
+        engine (AsyncEngine): Database engine.
+        path (str): Path of the snapshot file.
+    """
+    tables: dict[str, tuple[list[ColumnSpec], Iterable[tuple]]] = {}
+    async with engine.connect() as connection:
+        for table_name, columns in SNAPSHOT_TABLES.items():
+            # Departures are sorted inside the groups of leading columns.
+            statement = select(*columns).order_by(*columns)
+            rows = (await connection.execute(statement)).all()
+            specs = [
+                ColumnSpec(column.key, column_kind(column.type.python_type))
+                for column in columns
+            ]
+            tables[table_name] = (specs, rows)
+    write_snapshot(path, tables)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Export the timetables to a binary snapshot.')
+    parser.add_argument('path', help='Path of the snapshot file.')
+    arguments = parser.parse_args()
+
+    from app.dependancies.database import engine
+    asyncio.run(export_snapshot(engine, arguments.path))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+"""Module that counts SQL statements and flags lazy loads.
+
+Endpoints and query functions declare how many statements they may issue,
+and optionally how many rows they may fetch, with ``statement_budget``.
+The tests run each of them against the seeded stand-in inside a
+``StatementCounter`` and fail when a change exceeds the budget, such as a
+relationship that is no longer eagerly loaded.
+
+The lazy load detector reports every relationship the ORM loads lazily.
+Under AsyncSession a lazy load that needs a statement fails with
+MissingGreenlet, and inside run_sync it silently issues a statement per
+instance, so in warn mode the detector names the relationship in a
+LazyLoadWarning and in raise mode it fails with LazyLoadError first.
+
+Attributes:
+    lazy_load_detector (LazyLoadDetector): Detector of the app.
+"""
+import inspect
+import warnings
+from contextvars import ContextVar
+from typing import Any, Callable, NamedTuple, Optional, TypeVar
+
+from sqlalchemy import Engine, event
+from sqlalchemy.orm import ORMExecuteState, Session
+
+F = TypeVar('F', bound=Callable[..., Any])
+
+
+def row_count(cursor: Any) -> Optional[int]:
+    """Function to get the number of rows a statement returned or changed.
+    Args:
+        cursor (Any): DBAPI cursor after the execution.
+    Returns:
+        int: Number of rows, or None if the driver does not count them.
+    """
+    rows = cursor.rowcount
+    if rows < 0 and hasattr(cursor, '_rows'):
+        # Drivers such as sqlite do not count the rows of a select, but
+        # the asyncio adapters buffer them.
+        rows = len(cursor._rows)
+    return rows if rows >= 0 else None
+
+
+class StatementBudget(NamedTuple):
+    """Class that holds the statements and rows a function may use.
+    Attributes:
+        statements (int): Maximum number of statements.
+        rows (int): Maximum number of rows fetched, or None for no limit.
+    """
+    statements: int
+    rows: Optional[int] = None
+
+
+def statement_budget(
+    statements: int,
+    rows: Optional[int] = None,
+) -> Callable[[F], F]:
+    """Function to declare the statement budget of a function.
+    Args:
+        statements (int): Maximum number of statements.
+        rows (int): Maximum number of rows fetched.
+    Returns:
+        Callable: Decorator that returns the function unchanged.
+    """
+    def decorator(function: F) -> F:
+        setattr(function, '__statement_budget__',
+                StatementBudget(statements, rows))
+        return function
+    return decorator
+
+
+def get_statement_budget(function: Callable) -> Optional[StatementBudget]:
+    """Function to get the budget declared on a function or one it wraps.
+    Args:
+        function (Callable): Function, possibly wrapped by decorators.
+    Returns:
+        StatementBudget: Declared budget, or None.
+    """
+    unwrapped = inspect.unwrap(
+        function, stop=lambda item: hasattr(item, '__statement_budget__'))
+    return getattr(unwrapped, '__statement_budget__', None)
+
+
+_counters: ContextVar[tuple['StatementCounter', ...]] = \
+    ContextVar('statement_counters', default=())
+
+
+def _count_statement(connection: Any, cursor: Any, statement: str,
+                     parameters: Any, context: Any,
+                     executemany: bool) -> None:
+    counters = _counters.get()
+    if counters:
+        rows = row_count(cursor) or 0
+        for counter in counters:
+            counter.statements.append(statement)
+            counter.rows += rows
+
+
+class StatementCounter:
+    """Class that counts the statements of the code running inside it.
+
+    Statements issued by tasks started inside the block are counted as
+    well, and nested counters count their statements for the outer
+    counters too.
+    Attributes:
+        statements (list[str]): Statements issued.
+        rows (int): Rows fetched or changed by the statements.
+    """
+
+    def __init__(self) -> None:
+        self.statements: list[str] = []
+        self.rows = 0
+        self._token: Any = None
+
+    def __enter__(self) -> 'StatementCounter':
+        if not event.contains(
+                Engine, 'after_cursor_execute', _count_statement):
+            event.listen(Engine, 'after_cursor_execute', _count_statement)
+        self._token = _counters.set((*_counters.get(), self))
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        _counters.reset(self._token)
+
+    def over_budget(self, budget: StatementBudget) -> list[str]:
+        """Function to describe how the counts exceed a budget.
+        Args:
+            budget (StatementBudget): Budget to compare with.
+        Returns:
+            list[str]: One message per exceeded limit, empty within budget.
+        """
+        messages = []
+        if len(self.statements) > budget.statements:
+            messages.append(
+                f'{len(self.statements)} statements exceed the budget of '
+                f'{budget.statements}:\n' + '\n'.join(self.statements))
+        if budget.rows is not None and self.rows > budget.rows:
+            messages.append(
+                f'{self.rows} rows exceed the budget of {budget.rows}')
+        return messages
+
+
+class LazyLoadWarning(RuntimeWarning):
+    """Warning issued when a relationship is loaded lazily."""
+
+
+class LazyLoadError(Exception):
+    """Exception raised when a relationship is loaded lazily."""
+
+
+class LazyLoadDetector:
+    """Class that reports lazy loads of relationships.
+    Attributes:
+        mode (str): off, warn or raise.
+    """
+
+    def __init__(self) -> None:
+        self.mode = 'off'
+
+    def configure(self, mode: str) -> None:
+        """Function to change the mode of the detector.
+        Args:
+            mode (str): off, warn or raise.
+        """
+        if mode not in ('off', 'warn', 'raise'):
+            raise ValueError(f'Unknown lazy load mode: {mode}')
+        self.mode = mode
+        installed = event.contains(Session, 'do_orm_execute', self.check)
+        if mode == 'off' and installed:
+            event.remove(Session, 'do_orm_execute', self.check)
+        elif mode != 'off' and not installed:
+            event.listen(Session, 'do_orm_execute', self.check)
+
+    def check(self, orm_execute_state: ORMExecuteState) -> None:
+        instance_state = orm_execute_state.lazy_loaded_from
+        if instance_state is None:
+            return
+        path = orm_execute_state.loader_strategy_path
+        relationship = path[-1] if path is not None else \
+            instance_state.class_.__name__
+        message = (
+            f'{relationship} is loaded lazily, which issues a statement per '
+            f'instance; load it eagerly with selectinload or joinedload'
+        )
+        if self.mode == 'raise':
+            raise LazyLoadError(message)
+        warnings.warn(message, LazyLoadWarning, stacklevel=2)
+
+
+lazy_load_detector = LazyLoadDetector()
@@ -0,0 +1,229 @@
+"""Module that aligns realtime subway trains to their timetable slots.
+
+The realtime feed and the timetable of a station are separate lists: the
+feed only knows the next few trains of each heading and the timetable only
+knows when trains should come. The matcher pairs each realtime train with
+the unused scheduled departure of the same heading and destination closest
+to its expected arrival, so the response can show the delay of the train,
+and then continues the list with the scheduled departures beyond the last
+realtime train.
+
+The departure times of a heading are kept in sorted arrays per destination,
+so every train is matched with a binary search instead of a scan of the
+whole timetable. The expected arrival of each train is given by the caller,
+so it is the same as the one the realtime list of the response shows.
+"""
+import bisect
+import datetime
+from typing import NamedTuple, Optional
+
+from app.internal.date_utils import current_datetime, is_weekends
+from app.rows.subway import SubwayDepartureRow, SubwayRealtimeRow
+
+# Departures before this time belong to the service day that started the
+# day before, such as the trains running after midnight.
+SERVICE_DAY_START = datetime.time(3)
+MATCH_WINDOW = datetime.timedelta(minutes=10)
+HEADINGS = {'up': 'true', 'down': 'false'}
+
+
+class MatchedArrival(NamedTuple):
+    """Class that holds a train of a heading aligned to its scheduled slot.
+    Attributes:
+        expected (datetime.datetime): Expected arrival, the estimate of the
+            realtime feed or the scheduled time.
+        realtime (SubwayRealtimeRow): Realtime arrival, or None for a
+            scheduled departure beyond the realtime trains.
+        departure (SubwayDepartureRow): Scheduled departure, or None when
+            the train matched no slot.
+        scheduled (datetime.datetime): Scheduled time of the departure, or
+            None when the train matched no slot.
+        delay (datetime.timedelta): Expected minus scheduled time of a
+            matched realtime train, or None.
+    """
+    expected: datetime.datetime
+    realtime: Optional[SubwayRealtimeRow]
+    departure: Optional[SubwayDepartureRow]
+    scheduled: Optional[datetime.datetime]
+    delay: Optional[datetime.timedelta]
+
+
+def service_date(value: datetime.datetime) -> datetime.date:
+    """Function to get the service day a time belongs to.
+    Args:
+        value (datetime.datetime): Time.
+    Returns:
+        datetime.date: Date the service day started on.
+    """
+    start = datetime.datetime.combine(value.date(), SERVICE_DAY_START)
+    if value < start:
+        return value.date() - datetime.timedelta(days=1)
+    return value.date()
+
+
+class DepartureSlots:
+    """Class that holds the departures of a heading of a service day as
+    sorted arrays.
+    Attributes:
+        departures (list[SubwayDepartureRow]): Departures by time.
+        times (list[datetime.datetime]): Time of each departure.
+    """
+
+    def __init__(
+        self,
+        departures: list[SubwayDepartureRow],
+        day: datetime.date,
+    ) -> None:
+        """Function to build the arrays of the departures.
+        Args:
+            departures (list[SubwayDepartureRow]): Departures of a heading.
+            day (datetime.date): Service day of the departures.
+        """
+        # Departures after midnight move behind the rest of the day.
+        slots = sorted((
+            (self.slot_time(day, item.departure_time), item)
+            for item in departures
+        ), key=lambda slot: slot[0])
+        self.times = [time for time, _ in slots]
+        self.departures = [item for _, item in slots]
+        self._used = [False] * len(slots)
+        self._indices: dict[str, list[int]] = {}
+        for index, item in enumerate(self.departures):
+            self._indices.setdefault(item.destination_id, []).append(index)
+        self._times = {
+            destination: [self.times[index] for index in indices]
+            for destination, indices in self._indices.items()
+        }
+
+    @staticmethod
+    def slot_time(
+        day: datetime.date,
+        value: datetime.time,
+    ) -> datetime.datetime:
+        slot = datetime.datetime.combine(day, value)
+        if value < SERVICE_DAY_START:
+            slot += datetime.timedelta(days=1)
+        return slot
+
+    def take(
+        self,
+        destination_id: str,
+        expected: datetime.datetime,
+        window: datetime.timedelta,
+    ) -> Optional[int]:
+        """Function to claim the unused slot closest to an arrival.
+        Args:
+            destination_id (str): Destination of the train.
+            expected (datetime.datetime): Expected arrival of the train.
+            window (datetime.timedelta): Largest difference between the
+                expected and the scheduled time of a match.
+        Returns:
+            int: Index of the claimed departure, or None when no unused
+                slot of the destination lies within the window.
+        """
+        indices = self._indices.get(destination_id)
+        if indices is None:
+            return None
+        times = self._times[destination_id]
+        lower = bisect.bisect_left(times, expected - window)
+        upper = bisect.bisect_right(times, expected + window)
+        candidates = [
+            position for position in range(lower, upper)
+            if not self._used[indices[position]]
+        ]
+        if not candidates:
+            return None
+        position = min(
+            candidates, key=lambda value: abs(times[value] - expected))
+        self._used[indices[position]] = True
+        return indices[position]
+
+    def after(self, value: datetime.datetime) -> list[int]:
+        """Function to get the unused slots later than a time.
+        Args:
+            value (datetime.datetime): Time.
+        Returns:
+            list[int]: Indices of the departures, by time.
+        """
+        return [
+            index for index in range(
+                bisect.bisect_right(self.times, value), len(self.times))
+            if not self._used[index]
+        ]
+
+
+def match_heading(
+    realtime: list[tuple[datetime.datetime, SubwayRealtimeRow]],
+    departures: list[SubwayDepartureRow],
+    now: datetime.datetime,
+    window: datetime.timedelta = MATCH_WINDOW,
+) -> list[MatchedArrival]:
+    """Function to align the realtime trains of a heading to its departures.
+    Args:
+        realtime (list[tuple[datetime.datetime, SubwayRealtimeRow]]):
+            Expected arrival and realtime arrival of every train of the
+            heading.
+        departures (list[SubwayDepartureRow]): Departures of the heading on
+            the current service day.
+        now (datetime.datetime): Current time.
+        window (datetime.timedelta): Largest difference between the expected
+            and the scheduled time of a match.
+    Returns:
+        list[MatchedArrival]: Realtime trains by expected arrival, followed
+            by the departures scheduled after the last of them.
+    """
+    slots = DepartureSlots(departures, service_date(now))
+    trains = sorted(realtime, key=lambda train: train[0])
+    arrivals: list[MatchedArrival] = []
+    for expected, item in trains:
+        index = slots.take(item.destination_id, expected, window)
+        if index is None:
+            arrivals.append(MatchedArrival(expected, item, None, None, None))
+            continue
+        scheduled = slots.times[index]
+        arrivals.append(MatchedArrival(
+            expected, item, slots.departures[index], scheduled,
+            expected - scheduled,
+        ))
+    horizon = max(now, trains[-1][0]) if trains else now
+    for index in slots.after(horizon):
+        scheduled = slots.times[index]
+        arrivals.append(MatchedArrival(
+            scheduled, None, slots.departures[index], scheduled, None))
+    return arrivals
+
+
+def match_arrivals(
+    realtime: list[tuple[datetime.datetime, SubwayRealtimeRow]],
+    timetable: list[SubwayDepartureRow],
+    now: Optional[datetime.datetime] = None,
+    window: datetime.timedelta = MATCH_WINDOW,
+) -> dict[str, list[MatchedArrival]]:
+    """Function to align the realtime trains of a station to its timetable.
+    Args:
+        realtime (list[tuple[datetime.datetime, SubwayRealtimeRow]]):
+            Expected arrival and realtime arrival of every train of the
+            station.
+        timetable (list[SubwayDepartureRow]): Departures of the station.
+        now (datetime.datetime): Current time, or None for the current time
+            in Korea.
+        window (datetime.timedelta): Largest difference between the expected
+            and the scheduled time of a match.
+    Returns:
+        dict[str, list[MatchedArrival]]: Arrivals of the up and the down
+            heading.
+    """
+    if now is None:
+        now = current_datetime()
+    weekday = 'weekends' if is_weekends(service_date(now)) else 'weekdays'
+    return {
+        heading: match_heading(
+            [train for train in realtime if train[1].heading == flag],
+            [
+                item for item in timetable
+                if item.heading == heading and item.weekday == weekday
+            ],
+            now,
+            window,
+        ) for heading, flag in HEADINGS.items()
+    }
@@ -0,0 +1,75 @@
+"""Module that merges sorted departures of routes into timelines.
+
+Each route's departures are loaded already sorted, so a timeline of several
+routes, such as every route sharing a tag, is a k-way merge of sorted lists
+instead of a concatenation sorted again on every request. The merge is
+lazy and stops after the requested number of departures.
+"""
+import heapq
+import itertools
+from typing import Any, Callable, Generic, Hashable, Iterable, Optional, \
+    TypeVar
+
+K = TypeVar('K', bound=Hashable)
+T = TypeVar('T')
+
+
+class TimelineBuilder(Generic[K, T]):
+    """Class that groups sorted departures and merges each group.
+    Attributes:
+        key (Callable): Function returning the value departures are
+            sorted by.
+    """
+
+    def __init__(
+        self,
+        key: Callable[[T], Any],
+        groups: Iterable[K] = (),
+    ) -> None:
+        """Function to create a builder.
+        Args:
+            key (Callable): Function returning the sort value of a
+                departure.
+            groups (Iterable[K]): Groups that appear in the
+                timelines even without departures, in order.
+        """
+        self.key = key
+        self._departures: dict[K, list[Iterable[T]]] = {
+            group: [] for group in groups
+        }
+
+    @property
+    def groups(self) -> list[K]:
+        return list(self._departures)
+
+    def add(self, group: K, departures: Iterable[T]) -> None:
+        """Function to add the departures of a route to a group.
+        Args:
+            group (K): Group such as the tag of the route.
+            departures (Iterable[T]): Departures sorted by the key.
+        """
+        self._departures.setdefault(group, []).append(departures)
+
+    def merge(self, group: K, limit: Optional[int] = None) -> list[T]:
+        """Function to get the timeline of a group.
+        Args:
+            group (K): Group of the timeline.
+            limit (int): Maximum number of departures, or None for all.
+        Returns:
+            list[T]: Departures of the group sorted by the key.
+        """
+        merged = heapq.merge(*self._departures.get(group, []), key=self.key)
+        return list(itertools.islice(merged, limit))
+
+    def timelines(
+        self,
+        limit: Optional[int] = None,
+    ) -> dict[K, list[T]]:
+        """Function to get the timeline of every group.
+        Args:
+            limit (int): Maximum number of departures of each timeline.
+        Returns:
+            dict[K, list[T]]: Timeline of each group, in the order
+                the groups were added.
+        """
+        return {group: self.merge(group, limit) for group in self._departures}
@@ -0,0 +1,651 @@
+"""Module that records tracing spans of requests.
+
+Every traced request gets a root span from the middleware, with child
+spans for the route handler and its endpoint, the GraphQL parse, validate
+and execute steps and root field resolvers, each ``query_*`` function, each
+SQL statement with its row count and the serialization of the response.
+The current span is kept in a context variable, so spans of work running
+concurrently in tasks, such as independent GraphQL fields, get the right
+parent, and statements issued in a loop show up as a run of sibling spans.
+
+Finished spans are queued and exported by a background thread, either as
+JSON lines to the console or a file, or to an OTLP collector when the
+OpenTelemetry exporter is installed. Nothing is recorded outside a sampled
+request, so tracing costs a context variable lookup per span while it is
+off.
+
+Attributes:
+    tracer (Tracer): Tracer of the app.
+"""
+import abc
+import functools
+import inspect
+import json
+import logging
+import queue
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Iterator, Optional, TextIO, \
+    TypeVar
+
+from fastapi.routing import APIRoute
+from graphql import GraphQLResolveInfo
+from sqlalchemy import Engine, event
+from starlette.responses import JSONResponse
+from strawberry import Schema
+from strawberry.extensions import SchemaExtension
+
+from app.internal.config import AppSettings
+from app.internal.statements import row_count
+
+T = TypeVar('T')
+Scope = dict[str, Any]
+Message = dict[str, Any]
+Receive = Callable[[], Awaitable[Message]]
+Send = Callable[[Message], Awaitable[None]]
+ASGIApp = Callable[[Scope, Receive, Send], Awaitable[None]]
+
+SERVICE_NAME = 'hyuabot-backend'
+EXPORT_BATCH_SIZE = 512
+logger = logging.getLogger(__name__)
+
+
+class Span:
+    """Class that records one timed operation of a trace.
+    Attributes:
+        name (str): Name of the operation.
+        trace_id (int): 128-bit id shared by the spans of a trace.
+        span_id (int): 64-bit id of the span.
+        parent_id (int): Id of the parent span, or 0 for a root span.
+        start_time (int): Nanoseconds since the epoch at the start.
+        end_time (int): Nanoseconds since the epoch at the end, or 0 while
+            the span is open.
+        attributes (dict[str, Any]): Attributes of the operation.
+        error (str): Error that ended the span, or an empty string.
+    """
+    __slots__ = (
+        'name', 'trace_id', 'span_id', 'parent_id', 'start_time',
+        'end_time', 'attributes', 'error', '_started',
+    )
+
+    def __init__(
+        self,
+        name: str,
+        trace_id: int,
+        parent_id: int,
+        attributes: dict[str, Any],
+    ) -> None:
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = random.getrandbits(64) or 1
+        self.parent_id = parent_id
+        self.start_time = time.time_ns()
+        self.end_time = 0
+        self.attributes = attributes
+        self.error = ''
+        self._started = time.perf_counter_ns()
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def finish(self) -> None:
+        # The end is measured with the monotonic clock so that durations
+        # are not affected by adjustments of the wall clock.
+        self.end_time = self.start_time + \
+            time.perf_counter_ns() - self._started
+
+    @property
+    def duration(self) -> float:
+        return (self.end_time - self.start_time) / 1e9
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            'name': self.name,
+            'trace_id': f'{self.trace_id:032x}',
+            'span_id': f'{self.span_id:016x}',
+            'parent_id': f'{self.parent_id:016x}' if self.parent_id else None,
+            'start_time': self.start_time,
+            'duration_ms': round(self.duration * 1000, 3),
+            'attributes': self.attributes,
+            'error': self.error or None,
+        }
+
+
+class SpanExporter(abc.ABC):
+    """Class that sends finished spans out of the process."""
+
+    @abc.abstractmethod
+    def export(self, spans: list[Span]) -> None:
+        ...
+
+    def shutdown(self) -> None:
+        pass
+
+
+class StreamExporter(SpanExporter):
+    """Class that writes spans as JSON lines to a text stream.
+    Attributes:
+        stream (TextIO): Stream the spans are written to.
+    """
+
+    def __init__(self, stream: TextIO = sys.stdout) -> None:
+        self.stream = stream
+
+    def export(self, spans: list[Span]) -> None:
+        self.stream.write(''.join(
+            json.dumps(span.to_dict(), ensure_ascii=False, default=str) +
+            '\n' for span in spans
+        ))
+        self.stream.flush()
+
+
+class FileExporter(StreamExporter):
+    """Class that appends spans as JSON lines to a file.
+    Attributes:
+        path (str): Path of the file.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        super().__init__(open(path, 'a', encoding='utf-8'))
+
+    def shutdown(self) -> None:
+        self.stream.close()
+
+
+class OTLPExporter(SpanExporter):
+    """Class that sends spans to an OTLP collector over HTTP.
+    Attributes:
+        endpoint (str): URL of the collector, or None for the endpoint of
+            the OpenTelemetry environment variables.
+    """
+
+    def __init__(self, endpoint: Optional[str] = None) -> None:
+        try:
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter \
+                import OTLPSpanExporter
+            from opentelemetry.sdk.resources import Resource
+            from opentelemetry.sdk.trace import ReadableSpan
+            from opentelemetry.trace import SpanContext, Status, \
+                StatusCode, TraceFlags
+        except ImportError:
+            raise RuntimeError(
+                'The opentelemetry-exporter-otlp-proto-http package is '
+                'required for the otlp tracing exporter')
+        self.endpoint = endpoint
+        self._exporter = OTLPSpanExporter(endpoint=endpoint)
+        self._resource = Resource.create({'service.name': SERVICE_NAME})
+        self._readable_span = ReadableSpan
+        self._span_context = SpanContext
+        self._status = Status
+        self._status_code = StatusCode
+        self._sampled = TraceFlags(TraceFlags.SAMPLED)
+
+    def convert(self, span: Span) -> Any:
+        parent = None
+        if span.parent_id:
+            parent = self._span_context(
+                span.trace_id, span.parent_id, is_remote=False,
+                trace_flags=self._sampled,
+            )
+        if span.error:
+            status = self._status(self._status_code.ERROR, span.error)
+        else:
+            status = self._status(self._status_code.UNSET)
+        return self._readable_span(
+            name=span.name,
+            context=self._span_context(
+                span.trace_id, span.span_id, is_remote=False,
+                trace_flags=self._sampled,
+            ),
+            parent=parent,
+            resource=self._resource,
+            attributes={
+                key: value if isinstance(value, (str, bool, int, float))
+                else str(value)
+                for key, value in span.attributes.items()
+            },
+            status=status,
+            start_time=span.start_time,
+            end_time=span.end_time,
+        )
+
+    def export(self, spans: list[Span]) -> None:
+        self._exporter.export([self.convert(span) for span in spans])
+
+    def shutdown(self) -> None:
+        self._exporter.shutdown()
+
+
+def create_exporter(settings: AppSettings) -> Optional[SpanExporter]:
+    """Function to create the span exporter configured by the settings.
+    Args:
+        settings (AppSettings): Application settings.
+    Returns:
+        SpanExporter: Exporter, or None if tracing is off.
+    """
+    if settings.TRACING_EXPORTER == 'off':
+        return None
+    if settings.TRACING_EXPORTER == 'console':
+        return StreamExporter()
+    if settings.TRACING_EXPORTER == 'file':
+        return FileExporter(settings.TRACING_FILE)
+    if settings.TRACING_EXPORTER == 'otlp':
+        return OTLPExporter(settings.TRACING_OTLP_ENDPOINT)
+    raise ValueError(
+        f'Unknown tracing exporter: {settings.TRACING_EXPORTER}')
+
+
+class Tracer:
+    """Class that creates spans and exports them in a background thread.
+    Attributes:
+        exporter (SpanExporter): Exporter of the finished spans, or None
+            while tracing is off.
+        sample_rate (float): Fraction of the root spans recorded.
+    """
+
+    def __init__(self) -> None:
+        self.exporter: Optional[SpanExporter] = None
+        self.sample_rate = 1.0
+        self._current: ContextVar[Optional[Span]] = \
+            ContextVar('current_span', default=None)
+        self._queue: queue.SimpleQueue[Optional[Span]] = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def enabled(self) -> bool:
+        """Whether spans are exported."""
+        return self.exporter is not None
+
+    def current(self) -> Optional[Span]:
+        return self._current.get()
+
+    def configure(
+        self,
+        exporter: SpanExporter,
+        sample_rate: float = 1.0,
+    ) -> None:
+        """Function to start exporting spans and tracing SQL statements.
+
+        Calling it again replaces the previous exporter.
+        Args:
+            exporter (SpanExporter): Exporter of the finished spans.
+            sample_rate (float): Fraction of the root spans recorded.
+        """
+        self.shutdown()
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self._thread = threading.Thread(
+            target=self._run, name='span-exporter', daemon=True)
+        self._thread.start()
+        event.listen(Engine, 'before_cursor_execute', self._before_cursor)
+        event.listen(Engine, 'after_cursor_execute', self._after_cursor)
+        event.listen(Engine, 'handle_error', self._handle_error)
+
+    def shutdown(self) -> None:
+        """Function to export the queued spans and stop tracing."""
+        if self.exporter is None:
+            return
+        event.remove(Engine, 'before_cursor_execute', self._before_cursor)
+        event.remove(Engine, 'after_cursor_execute', self._after_cursor)
+        event.remove(Engine, 'handle_error', self._handle_error)
+        self._queue.put(None)
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.exporter.shutdown()
+        self.exporter = None
+
+    def start_span(
+        self,
+        name: str,
+        attributes: Optional[dict[str, Any]] = None,
+        root: bool = False,
+        remote_parent: Optional[tuple[int, int]] = None,
+    ) -> Optional[Span]:
+        """Function to open a span without making it the current span.
+        Args:
+            name (str): Name of the operation.
+            attributes (dict[str, Any]): Attributes of the operation.
+            root (bool): Whether the span may start a trace. Other spans
+                are only recorded inside a sampled trace.
+            remote_parent (tuple[int, int]): Trace id and span id of the
+                caller's span, for a root span continuing a remote trace.
+        Returns:
+            Span: Open span, or None if the span is not recorded.
+        """
+        if self.exporter is None:
+            return None
+        parent = self._current.get()
+        if parent is not None:
+            return Span(name, parent.trace_id, parent.span_id,
+                        attributes or {})
+        if not root or random.random() >= self.sample_rate:
+            return None
+        trace_id, parent_id = remote_parent or \
+            (random.getrandbits(128) or 1, 0)
+        return Span(name, trace_id, parent_id, attributes or {})
+
+    def end_span(
+        self,
+        span: Span,
+        error: Optional[BaseException] = None,
+    ) -> None:
+        if error is not None:
+            span.error = f'{type(error).__name__}: {error}'
+        span.finish()
+        self._queue.put(span)
+
+    @contextmanager
+    def span(
+        self,
+        name: str,
+        attributes: Optional[dict[str, Any]] = None,
+        root: bool = False,
+        remote_parent: Optional[tuple[int, int]] = None,
+    ) -> Iterator[Optional[Span]]:
+        """Function to open a span that is current inside the block.
+        Args:
+            name (str): Name of the operation.
+            attributes (dict[str, Any]): Attributes of the operation.
+            root (bool): Whether the span may start a trace.
+            remote_parent (tuple[int, int]): Trace id and span id of the
+                caller's span.
+        Returns:
+            Iterator[Span]: Open span, or None if the span is not recorded.
+        """
+        current = self.start_span(name, attributes, root, remote_parent)
+        if current is None:
+            yield None
+            return
+        token = self._current.set(current)
+        try:
+            yield current
+        except BaseException as error:
+            self.end_span(current, error)
+            raise
+        else:
+            self.end_span(current)
+        finally:
+            self._current.reset(token)
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            while batch[-1] is not None and len(batch) < EXPORT_BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            spans = [span for span in batch if span is not None]
+            if spans and self.exporter is not None:
+                try:
+                    self.exporter.export(spans)
+                except Exception:
+                    logger.exception('Failed to export %d spans', len(spans))
+            if batch[-1] is None:
+                return
+
+    def _before_cursor(self, connection: Any, cursor: Any, statement: str,
+                       parameters: Any, context: Any,
+                       executemany: bool) -> None:
+        current = self.start_span(
+            f'SQL {statement.lstrip().split(None, 1)[0].upper()}',
+            {
+                'db.system': connection.dialect.name,
+                'db.statement': statement,
+            },
+        )
+        connection.info.setdefault('trace_spans', []).append(current)
+
+    def _after_cursor(self, connection: Any, cursor: Any, statement: str,
+                      parameters: Any, context: Any,
+                      executemany: bool) -> None:
+        spans = connection.info.get('trace_spans')
+        current = spans.pop() if spans else None
+        if current is None:
+            return
+        rows = row_count(cursor)
+        if rows is not None:
+            current.set_attribute('db.rows', rows)
+        self.end_span(current)
+
+    def _handle_error(self, context: Any) -> None:
+        if context.connection is None:
+            return
+        spans = context.connection.info.get('trace_spans')
+        current = spans.pop() if spans else None
+        if current is not None:
+            self.end_span(current, context.original_exception)
+
+
+tracer = Tracer()
+
+
+def traced(
+    name: Optional[str] = None,
+) -> Callable[[Callable[..., Awaitable[T]]], Callable[..., Awaitable[T]]]:
+    """Function to record each call of a coroutine function as a span.
+    Args:
+        name (str): Name of the span, the function's name by default.
+    Returns:
+        Callable: Decorator for the coroutine function.
+    """
+    def decorator(
+        function: Callable[..., Awaitable[T]],
+    ) -> Callable[..., Awaitable[T]]:
+        span_name = name or function.__name__
+
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs) -> T:
+            if tracer.current() is None:
+                return await function(*args, **kwargs)
+            with tracer.span(span_name):
+                return await function(*args, **kwargs)
+        setattr(wrapper, '__traced__', True)
+        return wrapper
+    return decorator
+
+
+def parse_traceparent(value: str) -> Optional[tuple[int, int]]:
+    """Function to read the caller's span from a traceparent header.
+    Args:
+        value (str): Header in the W3C trace context format.
+    Returns:
+        tuple[int, int]: Trace id and span id, or None if the header is
+            missing or malformed.
+    """
+    parts = value.split('-')
+    if len(parts) < 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        trace_id, span_id = int(parts[1], 16), int(parts[2], 16)
+    except ValueError:
+        return None
+    if not trace_id or not span_id:
+        return None
+    return trace_id, span_id
+
+
+class TracingMiddleware:
+    """Middleware that opens the root span of every traced request.
+
+    A request carrying a traceparent header continues the caller's trace,
+    and the trace id is returned in the X-Trace-ID header.
+    Attributes:
+        app (ASGIApp): Wrapped application.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) \
+            -> None:
+        if scope['type'] != 'http' or tracer.exporter is None:
+            await self.app(scope, receive, send)
+            return
+        traceparent = dict(scope['headers']).get(b'traceparent', b'')
+        with tracer.span(
+            f'{scope["method"]} {scope["path"]}',
+            {
+                'http.method': scope['method'],
+                'http.target': scope['path'],
+            },
+            root=True,
+            remote_parent=parse_traceparent(traceparent.decode('latin-1')),
+        ) as current:
+            if current is None:
+                await self.app(scope, receive, send)
+                return
+            trace_id = f'{current.trace_id:032x}'.encode()
+
+            async def send_with_trace(message: Message) -> None:
+                if message['type'] == 'http.response.start':
+                    current.set_attribute(
+                        'http.status_code', message['status'])
+                    message['headers'] = [
+                        *message.get('headers', []),
+                        (b'x-trace-id', trace_id),
+                    ]
+                await send(message)
+
+            await self.app(scope, receive, send_with_trace)
+
+
+class TracedRoute(APIRoute):
+    """Route that records its handler and endpoint as spans.
+
+    The handler span covers dependency resolution, the endpoint and the
+    serialization of its result, and names the route template so that
+    requests of the same route can be grouped. Endpoints rendering their
+    result themselves, such as cached ones, get the route through their
+    ``bind_route`` attribute.
+    """
+
+    def __init__(self, path: str, endpoint: Callable[..., Any],
+                 **kwargs: Any) -> None:
+        # Routes included from a router get the endpoint already wrapped.
+        if inspect.iscoroutinefunction(endpoint) and \
+                not getattr(endpoint, '__traced__', False):
+            endpoint = traced(endpoint.__name__)(endpoint)
+        super().__init__(path, endpoint, **kwargs)
+        bind_route = getattr(endpoint, 'bind_route', None)
+        if bind_route is not None:
+            bind_route(self)
+
+    def get_route_handler(self) -> Callable[[Any], Awaitable[Any]]:
+        handler = super().get_route_handler()
+        path = self.path_format
+
+        async def traced_handler(request: Any) -> Any:
+            if tracer.current() is None:
+                return await handler(request)
+            with tracer.span(
+                f'{request.method} {path}', {'http.route': path},
+            ):
+                return await handler(request)
+        return traced_handler
+
+
+class TracedJSONResponse(JSONResponse):
+    """JSON response that records its rendering as a span."""
+
+    def render(self, content: Any) -> bytes:
+        if tracer.current() is None:
+            return super().render(content)
+        with tracer.span('serialize'):
+            return super().render(content)
+
+
+class TracingExtension(SchemaExtension):
+    """GraphQL extension that records the steps of an operation as spans.
+
+    Only root fields get a resolver span, since the nested fields of this
+    schema are plain attributes resolved from the query results.
+    """
+
+    @contextmanager
+    def _step(self, name: str) -> Iterator[None]:
+        if tracer.current() is None:
+            yield
+            return
+        with tracer.span(f'graphql.{name}'):
+            yield
+
+    def on_operation(self) -> Iterator[None]:
+        if tracer.current() is None:
+            yield
+            return
+        with tracer.span('graphql.operation') as current:
+            yield
+            if current is not None:
+                current.set_attribute(
+                    'graphql.operation.name',
+                    self.execution_context.operation_name or '',
+                )
+
+    def on_parse(self) -> Iterator[None]:
+        with self._step('parse'):
+            yield
+
+    def on_validate(self) -> Iterator[None]:
+        with self._step('validate'):
+            yield
+
+    def on_execute(self) -> Iterator[None]:
+        with self._step('execute'):
+            yield
+
+    def resolve(self, _next: Callable[..., Any], root: Any,
+                info: GraphQLResolveInfo, *args: Any, **kwargs: Any) -> Any:
+        if info.path.prev is not None or tracer.current() is None:
+            return _next(root, info, *args, **kwargs)
+        return self._resolve_root(_next, root, info, *args, **kwargs)
+
+    async def _resolve_root(self, _next: Callable[..., Any], root: Any,
+                            info: GraphQLResolveInfo, *args: Any,
+                            **kwargs: Any) -> Any:
+        with tracer.span(
+            f'graphql.resolve {info.field_name}',
+            {'graphql.field.name': info.field_name},
+        ):
+            result = _next(root, info, *args, **kwargs)
+            if inspect.isawaitable(result):
+                result = await result
+            return result
+
+
+class TracedSchema(Schema):
+    """GraphQL schema that adds the tracing extension while tracing is on.
+
+    Strawberry wraps every field resolver of an operation with the
+    extensions that resolve fields, so the extension is left out of the
+    operations executed while no spans are exported.
+    """
+
+    def get_extensions(self, sync: bool = False) -> list[Any]:
+        extensions = super().get_extensions(sync)
+        if tracer.enabled:
+            extensions.append(TracingExtension)
+        return extensions
+
+
+def configure_tracing(settings: AppSettings) -> None:
+    """Function to start tracing with the exporter of the settings.
+    Args:
+        settings (AppSettings): Application settings.
+    """
+    exporter = create_exporter(settings)
+    if exporter is None:
+        tracer.shutdown()
+        return
+    tracer.configure(exporter, settings.TRACING_SAMPLE_RATE)
+
+
+def shutdown_tracing() -> None:
+    """Function to export the queued spans and stop tracing."""
+    tracer.shutdown()
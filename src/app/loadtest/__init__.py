@@ -0,0 +1,7 @@
+"""Package that load tests the app against a seeded database stand-in.
+
+Run ``python -m app.loadtest --help`` for the load test,
+``python -m app.loadtest.memory --help`` for the memory budgets and
+``python -m app.loadtest.statements --help`` for the statement overhead. The
+stand-in needs the aiosqlite driver, installed with the ``loadtest`` extra.
+"""
@@ -0,0 +1,98 @@
+"""Command that runs the class changeover scenario against the app."""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import tempfile
+
+from app import create_app
+from app.dependancies import database
+from app.internal.config import AppSettings
+from app.loadtest.scenario import DEFAULT_MIX, LoadRunner, \
+    changeover_phases, format_report, load_scenario
+from app.loadtest.seed import TimedQueuePool, create_stand_in_engine, \
+    seed_database
+
+
+def parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog='python -m app.loadtest',
+        description='Replay a traffic spike against the app.',
+    )
+    parser.add_argument('--base-rate', type=float, default=20,
+                        help='Requests per second outside the spike.')
+    parser.add_argument('--spike-factor', type=float, default=15,
+                        help='Multiple of the base rate at the spike.')
+    parser.add_argument('--scale', type=float, default=1,
+                        help='Multiple of the default phase durations.')
+    parser.add_argument('--scenario',
+                        help='JSON file with the traffic mix and phases.')
+    parser.add_argument('--pool-size', type=int, default=5)
+    parser.add_argument('--max-overflow', type=int, default=10)
+    parser.add_argument('--pool-timeout', type=float, default=30)
+    parser.add_argument('--window', type=float, default=1,
+                        help='Seconds of each reported window.')
+    parser.add_argument('--max-in-flight', type=int, default=2000)
+    parser.add_argument('--seed', type=int, help='Seed of the traffic mix.')
+    parser.add_argument('--database',
+                        help='Path of the stand-in database file.')
+    parser.add_argument('--json', action='store_true',
+                        help='Print the report as JSON.')
+    return parser.parse_args()
+
+
+async def main(arguments: argparse.Namespace) -> None:
+    path = arguments.database or os.path.join(
+        tempfile.mkdtemp(), 'loadtest.sqlite')
+    engine = create_stand_in_engine(
+        path,
+        pool_size=arguments.pool_size,
+        max_overflow=arguments.max_overflow,
+        pool_timeout=arguments.pool_timeout,
+    )
+    await seed_database(engine, path, datetime.datetime.now())
+    database.database_router.primary = engine
+    database.database_router.replicas = []
+
+    settings = AppSettings(
+        DATABASE_URI=f'sqlite+aiosqlite:///{path}',
+        INVALIDATION_MODE='off',
+        TIMETABLE_SNAPSHOT_PATH=None,
+        ACCESS_LOG=False,
+    )
+    app = create_app(settings)
+    mix, phases = DEFAULT_MIX, []
+    if arguments.scenario is not None:
+        mix, phases = load_scenario(arguments.scenario)
+    if not phases:
+        phases = changeover_phases(
+            arguments.base_rate, arguments.spike_factor, arguments.scale)
+
+    pool = engine.sync_engine.pool
+    assert isinstance(pool, TimedQueuePool)
+
+    def pool_waits() -> list[float]:
+        waits, pool.wait_times = pool.wait_times, []
+        return waits
+
+    async with app.router.lifespan_context(app):
+        runner = LoadRunner(
+            app,
+            mix,
+            phases,
+            pool_waits=pool_waits,
+            window=arguments.window,
+            max_in_flight=arguments.max_in_flight,
+            seed=arguments.seed,
+        )
+        report = await runner.run()
+    await engine.dispose()
+    if arguments.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(format_report(report))
+
+
+if __name__ == '__main__':
+    asyncio.run(main(parse_arguments()))
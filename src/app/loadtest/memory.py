@@ -0,0 +1,304 @@
+"""Module that measures the memory each endpoint allocates.
+
+Every case is requested once to warm up the caches of SQLAlchemy, strawberry
+and the interpreter, then requested again while tracemalloc traces the
+allocations. The peak is the most memory held at once above the memory held
+before the request, which is what a worker needs on top of its baseline to
+serve it, and the retained memory is what is still held after the response
+is dropped and a garbage collection, which grows with leaks. Response caches
+and arrival boards are bypassed so the work behind each response is
+measured, and the scheduler is not started since tracemalloc would count the
+allocations of its jobs too.
+
+Budgets are given in KiB per case and can be overridden with a JSON file of
+``{"case": {"peak": KiB, "retained": KiB}}``.
+
+Run ``python -m app.loadtest.memory --help`` for the options.
+"""
+import argparse
+import asyncio
+import datetime
+import gc
+import json
+import os
+import sys
+import tempfile
+import tracemalloc
+from typing import Any, NamedTuple, Optional
+
+import httpx
+
+from app.internal.cache import cache_bypass
+
+SUBWAY_DOCUMENT = (
+    'query { subway { name timetable { up { time } down { time } } '
+    'realtime { up { remainingTime } down { remainingTime } } } }'
+)
+SHUTTLE_DOCUMENT = (
+    'query { shuttle { stop { stopName route { routeID timetable { time } } '
+    'tag { tagID timetable { time } } } } }'
+)
+BUS_DOCUMENT = (
+    'query { bus(routeStop: [{stop: 216000379, route: 216000061}, '
+    '{stop: 216000379, route: 216000068}]) { routeName realtime '
+    '{ remainingTime } timetable { time } } }'
+)
+
+
+class MemoryCase(NamedTuple):
+    """Class that describes a request whose memory is measured.
+    Attributes:
+        name (str): Name used in the report and the budgets.
+        method (str): HTTP method.
+        path (str): Path of the request.
+        json (dict): JSON body, if any.
+    """
+    name: str
+    method: str
+    path: str
+    json: Optional[dict[str, Any]] = None
+
+
+class MemoryBudget(NamedTuple):
+    """Class that holds the memory a case may use.
+    Attributes:
+        peak (int): Maximum peak in KiB.
+        retained (int): Maximum retained memory in KiB.
+    """
+    peak: int
+    retained: int
+
+
+class MemoryUsage(NamedTuple):
+    """Class that holds the memory a request used.
+    Attributes:
+        peak (int): Peak in bytes above the memory held before.
+        retained (int): Bytes still held after the request.
+        top (list[str]): Lines that retained the most memory.
+    """
+    peak: int
+    retained: int
+    top: list[str]
+
+
+DEFAULT_CASES = [
+    MemoryCase('shuttle_arrival', 'GET', '/shuttle/stop/dormitory_o/arrival'),
+    MemoryCase('shuttle_timetable', 'GET',
+               '/shuttle/stop/dormitory_o/timetable'),
+    MemoryCase('bus_arrival', 'GET', '/bus/stop/216000379/arrival'),
+    MemoryCase('subway_arrival', 'GET', '/subway/station/K449/arrival'),
+    MemoryCase('subway_timetable', 'GET', '/subway/station/K449/timetable'),
+    MemoryCase('graphql_shuttle', 'POST', '/query',
+               json={'query': SHUTTLE_DOCUMENT}),
+    MemoryCase('graphql_subway', 'POST', '/query',
+               json={'query': SUBWAY_DOCUMENT}),
+    MemoryCase('graphql_bus', 'POST', '/query', json={'query': BUS_DOCUMENT}),
+]
+# The schema's parser and validation caches are shared extension instances
+# that keep the context of the last operation, so a document retains its
+# last result until the next operation.
+DEFAULT_BUDGETS = {
+    'shuttle_arrival': MemoryBudget(peak=3072, retained=256),
+    'shuttle_timetable': MemoryBudget(peak=3072, retained=256),
+    'bus_arrival': MemoryBudget(peak=3072, retained=256),
+    'subway_arrival': MemoryBudget(peak=3072, retained=256),
+    'subway_timetable': MemoryBudget(peak=7168, retained=256),
+    'graphql_shuttle': MemoryBudget(peak=12288, retained=1536),
+    'graphql_subway': MemoryBudget(peak=4096, retained=512),
+    'graphql_bus': MemoryBudget(peak=2048, retained=256),
+}
+
+
+def load_budgets(path: Optional[str] = None) -> dict[str, MemoryBudget]:
+    """Function to get the default budgets updated from a JSON file.
+    Args:
+        path (str): Path of the JSON file, or None for the defaults.
+    Returns:
+        dict[str, MemoryBudget]: Budget of each case.
+    """
+    budgets = dict(DEFAULT_BUDGETS)
+    if path is not None:
+        with open(path) as file:
+            budgets.update(
+                (name, MemoryBudget(**budget))
+                for name, budget in json.load(file).items()
+            )
+    return budgets
+
+
+async def measure_request(
+    client: httpx.AsyncClient,
+    case: MemoryCase,
+    top: int = 5,
+) -> MemoryUsage:
+    """Function to measure the allocations of one request.
+    Args:
+        client (httpx.AsyncClient): Client of the app.
+        case (MemoryCase): Request to measure.
+        top (int): Number of lines to report in the retained memory.
+    Returns:
+        MemoryUsage: Peak and retained memory of the request.
+    """
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    try:
+        gc.collect()
+        before = tracemalloc.take_snapshot()
+        baseline = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        response = await client.request(
+            case.method, case.path, json=case.json)
+        peak = tracemalloc.get_traced_memory()[1] - baseline
+        response.raise_for_status()
+        del response
+        gc.collect()
+        retained = tracemalloc.get_traced_memory()[0] - baseline
+        after = tracemalloc.take_snapshot()
+    finally:
+        if started:
+            tracemalloc.stop()
+    statistics = after.filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+    ]).compare_to(before, 'lineno')
+    return MemoryUsage(
+        peak=peak,
+        retained=retained,
+        top=[str(statistic) for statistic in statistics[:top]],
+    )
+
+
+async def measure_cases(
+    app: Any,
+    cases: list[MemoryCase],
+    warmup: int = 1,
+) -> dict[str, MemoryUsage]:
+    """Function to measure every case against an app.
+    Args:
+        app (Any): ASGI application with its startup already run.
+        cases (list[MemoryCase]): Requests to measure.
+        warmup (int): Number of requests of each case before measuring.
+    Returns:
+        dict[str, MemoryUsage]: Memory used by each case.
+    """
+    token = cache_bypass.set(True)
+    try:
+        async with httpx.AsyncClient(
+            app=app,
+            base_url='http://memory',
+        ) as client:
+            usages = {}
+            for case in cases:
+                for _ in range(warmup):
+                    await client.request(case.method, case.path,
+                                         json=case.json)
+                usages[case.name] = await measure_request(client, case)
+            return usages
+    finally:
+        cache_bypass.reset(token)
+
+
+def over_budget(
+    usages: dict[str, MemoryUsage],
+    budgets: dict[str, MemoryBudget],
+) -> list[str]:
+    """Function to describe the cases that exceed their budgets.
+    Args:
+        usages (dict[str, MemoryUsage]): Memory used by each case.
+        budgets (dict[str, MemoryBudget]): Budget of each case. Cases
+            without a budget are not checked.
+    Returns:
+        list[str]: One message per exceeded limit.
+    """
+    messages = []
+    for name, usage in usages.items():
+        budget = budgets.get(name)
+        if budget is None:
+            continue
+        if usage.peak > budget.peak * 1024:
+            messages.append(
+                f'{name}: peak {usage.peak / 1024:.0f} KiB exceeds the '
+                f'budget of {budget.peak} KiB')
+        if usage.retained > budget.retained * 1024:
+            messages.append(
+                f'{name}: retained {usage.retained / 1024:.0f} KiB exceeds '
+                f'the budget of {budget.retained} KiB\n' +
+                '\n'.join(usage.top))
+    return messages
+
+
+def format_memory_report(
+    usages: dict[str, MemoryUsage],
+    budgets: dict[str, MemoryBudget],
+) -> str:
+    """Function to render the measured memory as a text table.
+    Args:
+        usages (dict[str, MemoryUsage]): Memory used by each case.
+        budgets (dict[str, MemoryBudget]): Budget of each case.
+    Returns:
+        str: Rendered report, in KiB.
+    """
+    lines = [
+        f'{"case":<20} {"peak":>8} {"budget":>8} {"retained":>8} '
+        f'{"budget":>8}',
+    ]
+    for name, usage in usages.items():
+        budget = budgets.get(name)
+        lines.append(
+            f'{name:<20} {usage.peak / 1024:>8.0f} '
+            f'{budget.peak if budget else "-":>8} '
+            f'{usage.retained / 1024:>8.0f} '
+            f'{budget.retained if budget else "-":>8}',
+        )
+    return '\n'.join(lines)
+
+
+def parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog='python -m app.loadtest.memory',
+        description='Measure the memory each endpoint allocates.',
+    )
+    parser.add_argument('--budgets',
+                        help='JSON file overriding the budgets in KiB.')
+    parser.add_argument('--interval', type=int, default=10,
+                        help='Minutes between two seeded shuttle '
+                             'departures.')
+    parser.add_argument('--database',
+                        help='Path of the stand-in database file.')
+    return parser.parse_args()
+
+
+async def main(arguments: argparse.Namespace) -> int:
+    from app import create_app
+    from app.dependancies import database
+    from app.internal.config import AppSettings
+    from app.loadtest.seed import create_stand_in_engine, seed_database
+
+    path = arguments.database or os.path.join(
+        tempfile.mkdtemp(), 'memory.sqlite')
+    engine = create_stand_in_engine(path)
+    await seed_database(engine, path, datetime.datetime.now(),
+                        interval=arguments.interval)
+    database.database_router.primary = engine
+    database.database_router.replicas = []
+    app = create_app(AppSettings(
+        DATABASE_URI=f'sqlite+aiosqlite:///{path}',
+        INVALIDATION_MODE='off',
+        TIMETABLE_SNAPSHOT_PATH=None,
+        ACCESS_LOG=False,
+        SCHEDULER_ENABLED=False,
+    ))
+    async with app.router.lifespan_context(app):
+        usages = await measure_cases(app, DEFAULT_CASES)
+    await engine.dispose()
+
+    budgets = load_budgets(arguments.budgets)
+    print(format_memory_report(usages, budgets))
+    messages = over_budget(usages, budgets)
+    for message in messages:
+        print(message, file=sys.stderr)
+    return 1 if messages else 0
+
+
+if __name__ == '__main__':
+    sys.exit(asyncio.run(main(parse_arguments())))
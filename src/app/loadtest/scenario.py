@@ -0,0 +1,351 @@
+"""Module that replays a traffic mix against the app and measures it.
+
+Requests are started on an open-loop schedule that follows the rate of the
+current phase, so a slow app builds up requests in flight instead of
+slowing down the load as a closed-loop client would. Every window of the
+run reports latency percentiles, the error rate and how long checkouts
+waited for a database connection.
+"""
+import asyncio
+import json
+import math
+import random
+import time
+from typing import Any, Callable, NamedTuple, Optional
+
+import httpx
+
+SHUTTLE_QUERY = (
+    'query { shuttle { stop { stopName tag { tagID '
+    'timetable { time remainingTime } } } } }'
+)
+
+
+class RequestSpec(NamedTuple):
+    """Class that describes one kind of request of the traffic mix.
+    Attributes:
+        name (str): Name used in the report.
+        method (str): HTTP method.
+        path (str): Path, formatted with a random value of each choice.
+        weight (float): Share of the traffic.
+        json (dict): JSON body, if any.
+        choices (dict[str, list[str]]): Values of the path placeholders.
+    """
+    name: str
+    method: str
+    path: str
+    weight: float
+    json: Optional[dict[str, Any]] = None
+    choices: dict[str, list[str]] = {}
+
+
+class Phase(NamedTuple):
+    """Class that describes a phase whose rate changes linearly.
+    Attributes:
+        name (str): Name used in the report.
+        duration (float): Length in seconds.
+        start_rate (float): Requests per second at the start.
+        end_rate (float): Requests per second at the end.
+    """
+    name: str
+    duration: float
+    start_rate: float
+    end_rate: float
+
+
+class Sample(NamedTuple):
+    name: str
+    latency: float
+    status: int
+
+
+DEFAULT_MIX = [
+    RequestSpec(
+        'shuttle_arrival', 'GET', '/shuttle/stop/{stop}/arrival', 60,
+        choices={'stop': ['dormitory_o', 'shuttlecock_o', 'station',
+                          'terminal', 'jungang_stn', 'shuttlecock_i']},
+    ),
+    RequestSpec(
+        'graphql_shuttle', 'POST', '/query', 25,
+        json={'query': SHUTTLE_QUERY},
+    ),
+    RequestSpec(
+        'shuttle_timetable', 'GET', '/shuttle/stop/{stop}/timetable', 5,
+        choices={'stop': ['dormitory_o', 'shuttlecock_o', 'station']},
+    ),
+    RequestSpec('bus_arrival', 'GET', '/bus/stop/{stop}/arrival', 5,
+                choices={'stop': ['216000379', '216000719']}),
+    RequestSpec('subway_arrival', 'GET', '/subway/station/{station}/arrival',
+                5, choices={'station': ['K449', 'K251']}),
+]
+
+
+def changeover_phases(
+    base_rate: float,
+    spike_factor: float,
+    scale: float = 1,
+) -> list[Phase]:
+    """Function to build the phases of a class changeover.
+
+    Traffic sits at the base rate, climbs to the spike in the minutes
+    around :50 and :00, holds, then decays back.
+    Args:
+        base_rate (float): Requests per second outside the spike.
+        spike_factor (float): Multiple of the base rate at the spike.
+        scale (float): Multiple of the default phase durations.
+    Returns:
+        list[Phase]: Phases of the scenario.
+    """
+    spike_rate = base_rate * spike_factor
+    return [
+        Phase('baseline', 10 * scale, base_rate, base_rate),
+        Phase('ramp', 10 * scale, base_rate, spike_rate),
+        Phase('spike', 20 * scale, spike_rate, spike_rate),
+        Phase('decay', 10 * scale, spike_rate, base_rate),
+    ]
+
+
+def load_scenario(path: str) -> tuple[list[RequestSpec], list[Phase]]:
+    """Function to read a traffic mix and phases from a JSON file.
+
+    The file has a ``mix`` list of RequestSpec fields and a ``phases``
+    list of Phase fields; either can be left out to keep the default.
+    Args:
+        path (str): Path of the JSON file.
+    Returns:
+        tuple[list[RequestSpec], list[Phase]]: Mix and phases, the phases
+            being empty when the file does not define them.
+    """
+    with open(path) as file:
+        scenario = json.load(file)
+    mix = [RequestSpec(**spec) for spec in scenario.get('mix', [])]
+    phases = [Phase(**phase) for phase in scenario.get('phases', [])]
+    return mix or DEFAULT_MIX, phases
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    """Function to get a percentile by the nearest-rank method.
+    Args:
+        values (list[float]): Sorted values.
+        fraction (float): Percentile between 0 and 1.
+    Returns:
+        float: Percentile, or 0 without values.
+    """
+    if not values:
+        return 0
+    return values[max(math.ceil(fraction * len(values)) - 1, 0)]
+
+
+def summarize(
+    samples: list[Sample],
+    pool_waits: list[float],
+) -> dict[str, float]:
+    latencies = sorted(sample.latency for sample in samples)
+    waits = sorted(pool_waits)
+    errors = sum(1 for sample in samples if sample.status >= 500)
+    return {
+        'requests': len(samples),
+        'error_rate': errors / len(samples) if samples else 0,
+        'p50_ms': percentile(latencies, 0.5) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'max_ms': (latencies[-1] if latencies else 0) * 1000,
+        'pool_checkouts': len(waits),
+        'pool_wait_p95_ms': percentile(waits, 0.95) * 1000,
+        'pool_wait_max_ms': (waits[-1] if waits else 0) * 1000,
+    }
+
+
+class LoadRunner:
+    """Class that replays a traffic mix against an ASGI app.
+    Attributes:
+        app (Any): ASGI application.
+        mix (list[RequestSpec]): Traffic mix.
+        phases (list[Phase]): Phases of the scenario.
+        pool_waits (Callable): Function returning the pool waits recorded
+            since its previous call.
+        window (float): Seconds of each reported window.
+        max_in_flight (int): Requests in flight above which new requests
+            are dropped and counted as status 0.
+        timeout (float): Seconds before a request counts as failed.
+    """
+
+    def __init__(
+        self,
+        app: Any,
+        mix: list[RequestSpec],
+        phases: list[Phase],
+        pool_waits: Callable[[], list[float]] = list,
+        window: float = 1,
+        max_in_flight: int = 2000,
+        timeout: float = 30,
+        seed: Optional[int] = None,
+    ) -> None:
+        self.app = app
+        self.mix = mix
+        self.phases = phases
+        self.pool_waits = pool_waits
+        self.window = window
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self._random = random.Random(seed)
+        self._weights = [spec.weight for spec in mix]
+        self._in_flight: set[asyncio.Task] = set()
+        self.samples: list[Sample] = []
+        self._reported = 0
+        self.windows: list[dict[str, Any]] = []
+
+    def rate_at(self, elapsed: float) -> Optional[tuple[str, float]]:
+        for phase in self.phases:
+            if elapsed < phase.duration:
+                progress = elapsed / phase.duration
+                return phase.name, phase.start_rate + \
+                    (phase.end_rate - phase.start_rate) * progress
+            elapsed -= phase.duration
+        return None
+
+    async def _send(self, client: httpx.AsyncClient) -> None:
+        spec = self._random.choices(self.mix, self._weights)[0]
+        path = spec.path.format(**{
+            key: self._random.choice(values)
+            for key, values in spec.choices.items()
+        })
+        request_started = time.perf_counter()
+        try:
+            response = await asyncio.wait_for(
+                client.request(spec.method, path, json=spec.json),
+                self.timeout,
+            )
+            status = response.status_code
+        except Exception:
+            status = 599
+        self.samples.append(Sample(
+            spec.name,
+            time.perf_counter() - request_started,
+            status,
+        ))
+
+    def _close_window(self, second: float, phase: str, rate: float) -> None:
+        # Samples are appended on completion, so a window reports the
+        # requests that finished in it.
+        samples = [
+            sample for sample in self.samples[self._reported:]
+            if sample.name != 'dropped'
+        ]
+        self._reported = len(self.samples)
+        report = summarize(samples, self.pool_waits())
+        report.update(
+            second=second,
+            phase=phase,
+            offered_rate=rate,
+            in_flight=len(self._in_flight),
+        )
+        self.windows.append(report)
+
+    async def run(self) -> dict[str, Any]:
+        """Function to run every phase and wait for the last requests.
+        Returns:
+            dict: Report with the windows, each kind of request and the
+                whole run.
+        """
+        self.pool_waits()
+        async with httpx.AsyncClient(
+            app=self.app,
+            base_url='http://loadtest',
+        ) as client:
+            started = time.perf_counter()
+            credit, window_index = 0.0, 0
+            previous = started
+            phase, rate = '', 0.0
+            while True:
+                now = time.perf_counter()
+                elapsed = now - started
+                current = self.rate_at(elapsed)
+                if current is None:
+                    break
+                phase, rate = current
+                credit += rate * (now - previous)
+                previous = now
+                while credit >= 1:
+                    credit -= 1
+                    if len(self._in_flight) >= self.max_in_flight:
+                        self.samples.append(Sample('dropped', 0, 0))
+                        continue
+                    task = asyncio.create_task(self._send(client))
+                    self._in_flight.add(task)
+                    task.add_done_callback(self._in_flight.discard)
+                while elapsed >= (window_index + 1) * self.window:
+                    window_index += 1
+                    self._close_window(window_index * self.window, phase,
+                                       rate)
+                await asyncio.sleep(0.005)
+            if self._in_flight:
+                await asyncio.wait(set(self._in_flight))
+            self._close_window(time.perf_counter() - started, 'drain', 0)
+
+        by_name: dict[str, list[Sample]] = {}
+        for sample in self.samples:
+            by_name.setdefault(sample.name, []).append(sample)
+        dropped = len(by_name.pop('dropped', []))
+        total = summarize(
+            [sample for samples in by_name.values() for sample in samples],
+            [],
+        )
+        total['dropped'] = dropped
+        total['pool_checkouts'] = sum(
+            window['pool_checkouts'] for window in self.windows)
+        total['pool_wait_max_ms'] = max(
+            (window['pool_wait_max_ms'] for window in self.windows),
+            default=0,
+        )
+        del total['pool_wait_p95_ms']
+        return {
+            'windows': self.windows,
+            'requests': {
+                name: summarize(samples, [])
+                for name, samples in sorted(by_name.items())
+            },
+            'total': total,
+        }
+
+
+def format_report(report: dict[str, Any]) -> str:
+    """Function to render a report as text tables.
+    Args:
+        report (dict): Report returned by LoadRunner.run.
+    Returns:
+        str: Rendered report.
+    """
+    lines = [
+        f'{"sec":>5} {"phase":<9} {"rate":>6} {"done":>5} {"err%":>5} '
+        f'{"p50":>7} {"p95":>7} {"p99":>7} {"wait95":>7} {"waitmax":>7} '
+        f'{"flight":>6}',
+    ]
+    for window in report['windows']:
+        lines.append(
+            f'{window["second"]:>5.0f} {window["phase"]:<9} '
+            f'{window["offered_rate"]:>6.0f} {window["requests"]:>5} '
+            f'{window["error_rate"] * 100:>5.1f} '
+            f'{window["p50_ms"]:>7.1f} {window["p95_ms"]:>7.1f} '
+            f'{window["p99_ms"]:>7.1f} {window["pool_wait_p95_ms"]:>7.1f} '
+            f'{window["pool_wait_max_ms"]:>7.1f} {window["in_flight"]:>6}',
+        )
+    lines.append('')
+    lines.append(
+        f'{"request":<20} {"count":>6} {"err%":>5} {"p50":>7} {"p95":>7} '
+        f'{"p99":>7} {"max":>7}',
+    )
+    for name, summary in [*report['requests'].items(),
+                          ('total', report['total'])]:
+        lines.append(
+            f'{name:<20} {summary["requests"]:>6} '
+            f'{summary["error_rate"] * 100:>5.1f} '
+            f'{summary["p50_ms"]:>7.1f} {summary["p95_ms"]:>7.1f} '
+            f'{summary["p99_ms"]:>7.1f} {summary["max_ms"]:>7.1f}',
+        )
+    lines.append(
+        f'dropped {report["total"]["dropped"]}, pool checkouts '
+        f'{report["total"]["pool_checkouts"]}, longest pool wait '
+        f'{report["total"]["pool_wait_max_ms"]:.1f} ms',
+    )
+    return '\n'.join(lines)
@@ -0,0 +1,246 @@
+"""Module that builds the database stand-in for the load test.
+
+The stand-in is a SQLite file created from the models and filled with a
+synthetic but realistically sized copy of the timetables, so the load test
+exercises the same statements as production without a PostgreSQL server.
+"""
+import datetime
+import os
+import time
+from typing import Any, Optional
+
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, \
+    create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from app.internal.date_utils import KST
+from app.model import BaseModel
+from app.model.bus import BusRealtimeItem, BusRoute, BusRouteStop, BusStop, \
+    BusTimetableItem
+from app.model.cafeteria import Menu, Restaurant
+from app.model.campus import Campus
+from app.model.commute_shuttle import CommuteShuttleRoute, \
+    CommuteShuttleStop, CommuteShuttleTimetableItem
+from app.model.library import ReadingRoom
+from app.model.shuttle import ShuttlePeriod, ShuttlePeriodType, \
+    ShuttleRoute, ShuttleRouteStop, ShuttleStop, ShuttleTimetableItem
+from app.model.subway import Line, RealtimeItem, RouteStation, Station, \
+    TimetableItem
+
+SHUTTLE_STOPS = [
+    'dormitory_o', 'shuttlecock_o', 'station', 'terminal', 'jungang_stn',
+    'shuttlecock_i', 'dormitory_i',
+]
+SHUTTLE_ROUTES = {
+    'DHDD': ('DH', ['dormitory_o', 'shuttlecock_o', 'station',
+                    'shuttlecock_i', 'dormitory_i']),
+    'DYDD': ('DY', ['dormitory_o', 'shuttlecock_o', 'terminal',
+                    'shuttlecock_i', 'dormitory_i']),
+    'DJDD': ('DJ', ['dormitory_o', 'shuttlecock_o', 'station',
+                    'jungang_stn', 'shuttlecock_i', 'dormitory_i']),
+    'C': ('C', ['dormitory_o', 'shuttlecock_o', 'station', 'terminal',
+                'shuttlecock_i', 'dormitory_i']),
+}
+BUS_STOPS = [216000379, 216000719, 216000138]
+BUS_ROUTES = [216000061, 216000068, 216000070, 217000014]
+SUBWAY_STATIONS = ['K449', 'K251']
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """Pool that records how long each checkout waited for a connection.
+    Attributes:
+        wait_times (list[float]): Seconds each checkout waited.
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.wait_times: list[float] = []
+
+    def _do_get(self) -> Any:
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            self.wait_times.append(time.perf_counter() - started)
+
+
+def create_stand_in_engine(
+    path: str,
+    pool_size: int = 5,
+    max_overflow: int = 10,
+    pool_timeout: float = 30,
+) -> AsyncEngine:
+    """Function to create an engine on the stand-in database.
+    Args:
+        path (str): Path of the SQLite file.
+        pool_size (int): Number of connections kept in the pool.
+        max_overflow (int): Number of connections opened beyond the pool.
+        pool_timeout (float): Seconds to wait for a connection.
+    Returns:
+        AsyncEngine: Engine with a TimedQueuePool.
+    """
+    return create_async_engine(
+        f'sqlite+aiosqlite:///{path}',
+        poolclass=TimedQueuePool,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_timeout=pool_timeout,
+    )
+
+
+def _minutes(total: int) -> datetime.time:
+    return datetime.time(total // 60 % 24, total % 60)
+
+
+async def seed_database(
+    engine: AsyncEngine,
+    path: Optional[str],
+    now: datetime.datetime,
+    interval: int = 10,
+) -> None:
+    """Function to create and fill the stand-in database.
+    Args:
+        engine (AsyncEngine): Engine on the stand-in database.
+        path (str): Path of the SQLite file, replaced if it exists, or None
+            for a database server whose schema is empty.
+        now (datetime.datetime): Time the current period is built around.
+        interval (int): Minutes between two shuttle departures.
+    """
+    if path is not None and os.path.exists(path):
+        os.remove(path)
+    async with engine.begin() as connection:
+        await connection.run_sync(BaseModel.metadata.create_all)
+
+    items: list[BaseModel] = []
+    # The bus and subway feeds store the time in Korea, which their arrivals
+    # are aged against.
+    feed_time = now.astimezone(KST).replace(tzinfo=None)
+    items.extend(
+        ShuttleStop(name=name, latitude=37.29, longitude=126.83)
+        for name in SHUTTLE_STOPS
+    )
+    items.append(ShuttlePeriodType(name='semester'))
+    items.append(ShuttlePeriod(
+        period_type_name='semester',
+        start=now - datetime.timedelta(days=30),
+        end=now + datetime.timedelta(days=30),
+    ))
+    for route_name, (tag, stops) in SHUTTLE_ROUTES.items():
+        items.append(ShuttleRoute(
+            name=route_name,
+            korean=route_name,
+            english=route_name,
+            tags=tag,
+            start_stop_id=stops[0],
+            end_stop_id=stops[-1],
+        ))
+        for order, stop_name in enumerate(stops):
+            items.append(ShuttleRouteStop(
+                route_name=route_name,
+                stop_name=stop_name,
+                stop_order=order,
+                cumulative_time=order * 5,
+            ))
+            for weekday in (True, False):
+                items.extend(
+                    ShuttleTimetableItem(
+                        period_type_name='semester',
+                        weekday=weekday,
+                        route_name=route_name,
+                        stop_name=stop_name,
+                        departure_time=_minutes(start + order * 5),
+                    )
+                    for start in range(7 * 60, 23 * 60, interval)
+                )
+
+    items.append(Campus(id=1, name='ERICA'))
+    items.append(Restaurant(
+        id=1, name='학생식당', campus_id=1, latitude=37.29, longitude=126.83,
+    ))
+    items.append(Menu(
+        restaurant_id=1, date=now.date(), slot='중식', food='백반',
+        price='5000',
+    ))
+    items.append(ReadingRoom(
+        id=1, name='제1열람실', campus_id=1, active=True, reservable=True,
+        total_seats=200, active_seats=200, occupied_seats=50,
+        available_seats=150, last_updated_time=now,
+    ))
+
+    items.extend(
+        BusStop(
+            id=stop_id, name=str(stop_id), latitude=37.29, longitude=126.83,
+            district=1, region='안산', mobile_number=str(stop_id),
+        )
+        for stop_id in BUS_STOPS
+    )
+    for route_id in BUS_ROUTES:
+        items.append(BusRoute(
+            id=route_id, name=str(route_id), type_code='13',
+            type_name='일반형시내버스', company_id=1, company_name='경기',
+            company_telephone='031', discrict=1,
+            up_first_time=datetime.time(5), down_first_time=datetime.time(5),
+            up_last_time=datetime.time(23), down_last_time=datetime.time(23),
+            start_stop_id=BUS_STOPS[0], end_stop_id=BUS_STOPS[-1],
+        ))
+        for order, stop_id in enumerate(BUS_STOPS):
+            items.append(BusRouteStop(
+                route_id=route_id, stop_id=stop_id, order=order,
+                start_stop_id=BUS_STOPS[0],
+            ))
+            items.append(BusRealtimeItem(
+                route_id=route_id, stop_id=stop_id, sequence=1, stop=3,
+                seat=10, minutes=7, low_floor=True,
+                last_updated_time=feed_time,
+            ))
+        for weekday in ('weekdays', 'saturday', 'sunday'):
+            items.extend(
+                BusTimetableItem(
+                    route_id=route_id, start_stop_id=BUS_STOPS[0],
+                    weekday=weekday, departure_time=_minutes(start),
+                )
+                for start in range(5 * 60, 24 * 60, 15)
+            )
+
+    items.append(Line(id=1004, name='4호선'))
+    for sequence, station_id in enumerate(SUBWAY_STATIONS):
+        items.append(Station(name=station_id))
+        items.append(RouteStation(
+            id=station_id, line_id=1004, station_name=station_id,
+            sequence=sequence, cumulative_time=sequence * 10,
+        ))
+    for station_id in SUBWAY_STATIONS:
+        for heading in ('up', 'down'):
+            for weekday in ('weekdays', 'weekends'):
+                items.extend(
+                    TimetableItem(
+                        station_id=station_id,
+                        destination_id=SUBWAY_STATIONS[-1],
+                        start_station_id=SUBWAY_STATIONS[0],
+                        weekday=weekday, heading=heading,
+                        departure_time=_minutes(start),
+                    )
+                    for start in range(5 * 60, 24 * 60, 8)
+                )
+            items.append(RealtimeItem(
+                station_id=station_id, destination_id=SUBWAY_STATIONS[-1],
+                heading='true' if heading == 'up' else 'false', sequence=1,
+                location=station_id, stop=2, minute=4, train='1234',
+                express=False, last=False, status=0,
+                last_updated_at=feed_time,
+            ))
+
+    items.append(CommuteShuttleRoute(name='R1', korean='R1', english='R1'))
+    for order, stop_name in enumerate(['A', 'B', 'C']):
+        items.append(CommuteShuttleStop(
+            name=stop_name, description=stop_name, latitude=37.29,
+            longitude=126.83,
+        ))
+        items.append(CommuteShuttleTimetableItem(
+            route_name='R1', stop_name=stop_name, stop_order=order,
+            departure_time=datetime.time(7, 10 * order),
+        ))
+
+    async with AsyncSession(engine) as session:
+        session.add_all(items)
+        await session.commit()
@@ -0,0 +1,329 @@
+"""Module that measures the Python overhead of the hot statements.
+
+Every case pairs a statement built on each call with literal values, the
+way the hot paths built them before, with the statement the app executes
+now: a module constant with bound parameters or a lambda statement. The
+preparation time is what a call spends constructing the statement and
+computing the cache key that SQLAlchemy looks its compiled form up by, and
+the execution time adds running the statement against the seeded stand-in
+and fetching its rows. Statements are compiled once during the warm-up, so
+neither time includes compiling them.
+
+Run ``python -m app.loadtest.statements --help`` for the options.
+"""
+import argparse
+import asyncio
+import datetime
+import os
+import sys
+import tempfile
+import time
+from typing import Any, Callable, NamedTuple
+
+from sqlalchemy import and_, or_, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from sqlalchemy.orm import aliased
+from sqlalchemy.sql import Executable
+
+from app.controller.query import shuttle as shuttle_query
+from app.controller.query import subway as subway_query
+from app.internal import date_utils
+from app.model.bus import BusRoute, BusRouteStop, BusStop
+from app.model.calendar import Holiday
+from app.model.shuttle import ShuttlePeriod, ShuttleRoute, \
+    ShuttleRouteStop, ShuttleStop, ShuttleTimetableItem
+from app.model.subway import RouteStation, TimetableItem
+from app.rows import bus as bus_rows
+from app.rows import shuttle as shuttle_rows
+from app.rows import subway as subway_rows
+
+StatementFactory = Callable[[], tuple[Executable, dict[str, Any]]]
+TODAY = datetime.date(2023, 5, 1)
+STOPS = ['dormitory_o', 'station']
+PAIRS = [(216000379, 216000061), (216000379, 216000068)]
+
+
+class StatementCase(NamedTuple):
+    """Class that describes a statement whose overhead is measured.
+    Attributes:
+        name (str): Name used in the report.
+        built (StatementFactory): Function returning the statement built
+            with literal values and no parameters.
+        cached (StatementFactory): Function returning the statement the
+            app executes and its parameters.
+    """
+    name: str
+    built: StatementFactory
+    cached: StatementFactory
+
+
+class StatementTiming(NamedTuple):
+    """Class that holds the time a statement takes per call.
+    Attributes:
+        prepare (float): Microseconds to construct the statement and compute
+            its cache key.
+        execute (float): Microseconds to also execute it and fetch its rows.
+    """
+    prepare: float
+    execute: float
+
+
+def build_period() -> tuple[Executable, dict[str, Any]]:
+    return select(ShuttlePeriod).where(
+        and_(ShuttlePeriod.start <= TODAY, ShuttlePeriod.end >= TODAY),
+    ), {}
+
+
+def build_holiday() -> tuple[Executable, dict[str, Any]]:
+    return select(Holiday).where(
+        or_(
+            and_(
+                Holiday.holiday_date == TODAY,
+                Holiday.calendar_type == 'solar',
+            ),
+            and_(
+                Holiday.holiday_date == date_utils.lunar_date(TODAY),
+                Holiday.calendar_type == 'lunar',
+            ),
+        ),
+    ), {}
+
+
+def build_shuttle_stop() -> tuple[Executable, dict[str, Any]]:
+    return select(
+        ShuttleStop.name, ShuttleRouteStop.route_name, ShuttleRoute.tags,
+    ).outerjoin(
+        ShuttleRouteStop, ShuttleRouteStop.stop_name == ShuttleStop.name,
+    ).outerjoin(
+        ShuttleRoute, ShuttleRoute.name == ShuttleRouteStop.route_name,
+    ).order_by(ShuttleRouteStop.route_name).where(
+        ShuttleStop.name == 'dormitory_o'), {}
+
+
+def build_bus_route_stop(criterion: Any) -> Executable:
+    start_stop = aliased(BusStop)
+    return select(
+        BusRouteStop.stop_id, BusStop.name, BusRouteStop.route_id,
+        BusRoute.name, BusRouteStop.order, start_stop.id, start_stop.name,
+    ).join(
+        BusStop, BusStop.id == BusRouteStop.stop_id,
+    ).join(
+        BusRoute, BusRoute.id == BusRouteStop.route_id,
+    ).outerjoin(
+        start_stop, start_stop.id == BusRouteStop.start_stop_id,
+    ).where(criterion)
+
+
+def build_bus_stop() -> tuple[Executable, dict[str, Any]]:
+    return build_bus_route_stop(BusRouteStop.stop_id == 216000379), {}
+
+
+def build_subway_timetable() -> tuple[Executable, dict[str, Any]]:
+    origin = aliased(RouteStation)
+    destination = aliased(RouteStation)
+    return select(
+        TimetableItem.station_id, TimetableItem.weekday,
+        TimetableItem.heading, origin.id, origin.station_name,
+        TimetableItem.destination_id, destination.station_name,
+        TimetableItem.departure_time,
+    ).join(
+        origin, TimetableItem.start_station_id == origin.id,
+    ).join(
+        destination, TimetableItem.destination_id == destination.id,
+    ).where(TimetableItem.station_id == 'K449').order_by(
+        TimetableItem.departure_time, TimetableItem.heading,
+        TimetableItem.weekday), {}
+
+
+def build_shuttle_rows() -> tuple[Executable, dict[str, Any]]:
+    return select(
+        ShuttleTimetableItem.route_name, ShuttleTimetableItem.stop_name,
+        ShuttleTimetableItem.period_type_name, ShuttleTimetableItem.weekday,
+        ShuttleTimetableItem.departure_time,
+    ).order_by(ShuttleTimetableItem.departure_time).where(
+        ShuttleTimetableItem.stop_name.in_(STOPS)), {}
+
+
+def build_bus_route_stops() -> tuple[Executable, dict[str, Any]]:
+    return build_bus_route_stop(
+        tuple_(BusRouteStop.stop_id, BusRouteStop.route_id).in_(PAIRS)), {}
+
+
+def build_subway_rows() -> tuple[Executable, dict[str, Any]]:
+    destination = aliased(RouteStation)
+    return select(
+        TimetableItem.station_id, TimetableItem.heading,
+        TimetableItem.weekday, TimetableItem.departure_time,
+        destination.id, destination.station_name,
+    ).join(
+        destination, TimetableItem.destination_id == destination.id,
+    ).where(and_(
+        TimetableItem.station_id.in_(['K449']),
+        TimetableItem.heading == 'up',
+    )), {}
+
+
+DEFAULT_CASES = [
+    StatementCase(
+        'current_period', build_period,
+        lambda: (date_utils.PERIOD_STATEMENT, {'value': TODAY}),
+    ),
+    StatementCase(
+        'is_holiday', build_holiday,
+        lambda: (date_utils.HOLIDAY_STATEMENT, {
+            'solar': TODAY, 'lunar': date_utils.lunar_date(TODAY),
+        }),
+    ),
+    StatementCase(
+        'shuttle_stop', build_shuttle_stop,
+        lambda: (shuttle_rows.STOP_ROUTE_STOP_STATEMENT,
+                 {'stop_id': 'dormitory_o'}),
+    ),
+    StatementCase(
+        'bus_stop', build_bus_stop,
+        lambda: (bus_rows.STOP_STATEMENTS[0], {'stop_id': 216000379}),
+    ),
+    StatementCase(
+        'subway_timetable', build_subway_timetable,
+        lambda: (subway_rows.STATION_DEPARTURE_STATEMENT,
+                 {'station_id': 'K449'}),
+    ),
+    StatementCase(
+        'graphql_shuttle_rows', build_shuttle_rows,
+        lambda: (shuttle_query.TIMETABLE_ROWS_BY_STOP_STATEMENT,
+                 {'stops': STOPS}),
+    ),
+    StatementCase(
+        'graphql_bus_route_stops', build_bus_route_stops,
+        lambda: (bus_rows.PAIR_STATEMENTS[0], {'pairs': PAIRS}),
+    ),
+    StatementCase(
+        'graphql_subway_rows', build_subway_rows,
+        lambda: (subway_query.build_row_statements(['K449'], 'up', None)[1],
+                 {}),
+    ),
+]
+
+
+def measure_prepare(factory: StatementFactory, iterations: int) -> float:
+    """Function to measure the construction and cache key of a statement.
+    Args:
+        factory (StatementFactory): Function returning the statement.
+        iterations (int): Number of calls to average.
+    Returns:
+        float: Microseconds per call.
+    """
+    started = time.perf_counter()
+    for _ in range(iterations):
+        statement, _ = factory()
+        statement._generate_cache_key()
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+async def measure_execute(
+    engine: AsyncEngine,
+    factory: StatementFactory,
+    iterations: int,
+) -> float:
+    """Function to measure a statement executed against a database.
+    Args:
+        engine (AsyncEngine): Engine of the database.
+        factory (StatementFactory): Function returning the statement.
+        iterations (int): Number of calls to average.
+    Returns:
+        float: Microseconds per call.
+    """
+    async with AsyncSession(engine) as db_session:
+        started = time.perf_counter()
+        for _ in range(iterations):
+            statement, parameters = factory()
+            (await db_session.execute(statement, parameters)).all()
+            db_session.expunge_all()
+        return (time.perf_counter() - started) / iterations * 1e6
+
+
+async def measure_cases(
+    engine: AsyncEngine,
+    cases: list[StatementCase],
+    iterations: int = 1000,
+    executions: int = 50,
+) -> dict[str, tuple[StatementTiming, StatementTiming]]:
+    """Function to measure every case.
+    Args:
+        engine (AsyncEngine): Engine of the seeded database.
+        cases (list[StatementCase]): Statements to measure.
+        iterations (int): Number of calls to average the preparation over.
+        executions (int): Number of calls to average the execution over.
+    Returns:
+        dict[str, tuple[StatementTiming, StatementTiming]]: Timing of the
+            built and the cached statement of each case.
+    """
+    timings = {}
+    for case in cases:
+        pair = []
+        for factory in (case.built, case.cached):
+            # Compiles the statement and warms up the lambda caches.
+            await measure_execute(engine, factory, 1)
+            pair.append(StatementTiming(
+                prepare=measure_prepare(factory, iterations),
+                execute=await measure_execute(engine, factory, executions),
+            ))
+        timings[case.name] = (pair[0], pair[1])
+    return timings
+
+
+def format_statement_report(
+    timings: dict[str, tuple[StatementTiming, StatementTiming]],
+) -> str:
+    """Function to render the measured timings as a text table.
+    Args:
+        timings (dict[str, tuple[StatementTiming, StatementTiming]]): Timing
+            of the built and the cached statement of each case.
+    Returns:
+        str: Rendered report, in microseconds per call.
+    """
+    lines = [
+        f'{"case":<24} {"prepare":>8} {"cached":>8} {"execute":>8} '
+        f'{"cached":>8}',
+    ]
+    for name, (built, cached) in timings.items():
+        lines.append(
+            f'{name:<24} {built.prepare:>8.1f} {cached.prepare:>8.1f} '
+            f'{built.execute:>8.1f} {cached.execute:>8.1f}',
+        )
+    return '\n'.join(lines)
+
+
+def parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog='python -m app.loadtest.statements',
+        description='Measure the Python overhead of the hot statements.',
+    )
+    parser.add_argument('--iterations', type=int, default=1000,
+                        help='Calls to average the preparation over.')
+    parser.add_argument('--executions', type=int, default=50,
+                        help='Calls to average the execution over.')
+    parser.add_argument('--database',
+                        help='Path of the stand-in database file.')
+    return parser.parse_args()
+
+
+async def main(arguments: argparse.Namespace) -> int:
+    from app.loadtest.seed import create_stand_in_engine, seed_database
+
+    path = arguments.database or os.path.join(
+        tempfile.mkdtemp(), 'statements.sqlite')
+    engine = create_stand_in_engine(path)
+    await seed_database(engine, path, datetime.datetime.now())
+    timings = await measure_cases(
+        engine, DEFAULT_CASES,
+        iterations=arguments.iterations,
+        executions=arguments.executions,
+    )
+    await engine.dispose()
+    print(format_statement_report(timings))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(asyncio.run(main(parse_arguments())))
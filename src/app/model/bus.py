@@ -2,7 +2,7 @@ import datetime
 from typing import List
 
 from sqlalchemy import Integer, String, Float, Time, Boolean, DateTime, \
-    ForeignKey
+    ForeignKey, Index
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from app.model import BaseModel
@@ -119,6 +119,13 @@ class BusRouteStop(BaseModel):
 
 class BusTimetableItem(BaseModel):
     __tablename__ = 'bus_timetable'
+    # Departures are joined on the route and the start stop of a route stop.
+    __table_args__ = (
+        Index(
+            'ix_bus_timetable_route_start_stop', 'route_id',
+            'start_stop_id', 'weekday', 'departure_time',
+        ),
+    )
     # Route - Timetable: 1 - N
     route_id: Mapped[int] = mapped_column(
         'route_id', Integer, primary_key=True)
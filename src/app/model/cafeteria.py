@@ -1,7 +1,7 @@
 import datetime
 from typing import TYPE_CHECKING
 
-from sqlalchemy import Integer, Float, Date, String, ForeignKey
+from sqlalchemy import Integer, Float, Date, String, ForeignKey, Index
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from app.model import BaseModel
@@ -26,6 +26,10 @@ class Restaurant(BaseModel):
 
 class Menu(BaseModel):
     __tablename__ = 'menu'
+    # Menus are read by restaurant and date.
+    __table_args__ = (
+        Index('ix_menu_restaurant_date', 'restaurant_id', 'feed_date'),
+    )
     # Restaurant - Menu: 1 - N
     restaurant_id: Mapped[int] = \
         mapped_column(ForeignKey('restaurant.restaurant_id'), primary_key=True)
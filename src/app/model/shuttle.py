@@ -1,7 +1,8 @@
 import datetime
 from typing import List
 
-from sqlalchemy import String, Float, Integer, DateTime, Boolean, Time
+from sqlalchemy import String, Float, Integer, DateTime, Boolean, Time, \
+    Index
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from app.model import BaseModel
@@ -97,6 +98,7 @@ class ShuttleRouteStop(BaseModel):
                     'ShuttleRouteStop.route_name,'
                     'ShuttleTimetableItem.stop_name == '
                     'ShuttleRouteStop.stop_name)',
+        order_by='ShuttleTimetableItem.departure_time',
         uselist=True,
         viewonly=True,
     )
@@ -118,6 +120,10 @@ class ShuttlePeriodType(BaseModel):
 
 class ShuttlePeriod(BaseModel):
     __tablename__ = 'shuttle_period'
+    # The current period is looked up by a time inside its range.
+    __table_args__ = (
+        Index('ix_shuttle_period_range', 'period_start', 'period_end'),
+    )
     period_type_name: Mapped[str] = \
         mapped_column('period_type', String(20), primary_key=True)
     period_type: Mapped['ShuttlePeriodType'] = relationship(
@@ -137,6 +143,13 @@ class ShuttlePeriod(BaseModel):
 
 class ShuttleTimetableItem(BaseModel):
     __tablename__ = 'shuttle_timetable'
+    # Arrivals read the departures of a stop, so the stop leads the index.
+    __table_args__ = (
+        Index(
+            'ix_shuttle_timetable_stop', 'stop_name', 'route_name',
+            'period_type', 'weekday', 'departure_time',
+        ),
+    )
     # Period - TimetableItem: 1 - N
     period_type_name: Mapped[str] = \
         mapped_column('period_type', String(20), primary_key=True)
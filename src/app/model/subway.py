@@ -1,7 +1,8 @@
 import datetime
 from typing import List
 
-from sqlalchemy import String, Integer, Time, Boolean, DateTime, ForeignKey
+from sqlalchemy import String, Integer, Time, Boolean, DateTime, ForeignKey, \
+    Index
 from sqlalchemy.orm import Mapped, mapped_column, relationship, backref
 
 from app.model import BaseModel
@@ -62,6 +63,13 @@ class RouteStation(BaseModel):
 
 class TimetableItem(BaseModel):
     __tablename__ = 'subway_timetable'
+    # Timetables are read by station, optionally of a heading and weekday.
+    __table_args__ = (
+        Index(
+            'ix_subway_timetable_station', 'station_id', 'up_down_type',
+            'weekday', 'departure_time',
+        ),
+    )
     # Current Station
     station_id: Mapped[str] = \
         mapped_column(
@@ -63,6 +63,7 @@ class Realtime(BaseModel):
     remaining_time: datetime.timedelta = Field(..., alias='time')
     low_plate: bool = Field(..., alias='low_plate')
     updated_at: datetime.datetime = Field(..., alias='updated_at')
+    stale: bool = Field(..., alias='stale')
 
 
 class RouteArrivalResponse(RouteStopResponse):
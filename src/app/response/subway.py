@@ -29,6 +29,7 @@ class Realtime(BaseModel):
     express_train: bool = Field(..., alias='express')
     last_train: bool = Field(..., alias='last')
     updated_at: datetime.datetime = Field(..., alias='updated_at')
+    stale: bool = Field(..., alias='stale')
 
 
 class Timetable(BaseModel):
@@ -40,6 +41,17 @@ class Timetable(BaseModel):
     time: datetime.time = Field(..., alias='time')
 
 
+class Arrival(BaseModel):
+    heading: str = Field(..., alias='heading')
+    sequence: int = Field(..., alias='sequence')
+    train_no: Optional[str] = Field(None, alias='no')
+    destination: Destination = Field(..., alias='destination')
+    scheduled_time: Optional[datetime.time] = Field(None, alias='scheduled')
+    time: datetime.timedelta = Field(..., alias='time')
+    delay: Optional[datetime.timedelta] = Field(None, alias='delay')
+    realtime: bool = Field(..., alias='realtime')
+
+
 class RealtimeResponse(BaseModel):
     up: list[Realtime] = Field(..., alias='up')
     down: list[Realtime] = Field(..., alias='down')
@@ -50,6 +62,11 @@ class TimetableResponse(BaseModel):
     down: list[Timetable] = Field(..., alias='down')
 
 
+class ArrivalResponse(BaseModel):
+    up: list[Arrival] = Field(..., alias='up')
+    down: list[Arrival] = Field(..., alias='down')
+
+
 class StationListItemResponse(BaseModel):
     id: str = Field(..., alias='id')
     name: str = Field(..., alias='name')
@@ -75,6 +92,7 @@ class StationCurrentStatusResponse(BaseModel):
     name: str = Field(..., alias='name')
     realtime: RealtimeResponse = Field(..., alias='realtime')
     timetable: TimetableResponse = Field(..., alias='timetable')
+    arrival: ArrivalResponse = Field(..., alias='arrival')
 
 
 class StationTimetableResponse(BaseModel):
@@ -0,0 +1,11 @@
+"""Package that reads the hot endpoints' data as plain rows.
+
+The arrival endpoints, the subway timetable and the GraphQL bus field only
+need a few columns of each table, so these modules read them with explicit
+Core selects into named tuples. That skips building ORM entities, tracking
+them in the identity map and filling their relationship collections, which
+is most of the Python time of these requests. Each module groups its rows
+into the same nesting the ORM relationships gave, so the response builders
+only change how they reach a column. Every other endpoint keeps using the
+ORM models.
+"""
@@ -0,0 +1,322 @@
+import datetime
+from typing import NamedTuple, Optional
+
+from sqlalchemy import bindparam, select, and_, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+
+from app.internal.departure_views import departure_views
+from app.internal.snapshot import timetable_snapshot
+from app.model.bus import BusRealtimeItem, BusRoute, BusRouteStop, BusStop, \
+    BusTimetableItem
+
+
+class BusRealtimeRow(NamedTuple):
+    """Class that holds a realtime arrival at a route stop.
+    Attributes:
+        stop (int): Number of stops left.
+        seat (int): Number of seats left.
+        minutes (int): Minutes left.
+        low_floor (bool): Whether the bus is a low floor bus.
+        last_updated_time (datetime.datetime): Time of the update.
+    """
+    stop: int
+    seat: int
+    minutes: int
+    low_floor: bool
+    last_updated_time: datetime.datetime
+
+
+class BusDepartureRow(NamedTuple):
+    """Class that holds a departure of a route from its start stop.
+    Attributes:
+        weekday (str): Weekday of the departure.
+        departure_time (datetime.time): Departure time.
+    """
+    weekday: str
+    departure_time: datetime.time
+
+
+class BusRouteStopRows(NamedTuple):
+    """Class that holds a route stop with its arrivals and departures.
+    Attributes:
+        stop_id (int): ID of the stop.
+        stop_name (str): Name of the stop.
+        route_id (int): ID of the route.
+        route_name (str): Name of the route.
+        order (int): Sequence of the stop in the route.
+        start_stop_id (int): ID of the start stop of the route.
+        start_stop_name (str): Name of the start stop of the route.
+        realtime (list[BusRealtimeRow]): Realtime arrivals.
+        timetable (list[BusDepartureRow]): Departures from the start stop.
+    """
+    stop_id: int
+    stop_name: str
+    route_id: int
+    route_name: str
+    order: int
+    start_stop_id: int
+    start_stop_name: str
+    realtime: list[BusRealtimeRow]
+    timetable: list[BusDepartureRow]
+
+
+class BusStopRows(NamedTuple):
+    """Class that holds a stop with its route stops.
+    Attributes:
+        id (int): ID of the stop.
+        name (str): Name of the stop.
+        mobile_number (str): Mobile search number of the stop.
+        latitude (float): Latitude of the stop.
+        longitude (float): Longitude of the stop.
+        district (int): District code of the stop.
+        region (str): Region of the stop.
+        routes (list[BusRouteStopRows]): Route stops of the stop.
+    """
+    id: int
+    name: str
+    mobile_number: str
+    latitude: float
+    longitude: float
+    district: int
+    region: str
+    routes: list[BusRouteStopRows]
+
+
+START_STOP = aliased(BusStop)
+STOP_STATEMENT = select(
+    BusStop.id, BusStop.name, BusStop.mobile_number, BusStop.latitude,
+    BusStop.longitude, BusStop.district, BusStop.region,
+)
+ROUTE_STOP_STATEMENT = select(
+    BusRouteStop.stop_id, BusStop.name, BusRouteStop.route_id,
+    BusRoute.name, BusRouteStop.order, START_STOP.id, START_STOP.name,
+).join(
+    BusStop, BusStop.id == BusRouteStop.stop_id,
+).join(
+    BusRoute, BusRoute.id == BusRouteStop.route_id,
+).outerjoin(
+    START_STOP, START_STOP.id == BusRouteStop.start_stop_id,
+).order_by(BusRouteStop.route_id)
+# Rows are ordered, where the ORM relationships left the order to the
+# database, so that every response lists them the same way.
+REALTIME_STATEMENT = select(
+    BusRealtimeItem.stop_id, BusRealtimeItem.route_id, BusRealtimeItem.stop,
+    BusRealtimeItem.seat, BusRealtimeItem.minutes, BusRealtimeItem.low_floor,
+    BusRealtimeItem.last_updated_time,
+).order_by(BusRealtimeItem.sequence)
+# Departures are listed for every route stop the route starts from.
+DEPARTURE_STATEMENT = select(
+    BusRouteStop.stop_id, BusRouteStop.route_id,
+    BusTimetableItem.weekday, BusTimetableItem.departure_time,
+).join(
+    BusTimetableItem, and_(
+        BusTimetableItem.route_id == BusRouteStop.route_id,
+        BusTimetableItem.start_stop_id == BusRouteStop.start_stop_id,
+    ),
+).order_by(BusTimetableItem.weekday, BusTimetableItem.departure_time)
+STOP_BY_ID_STATEMENT = STOP_STATEMENT.where(
+    BusStop.id == bindparam('stop_id'))
+# The route stops of every stop, of a stop, and of pairs of a stop and a
+# route.
+ALL_STATEMENTS = (
+    ROUTE_STOP_STATEMENT, REALTIME_STATEMENT, DEPARTURE_STATEMENT,
+)
+STOP_STATEMENTS = (
+    ROUTE_STOP_STATEMENT.where(
+        BusRouteStop.stop_id == bindparam('stop_id')),
+    REALTIME_STATEMENT.where(
+        BusRealtimeItem.stop_id == bindparam('stop_id')),
+    DEPARTURE_STATEMENT.where(
+        BusRouteStop.stop_id == bindparam('stop_id')),
+)
+PAIR_STATEMENTS = (
+    ROUTE_STOP_STATEMENT.where(
+        tuple_(BusRouteStop.stop_id, BusRouteStop.route_id).in_(
+            bindparam('pairs', expanding=True))),
+    REALTIME_STATEMENT.where(
+        tuple_(BusRealtimeItem.stop_id, BusRealtimeItem.route_id).in_(
+            bindparam('pairs', expanding=True))),
+    DEPARTURE_STATEMENT.where(
+        tuple_(BusRouteStop.stop_id, BusRouteStop.route_id).in_(
+            bindparam('pairs', expanding=True))),
+)
+
+# The route stops and the departures read from materialized views on
+# PostgreSQL, when enabled.
+ROUTE_STOP_VIEW = departure_views.add(
+    'bus_route_stop_view', ROUTE_STOP_STATEMENT,
+    columns=BusRouteStopRows._fields[:7],
+    key=('stop_id', 'route_id'),
+    sources=('bus_route_stop', 'bus_stop', 'bus_route'),
+)
+DEPARTURE_VIEW = departure_views.add(
+    'bus_departure_view', DEPARTURE_STATEMENT,
+    columns=('stop_id', 'route_id', *BusDepartureRow._fields),
+    key=('stop_id', 'route_id', 'weekday', 'departure_time'),
+    sources=('bus_route_stop', 'bus_timetable'),
+)
+ROUTE_STOP_COLUMNS = ROUTE_STOP_VIEW.table.c
+DEPARTURE_COLUMNS = DEPARTURE_VIEW.table.c
+VIEW_ROUTE_STOP_STATEMENT = select(*ROUTE_STOP_COLUMNS).order_by(
+    ROUTE_STOP_COLUMNS.route_id)
+VIEW_DEPARTURE_STATEMENT = select(*DEPARTURE_COLUMNS).order_by(
+    DEPARTURE_COLUMNS.weekday, DEPARTURE_COLUMNS.departure_time)
+VIEW_ALL_STATEMENTS = (
+    VIEW_ROUTE_STOP_STATEMENT, REALTIME_STATEMENT, VIEW_DEPARTURE_STATEMENT,
+)
+VIEW_STOP_STATEMENTS = (
+    VIEW_ROUTE_STOP_STATEMENT.where(
+        ROUTE_STOP_COLUMNS.stop_id == bindparam('stop_id')),
+    STOP_STATEMENTS[1],
+    VIEW_DEPARTURE_STATEMENT.where(
+        DEPARTURE_COLUMNS.stop_id == bindparam('stop_id')),
+)
+VIEW_PAIR_STATEMENTS = (
+    VIEW_ROUTE_STOP_STATEMENT.where(
+        tuple_(ROUTE_STOP_COLUMNS.stop_id, ROUTE_STOP_COLUMNS.route_id).in_(
+            bindparam('pairs', expanding=True))),
+    PAIR_STATEMENTS[1],
+    VIEW_DEPARTURE_STATEMENT.where(
+        tuple_(DEPARTURE_COLUMNS.stop_id, DEPARTURE_COLUMNS.route_id).in_(
+            bindparam('pairs', expanding=True))),
+)
+# Departures of the timetable snapshot by the route and start stop they
+# are listed for.
+SNAPSHOT_DEPARTURES = (
+    'bus_timetable',
+    ('weekday', 'departure_time'),
+    ('route_id', 'start_stop_id'),
+    ('weekday', 'departure_time'),
+)
+
+
+async def fetch_route_stop_rows(
+    db_session: AsyncSession,
+    statements: tuple,
+    parameters: dict,
+) -> list[BusRouteStopRows]:
+    """Function to fetch route stops and group their arrivals and
+    departures.
+    Args:
+        db_session (AsyncSession): Database session.
+        statements (tuple): Statements of the route stops, the realtime
+            arrivals, or None to leave them out, and the departures.
+        parameters (dict): Parameters of the statements.
+    Returns:
+        list[BusRouteStopRows]: Route stops.
+    """
+    route_stop_statement, realtime_statement, departure_statement = \
+        statements
+    route_stops: dict[tuple[int, int], BusRouteStopRows] = {}
+    for row in await db_session.execute(route_stop_statement, parameters):
+        route_stops[(row[0], row[2])] = BusRouteStopRows(*row, [], [])
+    if realtime_statement is not None:
+        for stop_id, route_id, *realtime in await db_session.execute(
+                realtime_statement, parameters):
+            route_stop = route_stops.get((stop_id, route_id))
+            if route_stop is not None:
+                route_stop.realtime.append(BusRealtimeRow(*realtime))
+    snapshot = timetable_snapshot.groups(*SNAPSHOT_DEPARTURES)
+    if snapshot is not None:
+        for route_stop in route_stops.values():
+            route_stop.timetable.extend(
+                BusDepartureRow(*row) for row in snapshot.get(
+                    (route_stop.route_id, route_stop.start_stop_id), []))
+        return list(route_stops.values())
+    for stop_id, route_id, weekday, departure_time in \
+            await db_session.execute(departure_statement, parameters):
+        route_stop = route_stops.get((stop_id, route_id))
+        if route_stop is not None:
+            route_stop.timetable.append(
+                BusDepartureRow(weekday, departure_time))
+    return list(route_stops.values())
+
+
+async def fetch_route_stops(
+    db_session: AsyncSession,
+    pairs: list[tuple[int, int]],
+    realtime: bool = True,
+) -> list[BusRouteStopRows]:
+    """Function to fetch route stops with their arrivals and departures.
+    Args:
+        db_session (AsyncSession): Database session.
+        pairs (list[tuple[int, int]]): Stop and route ID of each route
+            stop.
+        realtime (bool): Whether to fetch the realtime arrivals.
+    Returns:
+        list[BusRouteStopRows]: Route stops that exist.
+    """
+    route_stop_statement, realtime_statement, departure_statement = \
+        VIEW_PAIR_STATEMENTS if departure_views.ready else PAIR_STATEMENTS
+    return await fetch_route_stop_rows(
+        db_session,
+        (route_stop_statement, realtime_statement if realtime else None,
+         departure_statement),
+        {'pairs': pairs},
+    )
+
+
+async def fetch_realtime(
+    db_session: AsyncSession,
+    pairs: list[tuple[int, int]],
+) -> dict[tuple[int, int], list[BusRealtimeRow]]:
+    """Function to fetch the realtime arrivals of route stops.
+    Args:
+        db_session (AsyncSession): Database session.
+        pairs (list[tuple[int, int]]): Stop and route ID of each route
+            stop.
+    Returns:
+        dict[tuple[int, int], list[BusRealtimeRow]]: Arrivals by stop and
+            route ID.
+    """
+    arrivals: dict[tuple[int, int], list[BusRealtimeRow]] = {}
+    for stop_id, route_id, *realtime in await db_session.execute(
+            PAIR_STATEMENTS[1], {'pairs': pairs}):
+        arrivals.setdefault((stop_id, route_id), []).append(
+            BusRealtimeRow(*realtime))
+    return arrivals
+
+
+async def fetch_stop(
+    db_session: AsyncSession,
+    stop_id: int,
+) -> Optional[BusStopRows]:
+    """Function to fetch a stop with its route stops.
+    Args:
+        db_session (AsyncSession): Database session.
+        stop_id (int): ID of the stop.
+    Returns:
+        BusStopRows: Stop, or None if it does not exist.
+    """
+    stop = (await db_session.execute(
+        STOP_BY_ID_STATEMENT, {'stop_id': stop_id},
+    )).one_or_none()
+    if stop is None:
+        return None
+    return BusStopRows(*stop, await fetch_route_stop_rows(
+        db_session,
+        VIEW_STOP_STATEMENTS if departure_views.ready else STOP_STATEMENTS,
+        {'stop_id': stop_id},
+    ))
+
+
+async def fetch_stops(db_session: AsyncSession) -> list[BusStopRows]:
+    """Function to fetch every stop with its route stops.
+    Args:
+        db_session (AsyncSession): Database session.
+    Returns:
+        list[BusStopRows]: Stops.
+    """
+    stops = {
+        row[0]: BusStopRows(*row, [])
+        for row in await db_session.execute(STOP_STATEMENT)
+    }
+    for route_stop in await fetch_route_stop_rows(
+            db_session,
+            VIEW_ALL_STATEMENTS if departure_views.ready else ALL_STATEMENTS,
+            {}):
+        stop = stops.get(route_stop.stop_id)
+        if stop is not None:
+            stop.routes.append(route_stop)
+    return list(stops.values())
@@ -0,0 +1,148 @@
+import datetime
+from typing import NamedTuple, Optional
+
+from sqlalchemy import bindparam, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.internal.snapshot import timetable_snapshot
+from app.model.shuttle import ShuttleRoute, ShuttleRouteStop, ShuttleStop, \
+    ShuttleTimetableItem
+
+
+class ShuttleDepartureRow(NamedTuple):
+    """Class that holds a departure of a route from a stop.
+    Attributes:
+        period_type_name (str): Period of the departure.
+        weekday (bool): Whether it departs on weekdays.
+        departure_time (datetime.time): Departure time.
+    """
+    period_type_name: str
+    weekday: bool
+    departure_time: datetime.time
+
+
+class ShuttleRouteStopRows(NamedTuple):
+    """Class that holds a route of a stop with its departures.
+    Attributes:
+        route_name (str): Name of the route.
+        tags (str): Tag of the route.
+        timetable (list[ShuttleDepartureRow]): Departures by time.
+    """
+    route_name: str
+    tags: Optional[str]
+    timetable: list[ShuttleDepartureRow]
+
+
+class ShuttleStopRows(NamedTuple):
+    """Class that holds a stop with its routes.
+    Attributes:
+        name (str): Name of the stop.
+        routes (list[ShuttleRouteStopRows]): Routes of the stop.
+    """
+    name: str
+    routes: list[ShuttleRouteStopRows]
+
+
+# Routes are listed by name, as the order the ORM loaded them in was the
+# order the database happened to scan them in.
+ROUTE_STOP_STATEMENT = select(
+    ShuttleStop.name, ShuttleRouteStop.route_name, ShuttleRoute.tags,
+).outerjoin(
+    ShuttleRouteStop, ShuttleRouteStop.stop_name == ShuttleStop.name,
+).outerjoin(
+    ShuttleRoute, ShuttleRoute.name == ShuttleRouteStop.route_name,
+).order_by(ShuttleRouteStop.route_name)
+# Departures of the same time are ordered too, as the order of the index
+# a stop is read with differs from that of a full scan.
+DEPARTURE_STATEMENT = select(
+    ShuttleTimetableItem.stop_name, ShuttleTimetableItem.route_name,
+    ShuttleTimetableItem.period_type_name, ShuttleTimetableItem.weekday,
+    ShuttleTimetableItem.departure_time,
+).order_by(
+    ShuttleTimetableItem.departure_time,
+    ShuttleTimetableItem.period_type_name, ShuttleTimetableItem.weekday)
+STOP_ROUTE_STOP_STATEMENT = ROUTE_STOP_STATEMENT.where(
+    ShuttleStop.name == bindparam('stop_id'))
+STOP_DEPARTURE_STATEMENT = DEPARTURE_STATEMENT.where(
+    ShuttleTimetableItem.stop_name == bindparam('stop_id'))
+# Departures of the timetable snapshot, in the order of the statements.
+SNAPSHOT_DEPARTURES = (
+    'shuttle_timetable',
+    ('stop_name', 'route_name', 'period_type_name', 'weekday',
+     'departure_time'),
+    ('stop_name',),
+    ('departure_time', 'period_type_name', 'weekday'),
+)
+
+
+def group_stops(
+    route_stop_rows: list[tuple],
+    departure_rows: list[tuple],
+) -> list[ShuttleStopRows]:
+    """Function to group the rows of the stops by stop and route.
+    Args:
+        route_stop_rows (list[tuple]): Stop, route and tag of every route
+            stop, with a None route for a stop without routes.
+        departure_rows (list[tuple]): Stop, route, period, weekday and time
+            of every departure, by time.
+    Returns:
+        list[ShuttleStopRows]: Stops with their routes and departures.
+    """
+    stops: dict[str, ShuttleStopRows] = {}
+    routes: dict[tuple[str, str], ShuttleRouteStopRows] = {}
+    for stop_name, route_name, tags in route_stop_rows:
+        stop = stops.get(stop_name)
+        if stop is None:
+            stop = stops[stop_name] = ShuttleStopRows(stop_name, [])
+        if route_name is not None:
+            route = ShuttleRouteStopRows(route_name, tags, [])
+            routes[(stop_name, route_name)] = route
+            stop.routes.append(route)
+    for stop_name, route_name, period, weekday, departure_time \
+            in departure_rows:
+        route = routes.get((stop_name, route_name))
+        if route is not None:
+            route.timetable.append(
+                ShuttleDepartureRow(period, weekday, departure_time))
+    return list(stops.values())
+
+
+async def fetch_stop(
+    db_session: AsyncSession,
+    stop_id: str,
+) -> Optional[ShuttleStopRows]:
+    """Function to fetch a stop with its routes and departures.
+    Args:
+        db_session (AsyncSession): Database session.
+        stop_id (str): Name of the stop.
+    Returns:
+        ShuttleStopRows: Stop, or None if it does not exist.
+    """
+    parameters = {'stop_id': stop_id}
+    route_stops = (await db_session.execute(
+        STOP_ROUTE_STOP_STATEMENT, parameters)).all()
+    snapshot = timetable_snapshot.groups(*SNAPSHOT_DEPARTURES)
+    if snapshot is not None:
+        departures = snapshot.get((stop_id,), [])
+    else:
+        departures = (await db_session.execute(
+            STOP_DEPARTURE_STATEMENT, parameters)).all()
+    stops = group_stops(route_stops, departures)
+    return stops[0] if stops else None
+
+
+async def fetch_stops(db_session: AsyncSession) -> list[ShuttleStopRows]:
+    """Function to fetch every stop with its routes and departures.
+    Args:
+        db_session (AsyncSession): Database session.
+    Returns:
+        list[ShuttleStopRows]: Stops.
+    """
+    route_stops = (await db_session.execute(ROUTE_STOP_STATEMENT)).all()
+    snapshot = timetable_snapshot.groups(*SNAPSHOT_DEPARTURES)
+    if snapshot is not None:
+        # Departures are only ordered within a route stop.
+        departures = [row for rows in snapshot.values() for row in rows]
+    else:
+        departures = (await db_session.execute(DEPARTURE_STATEMENT)).all()
+    return group_stops(route_stops, departures)
@@ -0,0 +1,243 @@
+import datetime
+from typing import NamedTuple, Optional
+
+from sqlalchemy import bindparam, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+
+from app.internal.departure_views import departure_views
+from app.internal.snapshot import timetable_snapshot
+from app.model.subway import RealtimeItem, RouteStation, TimetableItem
+
+
+class SubwayRealtimeRow(NamedTuple):
+    """Class that holds a realtime arrival at a station.
+    Attributes:
+        heading (str): Heading, 'true' for up and 'false' for down.
+        sequence (int): Sequence of the arrival.
+        train (str): Number of the train.
+        destination_id (str): ID of the destination station.
+        destination_name (str): Name of the destination station.
+        location (str): Name of the current station of the train.
+        minute (int): Minutes left.
+        status (int): Status code of the train.
+        express (bool): Whether the train is an express train.
+        last (bool): Whether the train is the last train.
+        last_updated_at (datetime.datetime): Time of the update.
+    """
+    heading: str
+    sequence: int
+    train: str
+    destination_id: str
+    destination_name: str
+    location: str
+    minute: int
+    status: int
+    express: bool
+    last: bool
+    last_updated_at: datetime.datetime
+
+
+class SubwayDepartureRow(NamedTuple):
+    """Class that holds a departure from a station.
+    Attributes:
+        weekday (str): Weekday of the departure.
+        heading (str): Heading, up or down.
+        start_station_id (str): ID of the start station of the train.
+        start_station_name (str): Name of the start station of the train.
+        destination_id (str): ID of the destination station.
+        destination_name (str): Name of the destination station.
+        departure_time (datetime.time): Departure time.
+    """
+    weekday: str
+    heading: str
+    start_station_id: str
+    start_station_name: str
+    destination_id: str
+    destination_name: str
+    departure_time: datetime.time
+
+
+class SubwayStationRows(NamedTuple):
+    """Class that holds a station with its arrivals and departures.
+    Attributes:
+        id (str): ID of the station.
+        station_name (str): Name of the station.
+        line_id (int): ID of the line.
+        realtime (list[SubwayRealtimeRow]): Realtime arrivals by minutes
+            left.
+        timetable (list[SubwayDepartureRow]): Departures by time.
+    """
+    id: str
+    station_name: str
+    line_id: int
+    realtime: list[SubwayRealtimeRow]
+    timetable: list[SubwayDepartureRow]
+
+
+START_STATION = aliased(RouteStation)
+DESTINATION_STATION = aliased(RouteStation)
+STATION_STATEMENT = select(
+    RouteStation.id, RouteStation.station_name, RouteStation.line_id,
+)
+# Rows are ordered, where the ORM relationships left the order to the
+# database, so that every response lists them the same way.
+REALTIME_STATEMENT = select(
+    RealtimeItem.station_id, RealtimeItem.heading, RealtimeItem.sequence,
+    RealtimeItem.train, RealtimeItem.destination_id,
+    DESTINATION_STATION.station_name, RealtimeItem.location,
+    RealtimeItem.minute, RealtimeItem.status, RealtimeItem.express,
+    RealtimeItem.last, RealtimeItem.last_updated_at,
+).join(
+    DESTINATION_STATION,
+    RealtimeItem.destination_id == DESTINATION_STATION.id,
+).order_by(
+    RealtimeItem.minute, RealtimeItem.heading, RealtimeItem.sequence)
+DEPARTURE_STATEMENT = select(
+    TimetableItem.station_id, TimetableItem.weekday, TimetableItem.heading,
+    START_STATION.id, START_STATION.station_name,
+    TimetableItem.destination_id, DESTINATION_STATION.station_name,
+    TimetableItem.departure_time,
+).join(
+    START_STATION, TimetableItem.start_station_id == START_STATION.id,
+).join(
+    DESTINATION_STATION,
+    TimetableItem.destination_id == DESTINATION_STATION.id,
+).order_by(
+    TimetableItem.departure_time, TimetableItem.heading, TimetableItem.weekday)
+STATION_BY_ID_STATEMENT = STATION_STATEMENT.where(
+    RouteStation.id == bindparam('station_id'))
+STATION_REALTIME_STATEMENT = REALTIME_STATEMENT.where(
+    RealtimeItem.station_id == bindparam('station_id'))
+STATION_DEPARTURE_STATEMENT = DEPARTURE_STATEMENT.where(
+    TimetableItem.station_id == bindparam('station_id'))
+# The departures read from a materialized view on PostgreSQL, when enabled.
+DEPARTURE_VIEW = departure_views.add(
+    'subway_departure_view', DEPARTURE_STATEMENT,
+    columns=('station_id', *SubwayDepartureRow._fields),
+    key=('station_id', 'weekday', 'heading', 'departure_time'),
+    sources=('subway_timetable', 'subway_route_station'),
+)
+VIEW_DEPARTURE_STATEMENT = select(*DEPARTURE_VIEW.table.c).order_by(
+    DEPARTURE_VIEW.table.c.departure_time, DEPARTURE_VIEW.table.c.heading,
+    DEPARTURE_VIEW.table.c.weekday)
+VIEW_STATION_DEPARTURE_STATEMENT = VIEW_DEPARTURE_STATEMENT.where(
+    DEPARTURE_VIEW.table.c.station_id == bindparam('station_id'))
+# Departures of the timetable snapshot, named with the stations read from
+# the database.
+NAME_STATEMENT = select(RouteStation.id, RouteStation.station_name)
+SNAPSHOT_DEPARTURES = (
+    'subway_timetable',
+    ('weekday', 'heading', 'start_station_id', 'destination_id',
+     'departure_time'),
+    ('station_id',),
+    ('departure_time', 'heading', 'weekday'),
+)
+
+
+def group_stations(
+    station_rows: list[tuple],
+    realtime_rows: list[tuple],
+    departure_rows: list[tuple],
+) -> list[SubwayStationRows]:
+    """Function to group the arrivals and departures by station.
+    Args:
+        station_rows (list[tuple]): ID, name and line of every station.
+        realtime_rows (list[tuple]): Station followed by the columns of
+            SubwayRealtimeRow, by minutes left.
+        departure_rows (list[tuple]): Station followed by the columns of
+            SubwayDepartureRow, by time.
+    Returns:
+        list[SubwayStationRows]: Stations.
+    """
+    stations = {
+        row[0]: SubwayStationRows(*row, [], []) for row in station_rows
+    }
+    for station_id, *realtime in realtime_rows:
+        station = stations.get(station_id)
+        if station is not None:
+            station.realtime.append(SubwayRealtimeRow(*realtime))
+    for station_id, *departure in departure_rows:
+        station = stations.get(station_id)
+        if station is not None:
+            station.timetable.append(SubwayDepartureRow(*departure))
+    return list(stations.values())
+
+
+async def fetch_departures(
+    db_session: AsyncSession,
+    station_id: Optional[str] = None,
+) -> list[tuple]:
+    """Function to fetch the departures from a station or every station.
+    Args:
+        db_session (AsyncSession): Database session.
+        station_id (str): ID of the station, or None for every station.
+    Returns:
+        list[tuple]: Station followed by the columns of SubwayDepartureRow,
+            by time within each station.
+    """
+    snapshot = timetable_snapshot.groups(*SNAPSHOT_DEPARTURES)
+    if snapshot is None:
+        if station_id is None:
+            return list((await db_session.execute(
+                VIEW_DEPARTURE_STATEMENT if departure_views.ready
+                else DEPARTURE_STATEMENT)).all())
+        return list((await db_session.execute(
+            VIEW_STATION_DEPARTURE_STATEMENT if departure_views.ready
+            else STATION_DEPARTURE_STATEMENT,
+            {'station_id': station_id},
+        )).all())
+    names = dict((await db_session.execute(NAME_STATEMENT)).all())
+    keys = list(snapshot) if station_id is None else [(station_id,)]
+    departures = []
+    for key in keys:
+        for weekday, heading, start_id, destination_id, departure_time \
+                in snapshot.get(key, []):
+            # Departures of unknown stations are left out, as the joins of
+            # the statements leave them out.
+            if start_id in names and destination_id in names:
+                departures.append((
+                    *key, weekday, heading, start_id, names[start_id],
+                    destination_id, names[destination_id], departure_time,
+                ))
+    return departures
+
+
+async def fetch_station(
+    db_session: AsyncSession,
+    station_id: str,
+) -> Optional[SubwayStationRows]:
+    """Function to fetch a station with its arrivals and departures.
+    Args:
+        db_session (AsyncSession): Database session.
+        station_id (str): ID of the station.
+    Returns:
+        SubwayStationRows: Station, or None if it does not exist.
+    """
+    parameters = {'station_id': station_id}
+    station = (await db_session.execute(
+        STATION_BY_ID_STATEMENT, parameters)).all()
+    if not station:
+        return None
+    return group_stations(
+        station,
+        (await db_session.execute(
+            STATION_REALTIME_STATEMENT, parameters)).all(),
+        await fetch_departures(db_session, station_id),
+    )[0]
+
+
+async def fetch_stations(
+    db_session: AsyncSession,
+) -> list[SubwayStationRows]:
+    """Function to fetch every station with its arrivals and departures.
+    Args:
+        db_session (AsyncSession): Database session.
+    Returns:
+        list[SubwayStationRows]: Stations.
+    """
+    return group_stations(
+        (await db_session.execute(STATION_STATEMENT)).all(),
+        (await db_session.execute(REALTIME_STATEMENT)).all(),
+        await fetch_departures(db_session),
+    )
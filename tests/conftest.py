@@ -1,8 +1,15 @@
 # -*- coding: utf-8 -*-
 # Module that contains the configuration for the test.
 import asyncio
+import contextlib
+import datetime
+import itertools
+import os
+import uuid
 
 import pytest
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
 
 
 @pytest.fixture(scope='session')
@@ -11,3 +18,90 @@ def event_loop():
     loop = asyncio.get_event_loop()
     yield loop
     loop.close()
+
+
+@pytest.fixture
+def stand_in(tmp_path):
+    # Open SQLite databases filled with the stand-in data of the load test,
+    # each in its own file of the test.
+    pytest.importorskip('aiosqlite')
+    from app.loadtest.seed import create_stand_in_engine, seed_database
+
+    paths = (
+        str(tmp_path / f'stand_in_{index}.sqlite')
+        for index in itertools.count()
+    )
+
+    @contextlib.asynccontextmanager
+    async def open_stand_in(seeded_at=None, **engine_options):
+        path = next(paths)
+        engine = create_stand_in_engine(path, **engine_options)
+        try:
+            await seed_database(
+                engine, path, seeded_at or datetime.datetime.now())
+            yield engine
+        finally:
+            await engine.dispose()
+    return open_stand_in
+
+
+@pytest.fixture
+def stand_in_app(stand_in, monkeypatch):
+    # Open the app on a stand-in database, with the database router pointed
+    # at it and the caches bypassed unless asked for.
+    from app import create_app
+    from app.dependancies import database
+    from app.internal.cache import cache_bypass
+    from app.internal.config import AppSettings
+
+    @contextlib.asynccontextmanager
+    async def open_app(seeded_at=None, bypass_cache=True, **settings):
+        async with stand_in(seeded_at) as engine:
+            monkeypatch.setattr(database.database_router, 'primary', engine)
+            monkeypatch.setattr(database.database_router, 'replicas', [])
+            app = create_app(AppSettings(
+                DATABASE_URI=f'sqlite+aiosqlite:///{engine.url.database}',
+                INVALIDATION_MODE='off',
+                ACCESS_LOG=False,
+                LAZY_LOAD_MODE='raise',
+                **settings,
+            ))
+            token = cache_bypass.set(True) if bypass_cache else None
+            try:
+                async with app.router.lifespan_context(app):
+                    yield app
+            finally:
+                if token is not None:
+                    cache_bypass.reset(token)
+    return open_app
+
+
+@pytest.fixture
+def postgres_stand_in():
+    # Open the stand-in data on the PostgreSQL server of
+    # STAND_IN_POSTGRES_URI. Each database gets its own schema, so the
+    # stand-in never touches the tables of the database it runs on.
+    uri = os.getenv('STAND_IN_POSTGRES_URI')
+    if uri is None:
+        pytest.skip('STAND_IN_POSTGRES_URI is not set')
+    from app.loadtest.seed import seed_database
+
+    @contextlib.asynccontextmanager
+    async def open_stand_in(seeded_at=None):
+        schema = f'stand_in_{uuid.uuid4().hex[:8]}'
+        engine = create_async_engine(uri)
+        async with engine.begin() as connection:
+            await connection.execute(text(f'CREATE SCHEMA {schema}'))
+        await engine.dispose()
+        engine = create_async_engine(
+            uri, connect_args={'server_settings': {'search_path': schema}})
+        try:
+            await seed_database(
+                engine, None, seeded_at or datetime.datetime.now())
+            yield engine
+        finally:
+            async with engine.begin() as connection:
+                await connection.execute(
+                    text(f'DROP SCHEMA {schema} CASCADE'))
+            await engine.dispose()
+    return open_stand_in
@@ -0,0 +1,161 @@
+import asyncio
+import contextlib
+import datetime
+import time
+
+import pytest
+from httpx import AsyncClient
+
+from app.internal.boards import BoardStore, arrival_boards
+from app.internal.cache import MemoryBackend, cache_bypass
+from app.internal.invalidation import TableChanged, invalidation_bus
+from app.internal.scheduler import scheduler
+from app.internal.statements import StatementCounter
+
+URLS = [
+    "/shuttle/stop/dormitory_o/arrival",
+    "/shuttle/stop/station/arrival?output=route",
+    "/bus/stop/216000379/arrival",
+    "/subway/station/K449/arrival",
+]
+DOCUMENTS = [
+    '{ shuttle(stop: ["station", "dormitory_o"]) { stop { stopName '
+    'route { routeID timetable { time remainingTime } } '
+    'tag { tagID timetable { time otherStops { stopName time } } } } '
+    'params { period weekday } } }',
+    '{ bus(routeStop: [{stop: 216000719, route: 216000068}, '
+    '{stop: 216000379, route: 216000061}, {stop: 1, route: 1}]) '
+    '{ stopName routeName realtime { remainingTime } timetable { time } } }',
+    '{ subway(station: ["K251"]) { id name timetable { up { time } } '
+    'realtime { down { trainNo remainingTime } } } }',
+]
+TIME_DEPENDENT_KEYS = {"remaining_time", "remainingTime"}
+
+
+def normalize(value):
+    if isinstance(value, dict):
+        return {
+            key: normalize(item) for key, item in value.items()
+            if key not in TIME_DEPENDENT_KEYS
+        }
+    if isinstance(value, list):
+        return [normalize(item) for item in value]
+    return value
+
+
+@contextlib.asynccontextmanager
+async def board_app(stand_in_app):
+    # Boards and computed results must be built in the same minute.
+    if datetime.datetime.now().second >= 55:
+        await asyncio.sleep(60 - datetime.datetime.now().second)
+    async with stand_in_app(bypass_cache=False) as app:
+        for name in arrival_boards.boards:
+            await arrival_boards.refresh(name)
+        yield app
+
+
+async def fetch(client, target):
+    if target.startswith("/"):
+        response = await client.get(target)
+    else:
+        response = await client.post("/query", json={"query": target})
+    assert response.status_code == 200
+    return response.json()
+
+
+@pytest.mark.asyncio
+async def test_boards_match_computed_results(stand_in_app):
+    async with board_app(stand_in_app) as app, \
+            AsyncClient(app=app, base_url="http://test") as client:
+        with StatementCounter() as counter:
+            served = [
+                await fetch(client, target) for target in URLS + DOCUMENTS
+            ]
+        token = cache_bypass.set(True)
+        try:
+            computed = [
+                await fetch(client, target) for target in URLS + DOCUMENTS
+            ]
+        finally:
+            cache_bypass.reset(token)
+        response = await client.get("/bus/stop/216000379/arrival")
+        board = await arrival_boards.get("bus_arrival", 216000379)
+
+    assert counter.statements == []
+    assert normalize(served) == normalize(computed)
+    assert response.content == board
+    shuttle, bus, _ = [item["data"] for item in served[len(URLS):]]
+    assert [stop["stopName"] for stop in shuttle["shuttle"]["stop"]] == \
+        ["dormitory_o", "station"]
+    assert [(item["stopName"], item["routeName"]) for item in bus["bus"]] \
+        == [(item["stopName"], item["routeName"])
+            for item in computed[len(URLS) + 1]["data"]["bus"]]
+    assert len(bus["bus"]) == 2
+
+
+@pytest.mark.asyncio
+async def test_changed_tables_hold_back_boards(stand_in_app):
+    async with board_app(stand_in_app):
+        assert await arrival_boards.get("bus_arrival", 216000379)
+        assert await arrival_boards.get("bus", None)
+        await invalidation_bus.publish(TableChanged(
+            table="bus_realtime",
+            source="poll",
+            detected_at=datetime.datetime.now(),
+        ))
+        assert await arrival_boards.get("bus_arrival", 216000379) is None
+        assert await arrival_boards.get("bus", None) is None
+        assert await arrival_boards.get("subway_arrival", "K449")
+        await arrival_boards.refresh("bus_arrival")
+        assert await arrival_boards.get("bus_arrival", 216000379)
+
+        token = cache_bypass.set(True)
+        try:
+            assert await arrival_boards.get("subway_arrival", "K449") is None
+        finally:
+            cache_bypass.reset(token)
+    assert scheduler.jobs["bus_arrival_board"].runs >= 1
+
+
+@pytest.mark.asyncio
+async def test_boards_expire_after_a_minute(stand_in_app, monkeypatch):
+    async with board_app(stand_in_app):
+        assert await arrival_boards.get("bus_arrival", 216000379)
+        built_at = time.time()
+        monkeypatch.setattr(time, "time", lambda: built_at + 61)
+        assert await arrival_boards.get("bus_arrival", 216000379) is None
+        assert await arrival_boards.get("shuttle", None) is None
+        monkeypatch.undo()
+    with pytest.raises(ValueError):
+        BoardStore(MemoryBackend(), ttl=150)
+
+
+@pytest.mark.asyncio
+async def test_workers_rebuild_the_boards_they_serve(stand_in_app):
+    async with board_app(stand_in_app):
+        board = arrival_boards.boards["subway_arrival"]
+        job = scheduler.jobs["subway_arrival_board"]
+        board.requested_at = 0.0
+        built_at = board.built_at
+        await job.function()
+        assert board.built_at == built_at
+        assert await arrival_boards.get("subway_arrival", "K449")
+        await job.function()
+        assert board.built_at > built_at
+
+
+def test_board_registration():
+    store = BoardStore(MemoryBackend(), ttl=60, enabled=False)
+
+    @store.board("disabled", tables=())
+    async def build(db_session):
+        return {}
+    assert store.boards == {}
+    assert {
+        "shuttle_arrival_board", "bus_arrival_board",
+        "subway_arrival_board", "shuttle_board", "bus_board",
+        "subway_board",
+    } <= set(scheduler.jobs)
+    assert not scheduler.jobs["shuttle_board"].singleton
+    with pytest.raises(ValueError):
+        arrival_boards.board("shuttle", tables=())(build)
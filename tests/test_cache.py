@@ -0,0 +1,239 @@
+import asyncio
+import datetime
+
+import pydantic
+import pytest
+from fastapi import APIRouter, FastAPI
+from httpx import AsyncClient
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.controller.query.cache import app_settings, cached_query, \
+    query_caches
+from app.internal import cache as cache_module
+from app.internal.cache import MemoryBackend, PickleSerializer, \
+    TieredCache, cache_bypass, cached_response
+from app.internal.tracing import TracedJSONResponse, TracedRoute
+from app.internal.date_utils import current_datetime
+from app.internal.statements import StatementCounter
+from app.model.bus import BusRealtimeItem
+from app.model.subway import RealtimeItem
+
+
+def create_test_cache(backend: MemoryBackend) -> TieredCache:
+    return TieredCache(
+        namespace="test",
+        backend=backend,
+        serializer=PickleSerializer(),
+        local_size=2,
+    )
+
+
+@pytest.mark.asyncio
+async def test_tiered_cache_shared_backend():
+    backend = MemoryBackend()
+    first_worker = create_test_cache(backend)
+    second_worker = create_test_cache(backend)
+    key = first_worker.make_key(["stop", 1])
+
+    await first_worker.set(key, {"time": [1, 2]}, 60)
+    assert await second_worker.get(key) == (True, {"time": [1, 2]})
+
+    await second_worker.invalidate()
+    assert await second_worker.get(key) == (False, None)
+    assert await backend.get(key) is None
+
+    for index in range(3):
+        await first_worker.set(first_worker.make_key([index]), index, 60)
+    assert len(first_worker._local) == 2
+
+
+@pytest.mark.asyncio
+async def test_tiered_cache_stampede():
+    backend = MemoryBackend()
+    first_worker = create_test_cache(backend)
+    second_worker = create_test_cache(backend)
+    calls: list[int] = []
+
+    async def loader():
+        calls.append(1)
+        await asyncio.sleep(0.1)
+        return "value"
+
+    results = await asyncio.gather(*[
+        cache.get_or_set("test:key", 60, loader)
+        for cache in [first_worker, first_worker, second_worker]
+    ])
+    assert results == ["value", "value", "value"]
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_tiered_cache_drops_unsigned_pickles():
+    backend = MemoryBackend()
+    worker = create_test_cache(backend)
+    intruder = TieredCache(
+        namespace="test",
+        backend=backend,
+        serializer=PickleSerializer(b"another key"),
+        local_size=2,
+    )
+
+    await intruder.set("test:key", "value", 60)
+    assert await worker.get("test:key") == (False, None)
+    assert await worker.get_or_set("test:key", 60, loader_of("own")) == "own"
+    assert await create_test_cache(backend).get("test:key") == (True, "own")
+
+
+def loader_of(value):
+    async def loader():
+        return value
+    return loader
+
+
+class CachedModel(pydantic.BaseModel):
+    name: str
+
+
+@pytest.mark.asyncio
+async def test_cached_response_matches_the_route(monkeypatch):
+    monkeypatch.setitem(
+        cache_module.app_settings.RESPONSE_CACHE_TTL, "test_route", 60)
+    router = APIRouter(route_class=TracedRoute)
+    calls = []
+
+    @router.post("/created", response_model=CachedModel, status_code=201)
+    @cached_response("test_route", tables=())
+    async def create():
+        calls.append(1)
+        return {"name": "created", "secret": len(calls)}
+
+    app = FastAPI(default_response_class=TracedJSONResponse)
+    app.include_router(router)
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        responses = [await client.post("/created") for _ in range(2)]
+        token = cache_bypass.set(True)
+        try:
+            responses.append(await client.post("/created"))
+        finally:
+            cache_bypass.reset(token)
+
+    assert len(calls) == 2
+    assert [response.status_code for response in responses] == [201] * 3
+    assert [response.json() for response in responses] == \
+        [{"name": "created"}] * 3
+    assert {response.headers["content-type"] for response in responses} \
+        == {"application/json"}
+
+
+@pytest.mark.asyncio
+async def test_cached_query_key():
+    calls: list[tuple] = []
+
+    @cached_query("test_field")
+    async def query_test(db_session, name=None, ids=None):
+        calls.append((name, ids))
+        return len(calls)
+
+    ttl = app_settings.QUERY_CACHE_TTL
+    ttl["test_field"] = 60
+    try:
+        assert await query_test(None) == 1
+        assert await query_test(None, name=None) == 1
+        assert await query_test(None, ids=[1, 2]) == 2
+        assert await query_test(None, None, [1, 2]) == 2
+        assert await query_test(None, name="a", ids=[1, 2]) == 3
+
+        await query_caches["test_field"].invalidate()
+        assert await query_test(None) == 4
+
+        ttl["test_field"] = 0
+        assert await query_test(None) == 5
+        assert await query_test(None) == 6
+    finally:
+        ttl.pop("test_field")
+        await query_caches.pop("test_field").invalidate()
+
+
+@pytest.mark.asyncio
+async def test_bus_and_subway_cache_only_their_timetables(stand_in):
+    from app.controller.query.bus import BusRouteStopQuery, query_bus
+    from app.controller.query.subway import query_subway
+
+    route_stop = [BusRouteStopQuery(stop=216000379, route=216000061)]
+    # An end of the timetables keeps the queries off the arrival boards.
+    end = datetime.time(23, 59)
+
+    async def set_minutes(db_session, minutes):
+        updated_at = current_datetime().replace(tzinfo=None)
+        await db_session.execute(update(BusRealtimeItem).values(
+            minutes=minutes, last_updated_time=updated_at))
+        await db_session.execute(update(RealtimeItem).values(
+            minute=minutes, last_updated_at=updated_at))
+        await db_session.commit()
+
+    try:
+        async with stand_in() as engine, AsyncSession(engine) as db_session:
+            await set_minutes(db_session, 5)
+            (bus_before,) = await query_bus(
+                db_session, route_stop, timetable_end=end)
+            (subway_before, *_) = await query_subway(
+                db_session, station=["K449"], timetable_end=end)
+            await set_minutes(db_session, 40)
+            with StatementCounter() as counter:
+                (bus_after,) = await query_bus(
+                    db_session, route_stop, timetable_end=end)
+                (subway_after, *_) = await query_subway(
+                    db_session, station=["K449"], timetable_end=end)
+    finally:
+        for field in ("bus", "subway"):
+            await query_caches[field].invalidate()
+
+    # Only the realtime arrivals are fetched again.
+    assert len(counter.statements) == 2
+    assert bus_after.timetable == bus_before.timetable
+    assert subway_after.timetable == subway_before.timetable
+    assert bus_before.realtime and all(
+        realtime.time <= 5 for realtime in bus_before.realtime)
+    assert bus_after.realtime and all(
+        realtime.time >= 39 for realtime in bus_after.realtime)
+    subway_arrivals = subway_before.realtime.up + subway_before.realtime.down
+    assert subway_arrivals and all(
+        realtime.remaining_time <= 5 for realtime in subway_arrivals)
+    subway_arrivals = subway_after.realtime.up + subway_after.realtime.down
+    assert subway_arrivals and all(
+        realtime.remaining_time >= 39 for realtime in subway_arrivals)
+
+
+@pytest.mark.asyncio
+async def test_shuttle_cache_counts_from_the_minute(stand_in):
+    from app.controller.query.shuttle import query_shuttle
+
+    end = datetime.time(23, 59)
+    if datetime.datetime.now().second >= 55:
+        await asyncio.sleep(60 - datetime.datetime.now().second)
+    try:
+        async with stand_in() as engine, AsyncSession(engine) as db_session:
+            first = await query_shuttle(
+                db_session, stop_query=["dormitory_o"], timetable_end=end)
+            await asyncio.sleep(1)
+            with StatementCounter() as counter:
+                second = await query_shuttle(
+                    db_session, stop_query=["dormitory_o"], timetable_end=end)
+            token = cache_bypass.set(True)
+            try:
+                computed = await query_shuttle(
+                    db_session, stop_query=["dormitory_o"], timetable_end=end)
+            finally:
+                cache_bypass.reset(token)
+    finally:
+        await query_caches["shuttle"].invalidate()
+
+    remaining_times = [
+        item.remaining_time for stop in first.stops for route in stop.routes
+        for item in route.timetable
+    ]
+    assert counter.statements == []
+    assert first == second == computed
+    assert remaining_times and all(
+        remaining_time % 60 == 0 for remaining_time in remaining_times)
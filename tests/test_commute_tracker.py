@@ -0,0 +1,108 @@
+import datetime
+import time
+
+import pytest
+from httpx import AsyncClient
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.internal.commute_tracker import NO_STOP, CommuteShuttleTracker, \
+    RouteTimeline, commute_shuttle_tracker
+from app.internal.invalidation import TableChanged, invalidation_bus
+from app.model.commute_shuttle import CommuteShuttleTimetableItem
+
+timetable = [
+    ("A", datetime.time(7, 0)),
+    ("C", datetime.time(7, 20)),
+    ("B", datetime.time(7, 10)),
+]
+by_time = sorted(timetable, key=lambda stop: stop[1])
+route = RouteTimeline(
+    name="R1",
+    korean="R1",
+    english="R1",
+    timetable=timetable,
+    times=[departure_time for _, departure_time in by_time],
+    stops=[stop_name for stop_name, _ in by_time],
+)
+
+
+def test_route_timeline_current():
+    assert route.current(datetime.time(6, 59)) == \
+        (NO_STOP, ("A", datetime.time(7, 0)))
+    assert route.current(datetime.time(7, 5)) == \
+        (("A", datetime.time(7, 0)), ("B", datetime.time(7, 10)))
+    assert route.current(datetime.time(7, 10)) == \
+        (("A", datetime.time(7, 0)), ("C", datetime.time(7, 20)))
+    assert route.current(datetime.time(7, 21)) == \
+        (("C", datetime.time(7, 20)), NO_STOP)
+
+
+@pytest.mark.asyncio
+async def test_tracker_reset_by_invalidation():
+    today = datetime.date.today()
+    commute_shuttle_tracker._routes = {"R1": route}
+    commute_shuttle_tracker._routes_expire_at = time.monotonic() + 60
+    commute_shuttle_tracker._status = (today, "SUCCESS")
+    assert await commute_shuttle_tracker.routes(None) == {"R1": route}
+    assert await commute_shuttle_tracker.status(
+        None, datetime.datetime.combine(today, datetime.time(12))) == \
+        "SUCCESS"
+
+    await invalidation_bus.publish(TableChanged(
+        "commute_shuttle_timetable", "poll", datetime.datetime.now()))
+    assert commute_shuttle_tracker._routes is None
+    assert commute_shuttle_tracker._status is not None
+    await invalidation_bus.publish(TableChanged(
+        "shuttle_holiday", "poll", datetime.datetime.now()))
+    assert commute_shuttle_tracker._status is None
+
+
+@pytest.mark.asyncio
+async def test_tracker_routes_expire(stand_in):
+    kept = CommuteShuttleTracker(routes_ttl=3600)
+    expired = CommuteShuttleTracker(routes_ttl=0)
+    async with stand_in() as engine, AsyncSession(engine) as db_session:
+        before = await kept.routes(db_session)
+        assert await expired.routes(db_session) == before
+        # The timetable is edited without a change on the invalidation bus.
+        await db_session.execute(update(CommuteShuttleTimetableItem).values(
+            departure_time=datetime.time(6, 0)))
+        await db_session.commit()
+        assert await kept.routes(db_session) == before
+        after = await expired.routes(db_session)
+
+    assert after != before
+    assert all(
+        timeline.times == [datetime.time(6, 0)] * len(timeline.times)
+        for timeline in after.values()
+    )
+
+
+@pytest.mark.asyncio
+async def test_arrival_follows_the_tracker(stand_in_app, monkeypatch):
+    from app.controller import commute_shuttle
+
+    monkeypatch.setattr(
+        commute_shuttle, "current_datetime",
+        lambda: datetime.datetime(2023, 5, 2, 7, 5))
+    async with stand_in_app(bypass_cache=False) as app, \
+            AsyncClient(app=app, base_url="http://test") as client:
+        commute_shuttle_tracker._routes = {"R1": route}
+        commute_shuttle_tracker._routes_expire_at = time.monotonic() + 60
+        commute_shuttle_tracker._status = (datetime.date(2023, 5, 2), "OK")
+        try:
+            before = await client.get("/commute-shuttle/arrival")
+            commute_shuttle_tracker._routes = {"R2": route._replace(
+                name="R2")}
+            after = await client.get("/commute-shuttle/arrival")
+        finally:
+            commute_shuttle_tracker.reset_routes()
+            commute_shuttle_tracker.reset_status()
+
+    assert before.json()["status"] == "OK"
+    assert before.json()["route"][0]["current"] == {
+        "start": {"name": "A", "time": "07:00:00"},
+        "end": {"name": "B", "time": "07:10:00"},
+    }
+    assert [item["name"] for item in after.json()["route"]] == ["R2"]
@@ -0,0 +1,160 @@
+import asyncio
+import functools
+
+import pytest
+from httpx import AsyncClient
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+import app.controller.query as query_module
+from app.dependancies import database
+from app.dependancies.database import DatabaseRouter, RoutingSession, \
+    SessionFactory
+from app.model.bus import BusStop
+
+ROOT_FIELDS = (
+    '{ shuttle(stop: ["dormitory_o"], start: "00:00", end: "23:59") '
+    '{ stop { stopName route { routeID timetable { time } } } '
+    'params { period weekday } } '
+    'bus(routeStop: [{stop: 216000379, route: 216000061}], '
+    'start: "00:00", end: "23:59") { stopName routeName timetable { time } } '
+    'subway(station: ["K449"], start: "00:00", end: "23:59") '
+    '{ id name timetable { up { time } down { time } } } }'
+)
+
+
+def count_statements(engine):
+    statements = []
+    event.listen(
+        engine.sync_engine, "before_cursor_execute",
+        lambda *args: statements.append(args[2]),
+    )
+    return statements
+
+
+async def read_stops(router, reads):
+    async with AsyncSession(
+            sync_session_class=RoutingSession, router=router) as session:
+        return [
+            (await session.execute(select(BusStop.id))).all()
+            for _ in range(reads)
+        ]
+
+
+@pytest.mark.asyncio
+async def test_session_reads_from_one_replica(stand_in):
+    async with stand_in() as primary, stand_in() as first, \
+            stand_in() as second:
+        router = DatabaseRouter(primary, [first, second], cooldown=30)
+        statements = [
+            count_statements(engine) for engine in (primary, first, second)
+        ]
+        await read_stops(router, 3)
+        counts = [len(engine_statements) for engine_statements in statements]
+        await read_stops(router, 3)
+
+    assert counts == [0, 3, 0]
+    assert [len(engine_statements) for engine_statements in statements] \
+        == [0, 3, 3]
+
+
+@pytest.mark.asyncio
+async def test_unreachable_replica_reads_from_the_primary(stand_in, tmp_path):
+    unreachable = create_async_engine(
+        f"sqlite+aiosqlite:///{tmp_path / 'missing' / 'replica.sqlite'}")
+    async with stand_in() as primary:
+        router = DatabaseRouter(primary, [unreachable], cooldown=30)
+        statements = count_statements(primary)
+        rows = await read_stops(router, 2)
+        healthy = router.healthy_replicas()
+    await unreachable.dispose()
+
+    assert rows[0] and rows[0] == rows[1]
+    assert len(statements) == 2
+    assert healthy == []
+
+
+@pytest.mark.asyncio
+async def test_session_factory_caps_open_sessions(stand_in, monkeypatch):
+    async with stand_in() as engine:
+        monkeypatch.setattr(database.database_router, "primary", engine)
+        monkeypatch.setattr(database.database_router, "replicas", [])
+        async with SessionFactory(limit=1).sessions(3) as capped:
+            pass
+        async with SessionFactory(limit=4).sessions(3) as opened:
+            pass
+
+        factory = SessionFactory(limit=1)
+        with pytest.raises(RuntimeError):
+            async with factory.sessions(2) as failed:
+                await failed[0].execute(select(BusStop.id))
+                raise RuntimeError
+        async with asyncio.timeout(1):
+            async with factory.session() as reopened:
+                rows = (await reopened.execute(select(BusStop.id))).all()
+
+    assert len(capped) == 3 and len(set(map(id, capped))) == 1
+    assert len(set(map(id, opened))) == 3
+    assert not failed[0].in_transaction()
+    assert rows
+
+
+async def query_root_fields(stand_in_app, limit):
+    async with stand_in_app(GRAPHQL_SESSION_LIMIT=limit) as app, \
+            AsyncClient(app=app, base_url="http://test") as client:
+        response = await client.post("/query", json={"query": ROOT_FIELDS})
+    assert response.status_code == 200
+    return response.json()
+
+
+@pytest.mark.asyncio
+async def test_session_limit_keeps_the_result(stand_in_app, monkeypatch):
+    # A session must not run two statements at once, even when the cap
+    # hands the same session to several queries.
+    executing, overlapping = set(), []
+    execute = AsyncSession.execute
+
+    async def exclusive_execute(self, *args, **kwargs):
+        overlapping.append(self in executing)
+        executing.add(self)
+        try:
+            return await execute(self, *args, **kwargs)
+        finally:
+            executing.discard(self)
+    monkeypatch.setattr(AsyncSession, "execute", exclusive_execute)
+
+    capped = await query_root_fields(stand_in_app, 1)
+    concurrent = await query_root_fields(stand_in_app, 4)
+
+    assert "errors" not in capped
+    assert capped == concurrent
+    assert overlapping and not any(overlapping)
+    assert capped["data"]["bus"][0]["timetable"]
+
+
+@pytest.mark.asyncio
+async def test_root_fields_run_concurrently(stand_in_app, monkeypatch):
+    events = []
+
+    def record(name, function):
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            events.append(f"start {name}")
+            await asyncio.sleep(0.05)
+            try:
+                return await function(*args, **kwargs)
+            finally:
+                events.append(f"end {name}")
+        return wrapper
+    for name in ("query_shuttle", "query_bus", "query_subway"):
+        monkeypatch.setattr(
+            query_module, name, record(name, getattr(query_module, name)))
+
+    await query_root_fields(stand_in_app, 4)
+    concurrent = list(events)
+    events.clear()
+    await query_root_fields(stand_in_app, 1)
+
+    assert all(event.startswith("start") for event in concurrent[:3])
+    assert [event.split()[0] for event in events] == \
+        ["start", "end"] * 3
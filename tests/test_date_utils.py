@@ -0,0 +1,17 @@
+import datetime
+
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.internal.date_utils import is_holiday, lunar_date
+
+
+@pytest.mark.asyncio
+async def test_holidays_convert_each_day_once(stand_in):
+    lunar_date.cache_clear()
+    async with stand_in() as engine, AsyncSession(engine) as db_session:
+        for hour in (9, 18):
+            await is_holiday(
+                db_session, datetime.datetime(2023, 5, 1, hour, 30, 15))
+    assert lunar_date.cache_info().misses == 1
+    assert lunar_date.cache_info().hits == 1
@@ -0,0 +1,100 @@
+
+import pytest
+from sqlalchemy import func, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.internal.departure_views import departure_views
+from app.rows import bus, subway
+
+VIEWS = (subway.DEPARTURE_VIEW, bus.ROUTE_STOP_VIEW, bus.DEPARTURE_VIEW)
+
+
+async def fetch_arrivals(engine):
+    async with AsyncSession(engine) as db_session:
+        return (
+            await subway.fetch_stations(db_session),
+            await subway.fetch_station(db_session, "K449"),
+            await bus.fetch_stops(db_session),
+            await bus.fetch_stop(db_session, 216000379),
+            await bus.fetch_route_stops(
+                db_session, [(216000379, 216000061), (216000379, 1)]),
+        )
+
+
+@pytest.mark.asyncio
+async def test_view_statements_read_the_same_rows(stand_in, monkeypatch):
+    async with stand_in() as engine:
+        joined = await fetch_arrivals(engine)
+        # SQLite has no materialized views, so each view is stood in for by
+        # a table filled with its definition.
+        async with engine.begin() as connection:
+            for view in VIEWS:
+                definition = view.definition.compile(
+                    dialect=connection.dialect,
+                    compile_kwargs={"literal_binds": True},
+                )
+                await connection.execute(
+                    text(f"CREATE TABLE {view.name} AS {definition}"))
+        monkeypatch.setattr(departure_views, "engine", engine)
+        flat = await fetch_arrivals(engine)
+
+    assert joined[1].timetable
+    assert any(route.timetable for route in joined[3].routes)
+    assert flat == joined
+
+
+async def view_oids(connection):
+    return [
+        (await connection.execute(
+            text("SELECT to_regclass(:name)::oid"), {"name": view.name},
+        )).scalar_one()
+        for view in VIEWS
+    ]
+
+
+@pytest.mark.asyncio
+async def test_postgres_views_follow_their_definitions(postgres_stand_in):
+    async with postgres_stand_in() as engine, engine.begin() as connection:
+        for view in VIEWS:
+            await view.create(connection)
+        created = await view_oids(connection)
+        # Creating them again leaves them as they are.
+        for view in VIEWS:
+            await view.create(connection)
+        kept = await view_oids(connection)
+        # A view left by another definition is replaced.
+        await connection.execute(text(
+            f"COMMENT ON MATERIALIZED VIEW {subway.DEPARTURE_VIEW.name} "
+            f"IS 'stale'"))
+        for view in VIEWS:
+            await view.create(connection)
+        replaced = await view_oids(connection)
+        for view in VIEWS:
+            await view.drop(connection)
+
+    assert kept == created
+    assert replaced[0] != created[0]
+    assert replaced[1:] == created[1:]
+
+
+@pytest.mark.asyncio
+async def test_postgres_views_refresh_concurrently(postgres_stand_in):
+    from app.model.subway import TimetableItem
+
+    async with postgres_stand_in() as engine, engine.begin() as connection:
+        for view in VIEWS:
+            await view.create(connection)
+        before = (await connection.execute(
+            select(func.count()).select_from(
+                subway.DEPARTURE_VIEW.table))).scalar_one()
+        await connection.execute(TimetableItem.__table__.delete())
+        for view in VIEWS:
+            await view.refresh(connection)
+        after = (await connection.execute(
+            select(func.count()).select_from(
+                subway.DEPARTURE_VIEW.table))).scalar_one()
+        for view in VIEWS:
+            await view.drop(connection)
+
+    assert before > 0
+    assert after == 0
@@ -0,0 +1,109 @@
+import datetime
+
+import pytest
+from sqlalchemy import update
+
+from app.controller.query.cache import query_caches
+from app.internal.invalidation import InvalidationBus, \
+    NotifyChangeListener, PollingChangeListener, TableChanged, \
+    create_change_listener, install_notify_triggers, invalidation_bus, \
+    missing_notify_triggers, notify_trigger_statements
+from app.model.commute_shuttle import CommuteShuttleTimetableItem
+
+
+@pytest.mark.asyncio
+async def test_invalidation_bus():
+    bus = InvalidationBus()
+    received: list[str] = []
+
+    async def async_handler(event: TableChanged):
+        received.append(f"async:{event.table}")
+
+    bus.subscribe(["menu"], lambda event: received.append(event.table))
+    bus.subscribe(["menu", "reading_room"], async_handler)
+    assert bus.tables == {"menu", "reading_room"}
+
+    for table in ["menu", "reading_room", "bus_realtime"]:
+        await bus.publish(TableChanged(
+            table=table,
+            source="poll",
+            detected_at=datetime.datetime.now(),
+        ))
+    assert received == ["menu", "async:menu", "async:reading_room"]
+
+
+@pytest.mark.asyncio
+async def test_query_cache_invalidation():
+    await query_caches["bus"].set("query:bus:test", 1, 60)
+    await query_caches["cafeteria"].set("query:cafeteria:test", 1, 60)
+    await invalidation_bus.publish(TableChanged(
+        table="bus_realtime",
+        source="notify",
+        detected_at=datetime.datetime.now(),
+    ))
+    # The bus field only caches its timetables.
+    assert await query_caches["bus"].get("query:bus:test") == (True, 1)
+    await invalidation_bus.publish(TableChanged(
+        table="bus_timetable",
+        source="notify",
+        detected_at=datetime.datetime.now(),
+    ))
+    assert await query_caches["bus"].get("query:bus:test") == (False, None)
+    assert await query_caches["cafeteria"].get("query:cafeteria:test") == \
+        (True, 1)
+    await query_caches["cafeteria"].invalidate()
+
+
+@pytest.mark.asyncio
+async def test_polling_sees_rewrites_keeping_the_row_count(stand_in):
+    bus = InvalidationBus()
+    received: list[str] = []
+    bus.subscribe(["commute_shuttle_timetable"],
+                  lambda event: received.append(event.table))
+    async with stand_in() as engine:
+        listener = PollingChangeListener(engine, bus, interval=60)
+        await listener.poll()
+        await listener.poll()
+        assert received == []
+        async with engine.begin() as connection:
+            await connection.execute(
+                update(CommuteShuttleTimetableItem).values(
+                    departure_time=CommuteShuttleTimetableItem.departure_time,
+                ))
+        await listener.poll()
+        assert received == []
+        async with engine.begin() as connection:
+            await connection.execute(
+                update(CommuteShuttleTimetableItem).values(
+                    departure_time=datetime.time(6, 0)))
+        await listener.poll()
+    assert received == ["commute_shuttle_timetable"]
+
+
+def test_notify_trigger_statements():
+    statements = notify_trigger_statements(["menu"], "table_change")
+    assert "pg_notify('table_change', TG_TABLE_NAME)" in statements[0]
+    assert statements[-1].startswith("CREATE TRIGGER menu_notify_change")
+
+
+@pytest.mark.asyncio
+async def test_auto_mode_polls_without_notifications(stand_in):
+    async with stand_in() as engine:
+        listener = await create_change_listener(
+            engine, mode="auto", channel="table_change", interval=60)
+    assert isinstance(listener, PollingChangeListener)
+
+
+@pytest.mark.asyncio
+async def test_auto_mode_notifies_once_triggers_exist(postgres_stand_in):
+    async with postgres_stand_in() as engine:
+        missing = await missing_notify_triggers(engine, ["menu", "bus_stop"])
+        polling = await create_change_listener(
+            engine, mode="auto", channel="table_change", interval=60)
+        await install_notify_triggers(
+            engine, invalidation_bus.tables, "table_change")
+        notifying = await create_change_listener(
+            engine, mode="auto", channel="table_change", interval=60)
+    assert missing == {"menu", "bus_stop"}
+    assert isinstance(polling, PollingChangeListener)
+    assert isinstance(notifying, NotifyChangeListener)
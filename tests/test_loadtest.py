@@ -0,0 +1,105 @@
+import pytest
+
+from app import create_app
+from app.dependancies import database
+from app.internal.config import AppSettings
+from app.loadtest import statements
+from app.loadtest.memory import DEFAULT_BUDGETS, DEFAULT_CASES, \
+    MemoryBudget, MemoryUsage, load_budgets, measure_cases, over_budget
+from app.loadtest.scenario import LoadRunner, Phase, RequestSpec, \
+    changeover_phases, percentile
+
+
+def test_percentile():
+    values = [float(value) for value in range(1, 101)]
+    assert percentile(values, 0.5) == 50
+    assert percentile(values, 0.99) == 99
+    assert percentile([], 0.5) == 0
+
+
+def test_changeover_phases():
+    phases = changeover_phases(base_rate=10, spike_factor=20)
+    assert phases[0].start_rate == 10
+    assert max(phase.end_rate for phase in phases) == 200
+    assert phases[-1].end_rate == 10
+
+
+@pytest.mark.asyncio
+async def test_load_runner(stand_in, monkeypatch):
+    async with stand_in(pool_size=2, max_overflow=0) as engine:
+        monkeypatch.setattr(database.database_router, "primary", engine)
+        monkeypatch.setattr(database.database_router, "replicas", [])
+        app = create_app(AppSettings(
+            DATABASE_URI=f"sqlite+aiosqlite:///{engine.url.database}",
+            INVALIDATION_MODE="off",
+        ))
+        pool = engine.sync_engine.pool
+
+        def pool_waits():
+            waits, pool.wait_times = pool.wait_times, []
+            return waits
+
+        runner = LoadRunner(
+            app,
+            [
+                RequestSpec(
+                    "shuttle_arrival", "GET",
+                    "/shuttle/stop/{stop}/arrival", 1,
+                    choices={"stop": ["dormitory_o", "station"]},
+                ),
+                RequestSpec(
+                    "missing_stop", "GET", "/shuttle/stop/none/arrival", 1),
+            ],
+            [Phase("spike", 1, 20, 20)],
+            pool_waits=pool_waits,
+            seed=1,
+        )
+        async with app.router.lifespan_context(app):
+            report = await runner.run()
+
+    assert report["total"]["requests"] >= 15
+    assert report["total"]["error_rate"] == 0
+    assert report["total"]["dropped"] == 0
+    assert report["total"]["pool_checkouts"] > 0
+    assert set(report["requests"]) == {"shuttle_arrival", "missing_stop"}
+    assert report["windows"][-1]["phase"] == "drain"
+
+
+def test_memory_budgets_file(tmp_path):
+    path = tmp_path / "budgets.json"
+    path.write_text('{"bus_arrival": {"peak": 1, "retained": 2}}')
+    budgets = load_budgets(str(path))
+    assert budgets["bus_arrival"] == MemoryBudget(peak=1, retained=2)
+    assert budgets["shuttle_arrival"] == DEFAULT_BUDGETS["shuttle_arrival"]
+
+    messages = over_budget(
+        {"bus_arrival": MemoryUsage(peak=2048, retained=4096, top=["line"])},
+        budgets,
+    )
+    assert messages[0].startswith("bus_arrival: peak 2 KiB exceeds")
+    assert messages[1].endswith("budget of 2 KiB\nline")
+
+
+@pytest.mark.asyncio
+async def test_memory_budgets(stand_in_app):
+    async with stand_in_app(bypass_cache=False, SCHEDULER_ENABLED=False) \
+            as app:
+        usages = await measure_cases(app, DEFAULT_CASES)
+
+    assert set(usages) == {case.name for case in DEFAULT_CASES}
+    assert all(usage.peak > 0 for usage in usages.values())
+    messages = over_budget(usages, DEFAULT_BUDGETS)
+    assert not messages, "\n".join(messages)
+
+
+@pytest.mark.asyncio
+async def test_statement_overhead(stand_in):
+    async with stand_in() as engine:
+        timings = await statements.measure_cases(
+            engine, statements.DEFAULT_CASES, iterations=20, executions=2)
+
+    assert set(timings) == {case.name for case in statements.DEFAULT_CASES}
+    for name, (built, cached) in timings.items():
+        assert cached.prepare < built.prepare, name
+    report = statements.format_statement_report(timings)
+    assert report.splitlines()[1].startswith("current_period")
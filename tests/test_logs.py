@@ -0,0 +1,97 @@
+import json
+import logging
+
+import pytest
+from httpx import AsyncClient
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+from app import create_app
+from app.internal.config import AppSettings
+from app.internal.logs import SamplingFilter, configure_logging, \
+    shutdown_logging
+
+
+def read_records(capsys):
+    shutdown_logging()
+    return [
+        json.loads(line) for line in capsys.readouterr().out.splitlines()
+        if line.startswith("{")
+    ]
+
+
+@pytest.mark.asyncio
+async def test_access_log_with_request_id(capsys):
+    settings = AppSettings(INVALIDATION_MODE="off")
+    configure_logging(settings)
+    app = create_app(settings)
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        response = await client.post(
+            "/query",
+            json={"query": "query { __typename }"},
+            headers={"X-Request-ID": "abc"},
+        )
+        assert response.headers["x-request-id"] == "abc"
+        response = await client.post(
+            "/query", json={"query": "query { __typename }"},
+        )
+        generated_id = response.headers["x-request-id"]
+        assert generated_id not in ("", "abc")
+
+    records = [
+        record for record in read_records(capsys)
+        if record["logger"] == "app.access"
+    ]
+    assert [record["request_id"] for record in records] == \
+        ["abc", generated_id]
+    assert records[0]["status"] == 200
+    assert records[0]["path"] == "/query"
+    assert records[0]["duration_ms"] > 0
+
+
+def test_slow_sql_log(capsys):
+    configure_logging(AppSettings(
+        SQL_LOG_MODE="slow",
+        SQL_LOG_SLOW_THRESHOLD=0,
+    ))
+    engine = create_engine("sqlite://")
+    with engine.connect() as connection:
+        connection.execute(text("SELECT 1"))
+    records = [
+        record for record in read_records(capsys)
+        if record["logger"] == "app.sql"
+    ]
+    assert records[0]["statement"] == "SELECT 1"
+    assert records[0]["duration_ms"] >= 0
+
+
+def test_failed_sql_statements_are_forgotten(capsys):
+    configure_logging(AppSettings(
+        SQL_LOG_MODE="slow",
+        SQL_LOG_SLOW_THRESHOLD=0,
+    ))
+    engine = create_engine("sqlite://")
+    with engine.connect() as connection:
+        for _ in range(3):
+            with pytest.raises(OperationalError):
+                connection.execute(text("SELECT * FROM missing"))
+        assert connection.info["query_started"] == []
+        connection.execute(text("SELECT 1"))
+        assert connection.info["query_started"] == []
+    records = [
+        record for record in read_records(capsys)
+        if record["logger"] == "app.sql"
+    ]
+    assert [record["statement"] for record in records] == ["SELECT 1"]
+
+
+def test_sampling_filter():
+    sampling_filter = SamplingFilter({"app.access": 0, "app": 1})
+    assert sampling_filter.rate("app.access") == 0
+    assert sampling_filter.rate("app.sql") == 1
+    assert sampling_filter.rate("sqlalchemy") == 1
+    record = logging.LogRecord(
+        "app.access", logging.INFO, "", 0, "message", None, None)
+    assert not sampling_filter.filter(record)
+    record.levelno = logging.WARNING
+    assert sampling_filter.filter(record)
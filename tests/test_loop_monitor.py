@@ -0,0 +1,94 @@
+import asyncio
+import logging
+import time
+
+import pytest
+from httpx import AsyncClient
+
+from app import create_app
+from app.internal.config import AppSettings
+from app.internal.loop_monitor import LoopLagMonitor
+from app.internal.metrics import Metric, Sample, metrics_registry, \
+    render_metrics
+
+
+def hold_loop(seconds):
+    time.sleep(seconds)
+
+
+@pytest.mark.asyncio
+async def test_lag_percentiles():
+    monitor = LoopLagMonitor(interval=0.005, window=100)
+    assert monitor.percentiles() == {}
+    await monitor.start()
+    await asyncio.sleep(0.05)
+    hold_loop(0.1)
+    await asyncio.sleep(0.05)
+    await monitor.stop()
+
+    percentiles = monitor.percentiles()
+    assert set(percentiles) == {0.5, 0.95, 0.99}
+    assert percentiles[0.5] < 0.05
+    assert percentiles[0.99] >= 0.09
+    assert monitor.count == len(monitor.lags)
+    assert monitor.blocked == 0
+
+
+@pytest.mark.asyncio
+async def test_blocking_step_is_reported(caplog):
+    monitor = LoopLagMonitor(interval=0.01, blocking_threshold=0.05)
+    await monitor.start()
+    await asyncio.sleep(0.05)
+    with caplog.at_level(logging.WARNING, "app.internal.loop_monitor"):
+        hold_loop(0.2)
+        await asyncio.sleep(0.05)
+    hold_loop(0.01)
+    await monitor.stop()
+
+    assert monitor.blocked == 1
+    [record] = caplog.records
+    assert record.getMessage().startswith("Event loop blocked for more than")
+    assert "in hold_loop" in record.getMessage()
+
+
+def test_render_metrics():
+    rendered = render_metrics([
+        Metric("lag_seconds", "summary", "Lag.", [
+            Sample("lag_seconds", {"quantile": "0.5"}, 0.25),
+            Sample("lag_seconds_count", {}, 3),
+        ]),
+        Metric("label_escaping", "gauge", "Escaping.", [
+            Sample("label_escaping", {"path": 'a"b\\'}, float("inf")),
+        ]),
+    ])
+    assert rendered.splitlines() == [
+        "# HELP lag_seconds Lag.",
+        "# TYPE lag_seconds summary",
+        'lag_seconds{quantile="0.5"} 0.25',
+        "lag_seconds_count 3.0",
+        "# HELP label_escaping Escaping.",
+        "# TYPE label_escaping gauge",
+        'label_escaping{path="a\\"b\\\\"} +Inf',
+    ]
+
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint():
+    app = create_app(AppSettings(
+        DATABASE_URI="sqlite+aiosqlite://",
+        INVALIDATION_MODE="off",
+        TIMETABLE_SNAPSHOT_PATH=None,
+        ACCESS_LOG=False,
+        LOOP_MONITOR_INTERVAL=0.005,
+        METRICS_ENABLED=True,
+    ))
+    async with app.router.lifespan_context(app):
+        await asyncio.sleep(0.05)
+        async with AsyncClient(app=app, base_url="http://test") as client:
+            response = await client.get("/metrics")
+    assert metrics_registry.collect() == []
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'hyuabot_event_loop_lag_seconds{quantile="0.99"}' in response.text
+    assert "hyuabot_event_loop_blocked_total 0.0" in response.text
+    assert "/metrics" not in app.openapi()["paths"]
@@ -0,0 +1,127 @@
+import datetime
+import json
+
+import pytest
+from sqlalchemy import inspect, select, text
+
+from app.internal.date_utils import PERIOD_STATEMENT
+from app.internal.migrations import MIGRATIONS, applied_versions, \
+    downgrade, upgrade
+from app.model.cafeteria import Menu
+from app.rows import bus, shuttle, subway
+
+INDEXES = {
+    "shuttle_timetable": "ix_shuttle_timetable_stop",
+    "bus_timetable": "ix_bus_timetable_route_start_stop",
+    "subway_timetable": "ix_subway_timetable_station",
+    "menu": "ix_menu_restaurant_date",
+    "shuttle_period": "ix_shuttle_period_range",
+}
+
+
+def arrival_statements():
+    return {
+        "shuttle_timetable": (
+            shuttle.STOP_DEPARTURE_STATEMENT, {"stop_id": "dormitory_o"}),
+        "bus_timetable": (bus.STOP_STATEMENTS[2], {"stop_id": 216000379}),
+        "subway_timetable": (
+            subway.STATION_DEPARTURE_STATEMENT, {"station_id": "K449"}),
+        "shuttle_period": (
+            PERIOD_STATEMENT, {"value": datetime.datetime.now()}),
+        "menu": (select(Menu).where(
+            Menu.restaurant_id == 1,
+            Menu.date == datetime.date.today(),
+        ), {}),
+    }
+
+
+async def explain(connection, prefix, statement, parameters):
+    compiled = statement.compile(dialect=connection.dialect)
+    values = compiled.construct_params(parameters)
+    return (await connection.exec_driver_sql(
+        f"{prefix} {compiled}",
+        tuple(values[name] for name in compiled.positiontup),
+    )).all()
+
+
+def index_names(connection):
+    return {
+        table: {index["name"] for index in inspect(connection).get_indexes(
+            table)} for table in INDEXES
+    }
+
+
+@pytest.mark.asyncio
+async def test_upgrade_and_downgrade_indexes(stand_in):
+    async with stand_in() as engine:
+        # The stand-in is created from the models, which declare the indexes
+        # the migration creates when they do not exist.
+        applied = await upgrade(engine)
+        versions = await applied_versions(engine)
+        again = await upgrade(engine)
+        reverted = await downgrade(engine, 0)
+        async with engine.connect() as connection:
+            dropped = await connection.run_sync(index_names)
+        reapplied = await upgrade(engine)
+        async with engine.connect() as connection:
+            created = await connection.run_sync(index_names)
+
+    assert applied == [migration.version for migration in MIGRATIONS]
+    assert versions == set(applied)
+    assert again == []
+    assert reverted == applied[::-1]
+    assert all(INDEXES[table] not in names
+               for table, names in dropped.items())
+    assert reapplied == applied
+    assert all(INDEXES[table] in names for table, names in created.items())
+
+
+@pytest.mark.asyncio
+async def test_sqlite_arrival_queries_search_indexes(stand_in):
+    async with stand_in() as engine:
+        await upgrade(engine)
+        async with engine.connect() as connection:
+            plans = {
+                table: [row[-1] for row in await explain(
+                    connection, "EXPLAIN QUERY PLAN", *case)]
+                for table, case in arrival_statements().items()
+            }
+
+    for table, plan in plans.items():
+        assert any(
+            step.startswith(f"SEARCH {table} ") and INDEXES[table] in step
+            for step in plan
+        ), plan
+
+
+def index_conditions(plan, relation=None):
+    # Bitmap index scans name their table on the heap scan above them.
+    relation = plan.get("Relation Name", relation)
+    if "Index Cond" in plan:
+        yield relation, plan["Index Name"]
+    for child in plan.get("Plans", []):
+        yield from index_conditions(child, relation)
+
+
+@pytest.mark.asyncio
+async def test_postgres_arrival_queries_use_index_range_scans(
+        postgres_stand_in):
+    async with postgres_stand_in() as engine:
+        await upgrade(engine)
+        async with engine.begin() as connection:
+            await connection.execute(text("ANALYZE"))
+            # The stand-in is small enough for sequential scans to win, so
+            # they are disabled to see which index each query can use.
+            await connection.execute(text("SET LOCAL enable_seqscan = off"))
+            plans = {}
+            for table, case in arrival_statements().items():
+                (plan,), = await explain(
+                    connection, "EXPLAIN (FORMAT JSON)", *case)
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                plans[table] = list(index_conditions(plan[0]["Plan"]))
+
+    # A primary key sharing the leading columns may serve a query as well.
+    for table, scans in plans.items():
+        assert any(relation == table for relation, _ in scans), \
+            (table, scans)
@@ -0,0 +1,76 @@
+import datetime
+import os
+import threading
+
+import pytest
+from httpx import AsyncClient
+
+from app.internal.offload import ResponseOffloader
+
+SHUTTLE_DOCUMENT = (
+    '{ shuttle(date: "2023-05-01T09:00:00") { stop { stopName '
+    'route { routeID timetable { time remainingTime otherStops '
+    '{ stopName time } } } tag { tagID timetable { time } } } '
+    'params { period weekday } } }'
+)
+SUBWAY_DOCUMENT = (
+    '{ subway { id lineName timetable { up { destinationName time } '
+    'down { time } } realtime { up { trainNo remainingTime } '
+    'down { destinationName } } } }'
+)
+
+
+async def fetch_responses(stand_in_app, **settings):
+    async with stand_in_app(
+            datetime.datetime(2023, 5, 1, 9), **settings) as app, \
+            AsyncClient(app=app, base_url="http://test") as client:
+        responses = [
+            await client.get("/subway/station/K449/timetable"),
+            await client.post("/query", json={"query": SHUTTLE_DOCUMENT}),
+            await client.post("/query", json={"query": SUBWAY_DOCUMENT}),
+        ]
+    for response in responses:
+        assert response.status_code == 200
+        assert "errors" not in response.json()
+    return [response.content for response in responses]
+
+
+@pytest.mark.asyncio
+async def test_offloaded_responses_match_inline(stand_in_app):
+    inline = await fetch_responses(
+        stand_in_app, RESPONSE_OFFLOAD_MODE="off")
+    offloaded = await fetch_responses(
+        stand_in_app,
+        RESPONSE_OFFLOAD_MODE="thread",
+        RESPONSE_OFFLOAD_THRESHOLD=1,
+    )
+    assert offloaded == inline
+
+
+@pytest.mark.asyncio
+async def test_thread_offloader():
+    offloader = ResponseOffloader()
+    offloader.configure("thread", workers=1, threshold=10)
+    try:
+        with offloader.tally() as rows:
+            inline = await offloader.run(threading.get_ident, rows=9)
+            offloaded = await offloader.run(threading.get_ident, rows=10)
+        assert rows == [19]
+        assert inline == threading.get_ident()
+        assert offloaded != threading.get_ident()
+    finally:
+        offloader.shutdown()
+    assert await offloader.run(threading.get_ident, rows=10) == \
+        threading.get_ident()
+
+
+@pytest.mark.asyncio
+async def test_process_offloader():
+    offloader = ResponseOffloader()
+    offloader.configure("process", workers=1, threshold=1)
+    try:
+        assert await offloader.run(os.getpid, rows=1) != os.getpid()
+    finally:
+        offloader.shutdown()
+    with pytest.raises(ValueError):
+        offloader.configure("fork", workers=1, threshold=1)
@@ -0,0 +1,67 @@
+import hashlib
+import json
+
+import pytest
+from httpx import AsyncClient
+
+from app.main import app
+
+query = "query { __typename }"
+query_hash = hashlib.sha256(query.encode("utf-8")).hexdigest()
+
+
+@pytest.mark.asyncio
+async def test_persisted_query_registration():
+    extensions = {
+        "persistedQuery": {"version": 1, "sha256Hash": query_hash},
+    }
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        response = await client.post(
+            "/query",
+            json={"extensions": extensions},
+        )
+        assert response.status_code == 200
+        response_body = response.json()
+        assert response_body["errors"][0]["message"] == \
+            "PersistedQueryNotFound"
+        assert response_body["errors"][0]["extensions"]["code"] == \
+            "PERSISTED_QUERY_NOT_FOUND"
+
+        response = await client.post(
+            "/query",
+            json={"query": query, "extensions": extensions},
+        )
+        assert response.status_code == 200
+        assert response.json()["data"]["__typename"] == "Query"
+
+        response = await client.post(
+            "/query",
+            json={"extensions": extensions},
+        )
+        assert response.status_code == 200
+        assert response.json()["data"]["__typename"] == "Query"
+
+        response = await client.get(
+            "/query",
+            params={"extensions": json.dumps(extensions)},
+        )
+        assert response.status_code == 200
+        assert response.json()["data"]["__typename"] == "Query"
+
+
+@pytest.mark.asyncio
+async def test_persisted_query_hash_mismatch():
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        response = await client.post(
+            "/query",
+            json={
+                "query": "query { shuttle { params { period } } }",
+                "extensions": {
+                    "persistedQuery": {
+                        "version": 1,
+                        "sha256Hash": query_hash,
+                    },
+                },
+            },
+        )
+        assert response.status_code == 400
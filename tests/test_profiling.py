@@ -0,0 +1,60 @@
+import os
+import pstats
+
+import pytest
+from httpx import AsyncClient
+
+from app import create_app
+from app.internal.config import AppSettings
+
+query = {"query": "query { __typename }"}
+
+
+@pytest.mark.asyncio
+async def test_profiling_disabled_without_token(tmp_path):
+    app = create_app(AppSettings(PROFILE_DIRECTORY=str(tmp_path)))
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        response = await client.post(
+            "/query", json=query, headers={"X-Profile": "secret"},
+        )
+        assert response.status_code == 200
+        assert "x-profile-id" not in response.headers
+    assert os.listdir(tmp_path) == []
+
+
+@pytest.mark.asyncio
+async def test_profiling_with_token(tmp_path):
+    app = create_app(AppSettings(
+        PROFILE_TOKEN="secret",
+        PROFILE_DIRECTORY=str(tmp_path),
+    ))
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        response = await client.post("/query", json=query)
+        assert "x-profile-id" not in response.headers
+
+        response = await client.post(
+            "/query", json=query, headers={"X-Profile": "wrong"},
+        )
+        assert "x-profile-id" not in response.headers
+
+        response = await client.post(
+            "/query", json=query, headers={"X-Profile": "secret"},
+        )
+        assert response.json()["data"]["__typename"] == "Query"
+        profile_id = response.headers["x-profile-id"]
+        with open(tmp_path / f"{profile_id}.folded") as file:
+            for line in file:
+                stack, count = line.rsplit(" ", 1)
+                assert int(count) > 0
+
+        response = await client.post(
+            "/query?profile=secret",
+            json=query,
+            headers={"X-Profile-Mode": "trace"},
+        )
+        profile_id = response.headers["x-profile-id"]
+        stats = pstats.Stats(str(tmp_path / f"{profile_id}.prof"))
+        assert any(
+            function_name == "execute_operation"
+            for _, _, function_name in stats.stats
+        )
@@ -0,0 +1,118 @@
+import contextlib
+import datetime
+import os
+import time
+
+import pytest
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.internal.cache import cache_bypass
+from app.internal.date_utils import current_datetime
+from app.internal.realtime_aging import AgedArrival, age_arrival
+from app.model.bus import BusRealtimeItem
+
+UPDATED_AT = datetime.datetime(2023, 5, 10, 8, 0, 20)
+
+
+def at(minutes, seconds=0):
+    return UPDATED_AT.replace(second=0) + datetime.timedelta(
+        minutes=minutes, seconds=seconds)
+
+
+def test_age_arrival_counts_elapsed_minutes():
+    assert age_arrival(10, 5, UPDATED_AT, at(0, 50)) == \
+        AgedArrival(10, 5, False)
+    # The age counts from the start of the current minute.
+    assert age_arrival(10, 5, UPDATED_AT, at(1, 10)) == \
+        age_arrival(10, 5, UPDATED_AT, at(1, 50)) == \
+        AgedArrival(10, 5, False)
+    assert age_arrival(10, 5, UPDATED_AT, at(2, 10)) == \
+        AgedArrival(9, 5, False)
+    assert age_arrival(10, 5, UPDATED_AT, at(3, 30), stale_after=600) == \
+        AgedArrival(8, 4, False)
+    assert age_arrival(10, None, UPDATED_AT, at(3), stale_after=600) == \
+        AgedArrival(8, None, False)
+
+
+def test_age_arrival_drops_arrived_and_flags_stale():
+    assert age_arrival(2, 1, UPDATED_AT, at(3)) == AgedArrival(0, 0, False)
+    assert age_arrival(2, 1, UPDATED_AT, at(4)) is None
+    assert age_arrival(0, 0, UPDATED_AT, at(1)) == AgedArrival(0, 0, False)
+    assert age_arrival(30, 12, UPDATED_AT, at(4), stale_after=180) == \
+        AgedArrival(27, 11, True)
+    # A feed from a clock ahead of ours is taken as just updated.
+    assert age_arrival(4, 2, UPDATED_AT, at(-2)) == AgedArrival(4, 2, False)
+
+
+def test_subway_arrival_shows_the_aged_time_in_both_lists(monkeypatch):
+    from app.controller import subway as subway_controller
+    from app.rows.subway import SubwayDepartureRow, SubwayRealtimeRow, \
+        SubwayStationRows
+
+    now = datetime.datetime(2023, 5, 10, 8, 7, 30)
+    monkeypatch.setattr(subway_controller, "current_datetime", lambda: now)
+    station = SubwayStationRows("K449", "한대앞", 1004, [
+        SubwayRealtimeRow(
+            "true", 1, "A", "K456", "오이도", "K447", 9, 0, False, False,
+            datetime.datetime(2023, 5, 10, 8, 2, 40),
+        ),
+    ], [
+        SubwayDepartureRow(
+            "weekdays", "up", "K409", "당고개", "K456", "오이도",
+            datetime.time(8, 10),
+        ),
+    ])
+    response = subway_controller.build_station_arrival(station)
+
+    (realtime,) = response.realtime.up
+    arrival = response.arrival.up[0]
+    assert realtime.current_status.time == arrival.time == \
+        datetime.timedelta(minutes=5)
+    assert arrival.delay == datetime.timedelta(minutes=2)
+
+
+@contextlib.contextmanager
+def host_timezone(name):
+    previous = os.environ.get("TZ")
+    os.environ["TZ"] = name
+    time.tzset()
+    try:
+        yield
+    finally:
+        if previous is None:
+            del os.environ["TZ"]
+        else:
+            os.environ["TZ"] = previous
+        time.tzset()
+
+
+@pytest.mark.asyncio
+async def test_bus_arrivals_age_in_korean_time_on_any_host(stand_in):
+    from app.controller import bus as bus_controller
+    from app.controller.query.bus import BusRouteStopQuery, query_bus
+
+    token = cache_bypass.set(True)
+    try:
+        with host_timezone("UTC"):
+            async with stand_in() as engine, \
+                    AsyncSession(engine) as db_session:
+                # The feed stores its update time in Korea, nine hours
+                # ahead of the host.
+                updated_at = current_datetime().replace(
+                    second=0, microsecond=0) - datetime.timedelta(minutes=3)
+                await db_session.execute(update(BusRealtimeItem).values(
+                    last_updated_time=updated_at))
+                await db_session.commit()
+                (item,) = await query_bus(db_session, [
+                    BusRouteStopQuery(stop=216000379, route=216000061)])
+                response = await bus_controller.get_bus_stop_arrival(
+                    stop_id=216000379, db_session=db_session)
+    finally:
+        cache_bypass.reset(token)
+
+    assert [realtime.time for realtime in item.realtime] == [4]
+    assert {
+        realtime.remaining_time for route in response.route
+        for realtime in route.arrival_list
+    } == {datetime.timedelta(minutes=4)}
@@ -0,0 +1,133 @@
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+
+from app.model.bus import BusRouteStop, BusStop
+from app.model.shuttle import ShuttleRouteStop, ShuttleStop
+from app.model.subway import RealtimeItem, RouteStation, TimetableItem
+from app.rows import bus, shuttle, subway
+
+
+@pytest.mark.asyncio
+async def test_shuttle_rows_match_entities(stand_in):
+    async with stand_in() as engine, AsyncSession(engine) as db_session:
+        stops = await shuttle.fetch_stops(db_session)
+        station = await shuttle.fetch_stop(db_session, "station")
+        missing = await shuttle.fetch_stop(db_session, "none")
+        assert len(db_session.identity_map) == 0
+        entities = (await db_session.execute(
+            select(ShuttleStop).options(
+                selectinload(ShuttleStop.routes).options(
+                    selectinload(ShuttleRouteStop.timetable),
+                    selectinload(ShuttleRouteStop.route),
+                ),
+            ),
+        )).scalars().all()
+
+    assert missing is None
+    assert station in stops
+    assert [route.route_name for route in station.routes] == \
+        sorted(route.route_name for route in station.routes)
+    assert {
+        stop.name: {
+            route.route_name: (route.tags, [
+                tuple(item) for item in route.timetable
+            ]) for route in stop.routes
+        } for stop in stops
+    } == {
+        stop.name: {
+            route.route_name: (route.route.tags, [
+                (item.period_type_name, item.weekday, item.departure_time)
+                for item in sorted(route.timetable, key=lambda item: (
+                    item.departure_time, item.period_type_name,
+                    item.weekday))
+            ]) for route in stop.routes
+        } for stop in entities
+    }
+
+
+@pytest.mark.asyncio
+async def test_bus_rows_match_entities(stand_in):
+    async with stand_in() as engine, AsyncSession(engine) as db_session:
+        stops = await bus.fetch_stops(db_session)
+        stop = await bus.fetch_stop(db_session, 216000379)
+        missing = await bus.fetch_stop(db_session, 1)
+        route_stops = await bus.fetch_route_stops(
+            db_session, [(216000379, 216000061), (216000379, 1)])
+        assert len(db_session.identity_map) == 0
+        entities = (await db_session.execute(
+            select(BusStop).options(
+                selectinload(BusStop.routes).options(
+                    selectinload(BusRouteStop.route),
+                    selectinload(BusRouteStop.realtime),
+                    selectinload(BusRouteStop.timetable),
+                    selectinload(BusRouteStop.start_stop),
+                ),
+            ),
+        )).scalars().all()
+
+    assert missing is None
+    assert stop in stops
+    assert route_stops == [
+        route for route in stop.routes if route.route_id == 216000061
+    ]
+    assert {
+        (stop.id, stop.name, stop.mobile_number): {
+            route.route_id: (
+                route.route_name, route.order, route.start_stop_name,
+                sorted(tuple(item) for item in route.realtime),
+                sorted(tuple(item) for item in route.timetable),
+            ) for route in stop.routes
+        } for stop in stops
+    } == {
+        (stop.id, stop.name, stop.mobile_number): {
+            route.route_id: (
+                route.route.name, route.order, route.start_stop.name,
+                sorted((item.stop, item.seat, item.minutes, item.low_floor,
+                        item.last_updated_time) for item in route.realtime),
+                sorted((item.weekday, item.departure_time)
+                       for item in route.timetable),
+            ) for route in stop.routes
+        } for stop in entities
+    }
+
+
+@pytest.mark.asyncio
+async def test_subway_rows_match_entities(stand_in):
+    async with stand_in() as engine, AsyncSession(engine) as db_session:
+        stations = await subway.fetch_stations(db_session)
+        station = await subway.fetch_station(db_session, "K449")
+        missing = await subway.fetch_station(db_session, "X")
+        assert len(db_session.identity_map) == 0
+        entities = (await db_session.execute(
+            select(RouteStation).options(
+                selectinload(RouteStation.realtime).selectinload(
+                    RealtimeItem.destination),
+                selectinload(RouteStation.timetable).selectinload(
+                    TimetableItem.start_station),
+                selectinload(RouteStation.timetable).selectinload(
+                    TimetableItem.destination),
+            ),
+        )).scalars().all()
+
+    assert missing is None
+    assert station in stations
+    assert {
+        (station.id, station.station_name, station.line_id): (
+            [(item.train, item.destination_name, item.minute)
+             for item in station.realtime],
+            sorted(tuple(item) for item in station.timetable),
+        ) for station in stations
+    } == {
+        (station.id, station.station_name, station.line_id): (
+            [(item.train, item.destination.station_name, item.minute)
+             for item in sorted(station.realtime, key=lambda item: (
+                 item.minute, item.heading, item.sequence))],
+            sorted((item.weekday, item.heading, item.start_station.id,
+                    item.start_station.station_name, item.destination_id,
+                    item.destination.station_name, item.departure_time)
+                   for item in station.timetable),
+        ) for station in entities
+    }
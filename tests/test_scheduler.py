@@ -0,0 +1,177 @@
+import asyncio
+import datetime
+import logging
+
+import pytest
+from httpx import AsyncClient
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app import create_app
+from app.internal.cache import MemoryBackend
+from app.internal.config import AppSettings
+from app.internal.scheduler import KST, AdvisoryLockElection, \
+    CronSchedule, IntervalSchedule, LocalElection, Scheduler, \
+    create_election, lock_key, scheduler
+
+
+def kst(*args):
+    return datetime.datetime(*args, tzinfo=KST)
+
+
+@pytest.mark.parametrize("expression, moment, expected", [
+    ("0 0 * * *", kst(2023, 5, 1, 12, 30), kst(2023, 5, 2, 0, 0)),
+    ("*/15 9-10 * * 1-5", kst(2023, 5, 5, 10, 50), kst(2023, 5, 8, 9, 0)),
+    ("*/15 9-10 * * 1-5", kst(2023, 5, 1, 9, 15, 30),
+     kst(2023, 5, 1, 9, 30)),
+    ("30 4 1 * 0", kst(2023, 5, 1, 5, 0), kst(2023, 5, 7, 4, 30)),
+    ("0 12 29 2 *", kst(2023, 3, 1), kst(2024, 2, 29, 12, 0)),
+    ("5,10 0 * * 7", kst(2023, 5, 7, 0, 5), kst(2023, 5, 7, 0, 10)),
+])
+def test_cron_schedule(expression, moment, expected):
+    assert CronSchedule(expression).next_after(moment) == expected
+
+
+def test_cron_schedule_in_other_time_zone():
+    schedule = CronSchedule("0 0 * * *")
+    moment = datetime.datetime(
+        2023, 5, 1, 14, 59, tzinfo=datetime.timezone.utc)
+    assert schedule.next_after(moment) == kst(2023, 5, 2, 0, 0)
+
+
+@pytest.mark.parametrize("expression", [
+    "* * * *", "60 * * * *", "* 5-1 * * *", "*/0 * * * *", "a * * * *",
+    "0 0 31 2 *",
+])
+def test_invalid_cron_schedule(expression):
+    with pytest.raises(ValueError):
+        CronSchedule(expression).next_after(kst(2023, 1, 1))
+
+
+def test_interval_schedule():
+    assert IntervalSchedule(90).next_after(kst(2023, 5, 1)) == \
+        kst(2023, 5, 1, 0, 1, 30)
+    with pytest.raises(ValueError):
+        IntervalSchedule(0)
+
+
+@pytest.mark.asyncio
+async def test_local_election():
+    first, second = LocalElection("test"), LocalElection("test")
+    assert await first.campaign()
+    assert not await second.campaign()
+    assert await first.campaign()
+    await first.resign()
+    assert await second.campaign()
+    await second.resign()
+
+
+@pytest.mark.asyncio
+async def test_singleton_jobs_run_on_the_leader(caplog):
+    calls = []
+    workers = [Scheduler(), Scheduler()]
+    for worker in workers:
+        @worker.job("local", interval=60)
+        async def local():
+            calls.append("local")
+
+        @worker.job("shared", cron="* * * * *", singleton=True)
+        async def shared():
+            calls.append("shared")
+
+        @worker.job("failing", interval=60)
+        async def failing():
+            raise RuntimeError("failed")
+        await worker.start(LocalElection("workers"))
+
+    with caplog.at_level(logging.ERROR, "app.internal.scheduler"):
+        for worker in workers:
+            for job in worker.jobs.values():
+                await worker.run_job(job)
+    for worker in workers:
+        await worker.stop()
+
+    assert sorted(calls) == ["local", "local", "shared"]
+    leader, follower = workers
+    assert leader.jobs["shared"].runs == 1
+    assert follower.jobs["shared"].skipped == 1
+    assert follower.jobs["shared"].runs == 0
+    assert leader.jobs["failing"].failures == 1
+    assert leader.jobs["local"].last_success > 0
+    assert "Job failing failed" in caplog.text
+    metrics = {metric.name: metric for metric in follower.collect()}
+    assert {"job": "shared"} in [
+        sample.labels
+        for sample in metrics["hyuabot_job_skipped_total"].samples
+        if sample.value == 1
+    ]
+
+
+@pytest.mark.asyncio
+async def test_interval_jobs_run_until_stopped():
+    runs = []
+    worker = Scheduler()
+
+    @worker.job("tick", interval=0.01, run_at_start=True)
+    async def tick():
+        runs.append(datetime.datetime.now())
+    await worker.start(LocalElection("tick"))
+    await asyncio.sleep(0.1)
+    await worker.stop()
+    count = len(runs)
+    await asyncio.sleep(0.03)
+    assert count >= 3
+    assert len(runs) == count
+
+
+def test_job_registration():
+    worker = Scheduler()
+
+    async def job():
+        pass
+    worker.add_job("job", job, interval=1)
+    with pytest.raises(ValueError):
+        worker.add_job("job", job, interval=1)
+    with pytest.raises(ValueError):
+        worker.add_job("other", job)
+    with pytest.raises(ValueError):
+        worker.add_job("other", job, interval=1, cron="* * * * *")
+    assert {"cache_purge", "replica_health"} <= set(scheduler.jobs)
+
+
+def test_create_election():
+    engine = create_async_engine("postgresql+asyncpg://u:p@localhost/d")
+    election = create_election(AppSettings(), engine)
+    assert isinstance(election, AdvisoryLockElection)
+    assert election.key == lock_key("hyuabot-scheduler")
+    assert -2 ** 63 <= election.key < 2 ** 63
+    assert isinstance(create_election(
+        AppSettings(SCHEDULER_ELECTION="local"), engine), LocalElection)
+    with pytest.raises(ValueError):
+        create_election(AppSettings(SCHEDULER_ELECTION="redis"), engine)
+
+
+@pytest.mark.asyncio
+async def test_memory_backend_purge():
+    backend = MemoryBackend()
+    await backend.set("expired", b"value", ttl=-1)
+    await backend.set("fresh", b"value", ttl=60)
+    await backend.purge_expired()
+    assert list(backend._values) == ["fresh"]
+
+
+@pytest.mark.asyncio
+async def test_scheduler_started_with_app():
+    pytest.importorskip("aiosqlite")
+    app = create_app(AppSettings(
+        DATABASE_URI="sqlite+aiosqlite://",
+        INVALIDATION_MODE="off",
+        TIMETABLE_SNAPSHOT_PATH=None,
+        ACCESS_LOG=False,
+        METRICS_ENABLED=True,
+    ))
+    async with app.router.lifespan_context(app):
+        assert isinstance(scheduler.election, LocalElection)
+        async with AsyncClient(app=app, base_url="http://test") as client:
+            response = await client.get("/metrics")
+    assert scheduler.election is None
+    assert 'hyuabot_job_runs_total{job="cache_purge"} 0.0' in response.text
@@ -0,0 +1,25 @@
+import pytest
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from app.controller.shuttle import route_tags
+
+
+@pytest.mark.asyncio
+async def test_untagged_routes_are_skipped(tmp_path):
+    # The route tag is nullable in the database, unlike in the model.
+    pytest.importorskip("aiosqlite")
+    engine = create_async_engine(
+        f"sqlite+aiosqlite:///{tmp_path / 'routes.sqlite'}")
+    async with engine.begin() as connection:
+        await connection.execute(text(
+            "CREATE TABLE shuttle_route "
+            "(route_name TEXT PRIMARY KEY, route_tag TEXT)"))
+        await connection.execute(text(
+            "INSERT INTO shuttle_route VALUES ('DHDD', 'DH'), "
+            "('YS', 'Y'), ('C', 'C'), ('untagged', NULL), ('DYDD', 'DY')"))
+    async with AsyncSession(engine) as db_session:
+        tags = await route_tags(db_session)
+    await engine.dispose()
+
+    assert tags == ["DH", "DY", "C", "Y"]
@@ -0,0 +1,114 @@
+import datetime
+import struct
+
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.controller.query import shuttle as shuttle_query
+from app.controller.query import subway as subway_query
+from app.internal.invalidation import TableChanged
+from app.internal.snapshot import ColumnSpec, HEADER, SnapshotError, \
+    export_snapshot, load_snapshot, timetable_snapshot, write_snapshot
+from app.rows import bus, shuttle, subway
+
+columns = [
+    ColumnSpec("route_name", "str"),
+    ColumnSpec("weekday", "bool"),
+    ColumnSpec("route_id", "int"),
+    ColumnSpec("departure_time", "time"),
+]
+rows = [
+    ("DH", True, 216000061, datetime.time(8, 0)),
+    ("DH", False, 216000061, datetime.time(8, 30, 15)),
+    ("순환버스", True, 216000068, datetime.time(23, 59, 59)),
+]
+
+
+def test_snapshot_round_trip(tmp_path):
+    path = str(tmp_path / "timetable.snapshot")
+    write_snapshot(path, {"timetable": (columns, rows), "empty": (
+        [ColumnSpec("stop_name", "str")], [])})
+    snapshot = load_snapshot(path)
+    table = snapshot.tables["timetable"]
+    assert table.row_count == 3
+    assert list(table.rows()) == rows
+    assert list(table.raw("route_name")) == [0, 0, 1]
+    assert list(table.raw("departure_time")) == [28800, 30615, 86399]
+    assert snapshot.strings == ["DH", "순환버스"]
+    assert list(snapshot.tables["empty"].rows()) == []
+
+
+def test_snapshot_rejects_invalid_files(tmp_path):
+    path = str(tmp_path / "timetable.snapshot")
+    write_snapshot(path, {"timetable": (columns, rows)})
+    with open(path, "rb") as file:
+        content = bytearray(file.read())
+
+    corrupted = bytearray(content)
+    corrupted[-1] ^= 0xFF
+    with open(path, "wb") as file:
+        file.write(corrupted)
+    with pytest.raises(SnapshotError, match="checksum"):
+        load_snapshot(path)
+
+    outdated = bytearray(content)
+    struct.pack_into("<H", outdated, 4, 0)
+    with open(path, "wb") as file:
+        file.write(outdated)
+    with pytest.raises(SnapshotError, match="schema version"):
+        load_snapshot(path)
+
+    with open(path, "wb") as file:
+        file.write(content[:HEADER.size - 1])
+    with pytest.raises(SnapshotError):
+        load_snapshot(path)
+
+    write_snapshot(path, {"timetable": (columns, rows)}, created_at=0)
+    with pytest.raises(SnapshotError, match="maximum age"):
+        load_snapshot(path, max_age=3600)
+
+
+async def read_timetables(engine):
+    async with AsyncSession(engine) as db_session:
+        return (
+            await shuttle.fetch_stops(db_session),
+            await shuttle.fetch_stop(db_session, "dormitory_o"),
+            sorted((await shuttle_query.fetch_shuttle_rows(
+                db_session, ["dormitory_o", "station"]))[2]),
+            await bus.fetch_stops(db_session),
+            await bus.fetch_route_stops(db_session, [(216000379, 216000061)]),
+            await subway.fetch_stations(db_session),
+            await subway.fetch_departures(db_session, "K449"),
+            sorted(tuple(row) for row in await db_session.execute(
+                subway_query.build_row_statements(["K449"], "up", None)[1])),
+        )
+
+
+@pytest.mark.asyncio
+async def test_timetable_readers_serve_the_snapshot(tmp_path, stand_in):
+    path = str(tmp_path / "timetable.snapshot")
+    async with stand_in() as engine:
+        from_database = await read_timetables(engine)
+        await export_snapshot(engine, path)
+        timetable_snapshot.load(path)
+        try:
+            from_snapshot = await read_timetables(engine)
+            async with engine.connect() as connection:
+                names = dict((await connection.execute(
+                    subway.NAME_STATEMENT)).all())
+            subway_rows = subway_query.filter_snapshot_rows(
+                timetable_snapshot.groups(
+                    *subway_query.SNAPSHOT_TIMETABLE_ROWS),
+                names, ["K449"], "up", None,
+            )
+            timetable_snapshot.discard(TableChanged(
+                "subway_timetable", "notify", datetime.datetime.now()))
+            discarded = timetable_snapshot.groups(
+                *subway.SNAPSHOT_DEPARTURES)
+        finally:
+            timetable_snapshot.unload()
+
+    assert from_database[1].routes and from_database[6]
+    assert from_snapshot[:-1] == from_database[:-1]
+    assert sorted(subway_rows) == from_database[-1]
+    assert discarded is None
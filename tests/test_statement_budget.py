@@ -0,0 +1,151 @@
+import datetime
+
+import pytest
+from fastapi.routing import APIRoute
+from httpx import AsyncClient
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+
+from app.controller.query.bus import query_bus
+from app.controller.query.cafeteria import query_cafeteria
+from app.controller.query.commute_shuttle import query_commute_shuttle
+from app.controller.query.library import query_reading_room
+from app.controller.query.shuttle import query_shuttle
+from app.controller.query.subway import query_subway
+from app.internal.commute_tracker import commute_shuttle_tracker
+from app.internal.statements import LazyLoadError, LazyLoadWarning, \
+    StatementBudget, StatementCounter, get_statement_budget, \
+    lazy_load_detector, statement_budget
+from app.model import BaseModel
+from app.model.subway import RouteStation, TimetableItem
+
+PATH_PARAMS = {
+    "/shuttle": {"stop_id": "dormitory_o", "route_id": "DHDD"},
+    "/bus": {"stop_id": "216000379", "route_id": "216000061"},
+    "/commute-shuttle": {"route_id": "R1"},
+    "/subway": {"station_id": "K449"},
+    "/library": {"campus_id": "1", "room_id": "1"},
+    "/cafeteria": {"campus_id": "1"},
+    "/campus": {"campus_id": "1"},
+}
+DOCUMENTS = [
+    ("{ shuttle { stop { stopName } } }", [query_shuttle]),
+    (
+        "{ bus(routeStop: [{stop: 216000379, route: 216000061}, "
+        "{stop: 216000719, route: 216000068}]) { routeName } }",
+        [query_bus],
+    ),
+    ("{ subway { name } }", [query_subway]),
+    (
+        "{ cafeteria { name } readingRoom { name } "
+        "commuteShuttle { routeName } }",
+        [query_cafeteria, query_reading_room, query_commute_shuttle],
+    ),
+]
+
+
+async def count(client, method, url, **kwargs):
+    commute_shuttle_tracker.reset_routes()
+    commute_shuttle_tracker.reset_status()
+    with StatementCounter() as counter:
+        response = await client.request(method, url, **kwargs)
+    assert response.status_code == 200, url
+    return counter
+
+
+@pytest.mark.asyncio
+async def test_endpoint_budgets(stand_in_app):
+    failures = []
+    async with stand_in_app() as app, \
+            AsyncClient(app=app, base_url="http://test") as client:
+        for route in app.routes:
+            if not isinstance(route, APIRoute) or route.path == "/query":
+                continue
+            budget = get_statement_budget(route.endpoint)
+            assert budget is not None, f"{route.path} declares no budget"
+            prefix = "/" + route.path.split("/")[1]
+            url = route.path.format(**PATH_PARAMS.get(prefix, {}))
+            counter = await count(client, "GET", url)
+            assert counter.statements, url
+            failures.extend(
+                f"{url}: {message}"
+                for message in counter.over_budget(budget)
+            )
+    assert not failures, "\n".join(failures)
+
+
+@pytest.mark.asyncio
+async def test_document_budgets(stand_in_app):
+    failures = []
+    async with stand_in_app() as app, \
+            AsyncClient(app=app, base_url="http://test") as client:
+        for document, functions in DOCUMENTS:
+            budgets = [get_statement_budget(function)
+                       for function in functions]
+            budget = StatementBudget(
+                sum(budget.statements for budget in budgets),
+                sum(budget.rows for budget in budgets),
+            )
+            counter = await count(
+                client, "POST", "/query", json={"query": document})
+            failures.extend(
+                f"{document}: {message}"
+                for message in counter.over_budget(budget)
+            )
+    assert not failures, "\n".join(failures)
+
+
+def test_statement_counter():
+    engine = create_engine("sqlite://")
+    with engine.connect() as connection:
+        with StatementCounter() as outer:
+            connection.execute(text("CREATE TABLE item (id INTEGER)"))
+            with StatementCounter() as inner:
+                connection.execute(text("INSERT INTO item VALUES (1), (2)"))
+        connection.execute(text("SELECT * FROM item"))
+    assert len(outer.statements) == 2
+    assert outer.rows == 2
+    assert inner.statements == ["INSERT INTO item VALUES (1), (2)"]
+    assert outer.over_budget(StatementBudget(2, rows=2)) == []
+    messages = outer.over_budget(StatementBudget(1, rows=1))
+    assert len(messages) == 2
+    assert messages[0].startswith("2 statements exceed the budget of 1")
+
+
+def test_statement_budget_through_wrappers():
+    @statement_budget(3, rows=10)
+    async def endpoint():
+        pass
+
+    def wrapper():
+        pass
+    wrapper.__wrapped__ = endpoint
+    assert get_statement_budget(wrapper) == StatementBudget(3, 10)
+    assert get_statement_budget(test_statement_counter) is None
+
+
+def test_lazy_load_detector():
+    engine = create_engine("sqlite://")
+    BaseModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        session.add_all([
+            RouteStation(id="K449", line_id=1004, station_name="K449",
+                         sequence=0, cumulative_time=0),
+            TimetableItem(station_id="K449", destination_id="K449",
+                          start_station_id="K449", weekday="weekdays",
+                          heading="up", departure_time=datetime.time(5)),
+        ])
+        session.commit()
+    try:
+        lazy_load_detector.configure("warn")
+        with Session(engine) as session:
+            item = session.query(TimetableItem).one()
+            with pytest.warns(LazyLoadWarning, match="destination"):
+                assert item.destination.id == "K449"
+        lazy_load_detector.configure("raise")
+        with Session(engine) as session:
+            item = session.query(TimetableItem).one()
+            with pytest.raises(LazyLoadError, match="start_station"):
+                item.start_station
+    finally:
+        lazy_load_detector.configure("off")
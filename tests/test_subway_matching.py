@@ -0,0 +1,86 @@
+import datetime
+
+from app.internal.subway_matching import match_arrivals, service_date
+from app.rows.subway import SubwayDepartureRow, SubwayRealtimeRow
+
+# A Wednesday without holidays.
+NOW = datetime.datetime(2023, 5, 10, 8, 0)
+
+
+def departure(hour, minute, heading="up", destination="K456",
+              weekday="weekdays"):
+    return SubwayDepartureRow(
+        weekday, heading, "K409", "K409", destination, destination,
+        datetime.time(hour, minute),
+    )
+
+
+def realtime(train, minute, heading="true", destination="K456",
+             updated_at=NOW):
+    return updated_at + datetime.timedelta(minutes=minute), SubwayRealtimeRow(
+        heading, 1, train, destination, destination, "K449", minute, 0,
+        False, False, updated_at,
+    )
+
+
+def test_match_arrivals_aligns_trains_to_slots():
+    timetable = [
+        departure(7, 55), departure(8, 2), departure(8, 5, destination="K444"),
+        departure(8, 10), departure(8, 18), departure(8, 26),
+        departure(8, 3, heading="down"), departure(8, 4, weekday="weekends"),
+    ]
+    arrivals = match_arrivals([
+        realtime("B", 12, updated_at=NOW - datetime.timedelta(minutes=1)),
+        realtime("A", 4),
+        realtime("C", 1, destination="K444"),
+        realtime("X", 3, destination="K411"),
+    ], timetable, NOW)
+
+    up = [(
+        item.realtime.train if item.realtime else None,
+        item.scheduled.time() if item.scheduled else None,
+        item.delay,
+    ) for item in arrivals["up"]]
+    assert up == [
+        ("C", datetime.time(8, 5), datetime.timedelta(minutes=-4)),
+        ("X", None, None),
+        ("A", datetime.time(8, 2), datetime.timedelta(minutes=2)),
+        ("B", datetime.time(8, 10), datetime.timedelta(minutes=1)),
+        (None, datetime.time(8, 18), None),
+        (None, datetime.time(8, 26), None),
+    ]
+    assert [item.scheduled.time() for item in arrivals["down"]] == [
+        datetime.time(8, 3),
+    ]
+
+
+def test_match_arrivals_claims_each_slot_once():
+    arrivals = match_arrivals(
+        [realtime("A", 5), realtime("B", 6), realtime("C", 20)],
+        [departure(8, 5), departure(8, 40)],
+        NOW,
+    )["up"]
+    assert [(
+        item.realtime.train if item.realtime else None, item.delay,
+    ) for item in arrivals] == [
+        ("A", datetime.timedelta()),
+        ("B", None),
+        ("C", None),
+        (None, None),
+    ]
+    assert arrivals[-1].expected == datetime.datetime(2023, 5, 10, 8, 40)
+
+
+def test_match_arrivals_spans_midnight():
+    now = datetime.datetime(2023, 5, 10, 23, 55)
+    assert service_date(now + datetime.timedelta(hours=1)) == now.date()
+    arrivals = match_arrivals(
+        [realtime("A", 12, updated_at=now)],
+        [departure(0, 5), departure(0, 30), departure(23, 50)],
+        now,
+    )["up"]
+    assert [item.scheduled for item in arrivals] == [
+        datetime.datetime(2023, 5, 11, 0, 5),
+        datetime.datetime(2023, 5, 11, 0, 30),
+    ]
+    assert arrivals[0].delay == datetime.timedelta(minutes=2)
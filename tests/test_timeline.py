@@ -0,0 +1,31 @@
+from app.internal.timeline import TimelineBuilder
+
+
+def test_timeline_builder_merges_sorted_routes():
+    builder = TimelineBuilder(key=lambda value: value, groups=["DH", "DJ"])
+    builder.add("DH", [1, 4, 7])
+    builder.add("DH", [2, 3, 9])
+    builder.add("NEW", [5])
+    assert builder.groups == ["DH", "DJ", "NEW"]
+    assert builder.timelines() == {
+        "DH": [1, 2, 3, 4, 7, 9],
+        "DJ": [],
+        "NEW": [5],
+    }
+    assert builder.merge("DH", limit=3) == [1, 2, 3]
+    assert builder.merge("missing") == []
+
+
+def test_timeline_builder_stops_after_limit():
+    consumed = []
+
+    def departures(values):
+        for value in values:
+            consumed.append(value)
+            yield value
+
+    builder = TimelineBuilder(key=lambda value: value)
+    builder.add("C", departures(range(0, 100, 2)))
+    builder.add("C", departures(range(1, 100, 2)))
+    assert builder.merge("C", limit=4) == [0, 1, 2, 3]
+    assert len(consumed) < 10
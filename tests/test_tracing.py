@@ -0,0 +1,192 @@
+import asyncio
+import json
+
+import pytest
+from fastapi import APIRouter, FastAPI
+from httpx import AsyncClient
+from sqlalchemy import create_engine, text
+
+from app import create_app
+from app.internal.config import AppSettings
+from app.internal.tracing import FileExporter, SpanExporter, \
+    TracedJSONResponse, TracedRoute, TracingExtension, TracingMiddleware, \
+    parse_traceparent, traced, tracer
+
+
+class CollectingExporter(SpanExporter):
+    def __init__(self):
+        self.spans = []
+
+    def export(self, spans):
+        self.spans.extend(spans)
+
+
+@pytest.fixture
+def exporter():
+    collecting_exporter = CollectingExporter()
+    tracer.configure(collecting_exporter)
+    yield collecting_exporter
+    tracer.shutdown()
+
+
+def by_name(spans):
+    return {span.name: span for span in spans}
+
+
+def test_nested_spans(exporter):
+    with tracer.span("outside"):
+        pass
+    with pytest.raises(ValueError):
+        with tracer.span("request", root=True) as root:
+            with tracer.span("child", {"key": "value"}):
+                pass
+            raise ValueError("failed")
+    tracer.shutdown()
+
+    spans = by_name(exporter.spans)
+    assert set(spans) == {"request", "child"}
+    assert spans["child"].parent_id == root.span_id
+    assert spans["child"].trace_id == root.trace_id
+    assert spans["child"].attributes == {"key": "value"}
+    assert spans["request"].parent_id == 0
+    assert spans["request"].error == "ValueError: failed"
+    assert spans["request"].end_time >= spans["child"].end_time
+
+
+def test_sample_rate():
+    collecting_exporter = CollectingExporter()
+    tracer.configure(collecting_exporter, sample_rate=0)
+    with tracer.span("request", root=True) as root:
+        assert root is None
+        with tracer.span("child") as child:
+            assert child is None
+    tracer.shutdown()
+    assert collecting_exporter.spans == []
+
+
+@pytest.mark.asyncio
+async def test_concurrent_traced_functions(exporter):
+    @traced()
+    async def query_first():
+        await asyncio.sleep(0.01)
+
+    @traced("second")
+    async def query_second():
+        await asyncio.sleep(0.01)
+
+    with tracer.span("request", root=True) as root:
+        await asyncio.gather(query_first(), query_second())
+    tracer.shutdown()
+
+    spans = by_name(exporter.spans)
+    assert spans["query_first"].parent_id == root.span_id
+    assert spans["second"].parent_id == root.span_id
+
+
+def test_sql_spans(exporter):
+    engine = create_engine("sqlite://")
+    with tracer.span("request", root=True):
+        with engine.connect() as connection:
+            connection.execute(text("CREATE TABLE item (id INTEGER)"))
+            connection.execute(text("INSERT INTO item VALUES (1), (2)"))
+            with pytest.raises(Exception):
+                connection.execute(text("SELECT * FROM missing"))
+    tracer.shutdown()
+
+    spans = by_name(exporter.spans)
+    assert spans["SQL INSERT"].attributes["db.rows"] == 2
+    assert spans["SQL INSERT"].attributes["db.system"] == "sqlite"
+    assert spans["SQL SELECT"].error.startswith("OperationalError")
+
+
+def test_parse_traceparent():
+    assert parse_traceparent(
+        "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01",
+    ) == (0x0af7651916cd43dd8448eb211c80319c, 0xb7ad6b7169203331)
+    assert parse_traceparent("") is None
+    assert parse_traceparent("00-zz-b7ad6b7169203331-01") is None
+
+
+@pytest.mark.asyncio
+async def test_traced_route(exporter):
+    router = APIRouter(route_class=TracedRoute)
+
+    @router.get("/items/{item_id}")
+    async def read_item(item_id: int):
+        return {"id": item_id}
+
+    app = FastAPI(default_response_class=TracedJSONResponse)
+    app.add_middleware(TracingMiddleware)
+    app.include_router(router, prefix="/v1")
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        response = await client.get("/v1/items/1", headers={
+            "traceparent":
+                "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01",
+        })
+    assert response.json() == {"id": 1}
+    assert response.headers["x-trace-id"] == \
+        "0af7651916cd43dd8448eb211c80319c"
+    tracer.shutdown()
+
+    spans = by_name(exporter.spans)
+    root = spans["GET /v1/items/1"]
+    handler = spans["GET /v1/items/{item_id}"]
+    assert root.parent_id == 0xb7ad6b7169203331
+    assert root.attributes["http.status_code"] == 200
+    assert handler.parent_id == root.span_id
+    assert spans["read_item"].parent_id == handler.span_id
+    assert spans["serialize"].parent_id == handler.span_id
+    assert len(exporter.spans) == 4
+
+
+@pytest.mark.asyncio
+async def test_traced_graphql_operation(exporter):
+    app = create_app(AppSettings(
+        INVALIDATION_MODE="off",
+        TRACING_EXPORTER="console",
+        ACCESS_LOG=False,
+    ))
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        response = await client.post(
+            "/query", json={"query": "query Name { __typename }"},
+        )
+    assert response.status_code == 200
+    tracer.shutdown()
+
+    spans = by_name(exporter.spans)
+    root = spans["POST /query"]
+    operation = spans["graphql.operation"]
+    assert operation.parent_id == root.span_id
+    assert operation.attributes["graphql.operation.name"] == "Name"
+    for step in ("graphql.parse", "graphql.validate", "graphql.execute"):
+        assert spans[step].parent_id == operation.span_id
+    assert spans["serialize"].parent_id == root.span_id
+
+
+def test_tracing_extension_only_while_tracing():
+    from app.controller.query import schema
+
+    tracer.shutdown()
+    assert TracingExtension not in schema.get_extensions()
+    tracer.configure(CollectingExporter())
+    try:
+        assert TracingExtension in schema.get_extensions()
+    finally:
+        tracer.shutdown()
+    assert TracingExtension not in schema.get_extensions()
+
+
+def test_file_exporter(tmp_path):
+    path = tmp_path / "spans.jsonl"
+    tracer.configure(FileExporter(str(path)))
+    with tracer.span("request", root=True, attributes={"key": 1}):
+        pass
+    tracer.shutdown()
+
+    lines = path.read_text().splitlines()
+    assert len(lines) == 1
+    span = json.loads(lines[0])
+    assert span["name"] == "request"
+    assert span["parent_id"] is None
+    assert span["attributes"] == {"key": 1}
+    assert len(span["trace_id"]) == 32